@@ -88,27 +88,35 @@ class CuotaAdmin(admin.ModelAdmin):
     
     def save_model(self, request, obj, form, change):
         super().save_model(request, obj, form, change)
-        from .services import recalcular_deuda_contrato
+        from .services import invalidar_cierres_desde, recalcular_deuda_contrato
         recalcular_deuda_contrato(obj.contrato.id)
+        # Exención, capital o vencimiento cambian la mora al cierre de los meses ya guardados
+        fechas = [f for f in (obj.fecha_vencimiento, form.initial.get('fecha_vencimiento')) if f]
+        invalidar_cierres_desde(min(fechas))
         
     def delete_model(self, request, obj):
         contrato_id = obj.contrato.id
         super().delete_model(request, obj)
-        from .services import recalcular_deuda_contrato
+        from .services import invalidar_cierres_desde, recalcular_deuda_contrato
         recalcular_deuda_contrato(contrato_id)
+        invalidar_cierres_desde(obj.fecha_vencimiento)
 
 # 7. Pagos
 @admin.register(Pago)
 class PagoAdmin(admin.ModelAdmin):
-    list_display = ('fecha_pago', 'contrato', 'monto', 'metodo_pago', 'registrado_por')
+    list_display = ('fecha_pago', 'contrato', 'monto', 'metodo_pago', 'saldo_a_favor', 'registrado_por')
     list_filter = ('metodo_pago', 'fecha_pago')
     search_fields = (
         'contrato__cliente__nombres', 
         'contrato__cliente__apellidos', 
         'contrato__cliente__cedula',
-        'contrato__id'
+        'contrato__id',
+        'cuenta',
+        'comprobante'
     )
     date_hierarchy = 'fecha_pago'
+    # Lo calcula el recálculo de deuda al guardar
+    readonly_fields = ('saldo_a_favor',)
 
     def save_model(self, request, obj, form, change):
         """
@@ -166,3 +174,17 @@ class LogActividadAdmin(admin.ModelAdmin):
         
     def has_delete_permission(self, request, obj=None):
         return False # Nadie puede borrar logs (Integridad)
+
+@admin.register(TareaPDF)
+class TareaPDFAdmin(admin.ModelAdmin):
+    list_display = ('id', 'tipo', 'objeto_id', 'estado', 'intentos', 'solicitado_por', 'creado_en', 'terminado_en')
+    list_filter = ('estado', 'tipo')
+    readonly_fields = ('archivo', 'nombre_archivo', 'error', 'progreso', 'total', 'iniciado_en', 'terminado_en', 'creado_en')
+    actions = ['reintentar']
+
+    @admin.action(description="Reintentar las tareas seleccionadas")
+    def reintentar(self, request, queryset):
+        from django.utils import timezone
+        queryset.exclude(estado='EN_PROCESO').update(
+            estado='PENDIENTE', intentos=0, error='', disponible_desde=timezone.now(), terminado_en=None
+        )
@@ -1,4 +1,5 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_migrate
 
 
 class SbrAppConfig(AppConfig):
@@ -7,3 +8,10 @@ class SbrAppConfig(AppConfig):
 
     def ready(self):
         import Aplicaciones.sbr_app_dos.signals
+        post_migrate.connect(reparar_indice_texto_tras_migrar, sender=self)
+
+
+def reparar_indice_texto_tras_migrar(sender, using='default', **kwargs):
+    # Una migración posterior de Cliente puede haber borrado los triggers del índice de texto
+    from .busqueda_clientes import reparar_indice_texto
+    reparar_indice_texto(using)
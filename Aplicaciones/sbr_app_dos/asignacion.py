@@ -0,0 +1,257 @@
+"""
+Núcleo puro de asignación de pagos a cuotas (FIFO o desde una cuota de origen).
+
+No toca la base de datos ni modifica lo que recibe: trabaja sobre copias de
+"fotos" de las cuotas (CuotaSnapshot) y devuelve el plan de asignación.
+services.py se encarga de persistir ese plan en bloque.
+"""
+from decimal import Decimal, ROUND_HALF_UP
+
+CENTAVO = Decimal('0.01')
+ESTADOS_ABIERTOS = ('PENDIENTE', 'PARCIAL', 'VENCIDO')
+
+
+def a_centavos(valor):
+    """
+    Monto exacto en centavos (ROUND_HALF_UP) de una suma hecha en la BD; None cuenta como 0.
+    SQLite guarda los DecimalField como REAL y los suma en punto flotante (0.1 + 0.2 da
+    0.30000000000000004), así que todo Sum/aggregate de montos pasa por aquí antes de
+    compararse o acumularse. En MySQL/PostgreSQL no cambia nada.
+    """
+    return Decimal(valor or 0).quantize(CENTAVO, rounding=ROUND_HALF_UP)
+
+
+def calcular_mora(valor_capital, porcentaje_mora):
+    """Mora Única (Porcentual) de una cuota, con mínimo de $0.01."""
+    mora_calcular = (valor_capital * porcentaje_mora) / Decimal('100.00')
+    mora_calcular = mora_calcular.quantize(CENTAVO, rounding='ROUND_HALF_UP')
+    if mora_calcular < CENTAVO and porcentaje_mora > 0:
+        mora_calcular = CENTAVO
+    return mora_calcular
+
+
+class CuotaSnapshot:
+    """Foto liviana de una Cuota con solo los campos que usa la asignación."""
+    __slots__ = (
+        'id', 'numero_cuota', 'fecha_vencimiento', 'valor_capital', 'mora_exenta',
+        'valor_mora', 'valor_pagado', 'estado', 'fecha_ultimo_pago',
+    )
+
+    # Campos que la asignación puede modificar (los que hay que persistir)
+    CAMPOS_MUTABLES = ('valor_pagado', 'fecha_ultimo_pago', 'valor_mora', 'estado')
+
+    def __init__(self, id, numero_cuota, fecha_vencimiento, valor_capital, mora_exenta=False,
+                 valor_mora=Decimal('0.00'), valor_pagado=Decimal('0.00'), estado='PENDIENTE',
+                 fecha_ultimo_pago=None):
+        self.id = id
+        self.numero_cuota = numero_cuota
+        self.fecha_vencimiento = fecha_vencimiento
+        self.valor_capital = valor_capital
+        self.mora_exenta = mora_exenta
+        self.valor_mora = valor_mora
+        self.valor_pagado = valor_pagado
+        self.estado = estado
+        self.fecha_ultimo_pago = fecha_ultimo_pago
+
+    @classmethod
+    def desde_cuota(cls, cuota):
+        return cls(
+            cuota.id, cuota.numero_cuota, cuota.fecha_vencimiento, cuota.valor_capital,
+            cuota.mora_exenta, cuota.valor_mora or Decimal('0.00'),
+            cuota.valor_pagado or Decimal('0.00'), cuota.estado, cuota.fecha_ultimo_pago,
+        )
+
+    def copia(self):
+        return CuotaSnapshot(
+            self.id, self.numero_cuota, self.fecha_vencimiento, self.valor_capital,
+            self.mora_exenta, self.valor_mora, self.valor_pagado, self.estado,
+            self.fecha_ultimo_pago,
+        )
+
+    def valores(self):
+        return tuple(getattr(self, campo) for campo in self.CAMPOS_MUTABLES)
+
+    @property
+    def total_a_pagar(self):
+        return self.valor_capital + self.valor_mora
+
+    @property
+    def saldo_pendiente(self):
+        resultado = self.total_a_pagar - self.valor_pagado
+        # Treat sub-cent values as zero (precision tolerance)
+        return resultado if resultado >= CENTAVO else Decimal('0.00')
+
+    def __repr__(self):
+        return f"<CuotaSnapshot #{self.numero_cuota} pagado={self.valor_pagado} estado={self.estado}>"
+
+
+class PlanPago:
+    """
+    Resultado de asignar un pago:
+      - asignaciones: [(cuota_id, monto_aplicado), ...] en el orden en que se aplicaron
+      - cuotas: snapshots (ya modificados) de las cuotas que cambiaron
+      - sobrante: dinero que no cupo en ninguna cuota (saldo a favor)
+    """
+    __slots__ = ('asignaciones', 'cuotas', 'sobrante')
+
+    def __init__(self, asignaciones, cuotas, sobrante):
+        self.asignaciones = asignaciones
+        self.cuotas = cuotas
+        self.sobrante = sobrante
+
+    @property
+    def total_aplicado(self):
+        return sum((monto for _, monto in self.asignaciones), Decimal('0.00'))
+
+
+def ordenar_cuotas(cuotas):
+    return sorted(cuotas, key=lambda c: (c.numero_cuota, c.id or 0))
+
+
+def _distribuir(candidatas, dinero, fecha_pago, tocadas, asignaciones,
+                actualizar_estado=True, marcar_saldadas=False):
+    """
+    Reparte 'dinero' sobre las cuotas candidatas en orden. Muta los snapshots
+    (que siempre son copias de trabajo) y retorna el dinero sobrante.
+    """
+    for cuota in candidatas:
+        if dinero <= 0:
+            break
+
+        falta_por_pagar = cuota.total_a_pagar - cuota.valor_pagado
+
+        # Tolerance: treat amounts under $0.01 as zero
+        if falta_por_pagar < CENTAVO:
+            if marcar_saldadas:
+                cuota.estado = 'PAGADO'
+                cuota.fecha_ultimo_pago = fecha_pago
+                tocadas[cuota.id] = cuota
+            continue
+
+        monto_aplicado = min(dinero, falta_por_pagar)
+        cuota.valor_pagado += monto_aplicado
+        cuota.fecha_ultimo_pago = fecha_pago
+        if actualizar_estado:
+            cuota.estado = 'PAGADO' if falta_por_pagar - monto_aplicado < CENTAVO else 'PARCIAL'
+        dinero -= monto_aplicado
+
+        tocadas[cuota.id] = cuota
+        asignaciones.append((cuota.id, monto_aplicado))
+
+    return dinero
+
+
+def _aplicar_pago_nuevo(trabajo, monto, fecha_pago, numero_inicio):
+    """Regla de registrar_pago_cliente sobre copias de trabajo ya ordenadas."""
+    tocadas = {}
+    asignaciones = []
+    dinero = Decimal(monto)
+
+    # Si elige una cuota específica, comenzamos desde esa en adelante (ignorando anteriores).
+    # Si no, el comportamiento por defecto es pagar las más antiguas primero.
+    pendientes = [
+        c for c in trabajo
+        if c.estado in ESTADOS_ABIERTOS and (numero_inicio <= 0 or c.numero_cuota >= numero_inicio)
+    ]
+    dinero = _distribuir(pendientes, dinero, fecha_pago, tocadas, asignaciones, marcar_saldadas=True)
+
+    # Excedente (Surplus): continuar después de la última cuota que quedó abierta
+    # (o desde la primera si todas quedaron pagadas), saltando las ya pagadas.
+    if dinero > 0:
+        abiertas = [c for c in pendientes if c.estado in ESTADOS_ABIERTOS]
+        inicio_excedente = (abiertas[-1].numero_cuota + 1) if abiertas else 1
+        siguientes = [c for c in trabajo if c.numero_cuota >= inicio_excedente]
+        dinero = _distribuir(siguientes, dinero, fecha_pago, tocadas, asignaciones)
+
+    return PlanPago(asignaciones, ordenar_cuotas(tocadas.values()), dinero)
+
+
+def asignar_pago(cuotas, monto, fecha_pago, numero_inicio=0):
+    """
+    Plan de asignación de un pago nuevo (regla de registrar_pago_cliente).
+    No modifica 'cuotas': el plan trae copias de las cuotas que cambian.
+    """
+    trabajo = [c.copia() for c in ordenar_cuotas(cuotas)]
+    return _aplicar_pago_nuevo(trabajo, monto, fecha_pago, numero_inicio)
+
+
+def simular_pagos(cuotas, pagos):
+    """
+    Simulación "qué pasaría si" de muchos pagos nuevos seguidos.
+    pagos: iterable de (monto, fecha_pago, numero_inicio).
+    Retorna (cuotas_finales, [PlanPago, ...]) sin modificar 'cuotas'.
+    """
+    trabajo = [c.copia() for c in ordenar_cuotas(cuotas)]
+    planes = [
+        _aplicar_pago_nuevo(trabajo, monto, fecha_pago, numero_inicio)
+        for monto, fecha_pago, numero_inicio in pagos
+    ]
+    return trabajo, planes
+
+
+def _aplicar_mora_historica(afectadas, fecha_pago, porcentaje_mora):
+    """VIAJE EN EL TIEMPO: moras vigentes HASTA la fecha del pago."""
+    for cuota in afectadas:
+        # Si en la fecha que se hizo este pago, esta cuota ya estaba vencida:
+        if cuota.fecha_vencimiento < fecha_pago and not cuota.mora_exenta:
+            # Solo aplicar si la cuota no estaba ya pagada en su totalidad en ese viaje en el tiempo
+            if cuota.valor_capital - cuota.valor_pagado > CENTAVO:
+                cuota.valor_mora = calcular_mora(cuota.valor_capital, porcentaje_mora)
+                cuota.estado = 'VENCIDO'
+
+
+def reaplicar_pagos(cuotas, pagos, porcentaje_mora):
+    """
+    Regla de recalcular_deuda_contrato: parte de cuotas en cero y reaplica los pagos
+    en orden, con la mora histórica vigente a la fecha de cada pago.
+    pagos: iterable ordenado de (pago_id, monto, fecha_pago, numero_inicio).
+    Retorna (cuotas_finales, {pago_id: PlanPago}) sin modificar 'cuotas'.
+    """
+    trabajo = [c.copia() for c in ordenar_cuotas(cuotas)]
+    for cuota in trabajo:
+        cuota.valor_pagado = Decimal('0.00')
+        cuota.fecha_ultimo_pago = None
+        cuota.valor_mora = Decimal('0.00')
+        cuota.estado = 'PENDIENTE'
+
+    planes = {}
+    for pago_id, monto, fecha_pago, numero_inicio in pagos:
+        afectadas = [c for c in trabajo if c.numero_cuota >= numero_inicio]
+        _aplicar_mora_historica(afectadas, fecha_pago, porcentaje_mora)
+
+        tocadas = {}
+        asignaciones = []
+        sobrante = _distribuir(afectadas, monto, fecha_pago, tocadas, asignaciones, actualizar_estado=False)
+        planes[pago_id] = PlanPago(asignaciones, ordenar_cuotas(tocadas.values()), sobrante)
+
+    return trabajo, planes
+
+
+def cerrar_estados(cuotas, hoy, porcentaje_mora):
+    """
+    Estado y mora finales luego de reaplicar los pagos. Muta los snapshots recibidos
+    (pensado para el resultado de reaplicar_pagos, que ya son copias).
+    """
+    for cuota in cuotas:
+        # Estado según pagos y fechas
+        if cuota.saldo_pendiente < CENTAVO:
+            cuota.estado = 'PAGADO'
+        elif cuota.fecha_vencimiento < hoy and not cuota.mora_exenta:
+            # VENCIDO tiene prioridad sobre PARCIAL cuando está vencido
+            cuota.estado = 'VENCIDO'
+        elif cuota.valor_pagado > 0:
+            cuota.estado = 'PARCIAL'
+        elif cuota.fecha_vencimiento < hoy:
+            cuota.estado = 'VENCIDO'
+        else:
+            cuota.estado = 'PENDIENTE'
+
+        # Moras vigentes hoy (misma regla que actualizar_moras_masivo)
+        if cuota.estado in ESTADOS_ABIERTOS and cuota.fecha_vencimiento < hoy:
+            if cuota.mora_exenta:
+                cuota.estado = 'PENDIENTE' if cuota.saldo_pendiente > 0 else 'PAGADO'
+                cuota.valor_mora = Decimal('0.00')
+            else:
+                cuota.estado = 'VENCIDO'
+                cuota.valor_mora = calcular_mora(cuota.valor_capital, porcentaje_mora)
+    return cuotas
@@ -0,0 +1,200 @@
+"""
+Benchmark de servicios, vistas de reportes y generadores de PDF (comando benchmark_servicios).
+
+Cada caso se ejecuta varias veces; por cada uno se guarda el tiempo de la primera
+ejecución (cachés frías: reporte general, cierres mensuales, PDF en disco), la mediana
+y el mínimo, y cuántas consultas SQL hizo la primera y la última ejecución. El resultado
+es un dict serializable a JSON: guardar uno por commit y compararlos con
+comparar_resultados para detectar regresiones.
+
+Todo corre dentro de una transacción que se deshace al final (los servicios de pago
+y mora escriben en la BD) y con MEDIA_ROOT en un directorio temporal.
+"""
+import statistics
+import subprocess
+import tempfile
+import time
+from datetime import date
+
+from dateutil.relativedelta import relativedelta
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import connection, transaction
+from django.db.models import Count, Q
+from django.test import Client
+from django.test.utils import override_settings
+from django.urls import reverse
+
+from .models import Contrato, Cuota, Pago
+
+class ContadorConsultas:
+    """execute_wrapper que cuenta las consultas sin guardarlas (sirve con DEBUG=False)."""
+
+    def __init__(self):
+        self.total = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.total += 1
+        return execute(sql, params, many, context)
+
+class _Deshacer(Exception):
+    pass
+
+def _commit_actual():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=settings.BASE_DIR,
+            capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def medir(funcion, repeticiones):
+    """Ejecuta `funcion` `repeticiones` veces y retorna las métricas del caso."""
+    tiempos, consultas = [], []
+    for _ in range(repeticiones):
+        contador = ContadorConsultas()
+        # Savepoint: un error de BD en un caso no rompe la transacción del benchmark
+        with transaction.atomic(), connection.execute_wrapper(contador):
+            inicio = time.perf_counter()
+            funcion()
+            tiempos.append((time.perf_counter() - inicio) * 1000)
+        consultas.append(contador.total)
+    return {
+        'repeticiones': repeticiones,
+        'primera_ms': round(tiempos[0], 2),
+        'mediana_ms': round(statistics.median(tiempos), 2),
+        'min_ms': round(min(tiempos), 2),
+        'consultas': consultas[0],
+        'consultas_repetidas': consultas[-1],
+    }
+
+def muestra_benchmark():
+    """Objetos sobre los que se miden los casos: el contrato activo con más pagos, etc."""
+    contrato = (
+        Contrato.objects.filter(estado='ACTIVO')
+        .annotate(n_pagos=Count('pago')).order_by('-n_pagos', 'id').first()
+    )
+    if contrato is None:
+        return None
+    en_mora = Contrato.objects.filter(Q(esta_en_mora=True) | Q(pk=contrato.pk)).order_by('-esta_en_mora', 'id').first()
+    return {
+        'contrato': contrato,
+        'contrato_en_mora': en_mora,
+        'pago': Pago.objects.filter(contrato=contrato, es_entrada=False).order_by('-id').first(),
+        'cuota_pagada': Cuota.objects.filter(contrato=contrato, valor_pagado__gt=0).order_by('-numero_cuota').first(),
+        'cuota_pendiente': Cuota.objects.filter(contrato=contrato, valor_pagado=0).order_by('numero_cuota').first(),
+    }
+
+def casos_benchmark(muestra, usuario, cliente_http):
+    """Lista de (nombre, función) a medir."""
+    from Aplicaciones.sbr_gestor.views import calcular_ganancias_lotes_rapido
+    from .reportes import datos_reporte_mensual, pdf_reporte_general, pdf_reporte_mensual, rango_reporte
+    from .services import (
+        actualizar_moras_masivo, estado_cuenta_pdf, generar_pdf_contrato, recalcular_deuda_contrato,
+        recibo_entrada_pdf, recibo_pago_pdf, recibo_transaccion_pdf, registrar_pago_cliente,
+    )
+
+    contrato = muestra['contrato']
+    monto_cuota = muestra['cuota_pendiente'].valor_capital if muestra['cuota_pendiente'] else contrato.saldo_a_financiar
+    mes_pasado = date.today().replace(day=1) - relativedelta(months=1)
+    mes, anio = str(mes_pasado.month), str(mes_pasado.year)
+    desde, hasta = rango_reporte()
+
+    casos = [
+        ('registrar_pago_cliente',
+         lambda: registrar_pago_cliente(contrato.id, monto_cuota, 'EFECTIVO', None, usuario)),
+        ('recalcular_deuda_contrato', lambda: recalcular_deuda_contrato(contrato.id)),
+        ('actualizar_moras_masivo', lambda: actualizar_moras_masivo(Contrato.objects.all())),
+        ('datos_reporte_mensual', lambda: datos_reporte_mensual(usuario, mes, anio)),
+        ('calcular_ganancias_lotes_rapido', lambda: calcular_ganancias_lotes_rapido(mes, anio)),
+        ('calcular_ganancias_lotes_historico', lambda: calcular_ganancias_lotes_rapido()),
+        ('vista_reporte_general', lambda: _get(cliente_http, reverse('reporte_general'))),
+        ('vista_dashboard_gestor', lambda: _get(cliente_http, reverse('gestor_dashboard'))),
+        ('vista_dashboard_gestor_lotes', lambda: _get(cliente_http, reverse('gestor_dashboard') + '?lotes=1')),
+        ('vista_caja', lambda: _get(cliente_http, reverse('gestor_gastos'))),
+        ('vista_api_totales', lambda: _get(cliente_http, reverse('api_totales'))),
+        ('vista_api_graficos_categorias', lambda: _get(cliente_http, reverse('api_graficos_categorias'))),
+        ('vista_api_graficos_serie', lambda: _get(cliente_http, reverse('api_graficos_serie') + '?periodo=semana')),
+        ('pdf_contrato', lambda: generar_pdf_contrato(contrato.id)),
+        ('pdf_recibo_entrada', lambda: recibo_entrada_pdf(contrato.id)),
+        ('pdf_estado_cuenta', lambda: estado_cuenta_pdf(muestra['contrato_en_mora'].id)),
+        ('pdf_reporte_general', lambda: pdf_reporte_general(usuario, desde, hasta)),
+        ('pdf_reporte_mensual', lambda: pdf_reporte_mensual(usuario, mes, anio)),
+    ]
+    if muestra['cuota_pagada']:
+        casos.append(('pdf_recibo_pago', lambda: recibo_pago_pdf(muestra['cuota_pagada'].id)))
+    if muestra['pago']:
+        casos.append(('pdf_recibo_transaccion', lambda: recibo_transaccion_pdf(muestra['pago'].id)))
+    return casos
+
+def _get(cliente_http, url):
+    respuesta = cliente_http.get(url)
+    if respuesta.status_code != 200:
+        raise RuntimeError(f"GET {url} respondió {respuesta.status_code}")
+    return respuesta
+
+def ejecutar_benchmark(repeticiones=5, solo=None, sembrar=None, progreso=None):
+    """
+    Mide todos los casos (o los nombrados en `solo`) y retorna el dict del resultado.
+    Con `sembrar` (kwargs de sembrar_cartera) primero crea una cartera sintética, que
+    también se deshace al final. Un caso que falla (p. ej. sin WeasyPrint) queda con 'error'.
+    """
+    resultado = {
+        'commit': _commit_actual(),
+        'fecha': date.today().isoformat(),
+        'base_datos': connection.vendor,
+        'repeticiones': repeticiones,
+        'cartera': None,
+        'casos': {},
+    }
+    try:
+        with transaction.atomic(), tempfile.TemporaryDirectory() as media, override_settings(
+            MEDIA_ROOT=media, ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver']
+        ):
+            if sembrar is not None:
+                from .cartera_sintetica import sembrar_cartera
+                sembrar_cartera(**sembrar)
+            resultado['cartera'] = {
+                'contratos': Contrato.objects.count(),
+                'cuotas': Cuota.objects.count(),
+                'pagos': Pago.objects.count(),
+            }
+            muestra = muestra_benchmark()
+            if muestra is None:
+                raise ValueError("No hay contratos activos: use --sembrar o sembrar_cartera primero.")
+
+            usuario = User.objects.create_superuser(f"benchmark_{time.time_ns()}", password=None)
+            cliente_http = Client()
+            cliente_http.force_login(usuario)
+
+            for nombre, funcion in casos_benchmark(muestra, usuario, cliente_http):
+                if solo and nombre not in solo:
+                    continue
+                try:
+                    resultado['casos'][nombre] = medir(funcion, repeticiones)
+                except Exception as error:
+                    resultado['casos'][nombre] = {'error': f"{type(error).__name__}: {error}"}
+                if progreso:
+                    progreso(nombre, resultado['casos'][nombre])
+            raise _Deshacer
+    except _Deshacer:
+        pass
+    return resultado
+
+def comparar_resultados(anterior, actual, tolerancia=0.2):
+    """
+    Regresiones de `actual` frente a `anterior` (dicts de ejecutar_benchmark): más consultas,
+    o una mediana más lenta que anterior × (1 + tolerancia). Retorna una lista de textos.
+    """
+    regresiones = []
+    for nombre, caso in actual['casos'].items():
+        base = anterior.get('casos', {}).get(nombre)
+        if not base or 'error' in base or 'error' in caso:
+            continue
+        for campo in ('consultas', 'consultas_repetidas'):
+            if caso[campo] > base[campo]:
+                regresiones.append(f"{nombre}: {campo} {base[campo]} -> {caso[campo]}")
+        if caso['mediana_ms'] > base['mediana_ms'] * (1 + tolerancia):
+            regresiones.append(f"{nombre}: mediana {base['mediana_ms']} ms -> {caso['mediana_ms']} ms")
+    return regresiones
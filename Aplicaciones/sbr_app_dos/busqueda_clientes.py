@@ -0,0 +1,153 @@
+"""
+Listado de clientes paginado en el servidor: búsqueda de texto, filtros y cursor.
+
+La búsqueda por nombre o cédula usa el índice de texto de la migración 0038 (FTS5 en
+SQLite, FULLTEXT en MySQL; icontains en otros motores). Cada palabra es un prefijo y
+todas deben coincidir: "loo an" encuentra "Loor Ana", "0912" las cédulas que empiezan
+así. Si el texto completo es un número de lote, también trae los contratos de ese lote.
+
+La paginación es por cursor (fecha_contrato, id), más recientes primero: cada página
+es una consulta que usa el índice contrato_fecha_id_idx, sin OFFSET ni COUNT, así que
+cuesta lo mismo en la primera página que en la última.
+"""
+import re
+from datetime import date
+from importlib import import_module
+
+from django.db import connection, connections
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+
+from .models import Contrato
+
+TAMANO_PAGINA_CLIENTES = 50
+
+FILTROS_CLIENTES = ('q', 'estado', 'mora', 'vendedor', 'manzana')
+
+_PALABRA = re.compile(r'\w+')
+
+TABLA_INDICE_TEXTO = 'sbr_app_dos_cliente_fts'
+TRIGGERS_INDICE_TEXTO = {f'{TABLA_INDICE_TEXTO}_ai', f'{TABLA_INDICE_TEXTO}_ad', f'{TABLA_INDICE_TEXTO}_au'}
+
+
+def indice_texto_incompleto(using='default'):
+    """
+    SQLite: True si existe la tabla FTS5 pero faltan sus triggers. Una migración que rehace
+    sbr_app_dos_cliente (casi cualquier AlterField/RemoveField en SQLite) los borra sin
+    aviso y desde ahí la búsqueda deja de ver altas y cambios de clientes.
+    """
+    conexion = connections[using]
+    if conexion.vendor != 'sqlite':
+        return False
+    with conexion.cursor() as cursor:
+        cursor.execute("SELECT type, name FROM sqlite_master WHERE name LIKE %s", [f'{TABLA_INDICE_TEXTO}%'])
+        objetos = set(cursor.fetchall())
+    if ('table', TABLA_INDICE_TEXTO) not in objetos:
+        return False  # Base migrada a antes de 0038: no hay índice que mantener
+    return not TRIGGERS_INDICE_TEXTO <= {nombre for tipo, nombre in objetos if tipo == 'trigger'}
+
+
+def reparar_indice_texto(using='default'):
+    """Vuelve a crear la tabla FTS5 y sus triggers (con 'rebuild') si están incompletos."""
+    if not indice_texto_incompleto(using):
+        return False
+    # Las sentencias son las de la migración: una sola definición del índice
+    migracion = import_module('Aplicaciones.sbr_app_dos.migrations.0038_busqueda_clientes')
+    with connections[using].cursor() as cursor:
+        for sql in migracion.SQLITE_BORRAR + migracion.SQLITE_CREAR:
+            cursor.execute(sql)
+    return True
+
+
+def _coincidencias_texto(palabras):
+    """Condición sobre Cliente.id para las palabras buscadas (todas, como prefijo)."""
+    if connection.vendor == 'sqlite':
+        consulta = ' '.join(f'"{palabra}"*' for palabra in palabras)
+        return Q(cliente_id__in=RawSQL(
+            "SELECT rowid FROM sbr_app_dos_cliente_fts WHERE sbr_app_dos_cliente_fts MATCH %s", [consulta]
+        ))
+    if connection.vendor == 'mysql':
+        consulta = ' '.join(f'+{palabra}*' for palabra in palabras)
+        return Q(cliente_id__in=RawSQL(
+            "SELECT id FROM sbr_app_dos_cliente WHERE MATCH (cedula, apellidos, nombres) AGAINST (%s IN BOOLEAN MODE)",
+            [consulta]
+        ))
+    condicion = Q()
+    for palabra in palabras:
+        condicion &= (
+            Q(cliente__cedula__istartswith=palabra) | Q(cliente__apellidos__icontains=palabra)
+            | Q(cliente__nombres__icontains=palabra)
+        )
+    return condicion
+
+
+def _del_lote(**filtro):
+    """Contratos con un lote que cumple `filtro`, en el M2M o en el campo antiguo 'lote'."""
+    lotes_m2m = Contrato.lotes.through.objects.filter(**{f'lote__{k}': v for k, v in filtro.items()})
+    return Q(pk__in=lotes_m2m.values('contrato_id')) | Q(**{f'lote__{k}': v for k, v in filtro.items()})
+
+
+def filtrar_contratos(contratos, q='', estado='', mora='', vendedor='', manzana=''):
+    """Aplica la búsqueda y los filtros del listado (valores tal como llegan en request.GET)."""
+    palabras = _PALABRA.findall(q or '')
+    if palabras:
+        condicion = _coincidencias_texto(palabras)
+        if len(palabras) == 1:
+            condicion |= _del_lote(numero_lote=palabras[0])
+        contratos = contratos.filter(condicion)
+    if estado:
+        contratos = contratos.filter(estado=estado)
+    if mora == 'en-mora':
+        contratos = contratos.filter(estado='ACTIVO', esta_en_mora=True)
+    elif mora == 'al-dia':
+        contratos = contratos.exclude(estado='ACTIVO', esta_en_mora=True)
+    if vendedor and vendedor.isdigit():
+        contratos = contratos.filter(cliente__vendedor_id=int(vendedor))
+    if manzana:
+        contratos = contratos.filter(_del_lote(manzana=manzana))
+    return contratos
+
+
+def cursor_contrato(contrato):
+    return f"{contrato.fecha_contrato.isoformat()}_{contrato.id}"
+
+
+def leer_cursor(valor):
+    """'YYYY-MM-DD_id' -> (fecha, id); None si no es válido."""
+    try:
+        fecha, pk = (valor or '').split('_')
+        return date.fromisoformat(fecha), int(pk)
+    except ValueError:
+        return None
+
+
+def pagina_contratos(contratos, despues=None, antes=None, tamano=TAMANO_PAGINA_CLIENTES):
+    """
+    Una página del listado (más recientes primero). `despues` / `antes` son cursores de
+    cursor_contrato: la página siguiente empieza después del último contrato mostrado,
+    la anterior termina antes del primero. Retorna {'contratos', 'siguiente', 'anterior'}
+    con los cursores de las páginas vecinas (None si no hay).
+    """
+    desde_despues, desde_antes = leer_cursor(despues), leer_cursor(antes)
+    if desde_antes:
+        fecha, pk = desde_antes
+        pagina = list(
+            contratos.filter(Q(fecha_contrato__gt=fecha) | Q(fecha_contrato=fecha, id__gt=pk))
+            .order_by('fecha_contrato', 'id')[:tamano + 1]
+        )
+        hay_mas = len(pagina) > tamano
+        pagina = pagina[:tamano][::-1]
+        hay_anterior, hay_siguiente = hay_mas, True
+    else:
+        if desde_despues:
+            fecha, pk = desde_despues
+            contratos = contratos.filter(Q(fecha_contrato__lt=fecha) | Q(fecha_contrato=fecha, id__lt=pk))
+        pagina = list(contratos.order_by('-fecha_contrato', '-id')[:tamano + 1])
+        hay_siguiente = len(pagina) > tamano
+        pagina = pagina[:tamano]
+        hay_anterior = desde_despues is not None
+    return {
+        'contratos': pagina,
+        'siguiente': cursor_contrato(pagina[-1]) if pagina and hay_siguiente else None,
+        'anterior': cursor_contrato(pagina[0]) if pagina and hay_anterior else None,
+    }
@@ -0,0 +1,133 @@
+"""
+Caché en disco de los PDF de recibos.
+
+La clave es el contenido: sha256 del nombre de la plantilla, su fecha de modificación y
+el HTML ya renderizado con el contexto. Renderizar el HTML es barato; lo caro es WeasyPrint.
+Si los datos del recibo no cambian, el mismo archivo se sirve desde MEDIA_ROOT/cache_pdf
+sin volver a renderizar. Si cambian, cambia la clave y el archivo viejo envejece hasta que
+lo borra la limpieza por edad/tamaño (la edad cuenta desde el último uso).
+"""
+import hashlib
+import os
+import tempfile
+import time
+
+from django.conf import settings
+from django.http import FileResponse
+from django.template.loader import get_template
+from django.utils.cache import get_conditional_response
+from django.utils.http import quote_etag
+
+from .render_pdf import html_a_pdf
+
+DIRECTORIO_CACHE_PDF = 'cache_pdf'
+
+# Última limpieza tras un fallo de caché en este proceso (time.monotonic)
+_ultima_limpieza = None
+
+def directorio_cache_pdf():
+    return os.path.join(settings.MEDIA_ROOT, DIRECTORIO_CACHE_PDF)
+
+def _escribir_pdf(html, destino):
+    html_a_pdf(html, destino)
+
+def pdf_en_cache(plantilla, context):
+    """
+    Retorna (ruta, clave) del PDF de la plantilla con ese contexto.
+    Solo se llama a WeasyPrint si el archivo no está en caché.
+    """
+    template = get_template(plantilla)
+    html = template.render(context)
+
+    firma = hashlib.sha256()
+    for parte in (plantilla, str(os.path.getmtime(template.origin.name)), html):
+        firma.update(parte.encode('utf-8'))
+        firma.update(b'\0')
+    clave = firma.hexdigest()
+    ruta = os.path.join(directorio_cache_pdf(), clave[:2], f'{clave}.pdf')
+
+    try:
+        os.utime(ruta)  # Acierto: renovar la edad
+        return ruta, clave
+    except FileNotFoundError:
+        pass
+
+    # Escribir a un temporal y renombrar: otro proceso nunca ve un PDF a medias
+    os.makedirs(os.path.dirname(ruta), exist_ok=True)
+    fd, temporal = tempfile.mkstemp(suffix='.tmp', dir=os.path.dirname(ruta))
+    try:
+        with os.fdopen(fd, 'wb') as destino:
+            _escribir_pdf(html, destino)
+        os.replace(temporal, ruta)
+    except BaseException:
+        os.unlink(temporal)
+        raise
+
+    _limpiar_si_corresponde()
+    return ruta, clave
+
+def _limpiar_si_corresponde():
+    """
+    Limpieza tras un fallo de caché, como mucho una vez cada PDF_CACHE_SEGUNDOS_LIMPIEZA
+    por proceso: recorrer toda la carpeta en cada fallo hacía que una exportación de N
+    recibos costara N recorridos.
+    """
+    global _ultima_limpieza
+    ahora = time.monotonic()
+    intervalo = getattr(settings, 'PDF_CACHE_SEGUNDOS_LIMPIEZA', 300)
+    if _ultima_limpieza is not None and ahora - _ultima_limpieza < intervalo:
+        return
+    _ultima_limpieza = ahora
+    limpiar_cache_pdf()
+
+def limpiar_cache_pdf(max_mb=None, max_dias=None):
+    """
+    Borra los PDF sin uso en más de PDF_CACHE_MAX_DIAS días y, si la caché supera
+    PDF_CACHE_MAX_MB, los menos usados hasta quedar por debajo. Retorna cuántos borró.
+    """
+    if max_mb is None:
+        max_mb = getattr(settings, 'PDF_CACHE_MAX_MB', 200)
+    if max_dias is None:
+        max_dias = getattr(settings, 'PDF_CACHE_MAX_DIAS', 30)
+
+    archivos = []
+    if os.path.isdir(directorio_cache_pdf()):
+        for carpeta in os.scandir(directorio_cache_pdf()):
+            if not carpeta.is_dir():
+                continue
+            for archivo in os.scandir(carpeta.path):
+                if archivo.name.endswith('.pdf'):
+                    info = archivo.stat()
+                    archivos.append((info.st_mtime, info.st_size, archivo.path))
+
+    archivos.sort()
+    limite_edad = time.time() - max_dias * 86400
+    total = sum(tamano for _, tamano, _ in archivos)
+    borrados = 0
+    for modificado, tamano, ruta in archivos:
+        if modificado >= limite_edad and total <= max_mb * 1024 * 1024:
+            break
+        try:
+            os.remove(ruta)
+        except FileNotFoundError:
+            pass
+        total -= tamano
+        borrados += 1
+    return borrados
+
+def respuesta_pdf(request, pdf, filename):
+    """
+    Descarga del PDF en caché con ETag: si el navegador ya tiene esta versión
+    (If-None-Match) responde 304 sin cuerpo; si no, lo transmite desde disco.
+    """
+    ruta, clave = pdf
+    etag = quote_etag(clave)
+    no_modificado = get_conditional_response(request, etag=etag)
+    if no_modificado is not None:
+        return no_modificado
+
+    response = FileResponse(open(ruta, 'rb'), as_attachment=True, filename=filename, content_type='application/pdf')
+    response['ETag'] = etag
+    # Cada descarga revalida: los datos del recibo pueden cambiar con nuevos pagos
+    response['Cache-Control'] = 'private, no-cache'
+    return response
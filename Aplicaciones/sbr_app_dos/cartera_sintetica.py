@@ -0,0 +1,208 @@
+"""
+Cartera sintética para medir rendimiento (comandos sembrar_cartera y benchmark_servicios).
+
+Genera vendedores, lotes repartidos en manzanas, clientes y contratos de 12 a 240 cuotas
+con un comportamiento de pago por contrato: puntuales, irregulares (abonos parciales,
+meses saltados, pagos dobles), morosos que dejan de pagar y adelantados. Las cuotas,
+los detalles de pago, la mora y los resúmenes los calcula el motor real
+(generar_tablas_amortizacion + recalcular_deuda_contrato), así que la cartera queda
+igual de consistente que una cargada desde las vistas. Con la misma semilla y el mismo
+día se obtiene la misma cartera.
+"""
+import random
+from datetime import date, timedelta
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.db import transaction
+
+from .asignacion import CENTAVO
+from .models import Cliente, ConfiguracionSistema, Contrato, Cuota, Lote, MovimientoCaja, Pago
+from .services import (
+    actualizar_resumen_diario, generar_tablas_amortizacion, invalidar_cierres_desde, recalcular_deuda_contrato,
+)
+
+PLAZOS = (12, 24, 36, 48, 60, 72, 96, 120, 180, 240)
+PESOS_PLAZOS = (10, 18, 20, 16, 12, 8, 6, 5, 3, 2)
+
+# Comportamiento de pago de cada contrato y su peso en la cartera
+PERFILES = {'PUNTUAL': 45, 'IRREGULAR': 30, 'MOROSO': 15, 'ADELANTADO': 10}
+
+BANCOS = ('Pichincha', 'Guayaquil', 'Produbanco', 'Pacífico', 'Bolivariano')
+APELLIDOS = ('Zambrano', 'Vera', 'Moreira', 'Cedeño', 'Macías', 'Mendoza', 'Intriago', 'Loor', 'Alcívar', 'Pico')
+NOMBRES = ('María', 'José', 'Luis', 'Ana', 'Carlos', 'Rosa', 'Jorge', 'Carmen', 'Pedro', 'Lucía')
+
+def _dinero(valor):
+    return Decimal(valor).quantize(CENTAVO)
+
+def _pago(rng, contrato_id, fecha, monto, **extra):
+    metodo = rng.choices(('EFECTIVO', 'TRANSFERENCIA'), weights=(60, 40))[0]
+    datos = {}
+    if metodo == 'TRANSFERENCIA':
+        datos = {'banco': rng.choice(BANCOS), 'cuenta': str(rng.randint(10**9, 10**10 - 1))}
+    return Pago(contrato_id=contrato_id, fecha_pago=fecha, monto=_dinero(monto), metodo_pago=metodo, **datos, **extra)
+
+def _pagos_del_contrato(rng, tabla, perfil, hoy):
+    """Abonos (sin la entrada) de un contrato según su perfil, hasta hoy."""
+    pagos = []
+    dejo_de_pagar = rng.randint(1, max(1, len(tabla['numeros']) // 2)) if perfil == 'MOROSO' else None
+    for numero, vence, capital in zip(tabla['numeros'], tabla['fechas'], tabla['capitales']):
+        if vence > hoy + timedelta(days=20):
+            break
+        if dejo_de_pagar is not None and numero >= dejo_de_pagar:
+            break
+        fecha = vence + timedelta(days=rng.randint(-10, 5))
+        if perfil == 'IRREGULAR':
+            accion = rng.choices(('COMPLETO', 'PARCIAL', 'SALTA', 'DOBLE'), weights=(40, 30, 20, 10))[0]
+            if accion == 'SALTA':
+                continue
+            if accion == 'PARCIAL':
+                monto = capital * Decimal(rng.randint(30, 90)) / 100
+            elif accion == 'DOBLE':
+                monto = capital * 2
+            else:
+                monto = capital
+            fecha += timedelta(days=rng.randint(0, 40))
+        elif perfil == 'ADELANTADO':
+            monto = capital * Decimal(rng.choice((1, 1, 2, 3)))
+            fecha -= timedelta(days=rng.randint(0, 20))
+        else:
+            monto = capital
+        if fecha > hoy:
+            continue
+        pagos.append((fecha, monto))
+    return pagos
+
+@transaction.atomic
+def sembrar_cartera(contratos=200, vendedores=5, manzanas=12, lotes_libres=0.1, semilla=2026,
+                    prefijo='sintetico', anios=6, hoy=None):
+    """
+    Crea la cartera y retorna un dict con los conteos. Los usuarios vendedores se llaman
+    '<prefijo>_vendedor_<n>' (sirven para reconocer los datos sintéticos).
+    """
+    rng = random.Random(semilla)
+    hoy = hoy or date.today()
+    ConfiguracionSistema.objects.get_or_create(
+        defaults={'nombre_empresa': 'Urbanización Sintética', 'ruc_empresa': '0999999999001'}
+    )
+
+    usuarios = [
+        User.objects.create_user(username=f"{prefijo}_vendedor_{n}", first_name='Vendedor', last_name=str(n))
+        for n in range(1, vendedores + 1)
+    ]
+
+    # Lotes: uno por contrato más un porcentaje disponible, repartidos en manzanas
+    total_lotes = contratos + int(contratos * lotes_libres)
+    lotes = Lote.objects.bulk_create([
+        Lote(
+            manzana=chr(ord('A') + i % manzanas) if manzanas <= 26 else f"M{i % manzanas + 1}",
+            numero_lote=str(i // manzanas + 1),
+            dimensiones=rng.choice(('10x20m', '12x25m', '15x30m', '8x15m')),
+            precio_contado=_dinero(rng.randrange(6000, 30000, 250)),
+            estado='VENDIDO' if i < contratos else 'DISPONIBLE',
+            creado_por=rng.choice(usuarios),
+        )
+        for i in range(total_lotes)
+    ], batch_size=1000)
+
+    clientes = Cliente.objects.bulk_create([
+        Cliente(
+            vendedor=rng.choice(usuarios), cedula=f"{rng.randint(10**9, 10**10 - 1)}",
+            nombres=rng.choice(NOMBRES), apellidos=f"{rng.choice(APELLIDOS)} {rng.choice(APELLIDOS)}",
+            celular=f"09{rng.randint(10**7, 10**8 - 1)}", direccion='Dirección sintética',
+        )
+        for _ in range(contratos)
+    ], batch_size=1000)
+
+    nuevos = []
+    for cliente, lote in zip(clientes, lotes):
+        plazo = rng.choices(PLAZOS, weights=PESOS_PLAZOS)[0]
+        precio = lote.precio_contado * Decimal(rng.choice(('1.00', '1.10', '1.25')))
+        entrada = _dinero(precio * Decimal(rng.randint(10, 30)) / 100)
+        nuevos.append(Contrato(
+            cliente=cliente, lote=lote, fecha_contrato=hoy - timedelta(days=rng.randint(0, anios * 365)),
+            precio_venta_final=_dinero(precio), valor_entrada=entrada,
+            saldo_a_financiar=_dinero(precio) - entrada, numero_cuotas=plazo,
+        ))
+    nuevos = Contrato.objects.bulk_create(nuevos, batch_size=1000)
+    Contrato.lotes.through.objects.bulk_create(
+        [Contrato.lotes.through(contrato_id=c.id, lote_id=c.lote_id) for c in nuevos], batch_size=1000
+    )
+
+    # Tabla de amortización en memoria para decidir los pagos, y luego la real
+    tablas = {t['contrato_id']: t for t in generar_tablas_amortizacion(nuevos, dry_run=True)}
+    generar_tablas_amortizacion(nuevos, batch_size=2000)
+
+    pagos = []
+    for contrato in nuevos:
+        pagos.append(_pago(rng, contrato.id, contrato.fecha_contrato, contrato.valor_entrada,
+                           es_entrada=True, numero_transaccion=1, observacion='Pago de Entrada'))
+        perfil = rng.choices(list(PERFILES), weights=list(PERFILES.values()))[0]
+        for numero, (fecha, monto) in enumerate(_pagos_del_contrato(rng, tablas[contrato.id], perfil, hoy), start=2):
+            pagos.append(_pago(rng, contrato.id, fecha, monto, numero_transaccion=numero))
+    Pago.objects.bulk_create(pagos, batch_size=2000)
+
+    # Exenciones de mora puestas a mano por el administrador (~2% de las cuotas vencidas)
+    vencidas = list(
+        Cuota.objects.filter(contrato__in=nuevos, fecha_vencimiento__lt=hoy).order_by('id').values_list('id', flat=True)
+    )
+    exentas = rng.sample(vencidas, len(vencidas) // 50)
+    Cuota.objects.filter(id__in=exentas).update(mora_exenta=True)
+
+    # El motor real reparte los pagos, calcula la mora y los resúmenes
+    for contrato in nuevos:
+        recalcular_deuda_contrato(contrato.id)
+
+    # Devoluciones y cancelaciones: liberan el lote
+    finalizados = rng.sample(nuevos, len(nuevos) // 20)
+    for i, contrato in enumerate(finalizados):
+        estado = 'DEVOLUCION' if i % 2 == 0 else 'CANCELADO'
+        fin = contrato.fecha_contrato + timedelta(days=rng.randint(30, 400))
+        Contrato.objects.filter(id=contrato.id).update(estado=estado, fecha_fin_contrato=min(fin, hoy))
+    Lote.objects.filter(id__in=[c.lote_id for c in finalizados]).update(estado='DISPONIBLE')
+
+    # Caja: ingresos varios y gastos de la oficina
+    movimientos = MovimientoCaja.objects.bulk_create([
+        MovimientoCaja(
+            tipo=rng.choices(('INGRESO', 'GASTO'), weights=(30, 70))[0],
+            monto=_dinero(rng.randrange(500, 60000) / 100),
+            fecha=hoy - timedelta(days=rng.randint(0, anios * 365)),
+            descripcion='Movimiento sintético', registrado_por=rng.choice(usuarios),
+        )
+        for _ in range(max(1, contratos // 2))
+    ], batch_size=1000)
+
+    # Gestor: gastos e ingresos administrativos por categoría
+    from Aplicaciones.sbr_gestor.libro import sincronizar_libro
+    from Aplicaciones.sbr_gestor.models import CategoriaTransaccion, Transaccion
+    categorias = [
+        CategoriaTransaccion.objects.get_or_create(nombre=nombre, tipo=tipo)[0]
+        for nombre, tipo in (('Mantenimiento', 'GASTO'), ('Servicios básicos', 'GASTO'), ('Alquiler', 'INGRESO'))
+    ]
+    transacciones = Transaccion.objects.bulk_create([
+        Transaccion(
+            tipo=categoria.tipo, categoria=categoria, valor=_dinero(rng.randrange(1000, 150000) / 100),
+            descripcion=f"{categoria.nombre} (sintético)", fecha=hoy - timedelta(days=rng.randint(0, anios * 365)),
+            registrado_por=rng.choice(usuarios),
+        )
+        for categoria in (rng.choice(categorias) for _ in range(max(1, contratos // 2)))
+    ], batch_size=1000)
+
+    # Las cargas en bloque no disparan las señales: reconstruir los resúmenes diarios y el libro de caja
+    if nuevos:
+        invalidar_cierres_desde(min(c.fecha_contrato for c in nuevos))
+    dias = actualizar_resumen_diario()
+    sincronizar_libro()
+
+    return {
+        'vendedores': len(usuarios),
+        'lotes': len(lotes),
+        'contratos': len(nuevos),
+        'cuotas': sum(len(t['numeros']) for t in tablas.values()),
+        'pagos': len(pagos),
+        'cuotas_exentas': len(exentas),
+        'devoluciones_y_cancelaciones': len(finalizados),
+        'movimientos_caja': len(movimientos),
+        'transacciones_gestor': len(transacciones),
+        'dias_resumen': dias,
+    }
@@ -0,0 +1,127 @@
+"""
+Exportación masiva de recibos de pago y estados de cuenta (cierre de mes, cobranza).
+
+Cada documento sale de la caché de PDF (cache_pdf) o se renderiza en un pool de procesos;
+los procesos solo devuelven la ruta del PDF en disco. El proceso principal copia cada
+archivo al ZIP (o lo agrega al PDF unido) apenas le llega, en orden, con a lo sumo
+2 × procesos documentos en vuelo: la memoria no crece con el tamaño de la exportación.
+El PDF unido sí conserva las páginas hasta escribirlo (pypdf no escribe por partes);
+para exportaciones muy grandes conviene el ZIP.
+"""
+import multiprocessing
+import zipfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from django.db.models import Q
+
+from .models import Contrato, Pago
+
+TIPOS_EXPORTACION = {
+    'RECIBOS': 'Recibos de pago',
+    'ESTADOS': 'Estados de cuenta',
+}
+FORMATOS_EXPORTACION = ('zip', 'pdf')
+
+def documentos_exportacion(tipo, desde=None, hasta=None, contratos=None, usuario=None):
+    """
+    Ids a exportar, en el orden en que salen en el archivo.
+    RECIBOS: pagos (sin la entrada) entre `desde` y `hasta`, de `contratos` si se indican.
+    ESTADOS: los contratos indicados o, si no hay, los activos en mora.
+    """
+    if tipo == 'RECIBOS':
+        pagos = Pago.objects.filter(es_entrada=False)
+        if desde:
+            pagos = pagos.filter(fecha_pago__gte=desde)
+        if hasta:
+            pagos = pagos.filter(fecha_pago__lte=hasta)
+        if contratos:
+            pagos = pagos.filter(contrato_id__in=contratos)
+        if usuario is not None and not usuario.is_superuser:
+            pagos = pagos.filter(contrato__cliente__vendedor=usuario)
+        return list(pagos.order_by('fecha_pago', 'id').values_list('id', flat=True))
+
+    if tipo == 'ESTADOS':
+        if contratos:
+            qs = Contrato.objects.filter(id__in=contratos)
+        else:
+            qs = Contrato.objects.filter(Q(esta_en_mora=True) | Q(resumen__cuotas_vencidas__gt=0), estado='ACTIVO')
+        if usuario is not None and not usuario.is_superuser:
+            qs = qs.filter(cliente__vendedor=usuario)
+        return list(qs.order_by('id').values_list('id', flat=True).distinct())
+
+    raise ValueError(f"Tipo de exportación desconocido: {tipo}")
+
+def render_documento(tipo, objeto_id):
+    """(ruta, nombre) del PDF de un documento; se renderiza solo si no está en caché."""
+    from .services import estado_cuenta_pdf, recibo_transaccion_pdf
+
+    if tipo == 'RECIBOS':
+        ruta, _ = recibo_transaccion_pdf(objeto_id)
+        return ruta, f"Recibo_Pago_{objeto_id}.pdf"
+    ruta, _ = estado_cuenta_pdf(objeto_id)
+    return ruta, f"Estado_Cuenta_{objeto_id}.pdf"
+
+def documentos_en_paralelo(tipo, ids, procesos=1):
+    """
+    Genera (ruta, nombre) en el orden de `ids`. Con procesos > 1 los renders corren en
+    un pool 'spawn' (ver worker_pdf) y solo hay 2 × procesos documentos pendientes a la vez.
+    """
+    if procesos <= 1:
+        for objeto_id in ids:
+            yield render_documento(tipo, objeto_id)
+        return
+
+    from django.db import connections
+    from .worker_pdf import inicializar_proceso, renderizar_documento
+
+    # Los procesos hijos abren sus propias conexiones
+    connections.close_all()
+    contexto = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=procesos, mp_context=contexto, initializer=inicializar_proceso) as pool:
+        en_vuelo = deque()
+        pendientes = iter(ids)
+        for objeto_id in pendientes:
+            en_vuelo.append(pool.submit(renderizar_documento, tipo, objeto_id))
+            if len(en_vuelo) >= 2 * procesos:
+                break
+        while en_vuelo:
+            yield en_vuelo.popleft().result()
+            siguiente = next(pendientes, None)
+            if siguiente is not None:
+                en_vuelo.append(pool.submit(renderizar_documento, tipo, siguiente))
+
+def escribir_zip(documentos, destino, progreso=None):
+    # Los PDF ya vienen comprimidos: guardarlos sin volver a comprimir
+    with zipfile.ZipFile(destino, 'w', compression=zipfile.ZIP_STORED) as archivo:
+        for hechos, (ruta, nombre) in enumerate(documentos, start=1):
+            archivo.write(ruta, arcname=nombre)
+            if progreso:
+                progreso(hechos)
+
+def escribir_pdf_unido(documentos, destino, progreso=None):
+    from pypdf import PdfWriter
+
+    unido = PdfWriter()
+    for hechos, (ruta, _) in enumerate(documentos, start=1):
+        unido.append(ruta)
+        if progreso:
+            progreso(hechos)
+    unido.write(destino)
+
+def exportar_documentos(tipo, ids, formato, destino, procesos=1, progreso=None):
+    """
+    Escribe en `destino` (ruta o archivo abierto) el ZIP o el PDF unido de los documentos.
+    `progreso(hechos)` se llama después de agregar cada uno.
+    """
+    if formato not in FORMATOS_EXPORTACION:
+        raise ValueError(f"Formato de exportación desconocido: {formato}")
+    if not ids:
+        raise ValueError("No hay documentos para exportar con esos filtros.")
+
+    documentos = documentos_en_paralelo(tipo, ids, procesos)
+    if formato == 'zip':
+        escribir_zip(documentos, destino, progreso)
+    else:
+        escribir_pdf_unido(documentos, destino, progreso)
+    return len(ids)
@@ -0,0 +1,184 @@
+"""
+Instrumentación por request: consultas SQL, tiempo de BD, de plantillas y de PDF.
+
+El middleware (sbr_dos.middleware.InstrumentacionMiddleware) mide una fracción de los
+requests (INSTRUMENTACION_MUESTREO) y por cada uno:
+  - agrega la cabecera Server-Timing (visible en las herramientas del navegador),
+  - suma la muestra al agregado en memoria por nombre de URL (vista de superusuario),
+  - escribe una línea JSON en el logger 'sbr.instrumentacion'.
+
+La medición del request en curso vive en un ContextVar: el execute_wrapper de la BD,
+el backend de plantillas (PlantillasMedidas) y medir_pdf() suman ahí sin recibirla
+como parámetro. Fuera de un request medido (comandos, procesos de la cola de PDF)
+todo esto no hace nada. El agregado es por proceso: con varios workers, cada uno
+muestra sus propias muestras.
+"""
+import heapq
+import statistics
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.template import TemplateDoesNotExist
+from django.template.backends.django import DjangoTemplates, Template, reraise
+
+_medicion_actual = ContextVar('medicion_instrumentacion', default=None)
+
+MAX_LARGO_SQL = 300
+
+class Medicion:
+    """Acumuladores de un request medido."""
+
+    def __init__(self, consultas_lentas=3):
+        self.consultas = 0
+        self.sql_ms = 0.0
+        self.plantillas_ms = 0.0
+        self.pdf_ms = 0.0
+        self.lentas = []  # heap de (ms, sql): las N más lentas
+        self._max_lentas = consultas_lentas
+        self._profundidad_plantilla = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        """execute_wrapper de la conexión."""
+        inicio = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            ms = (time.perf_counter() - inicio) * 1000
+            self.consultas += 1
+            self.sql_ms += ms
+            if self._max_lentas:
+                entrada = (ms, sql[:MAX_LARGO_SQL])
+                if len(self.lentas) < self._max_lentas:
+                    heapq.heappush(self.lentas, entrada)
+                elif ms > self.lentas[0][0]:
+                    heapq.heapreplace(self.lentas, entrada)
+
+    def consultas_lentas(self):
+        return [{'ms': round(ms, 2), 'sql': sql} for ms, sql in sorted(self.lentas, reverse=True)]
+
+    def como_dict(self):
+        return {
+            'consultas': self.consultas,
+            'sql_ms': round(self.sql_ms, 2),
+            'plantillas_ms': round(self.plantillas_ms, 2),
+            'pdf_ms': round(self.pdf_ms, 2),
+        }
+
+def medicion_actual():
+    return _medicion_actual.get()
+
+@contextmanager
+def medir_request(consultas_lentas=3):
+    medicion = Medicion(consultas_lentas)
+    token = _medicion_actual.set(medicion)
+    try:
+        yield medicion
+    finally:
+        _medicion_actual.reset(token)
+
+@contextmanager
+def medir_pdf():
+    """Cronómetro alrededor del render de WeasyPrint / pisa."""
+    medicion = _medicion_actual.get()
+    if medicion is None:
+        yield
+        return
+    inicio = time.perf_counter()
+    try:
+        yield
+    finally:
+        medicion.pdf_ms += (time.perf_counter() - inicio) * 1000
+
+# ==========================================
+# PLANTILLAS
+# ==========================================
+class _PlantillaMedida(Template):
+    def render(self, context=None, request=None):
+        medicion = _medicion_actual.get()
+        if medicion is None:
+            return super().render(context, request)
+        # render_to_string dentro de otra plantilla (tags) no se cuenta dos veces
+        medicion._profundidad_plantilla += 1
+        inicio = time.perf_counter()
+        try:
+            return super().render(context, request)
+        finally:
+            medicion._profundidad_plantilla -= 1
+            if medicion._profundidad_plantilla == 0:
+                medicion.plantillas_ms += (time.perf_counter() - inicio) * 1000
+
+class PlantillasMedidas(DjangoTemplates):
+    """Backend DjangoTemplates que cronometra cada render de primer nivel."""
+
+    def from_string(self, template_code):
+        return _PlantillaMedida(self.engine.from_string(template_code), self)
+
+    def get_template(self, template_name):
+        try:
+            return _PlantillaMedida(self.engine.get_template(template_name), self)
+        except TemplateDoesNotExist as exc:
+            reraise(exc, self)
+
+# ==========================================
+# AGREGADO POR URL
+# ==========================================
+class AgregadoRutas:
+    """Últimas INSTRUMENTACION_VENTANA muestras de cada nombre de URL, en memoria del proceso."""
+
+    def __init__(self):
+        self._rutas = {}
+        self._lock = threading.Lock()
+
+    def registrar(self, ruta, total_ms, medicion):
+        ventana = getattr(settings, 'INSTRUMENTACION_VENTANA', 200)
+        muestra = (total_ms, medicion.consultas, medicion.sql_ms, medicion.plantillas_ms, medicion.pdf_ms)
+        with self._lock:
+            datos = self._rutas.setdefault(ruta, {'muestras': deque(maxlen=ventana), 'lentas': []})
+            datos['muestras'].append(muestra)
+            # Las consultas más lentas vistas en la ruta (sin repetir el mismo SQL)
+            lentas = {sql: ms for ms, sql in datos['lentas']}
+            for ms, sql in medicion.lentas:
+                lentas[sql] = max(ms, lentas.get(sql, 0))
+            datos['lentas'] = heapq.nlargest(medicion._max_lentas or 3, ((ms, sql) for sql, ms in lentas.items()))
+
+    def resumen(self):
+        """Una fila por ruta, las más lentas (p95 del total) primero."""
+        with self._lock:
+            copia = {ruta: (list(d['muestras']), list(d['lentas'])) for ruta, d in self._rutas.items()}
+        filas = []
+        for ruta, (muestras, lentas) in copia.items():
+            totales = sorted(m[0] for m in muestras)
+            promedio = lambda i: round(statistics.fmean(m[i] for m in muestras), 2)
+            filas.append({
+                'ruta': ruta,
+                'muestras': len(muestras),
+                'total_ms': promedio(0),
+                'p95_ms': round(totales[min(len(totales) - 1, int(len(totales) * 0.95))], 2),
+                'max_ms': round(totales[-1], 2),
+                'consultas': promedio(1),
+                'max_consultas': max(m[1] for m in muestras),
+                'sql_ms': promedio(2),
+                'plantillas_ms': promedio(3),
+                'pdf_ms': promedio(4),
+                'lentas': [{'ms': round(ms, 2), 'sql': sql} for ms, sql in lentas],
+            })
+        return sorted(filas, key=lambda f: f['p95_ms'], reverse=True)
+
+    def reiniciar(self):
+        with self._lock:
+            self._rutas.clear()
+
+agregado_rutas = AgregadoRutas()
+
+def server_timing(total_ms, medicion):
+    """Valor de la cabecera Server-Timing."""
+    return ", ".join([
+        f"total;dur={total_ms:.1f}",
+        f'db;dur={medicion.sql_ms:.1f};desc="{medicion.consultas} consultas"',
+        f"tpl;dur={medicion.plantillas_ms:.1f}",
+        f"pdf;dur={medicion.pdf_ms:.1f}",
+    ])
@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+from Aplicaciones.sbr_app_dos.services import recalcular_moras_diario
+
+
+class Command(BaseCommand):
+    help = (
+        'Recalcula la mora de toda la cartera una vez al día. '
+        'Programar en cron / tareas programadas: python manage.py actualizar_moras'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--forzar', action='store_true',
+            help='Recalcular incluso los contratos cuya mora ya se calculó hoy'
+        )
+        parser.add_argument(
+            '--solo-activos', action='store_true',
+            help='Procesar solo contratos en estado ACTIVO'
+        )
+
+    def handle(self, *args, **options):
+        conteos = recalcular_moras_diario(
+            forzar=options['forzar'],
+            solo_activos=options['solo_activos']
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f"Mora actualizada: {conteos['vencidas']} cuotas con mora, "
+            f"{conteos['exentas']} exentas, "
+            f"{conteos['contratos_en_mora']} contratos entraron en mora, "
+            f"{conteos['contratos_al_dia']} quedaron al día."
+        ))
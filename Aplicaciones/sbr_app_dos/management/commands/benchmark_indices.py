@@ -0,0 +1,146 @@
+import random
+import time
+from datetime import date, timedelta
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from Aplicaciones.sbr_app_dos.models import Cliente, Contrato, Cuota, DetallePago, Lote, Pago
+from Aplicaciones.sbr_gestor.models import Transaccion
+
+ESTADOS_ABIERTOS = ['PENDIENTE', 'PARCIAL', 'VENCIDO']
+
+
+class _Rollback(Exception):
+    """Deshace los datos sembrados al terminar la medición."""
+
+
+class Command(BaseCommand):
+    help = (
+        'Siembra una cartera sintética (por defecto 100.000 cuotas) dentro de una transacción, muestra '
+        'el plan (EXPLAIN) y el tiempo de las consultas más usadas sobre Cuota, Pago, DetallePago y '
+        'Transaccion, y deshace todo al final. Para comparar antes/después de los índices: '
+        'python manage.py migrate sbr_app_dos 0036 && python manage.py migrate sbr_gestor 0002, '
+        'correr el benchmark, volver a "migrate" y correrlo otra vez. Funciona con SQLite y MySQL '
+        '(MySQL no soporta índices parciales: ahí el de (estado, fecha_vencimiento) cubre ese caso).'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--cuotas', type=int, default=100_000, help='Total aproximado de cuotas a sembrar')
+        parser.add_argument('--plazo', type=int, default=48, help='Cuotas por contrato')
+        parser.add_argument('--repeticiones', type=int, default=20, help='Ejecuciones por consulta para el tiempo')
+        parser.add_argument('--semilla', type=int, default=2026)
+
+    def handle(self, *args, **options):
+        random.seed(options['semilla'])
+        try:
+            with transaction.atomic():
+                muestra = self.sembrar(max(1, options['cuotas'] // options['plazo']), options['plazo'])
+                self.medir(muestra, options['repeticiones'])
+                raise _Rollback
+        except _Rollback:
+            self.stdout.write(self.style.SUCCESS("Datos de prueba descartados."))
+
+    def sembrar(self, contratos, plazo):
+        inicio = time.perf_counter()
+        hoy = date.today()
+        vendedor = User.objects.create(username=f"benchmark_{random.randint(0, 10**9)}")
+        lotes = Lote.objects.bulk_create(
+            Lote(manzana=f"B{i // 50}", numero_lote=str(i), dimensiones='10x20m', precio_contado=Decimal('9000'))
+            for i in range(contratos)
+        )
+        clientes = Cliente.objects.bulk_create(
+            Cliente(vendedor=vendedor, cedula=f"{i:010d}", nombres='Cliente', apellidos=f"Benchmark {i}",
+                    celular='0990000000', direccion='-')
+            for i in range(contratos)
+        )
+        contratos_creados = Contrato.objects.bulk_create(
+            Contrato(cliente=cliente, lote=lote, fecha_contrato=hoy - timedelta(days=random.randint(0, 4 * 365)),
+                     saldo_a_financiar=Decimal('8000'), numero_cuotas=plazo, valor_entrada=Decimal('1000'),
+                     precio_venta_final=Decimal('9000'))
+            for cliente, lote in zip(clientes, lotes)
+        )
+
+        cuotas = []
+        for contrato in contratos_creados:
+            for numero in range(1, plazo + 1):
+                vence = contrato.fecha_contrato + timedelta(days=30 * numero)
+                # Como en la cartera real: la mayoría de cuotas pasadas están pagadas
+                if vence < hoy:
+                    estado = random.choices(['PAGADO', 'VENCIDO', 'PARCIAL'], weights=[85, 10, 5])[0]
+                else:
+                    estado = 'PENDIENTE'
+                cuotas.append(Cuota(contrato=contrato, numero_cuota=numero, fecha_vencimiento=vence,
+                                    valor_capital=Decimal('166.67'), estado=estado))
+        Cuota.objects.bulk_create(cuotas, batch_size=2000)
+
+        pagos = [
+            Pago(contrato=contrato, fecha_pago=contrato.fecha_contrato, monto=Decimal('1000'),
+                 metodo_pago='EFECTIVO', es_entrada=True)
+            for contrato in contratos_creados
+        ]
+        pagadas = list(
+            Cuota.objects.filter(contrato__cliente__vendedor=vendedor, estado='PAGADO')
+            .only('id', 'contrato_id', 'fecha_vencimiento')
+        )
+        pagos += [
+            Pago(contrato_id=cuota.contrato_id, fecha_pago=cuota.fecha_vencimiento, monto=Decimal('166.67'),
+                 metodo_pago='EFECTIVO')
+            for cuota in pagadas
+        ]
+        pagos = Pago.objects.bulk_create(pagos, batch_size=2000)
+        DetallePago.objects.bulk_create(
+            (DetallePago(pago=pago, cuota=cuota, monto_aplicado=Decimal('166.67'))
+             for pago, cuota in zip(pagos[len(contratos_creados):], pagadas)),
+            batch_size=2000
+        )
+        Transaccion.objects.bulk_create(
+            (Transaccion(tipo=random.choice(['INGRESO', 'GASTO']), valor=Decimal('50'), descripcion='benchmark',
+                         fecha=hoy - timedelta(days=random.randint(0, 4 * 365)))
+             for _ in range(len(cuotas) // 10)),
+            batch_size=2000
+        )
+        self.stdout.write(
+            f"Sembrado en {time.perf_counter() - inicio:.1f}s: {len(contratos_creados)} contratos, "
+            f"{len(cuotas)} cuotas, {len(pagos)} pagos, {len(pagadas)} detalles, {len(cuotas) // 10} transacciones "
+            f"({connection.vendor})."
+        )
+        contrato = contratos_creados[len(contratos_creados) // 2]
+        detalle = DetallePago.objects.filter(pago__contrato=contrato).first()
+        return {'contrato': contrato, 'detalle': detalle, 'hoy': hoy}
+
+    def consultas(self, muestra):
+        """Las rutas de acceso que motivaron los índices de la migración 0037."""
+        contrato, detalle, hoy = muestra['contrato'], muestra['detalle'], muestra['hoy']
+        desde = hoy.replace(day=1) - timedelta(days=90)
+        hasta = desde + timedelta(days=30)
+        consultas = [
+            ("Cuotas abiertas de un contrato",
+             Cuota.objects.filter(contrato=contrato, estado__in=ESTADOS_ABIERTOS)),
+            ("Cuota por número",
+             Cuota.objects.filter(contrato=contrato, numero_cuota=contrato.numero_cuotas // 2)),
+            ("Vencidas de la cartera (mora masiva)",
+             Cuota.objects.filter(estado__in=ESTADOS_ABIERTOS, fecha_vencimiento__lt=hoy)),
+            ("Vencidas con estado VENCIDO",
+             Cuota.objects.filter(estado='VENCIDO', fecha_vencimiento__lt=hoy)),
+            ("Abonos de un contrato (sin entrada)",
+             Pago.objects.filter(contrato=contrato, es_entrada=False)),
+            ("Pagos de un mes",
+             Pago.objects.filter(fecha_pago__range=(desde, hasta))),
+            ("Transacciones de un tipo en un mes",
+             Transaccion.objects.filter(tipo='INGRESO', fecha__range=(desde, hasta))),
+        ]
+        if detalle is not None:
+            consultas.append(("Detalle de un pago sobre una cuota",
+                              DetallePago.objects.filter(pago_id=detalle.pago_id, cuota_id=detalle.cuota_id)))
+        return consultas
+
+    def medir(self, muestra, repeticiones):
+        for titulo, queryset in self.consultas(muestra):
+            inicio = time.perf_counter()
+            for _ in range(repeticiones):
+                filas = len(queryset.all())
+            promedio = (time.perf_counter() - inicio) / repeticiones * 1000
+            self.stdout.write(self.style.MIGRATE_HEADING(f"\n{titulo}: {filas} filas, {promedio:.2f} ms"))
+            self.stdout.write(queryset.explain())
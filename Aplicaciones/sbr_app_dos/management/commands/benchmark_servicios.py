@@ -0,0 +1,66 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from Aplicaciones.sbr_app_dos.benchmark import comparar_resultados, ejecutar_benchmark
+
+
+class Command(BaseCommand):
+    help = (
+        'Mide tiempo y número de consultas de los servicios de pago y mora, los reportes y los '
+        'generadores de PDF, y escribe el resultado en JSON. No deja cambios en la BD. '
+        'Ej: python manage.py benchmark_servicios --sembrar 500 --salida bench_abc123.json '
+        '--comparar bench_anterior.json'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeticiones', type=int, default=5)
+        parser.add_argument('--casos', nargs='+', help='Solo estos casos (por nombre)')
+        parser.add_argument(
+            '--sembrar', type=int, metavar='CONTRATOS',
+            help='Medir sobre una cartera sintética de N contratos (se descarta al terminar)'
+        )
+        parser.add_argument('--semilla', type=int, default=2026)
+        parser.add_argument('--salida', help='Archivo JSON de resultados (por defecto, a la salida estándar)')
+        parser.add_argument('--comparar', help='JSON de una ejecución anterior: falla si hay regresiones')
+        parser.add_argument(
+            '--tolerancia', type=float, default=0.2,
+            help='Margen de tiempo antes de considerar regresión (0.2 = 20%%)'
+        )
+
+    def handle(self, *args, **options):
+        if options['repeticiones'] < 1:
+            raise CommandError("--repeticiones debe ser al menos 1.")
+        sembrar = None
+        if options['sembrar']:
+            sembrar = {'contratos': options['sembrar'], 'semilla': options['semilla'], 'prefijo': 'benchmark'}
+
+        def progreso(nombre, caso):
+            if 'error' in caso:
+                self.stderr.write(self.style.WARNING(f"  {nombre}: {caso['error']}"))
+            else:
+                self.stderr.write(
+                    f"  {nombre}: {caso['mediana_ms']} ms (primera {caso['primera_ms']} ms), "
+                    f"{caso['consultas']} consultas"
+                )
+
+        try:
+            resultado = ejecutar_benchmark(options['repeticiones'], options['casos'], sembrar, progreso)
+        except ValueError as error:
+            raise CommandError(str(error))
+
+        salida = json.dumps(resultado, indent=2, ensure_ascii=False)
+        if options['salida']:
+            with open(options['salida'], 'w', encoding='utf-8') as archivo:
+                archivo.write(salida + '\n')
+            self.stderr.write(self.style.SUCCESS(f"Resultados en {options['salida']}"))
+        else:
+            self.stdout.write(salida)
+
+        if options['comparar']:
+            with open(options['comparar'], encoding='utf-8') as archivo:
+                regresiones = comparar_resultados(json.load(archivo), resultado, options['tolerancia'])
+            for regresion in regresiones:
+                self.stderr.write(self.style.ERROR(regresion))
+            if regresiones:
+                raise CommandError(f"{len(regresiones)} regresiones frente a {options['comparar']}.")
+            self.stderr.write(self.style.SUCCESS("Sin regresiones."))
@@ -0,0 +1,51 @@
+from datetime import date
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from Aplicaciones.sbr_app_dos.exportacion_pdf import (
+    FORMATOS_EXPORTACION, TIPOS_EXPORTACION, documentos_exportacion, exportar_documentos,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        'Exporta en un ZIP o en un solo PDF los recibos de pago de un período o los estados de cuenta '
+        'de los contratos en mora. Ej: python manage.py exportar_recibos --desde 2026-09-01 --hasta 2026-09-30 '
+        '--salida recibos_septiembre.zip'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--documentos', choices=[t.lower() for t in TIPOS_EXPORTACION], default='recibos',
+            help='recibos: pagos del período; estados: estado de cuenta de los contratos en mora'
+        )
+        parser.add_argument('--desde', type=date.fromisoformat, help='Fecha inicial de los pagos (AAAA-MM-DD)')
+        parser.add_argument('--hasta', type=date.fromisoformat, help='Fecha final de los pagos (AAAA-MM-DD)')
+        parser.add_argument('--contratos', type=int, nargs='+', help='Solo estos contratos (ids)')
+        parser.add_argument('--formato', choices=FORMATOS_EXPORTACION, help='Por defecto, la extensión de --salida')
+        parser.add_argument('--salida', required=True, help='Archivo a generar (.zip o .pdf)')
+        parser.add_argument(
+            '--procesos', type=int, default=getattr(settings, 'PDF_EXPORTACION_PROCESOS', 2),
+            help='Procesos de render en paralelo'
+        )
+
+    def handle(self, *args, **options):
+        tipo = options['documentos'].upper()
+        formato = options['formato'] or options['salida'].rsplit('.', 1)[-1].lower()
+        if formato not in FORMATOS_EXPORTACION:
+            raise CommandError("Indique --formato zip|pdf o una --salida terminada en .zip o .pdf.")
+
+        ids = documentos_exportacion(tipo, options['desde'], options['hasta'], options['contratos'])
+        if not ids:
+            raise CommandError("No hay documentos para exportar con esos filtros.")
+
+        total = len(ids)
+        paso = max(1, total // 20)
+
+        def progreso(hechos):
+            if hechos % paso == 0 or hechos == total:
+                self.stdout.write(f"  {hechos}/{total} documentos ({hechos * 100 // total}%)")
+
+        self.stdout.write(f"Exportando {total} {TIPOS_EXPORTACION[tipo].lower()} a {options['salida']}...")
+        exportar_documentos(tipo, ids, formato, options['salida'], max(1, options['procesos']), progreso)
+        self.stdout.write(self.style.SUCCESS(f"Exportación lista: {options['salida']}"))
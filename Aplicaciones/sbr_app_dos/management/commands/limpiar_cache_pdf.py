@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+from Aplicaciones.sbr_app_dos.cache_pdf import limpiar_cache_pdf
+
+
+class Command(BaseCommand):
+    help = (
+        'Borra de la caché de recibos PDF los archivos viejos o los menos usados si supera el tamaño máximo '
+        '(PDF_CACHE_MAX_DIAS / PDF_CACHE_MAX_MB). Con --todo la vacía.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--todo', action='store_true', help='Borrar todos los PDF en caché')
+
+    def handle(self, *args, **options):
+        borrados = limpiar_cache_pdf(max_mb=0, max_dias=0) if options['todo'] else limpiar_cache_pdf()
+        self.stdout.write(self.style.SUCCESS(f"Caché de PDF: {borrados} archivos borrados."))
@@ -0,0 +1,86 @@
+import multiprocessing
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connections
+from Aplicaciones.sbr_app_dos.tareas_pdf import liberar_tareas_colgadas, purgar_tareas, registrar_fallo, tomar_tareas
+from Aplicaciones.sbr_app_dos.worker_pdf import ejecutar_en_proceso, inicializar_proceso
+
+
+class Command(BaseCommand):
+    help = (
+        'Worker de la cola de PDF (contratos, recibos, reportes): renderiza las tareas pendientes '
+        'en un pool de procesos. Dejar corriendo como servicio: python manage.py procesar_pdfs'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--procesos', type=int, default=getattr(settings, 'PDF_MAX_RENDERS_CONCURRENTES', 2),
+            help='Tamaño del pool (el máximo global sigue siendo PDF_MAX_RENDERS_CONCURRENTES)'
+        )
+        parser.add_argument(
+            '--una-vez', action='store_true',
+            help='Procesar lo que haya en la cola y terminar (para cron)'
+        )
+        parser.add_argument(
+            '--espera', type=float, default=2.0,
+            help='Segundos entre consultas a la cola cuando no hay trabajo'
+        )
+
+    def handle(self, *args, **options):
+        procesos = max(1, options['procesos'])
+        self.listas = self.fallidas = 0
+        self.ultima_purga = 0
+
+        # Si un proceso hijo muere el pool queda inservible: se crea otro
+        while self._procesar(procesos, options) == 'roto':
+            self.stdout.write(self.style.WARNING("Pool de procesos reiniciado."))
+
+        self.stdout.write(self.style.SUCCESS(f"PDF generados: {self.listas}, con error: {self.fallidas}."))
+
+    def _procesar(self, procesos, options):
+        # Los procesos hijos abren sus propias conexiones
+        connections.close_all()
+        contexto = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(max_workers=procesos, mp_context=contexto, initializer=inicializar_proceso) as pool:
+            en_curso = {}
+            while True:
+                if time.monotonic() - self.ultima_purga > 3600:
+                    liberar_tareas_colgadas()
+                    purgar_tareas()
+                    self.ultima_purga = time.monotonic()
+
+                for tarea_id in tomar_tareas(procesos - len(en_curso)):
+                    en_curso[pool.submit(ejecutar_en_proceso, tarea_id)] = tarea_id
+
+                if not en_curso:
+                    if options['una_vez']:
+                        return 'fin'
+                    time.sleep(options['espera'])
+                    continue
+
+                terminadas, _ = wait(en_curso, timeout=options['espera'], return_when=FIRST_COMPLETED)
+                roto = False
+                for futuro in terminadas:
+                    tarea_id = en_curso.pop(futuro)
+                    try:
+                        ok = futuro.result()
+                    except BrokenProcessPool as e:
+                        # El proceso murió (memoria, señal) sin alcanzar a registrar el fallo
+                        registrar_fallo(tarea_id, e)
+                        ok, roto = False, True
+                    except Exception as e:
+                        registrar_fallo(tarea_id, e)
+                        ok = False
+                    if ok:
+                        self.listas += 1
+                    else:
+                        self.fallidas += 1
+                        self.stdout.write(self.style.WARNING(f"Tarea PDF #{tarea_id} falló."))
+                if roto:
+                    for tarea_id in en_curso.values():
+                        registrar_fallo(tarea_id, "Pool de procesos reiniciado.")
+                    return 'roto'
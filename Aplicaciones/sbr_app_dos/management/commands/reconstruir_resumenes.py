@@ -0,0 +1,46 @@
+from django.core.management.base import BaseCommand
+from Aplicaciones.sbr_gestor.libro import sincronizar_libro, verificar_libro
+from Aplicaciones.sbr_app_dos.busqueda_clientes import indice_texto_incompleto, reparar_indice_texto
+from Aplicaciones.sbr_app_dos.models import Contrato
+from Aplicaciones.sbr_app_dos.services import (
+    actualizar_resumen_diario, actualizar_resumenes, verificar_resumen_diario, verificar_resumenes
+)
+
+
+class Command(BaseCommand):
+    help = (
+        'Reconstruye las tablas ResumenContrato (saldos precalculados) y ResumenDiario (KPIs) '
+        'desde las cuotas, pagos y transacciones, asienta en el libro de caja lo que falte y '
+        'repara el índice de búsqueda de clientes si perdió sus triggers. '
+        'Con --verificar solo compara y muestra las diferencias.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--verificar', action='store_true',
+            help='No escribir nada: comparar los resúmenes guardados contra los datos de origen'
+        )
+
+    def handle(self, *args, **options):
+        contratos = Contrato.objects.all()
+
+        if options['verificar']:
+            diferencias = verificar_resumenes(contratos) + verificar_resumen_diario() + verificar_libro()
+            if indice_texto_incompleto():
+                diferencias.append("Índice de búsqueda de clientes sin triggers: la búsqueda no ve los cambios.")
+            for diferencia in diferencias:
+                self.stdout.write(self.style.WARNING(diferencia))
+            if diferencias:
+                self.stdout.write(self.style.ERROR(f"{len(diferencias)} diferencias encontradas."))
+            else:
+                self.stdout.write(self.style.SUCCESS("Resúmenes consistentes con las cuotas."))
+            return
+
+        total = actualizar_resumenes(contratos)
+        self.stdout.write(self.style.SUCCESS(f"Resumen reconstruido para {total} contratos."))
+        dias = actualizar_resumen_diario()
+        self.stdout.write(self.style.SUCCESS(f"Resumen diario reconstruido: {dias} filas."))
+        asientos = sincronizar_libro()
+        self.stdout.write(self.style.SUCCESS(f"Libro de caja: {asientos} asientos nuevos."))
+        if reparar_indice_texto():
+            self.stdout.write(self.style.SUCCESS("Índice de búsqueda de clientes reconstruido."))
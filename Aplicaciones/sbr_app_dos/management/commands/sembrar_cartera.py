@@ -0,0 +1,35 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from Aplicaciones.sbr_app_dos.cartera_sintetica import sembrar_cartera
+
+
+class Command(BaseCommand):
+    help = (
+        'Crea una cartera sintética realista (vendedores, lotes por manzana, contratos de 12 a 240 cuotas, '
+        'pagos irregulares, exenciones de mora, devoluciones) para medir rendimiento. Usar solo en una '
+        'base de datos de pruebas. Ej: python manage.py sembrar_cartera --contratos 2000 --vendedores 8'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--contratos', type=int, default=200)
+        parser.add_argument('--vendedores', type=int, default=5)
+        parser.add_argument('--manzanas', type=int, default=12)
+        parser.add_argument('--semilla', type=int, default=2026, help='La misma semilla genera la misma cartera')
+        parser.add_argument('--prefijo', default='sintetico', help='Prefijo de los usuarios vendedores creados')
+
+    def handle(self, *args, **options):
+        if User.objects.filter(username__startswith=f"{options['prefijo']}_vendedor_").exists():
+            raise CommandError(
+                f"Ya existe una cartera con el prefijo '{options['prefijo']}'. Use otro --prefijo."
+            )
+        if options['contratos'] < 1 or options['vendedores'] < 1 or options['manzanas'] < 1:
+            raise CommandError("--contratos, --vendedores y --manzanas deben ser al menos 1.")
+
+        self.stdout.write(f"Sembrando {options['contratos']} contratos...")
+        conteos = sembrar_cartera(
+            contratos=options['contratos'], vendedores=options['vendedores'], manzanas=options['manzanas'],
+            semilla=options['semilla'], prefijo=options['prefijo'],
+        )
+        for nombre, total in conteos.items():
+            self.stdout.write(f"  {nombre.replace('_', ' ')}: {total}")
+        self.stdout.write(self.style.SUCCESS("Cartera sintética creada."))
@@ -0,0 +1,18 @@
+# Generated by Django 6.0.1 on 2026-10-18 01:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sbr_app_dos', '0029_contrato_fecha_registro_lote_fecha_registro'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='contrato',
+            name='mora_calculada_hasta',
+            field=models.DateField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 6.0.1 on 2026-10-18 10:12
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sbr_app_dos', '0030_contrato_mora_calculada_hasta'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ResumenContrato',
+            fields=[
+                ('contrato', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='resumen', serialize=False, to='sbr_app_dos.contrato')),
+                ('saldo_capital', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('saldo_mora', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('saldo_pendiente', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('total_pagado', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('cuotas_vencidas', models.PositiveIntegerField(default=0)),
+                ('proxima_fecha_vencimiento', models.DateField(blank=True, null=True)),
+                ('actualizado_en', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'Resumen de Contrato',
+                'verbose_name_plural': 'Resúmenes de Contratos',
+            },
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 6.0.1 on 2026-10-18 11:05
+
+import django.core.serializers.json
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sbr_app_dos', '0031_resumencontrato'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CierreMensual',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('anio', models.PositiveSmallIntegerField()),
+                ('mes', models.PositiveSmallIntegerField()),
+                ('cobros', models.JSONField(default=list, encoder=django.core.serializers.json.DjangoJSONEncoder)),
+                ('mora_historica', models.JSONField(default=list, encoder=django.core.serializers.json.DjangoJSONEncoder)),
+                ('total_cobrado', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('total_entradas', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('total_ingresos', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('total_mora_historica', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('generado_en', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'Cierre Mensual',
+                'verbose_name_plural': 'Cierres Mensuales',
+                'ordering': ['anio', 'mes'],
+                'constraints': [models.UniqueConstraint(fields=('anio', 'mes'), name='cierre_mensual_unico')],
+            },
+        ),
+    ]
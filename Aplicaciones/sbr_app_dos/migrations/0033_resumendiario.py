@@ -0,0 +1,37 @@
+# Generated by Django 6.0.1 on 2026-10-18 12:20
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sbr_app_dos', '0032_cierremensual'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ResumenDiario',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('fecha', models.DateField(db_index=True)),
+                ('pagos_recibidos', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('ingresos_lotes', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('entradas', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('abonos_cuotas', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('ingresos_caja', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('gastos', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('mora_generada', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('vendedor', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='resumenes_diarios', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Resumen Diario',
+                'verbose_name_plural': 'Resúmenes Diarios',
+                'ordering': ['fecha'],
+                'constraints': [models.UniqueConstraint(fields=('fecha', 'vendedor'), name='resumen_diario_unico')],
+            },
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 6.0.1 on 2026-10-18 13:40
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sbr_app_dos', '0033_resumendiario'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TareaPDF',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tipo', models.CharField(choices=[('CONTRATO', 'Contrato'), ('RECIBO_ENTRADA', 'Recibo de Entrada'), ('RECIBO_PAGO', 'Recibo de Cuota'), ('RECIBO_TRANSACCION', 'Recibo de Pago'), ('REPORTE_GENERAL', 'Reporte General'), ('REPORTE_MENSUAL', 'Reporte Mensual')], max_length=20)),
+                ('objeto_id', models.PositiveIntegerField(blank=True, null=True)),
+                ('parametros', models.JSONField(blank=True, default=dict)),
+                ('estado', models.CharField(choices=[('PENDIENTE', 'Pendiente'), ('EN_PROCESO', 'En Proceso'), ('LISTO', 'Listo'), ('ERROR', 'Error')], default='PENDIENTE', max_length=20)),
+                ('intentos', models.PositiveSmallIntegerField(default=0)),
+                ('max_intentos', models.PositiveSmallIntegerField(default=3)),
+                ('disponible_desde', models.DateTimeField(default=django.utils.timezone.now)),
+                ('iniciado_en', models.DateTimeField(blank=True, null=True)),
+                ('terminado_en', models.DateTimeField(blank=True, null=True)),
+                ('archivo', models.CharField(blank=True, max_length=255)),
+                ('nombre_archivo', models.CharField(blank=True, max_length=255)),
+                ('error', models.TextField(blank=True)),
+                ('creado_en', models.DateTimeField(auto_now_add=True)),
+                ('solicitado_por', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='tareas_pdf', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Tarea PDF',
+                'verbose_name_plural': 'Tareas PDF',
+                'ordering': ['id'],
+                'indexes': [models.Index(fields=['estado', 'disponible_desde'], name='tarea_pdf_cola_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 6.0.1 on 2026-10-18 15:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sbr_app_dos', '0034_tareapdf'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tareapdf',
+            name='progreso',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='tareapdf',
+            name='total',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AlterField(
+            model_name='tareapdf',
+            name='tipo',
+            field=models.CharField(choices=[('CONTRATO', 'Contrato'), ('RECIBO_ENTRADA', 'Recibo de Entrada'), ('RECIBO_PAGO', 'Recibo de Cuota'), ('RECIBO_TRANSACCION', 'Recibo de Pago'), ('REPORTE_GENERAL', 'Reporte General'), ('REPORTE_MENSUAL', 'Reporte Mensual'), ('EXPORTACION', 'Exportación de Recibos')], max_length=20),
+        ),
+    ]
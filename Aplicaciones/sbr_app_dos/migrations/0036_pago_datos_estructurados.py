@@ -0,0 +1,133 @@
+# Generated by Django 6.0.1 on 2026-10-18 16:30
+
+import re
+from decimal import Decimal, InvalidOperation
+
+from django.conf import settings
+from django.db import migrations, models
+
+# Parser de las observaciones en texto libre que escribían las vistas antes de estas
+# columnas (copiado aquí: la migración no debe depender del código vivo de la app):
+#     "Pago de Entrada (TRANSFERENCIA). Banco: X. Cuenta/Comp: Y."
+#     "Pago de Entrada (DEPOSITO). Depósito. Banco: X. Comp: Y."
+#     "... | Saldo a favor remanente: $50.00"
+
+# El banco termina en el primer ". Cuenta/Comp:" o ". Comp:"; el número, al final o en " | "
+PATRON_BANCO = re.compile(
+    r"Banco:\s*(?P<banco>.*?)\.?\s*(?P<etiqueta>Cuenta/Comp|Comp):\s*(?P<numero>[^|]*?)\.?\s*(?:\||$)",
+    re.DOTALL,
+)
+MARCA_DEPOSITO = '(DEPOSITO)'
+PATRON_SALDO_A_FAVOR = re.compile(r"(?:\s*\|\s*)?Saldo a favor remanente:\s*\$\s*(?P<saldo>[\d,]*\.?\d+)")
+
+
+def extraer_datos_pago(observacion):
+    """
+    Retorna dict con banco, cuenta, comprobante, saldo_a_favor, es_deposito y la observación
+    sin la nota de saldo a favor (que pasa a su propia columna). El depósito se reconoce por
+    la marca de la venta, no por los datos: el formulario lo guardaba con banco y papeleta vacíos.
+    """
+    datos = {
+        'banco': '', 'cuenta': '', 'comprobante': '', 'saldo_a_favor': Decimal('0.00'),
+        'es_deposito': False, 'observacion': observacion,
+    }
+    if not observacion:
+        return datos
+    datos['es_deposito'] = MARCA_DEPOSITO in observacion
+
+    saldo = PATRON_SALDO_A_FAVOR.search(observacion)
+    if saldo:
+        try:
+            datos['saldo_a_favor'] = Decimal(saldo.group('saldo').replace(',', '')).quantize(Decimal('0.01'))
+        except InvalidOperation:
+            pass
+        datos['observacion'] = PATRON_SALDO_A_FAVOR.sub('', observacion).strip() or None
+
+    banco = PATRON_BANCO.search(observacion)
+    if banco:
+        datos['banco'] = banco.group('banco').strip()
+        # Transferencia: cuenta o comprobante en un solo campo; depósito: número de papeleta
+        campo = 'cuenta' if banco.group('etiqueta') == 'Cuenta/Comp' else 'comprobante'
+        datos[campo] = banco.group('numero').strip()
+    return datos
+
+
+def llenar_datos_pago(apps, schema_editor):
+    """
+    Pasa banco/cuenta/comprobante y el saldo a favor de la observación a sus columnas, y
+    separa los depósitos (guardados como TRANSFERENCIA) en su propio método.
+    """
+    Pago = apps.get_model('sbr_app_dos', 'Pago')
+    pagos = Pago.objects.exclude(observacion__isnull=True).exclude(observacion='').only('id', 'observacion', 'metodo_pago')
+    campos = ['banco', 'cuenta', 'comprobante', 'saldo_a_favor', 'observacion', 'metodo_pago']
+    modificados = []
+    for pago in pagos.iterator(chunk_size=2000):
+        datos = extraer_datos_pago(pago.observacion)
+        pago.banco = datos['banco'][:100]
+        pago.cuenta = datos['cuenta'][:100]
+        pago.comprobante = datos['comprobante'][:100]
+        pago.saldo_a_favor = datos['saldo_a_favor']
+        pago.observacion = datos['observacion']
+        if datos['es_deposito'] and pago.metodo_pago == 'TRANSFERENCIA':
+            pago.metodo_pago = 'DEPOSITO'
+        modificados.append(pago)
+        if len(modificados) >= 2000:
+            Pago.objects.bulk_update(modificados, campos)
+            modificados = []
+    Pago.objects.bulk_update(modificados, campos)
+
+
+def devolver_saldo_a_observacion(apps, schema_editor):
+    """
+    Reversa: la nota de saldo a favor vuelve al texto (los datos bancarios nunca salieron de
+    él) y los depósitos de la venta vuelven a TRANSFERENCIA, con la marca aún en la observación.
+    """
+    Pago = apps.get_model('sbr_app_dos', 'Pago')
+    Pago.objects.filter(metodo_pago='DEPOSITO', observacion__contains=MARCA_DEPOSITO).update(metodo_pago='TRANSFERENCIA')
+    modificados = []
+    for pago in Pago.objects.filter(saldo_a_favor__gt=0).only('id', 'observacion', 'saldo_a_favor').iterator(chunk_size=2000):
+        nota = f"Saldo a favor remanente: ${pago.saldo_a_favor:.2f}"
+        pago.observacion = f"{pago.observacion} | {nota}" if pago.observacion else nota
+        modificados.append(pago)
+    Pago.objects.bulk_update(modificados, ['observacion'], batch_size=2000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sbr_app_dos', '0035_tareapdf_exportacion'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='pago',
+            name='banco',
+            field=models.CharField(blank=True, default='', max_length=100),
+        ),
+        migrations.AddField(
+            model_name='pago',
+            name='comprobante',
+            field=models.CharField(blank=True, default='', help_text='Número de papeleta del depósito', max_length=100),
+        ),
+        migrations.AddField(
+            model_name='pago',
+            name='cuenta',
+            field=models.CharField(blank=True, default='', help_text='Cuenta o comprobante de la transferencia', max_length=100),
+        ),
+        migrations.AddField(
+            model_name='pago',
+            name='saldo_a_favor',
+            field=models.DecimalField(decimal_places=2, default=0, help_text='Parte del pago que no cubrió ninguna cuota', max_digits=12),
+        ),
+        migrations.AlterField(
+            model_name='pago',
+            name='metodo_pago',
+            field=models.CharField(choices=[('EFECTIVO', 'Efectivo'), ('TRANSFERENCIA', 'Transferencia'), ('DEPOSITO', 'Depósito')], max_length=20),
+        ),
+        migrations.AddIndex(
+            model_name='pago',
+            index=models.Index(condition=models.Q(('saldo_a_favor__gt', 0)), fields=['saldo_a_favor'], name='pago_saldo_a_favor_idx'),
+        ),
+        migrations.RunPython(llenar_datos_pago, devolver_saldo_a_observacion),
+    ]
@@ -0,0 +1,59 @@
+# Generated by Django 6.0.1 on 2026-10-18 17:15
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def verificar_cuotas_duplicadas(apps, schema_editor):
+    """Aborta con un mensaje claro si hay cuotas repetidas antes de crear la restricción única."""
+    Cuota = apps.get_model('sbr_app_dos', 'Cuota')
+    duplicadas = list(
+        Cuota.objects.values('contrato_id', 'numero_cuota').annotate(n=Count('id')).filter(n__gt=1)[:20]
+    )
+    if duplicadas:
+        detalle = ", ".join(f"contrato {d['contrato_id']} cuota {d['numero_cuota']}" for d in duplicadas)
+        raise RuntimeError(
+            f"Hay cuotas con número repetido ({detalle}). Regenere la tabla de amortización de esos "
+            "contratos (o corrija la numeración en el admin) y vuelva a migrar."
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sbr_app_dos', '0036_pago_datos_estructurados'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RunPython(verificar_cuotas_duplicadas, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='cuota',
+            index=models.Index(fields=['contrato', 'estado'], name='cuota_contrato_estado_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='cuota',
+            index=models.Index(fields=['estado', 'fecha_vencimiento'], name='cuota_estado_venc_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='cuota',
+            index=models.Index(condition=models.Q(('estado__in', ['PENDIENTE', 'PARCIAL', 'VENCIDO'])), fields=['fecha_vencimiento'], name='cuota_abierta_venc_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='detallepago',
+            index=models.Index(fields=['pago', 'cuota'], name='detalle_pago_cuota_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='pago',
+            index=models.Index(fields=['contrato', 'es_entrada'], name='pago_contrato_entrada_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='pago',
+            index=models.Index(fields=['fecha_pago'], name='pago_fecha_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='cuota',
+            constraint=models.UniqueConstraint(fields=('contrato', 'numero_cuota'), name='cuota_contrato_numero_unico'),
+        ),
+    ]
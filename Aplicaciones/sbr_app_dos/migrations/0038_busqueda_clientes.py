@@ -0,0 +1,89 @@
+# Generated by Django 6.0.1 on 2026-10-18 19:05
+
+from django.db import migrations, models
+
+# Índice de texto de la búsqueda de clientes (busqueda_clientes.py). En SQLite es una
+# tabla FTS5 "espejo" de Cliente que mantienen los triggers (también con bulk_create y
+# con cambios hechos fuera de Django); en MySQL un índice FULLTEXT sobre la misma tabla.
+# Con otros motores la búsqueda usa icontains y aquí no se crea nada.
+#
+# OJO: en SQLite casi cualquier migración posterior de Cliente (AlterField, RemoveField,
+# AddField con default) rehace sbr_app_dos_cliente y borra estos triggers sin aviso. Esa
+# migración debe terminar con RunPython(recrear_indice_texto) (ver 0040). Como red, el
+# post_migrate de la app y reconstruir_resumenes los recrean si faltan
+# (busqueda_clientes.reparar_indice_texto).
+
+SQLITE_CREAR = [
+    """
+    CREATE VIRTUAL TABLE sbr_app_dos_cliente_fts USING fts5(
+        cedula, apellidos, nombres,
+        content='sbr_app_dos_cliente', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2'
+    )
+    """,
+    """
+    CREATE TRIGGER sbr_app_dos_cliente_fts_ai AFTER INSERT ON sbr_app_dos_cliente BEGIN
+        INSERT INTO sbr_app_dos_cliente_fts(rowid, cedula, apellidos, nombres)
+        VALUES (new.id, new.cedula, new.apellidos, new.nombres);
+    END
+    """,
+    """
+    CREATE TRIGGER sbr_app_dos_cliente_fts_ad AFTER DELETE ON sbr_app_dos_cliente BEGIN
+        INSERT INTO sbr_app_dos_cliente_fts(sbr_app_dos_cliente_fts, rowid, cedula, apellidos, nombres)
+        VALUES ('delete', old.id, old.cedula, old.apellidos, old.nombres);
+    END
+    """,
+    """
+    CREATE TRIGGER sbr_app_dos_cliente_fts_au AFTER UPDATE OF cedula, apellidos, nombres ON sbr_app_dos_cliente BEGIN
+        INSERT INTO sbr_app_dos_cliente_fts(sbr_app_dos_cliente_fts, rowid, cedula, apellidos, nombres)
+        VALUES ('delete', old.id, old.cedula, old.apellidos, old.nombres);
+        INSERT INTO sbr_app_dos_cliente_fts(rowid, cedula, apellidos, nombres)
+        VALUES (new.id, new.cedula, new.apellidos, new.nombres);
+    END
+    """,
+    # Indexar los clientes existentes
+    "INSERT INTO sbr_app_dos_cliente_fts(sbr_app_dos_cliente_fts) VALUES ('rebuild')",
+]
+
+SQLITE_BORRAR = [
+    "DROP TRIGGER IF EXISTS sbr_app_dos_cliente_fts_ai",
+    "DROP TRIGGER IF EXISTS sbr_app_dos_cliente_fts_ad",
+    "DROP TRIGGER IF EXISTS sbr_app_dos_cliente_fts_au",
+    "DROP TABLE IF EXISTS sbr_app_dos_cliente_fts",
+]
+
+MYSQL_CREAR = ["ALTER TABLE sbr_app_dos_cliente ADD FULLTEXT INDEX cliente_busqueda_ft (cedula, apellidos, nombres)"]
+MYSQL_BORRAR = ["ALTER TABLE sbr_app_dos_cliente DROP INDEX cliente_busqueda_ft"]
+
+
+def _ejecutar(schema_editor, sentencias):
+    for sql in sentencias.get(schema_editor.connection.vendor, []):
+        schema_editor.execute(sql)
+
+
+def crear_indice_texto(apps, schema_editor):
+    _ejecutar(schema_editor, {'sqlite': SQLITE_CREAR, 'mysql': MYSQL_CREAR})
+
+
+def borrar_indice_texto(apps, schema_editor):
+    _ejecutar(schema_editor, {'sqlite': SQLITE_BORRAR, 'mysql': MYSQL_BORRAR})
+
+
+def recrear_indice_texto(apps, schema_editor):
+    """Para migraciones posteriores de Cliente: en SQLite rehacer la tabla borra los triggers."""
+    _ejecutar(schema_editor, {'sqlite': SQLITE_BORRAR + SQLITE_CREAR})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sbr_app_dos', '0037_indices_consultas'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='contrato',
+            index=models.Index(fields=['-fecha_contrato', '-id'], name='contrato_fecha_id_idx'),
+        ),
+        migrations.RunPython(crear_indice_texto, borrar_indice_texto),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 6.0.1 on 2026-10-18 22:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sbr_app_dos', '0038_busqueda_clientes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='movimientocaja',
+            index=models.Index(fields=['-fecha', '-id'], name='movimientocaja_fecha_id_idx'),
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 6.0.1 on 2026-10-18 23:05
+
+from importlib import import_module
+
+from django.db import migrations, models
+
+# Agregar la columna rehace sbr_app_dos_cliente en SQLite y se pierden los triggers del
+# índice de búsqueda (0038): se vuelven a crear al final, también al revertir
+recrear_indice_texto = import_module('Aplicaciones.sbr_app_dos.migrations.0038_busqueda_clientes').recrear_indice_texto
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sbr_app_dos', '0039_historial_movimientos'),
+    ]
+
+    operations = [
+        migrations.RunPython(migrations.RunPython.noop, recrear_indice_texto),
+        migrations.AddField(
+            model_name='cliente',
+            name='actualizado_en',
+            field=models.DateTimeField(auto_now=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='contrato',
+            name='actualizado_en',
+            field=models.DateTimeField(auto_now=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='lote',
+            name='actualizado_en',
+            field=models.DateTimeField(auto_now=True, null=True),
+        ),
+        migrations.RunPython(recrear_indice_texto, migrations.RunPython.noop),
+    ]
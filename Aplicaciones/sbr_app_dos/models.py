@@ -1,6 +1,9 @@
 from django.db import models
+from django.db.models.functions import Cast, Coalesce
 from django.contrib.auth.models import User
 from django.core.validators import MinValueValidator
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import timezone
 from .validators import validar_archivo_seguro
 import bleach
 
@@ -18,6 +21,15 @@ class ConfiguracionSistema(models.Model):
     ruc_empresa = models.CharField(max_length=13)
     logo = models.ImageField(upload_to='config/logos/', blank=True, null=True, validators=[validar_archivo_seguro])
 
+    def save(self, *args, **kwargs):
+        # Si cambia el porcentaje, la mora calculada hoy ya no es válida, ni la mora al
+        # cierre de los meses guardados (se calcula con el porcentaje vigente)
+        anterior = ConfiguracionSistema.objects.filter(pk=self.pk).values_list('mora_porcentaje', flat=True).first()
+        super().save(*args, **kwargs)
+        if anterior is not None and anterior != self.mora_porcentaje:
+            Contrato.objects.update(mora_calculada_hasta=None)
+            CierreMensual.objects.all().delete()
+
     def __str__(self):
         return "Configuración General del Sistema"
 
@@ -66,6 +78,8 @@ class Lote(models.Model):
     
     # Fecha exacta en que se registró en el sistema
     fecha_registro = models.DateTimeField(auto_now_add=True, null=True, blank=True)
+    # Última edición (huella de los reportes en caché: reportes.version_datos_reporte)
+    actualizado_en = models.DateTimeField(auto_now=True, null=True)
     
     # Para saber si está ocupado rápido
     def __str__(self):
@@ -83,6 +97,8 @@ class Cliente(models.Model):
     email = models.EmailField(blank=True, null=True)
     direccion = models.TextField()
     fecha_registro = models.DateTimeField(auto_now_add=True)
+    # Última edición: reasignar vendedor o corregir datos cambia los reportes en caché
+    actualizado_en = models.DateTimeField(auto_now=True, null=True)
 
     def save(self, *args, **kwargs):
         # Sanitización de Inputs (Bleach) - Punto 3.1
@@ -94,6 +110,50 @@ class Cliente(models.Model):
         return f"{self.apellidos} {self.nombres}"
 
 
+class EtiquetaLotes(models.Subquery):
+    """
+    Valores de un campo de los lotes (M2M) del contrato, ordenados y unidos con ', '
+    en una sola cadena: subconsulta correlacionada con GROUP_CONCAT.
+    NULL si el contrato no tiene lotes en el M2M.
+    """
+    template = "(SELECT GROUP_CONCAT(valor, ', ') FROM (%(subquery)s) AS etiqueta)"
+    output_field = models.CharField()
+
+    def __init__(self, campo, numerico=False):
+        # Números de lote: orden numérico ('2' antes que '10') y con repetidos, como
+        # numeros_lotes_str; las manzanas sin repetir, como manzanas_str
+        orden = [Cast(campo, models.IntegerField()), campo] if numerico else [campo]
+        lotes = (
+            Lote.objects.filter(contratos=models.OuterRef('pk'))
+            .annotate(valor=models.F(campo)).order_by(*orden).values('valor')
+        )
+        if not numerico:
+            lotes = lotes.distinct()
+        self.numerico = numerico
+        super().__init__(lotes)
+
+    def as_mysql(self, compiler, connection, **extra_context):
+        # MySQL no garantiza el orden de la tabla derivada: se ordena dentro del GROUP_CONCAT
+        orden = "CAST(valor AS UNSIGNED), valor" if self.numerico else "valor"
+        template = f"(SELECT GROUP_CONCAT(valor ORDER BY {orden} SEPARATOR ', ') FROM (%(subquery)s) AS etiqueta)"
+        return self.as_sql(compiler, connection, template=template, **extra_context)
+
+
+class ContratoQuerySet(models.QuerySet):
+    def with_lote_labels(self):
+        """
+        Anota etiqueta_manzanas ('A, B') y etiqueta_numeros_lotes ('1, 2, 5') en la misma
+        consulta; manzanas_str y numeros_lotes_str las usan en vez de consultar los lotes.
+        Contratos antiguos sin lotes en el M2M toman los del campo 'lote'.
+        """
+        return self.annotate(
+            etiqueta_manzanas=Coalesce(EtiquetaLotes('manzana'), 'lote__manzana', models.Value('')),
+            etiqueta_numeros_lotes=Coalesce(
+                EtiquetaLotes('numero_lote', numerico=True), 'lote__numero_lote', models.Value('')
+            ),
+        )
+
+
 class Contrato(models.Model):
     cliente = models.ForeignKey(Cliente, on_delete=models.PROTECT)
     # Changed from OneToOneField to ForeignKey to allow lote reuse after cancellation/devolucion
@@ -129,28 +189,45 @@ class Contrato(models.Model):
     
     # Bandera para saber si está en mora actualmente (calculado)
     esta_en_mora = models.BooleanField(default=False)
+    # Último día en que se recalculó la mora (las vistas de lectura no recalculan si es hoy)
+    mora_calculada_hasta = models.DateField(null=True, blank=True)
 
     # Fecha exacta en que se registró el contrato en el sistema
     fecha_registro = models.DateTimeField(auto_now_add=True, null=True, blank=True)
+    # Última edición por save() (fecha, cliente, lote...; las moras van por ResumenContrato)
+    actualizado_en = models.DateTimeField(auto_now=True, null=True)
+
+    class Meta:
+        indexes = [
+            # Paginación por cursor del listado de clientes (más recientes primero)
+            models.Index(fields=['-fecha_contrato', '-id'], name='contrato_fecha_id_idx'),
+        ]
 
     def __str__(self):
         return f"Contrato #{self.id} - {self.cliente}"
 
+    objects = ContratoQuerySet.as_manager()
+
+    def _lotes(self):
+        """Lotes del M2M (una consulta, o ninguna si vienen de prefetch_related('lotes'))."""
+        return list(self.lotes.all())
+
     @property
     def lote_principal(self):
         """Devuelve el primer lote asociado para compatibilidad."""
-        return self.lotes.first() or self.lote
+        lotes = self._lotes()
+        return min(lotes, key=lambda l: l.pk) if lotes else self.lote
 
     @property
     def lotes_display(self):
         """String concatenado de los lotes: 'Mz A - 1, 2'"""
-        lotes_qs = self.lotes.all()
-        if not lotes_qs.exists() and self.lote:
+        lotes = self._lotes()
+        if not lotes and self.lote:
             return f"Mz {self.lote.manzana} - Lote {self.lote.numero_lote}"
             
         # Agrupar por Manzana
         grupos = {}
-        for l in lotes_qs:
+        for l in lotes:
             if l.manzana not in grupos:
                 grupos[l.manzana] = []
             grupos[l.manzana].append(str(l.numero_lote))
@@ -165,27 +242,30 @@ class Contrato(models.Model):
     @property
     def manzanas_str(self):
         """Devuelve string de manzanas unicas: 'A, B'"""
-        lotes_qs = self.lotes.all()
-        if not lotes_qs.exists() and self.lote:
+        if 'etiqueta_manzanas' in self.__dict__:  # with_lote_labels()
+            return self.etiqueta_manzanas
+        lotes = self._lotes()
+        if not lotes and self.lote:
             return str(self.lote.manzana)
-        mzs = sorted(list(set(l.manzana for l in lotes_qs)))
+        mzs = sorted(list(set(l.manzana for l in lotes)))
         return ", ".join(mzs)
 
     @property
     def numeros_lotes_str(self):
         """Devuelve string de numeros de lote: '1, 2, 5'"""
-        lotes_qs = self.lotes.all()
-        if not lotes_qs.exists() and self.lote:
+        if 'etiqueta_numeros_lotes' in self.__dict__:  # with_lote_labels()
+            return self.etiqueta_numeros_lotes
+        lotes = self._lotes()
+        if not lotes and self.lote:
             return str(self.lote.numero_lote)
         
         # Opcional: mostrar 'Mz A: 1, 2 / Mz B: 5' si hay mezcla compleja
         # Para simplificar en columnas separadas, solo listamos números
         # Si queremos ser precisos cuando hay multiple manzanas, lo mejor es el lotes_display general.
         # Pero intentaremos listar todos los números.
-        nums = sorted([str(l.numero_lote) for l in lotes_qs], key=lambda x: int(x) if x.isdigit() else x)
+        nums = sorted([str(l.numero_lote) for l in lotes], key=lambda x: (int(x) if x.isdigit() else 0, x))
         return ", ".join(nums)
 
-
 class Cuota(models.Model):
     ESTADOS_PAGO = [
         ('PENDIENTE', 'Pendiente'),
@@ -213,6 +293,21 @@ class Cuota(models.Model):
 
     class Meta:
         ordering = ['numero_cuota'] # Ordenar cronológicamente
+        constraints = [
+            # También es el índice de "cuotas del contrato en orden"
+            models.UniqueConstraint(fields=['contrato', 'numero_cuota'], name='cuota_contrato_numero_unico'),
+        ]
+        indexes = [
+            # Cuotas pendientes/vencidas de un contrato (resumen, próxima cuota, pagos)
+            models.Index(fields=['contrato', 'estado'], name='cuota_contrato_estado_idx'),
+            # Vencidas de toda la cartera (mora masiva, dashboard)
+            models.Index(fields=['estado', 'fecha_vencimiento'], name='cuota_estado_venc_idx'),
+            # Solo cuotas abiertas: las pagadas son la mayoría y nunca se buscan por vencimiento
+            models.Index(
+                fields=['fecha_vencimiento'], condition=models.Q(estado__in=['PENDIENTE', 'PARCIAL', 'VENCIDO']),
+                name='cuota_abierta_venc_idx'
+            ),
+        ]
 
     def __str__(self):
         return f"Cuota {self.numero_cuota} - {self.contrato}"
@@ -236,10 +331,100 @@ class Cuota(models.Model):
         return resultado
 
 
+class ResumenContrato(models.Model):
+    """
+    Saldos precalculados del contrato (una fila por contrato) para que listados y
+    reportes no sumen N cuotas. Lo mantienen los servicios de pagos y moras
+    (services.actualizar_resumenes); no editar a mano.
+    """
+    contrato = models.OneToOneField(Contrato, on_delete=models.CASCADE, primary_key=True, related_name='resumen')
+    # El pago se imputa primero a capital: saldo_capital + saldo_mora = saldo_pendiente
+    saldo_capital = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    saldo_mora = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    saldo_pendiente = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    # Abonado a cuotas (no incluye la entrada)
+    total_pagado = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    cuotas_vencidas = models.PositiveIntegerField(default=0)
+    # Primera cuota PENDIENTE o PARCIAL (mismo criterio que "Próxima a pagar" del detalle)
+    proxima_fecha_vencimiento = models.DateField(null=True, blank=True)
+    actualizado_en = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = "Resumen de Contrato"
+        verbose_name_plural = "Resúmenes de Contratos"
+
+    def __str__(self):
+        return f"Resumen {self.contrato_id}: saldo ${self.saldo_pendiente}"
+
+
+class ResumenDiario(models.Model):
+    """
+    Totales por día y vendedor para los KPIs del dashboard y del gestor, que así suman
+    días en lugar de recorrer todos los pagos y transacciones. Lo mantienen los servicios
+    de pagos, moras y caja (services.actualizar_resumen_diario); no editar a mano.
+    """
+    fecha = models.DateField(db_index=True)
+    # Vendedor del cliente (pagos, entradas, mora) o quien registró la transacción de caja
+    vendedor = models.ForeignKey(User, on_delete=models.CASCADE, null=True, blank=True, related_name='resumenes_diarios')
+    # Todo lo cobrado ese día (fecha_pago), de cualquier contrato
+    pagos_recibidos = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    # Cobrado ese día sin contratos en DEVOLUCION (cash-flow del gestor)
+    ingresos_lotes = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    # valor_entrada de los contratos firmados ese día y pagos no-entrada (DEVOLUCION en negativo)
+    entradas = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    abonos_cuotas = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    ingresos_caja = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    gastos = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    # Mora de las cuotas que vencen ese día
+    mora_generada = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+
+    class Meta:
+        verbose_name = "Resumen Diario"
+        verbose_name_plural = "Resúmenes Diarios"
+        ordering = ['fecha']
+        constraints = [
+            models.UniqueConstraint(fields=['fecha', 'vendedor'], name='resumen_diario_unico'),
+        ]
+
+    def __str__(self):
+        return f"Resumen {self.fecha}: cobrado ${self.pagos_recibidos}"
+
+
+class CierreMensual(models.Model):
+    """
+    Foto inmutable del Reporte Mensual de un mes ya cerrado (toda la cartera; cliente,
+    lote y el filtro por vendedor se unen en vivo al leerla). La genera reportes.obtener_cierres_mensuales la
+    primera vez que se consulta el mes y se elimina cuando cambia un pago con fecha en
+    ese mes o en uno anterior (services.invalidar_cierres_desde); no editar a mano.
+    """
+    anio = models.PositiveSmallIntegerField()
+    mes = models.PositiveSmallIntegerField()
+    # Filas planas (una por pago / por contrato): contrato_id e importes, sin datos del cliente
+    cobros = models.JSONField(default=list, encoder=DjangoJSONEncoder)
+    mora_historica = models.JSONField(default=list, encoder=DjangoJSONEncoder)
+    total_cobrado = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    total_entradas = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    total_ingresos = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    total_mora_historica = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    generado_en = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = "Cierre Mensual"
+        verbose_name_plural = "Cierres Mensuales"
+        ordering = ['anio', 'mes']
+        constraints = [
+            models.UniqueConstraint(fields=['anio', 'mes'], name='cierre_mensual_unico'),
+        ]
+
+    def __str__(self):
+        return f"Cierre {self.mes:02d}/{self.anio}: cobrado ${self.total_cobrado}"
+
+
 class Pago(models.Model):
     METODOS = [
         ('EFECTIVO', 'Efectivo'),
-        ('TRANSFERENCIA', 'Transferencia/Depósito'),
+        ('TRANSFERENCIA', 'Transferencia'),
+        ('DEPOSITO', 'Depósito'),
     ]
 
     contrato = models.ForeignKey(Contrato, on_delete=models.CASCADE)
@@ -258,6 +443,22 @@ class Pago(models.Model):
     es_entrada = models.BooleanField(default=False, help_text="Indica si este pago corresponde a la cuota de entrada no amortizable")
     cuota_origen = models.ForeignKey('Cuota', on_delete=models.SET_NULL, null=True, blank=True, help_text="Si seleccionó una cuota intencionalmente al pagar, este campo la guarda para recordarlo")
 
+    # Datos bancarios y excedente en columnas (antes solo dentro de la observación)
+    banco = models.CharField(max_length=100, blank=True, default='')
+    cuenta = models.CharField(max_length=100, blank=True, default='', help_text="Cuenta o comprobante de la transferencia")
+    comprobante = models.CharField(max_length=100, blank=True, default='', help_text="Número de papeleta del depósito")
+    saldo_a_favor = models.DecimalField(max_digits=12, decimal_places=2, default=0, help_text="Parte del pago que no cubrió ninguna cuota")
+
+    class Meta:
+        indexes = [
+            # Solo los pagos con excedente: reporte de saldos a favor de la cartera
+            models.Index(fields=['saldo_a_favor'], condition=models.Q(saldo_a_favor__gt=0), name='pago_saldo_a_favor_idx'),
+            # Entrada vs. abonos de un contrato (recálculo, recibos, reporte general)
+            models.Index(fields=['contrato', 'es_entrada'], name='pago_contrato_entrada_idx'),
+            # Filtros por mes/rango (gestor, reportes, exportación)
+            models.Index(fields=['fecha_pago'], name='pago_fecha_idx'),
+        ]
+
     def save(self, *args, **kwargs):
         # Sanitización de Inputs (Bleach)
         if self.observacion:
@@ -274,6 +475,11 @@ class DetallePago(models.Model):
     monto_aplicado = models.DecimalField(max_digits=10, decimal_places=2, help_text="Monto de este pago destinado a esta cuota")
     fecha_registro = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['pago', 'cuota'], name='detalle_pago_cuota_idx'),
+        ]
+
     def __str__(self):
         return f"Detalle Pago #{self.pago.id} -> Cuota #{self.cuota.numero_cuota}: ${self.monto_aplicado}"
 
@@ -311,5 +517,64 @@ class MovimientoCaja(models.Model):
             self.descripcion = bleach.clean(self.descripcion, tags=[], attributes={}, strip=True)
         super().save(*args, **kwargs)
 
+    class Meta:
+        indexes = [
+            # Historial de la caja paginado por cursor (sbr_gestor/movimientos.py)
+            models.Index(fields=['-fecha', '-id'], name='movimientocaja_fecha_id_idx'),
+        ]
+
     def __str__(self):
         return f"{self.tipo} - ${self.monto} ({self.fecha})"
+
+
+class TareaPDF(models.Model):
+    """
+    Render de un PDF fuera del request (contratos, recibos, reportes). La encola
+    tareas_pdf.encolar_pdf y la procesa el comando procesar_pdfs con un pool de procesos.
+    """
+    TIPO_CHOICES = [
+        ('CONTRATO', 'Contrato'),
+        ('RECIBO_ENTRADA', 'Recibo de Entrada'),
+        ('RECIBO_PAGO', 'Recibo de Cuota'),
+        ('RECIBO_TRANSACCION', 'Recibo de Pago'),
+        ('REPORTE_GENERAL', 'Reporte General'),
+        ('REPORTE_MENSUAL', 'Reporte Mensual'),
+        ('EXPORTACION', 'Exportación de Recibos'),
+    ]
+    ESTADO_CHOICES = [
+        ('PENDIENTE', 'Pendiente'),
+        ('EN_PROCESO', 'En Proceso'),
+        ('LISTO', 'Listo'),
+        ('ERROR', 'Error'),
+    ]
+    tipo = models.CharField(max_length=20, choices=TIPO_CHOICES)
+    # Contrato / cuota / pago según el tipo; los reportes y exportaciones usan parametros
+    objeto_id = models.PositiveIntegerField(null=True, blank=True)
+    parametros = models.JSONField(default=dict, blank=True)
+    estado = models.CharField(max_length=20, choices=ESTADO_CHOICES, default='PENDIENTE')
+    intentos = models.PositiveSmallIntegerField(default=0)
+    max_intentos = models.PositiveSmallIntegerField(default=3)
+    # Los reintentos esperan (backoff) hasta esta hora
+    disponible_desde = models.DateTimeField(default=timezone.now)
+    iniciado_en = models.DateTimeField(null=True, blank=True)
+    terminado_en = models.DateTimeField(null=True, blank=True)
+    # Ruta del resultado dentro de MEDIA_ROOT
+    archivo = models.CharField(max_length=255, blank=True)
+    nombre_archivo = models.CharField(max_length=255, blank=True)
+    error = models.TextField(blank=True)
+    # Avance de las exportaciones (documentos listos de total)
+    progreso = models.PositiveIntegerField(default=0)
+    total = models.PositiveIntegerField(default=0)
+    solicitado_por = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='tareas_pdf')
+    creado_en = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name = "Tarea PDF"
+        verbose_name_plural = "Tareas PDF"
+        ordering = ['id']
+        indexes = [
+            models.Index(fields=['estado', 'disponible_desde'], name='tarea_pdf_cola_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.get_tipo_display()} #{self.objeto_id or self.id} ({self.estado})"
@@ -0,0 +1,112 @@
+"""
+Presupuesto de consultas para las pruebas: detecta los N+1 antes de que lleguen a producción.
+
+    with presupuesto_consultas(12, 'reporte general'):
+        client.get('/reportes/general/')
+
+    @presupuesto_consultas(5)
+    def test_algo(self): ...
+
+Un presupuesto fijo no basta si los datos de prueba son pocos (un N+1 sobre 3 contratos
+son 3 consultas). verificar_escalamiento mide cada caso con la cartera chica, la amplía
+y vuelve a medir: cualquier caso cuyas consultas crecen con los datos falla, y el
+mensaje muestra el SQL más repetido (la firma del N+1).
+"""
+import re
+from collections import Counter
+from contextlib import ContextDecorator
+
+from django.db import connections
+
+# Parámetros y listas IN: el mismo SQL con otros valores cuenta como repetido
+_PATRON_IN = re.compile(r"IN \((?:%s|\?|[\d.]+)(?:, (?:%s|\?|[\d.]+))*\)")
+_PATRON_NUMERO = re.compile(r"\b\d+(?:\.\d+)?\b")
+
+def normalizar_sql(sql):
+    return _PATRON_NUMERO.sub('N', _PATRON_IN.sub('IN (...)', sql))
+
+class ConsultasRegistradas:
+    """execute_wrapper que guarda el SQL de cada consulta."""
+
+    def __init__(self):
+        self.sql = []
+
+    def __call__(self, execute, sql, params, many, context):
+        self.sql.append(sql)
+        return execute(sql, params, many, context)
+
+    @property
+    def total(self):
+        return len(self.sql)
+
+    def repetidas(self, limite=3):
+        """[(veces, sql)] de las consultas que se repiten, las más repetidas primero."""
+        conteo = Counter(normalizar_sql(sql) for sql in self.sql)
+        return [(veces, sql) for sql, veces in conteo.most_common(limite) if veces > 1]
+
+    def detalle(self, limite=3):
+        lineas = [f"  {veces}× {sql[:300]}" for veces, sql in self.repetidas(limite)]
+        return "\n".join(lineas) if lineas else "  (ninguna consulta repetida)"
+
+def medir_consultas(funcion, using='default'):
+    """Ejecuta `funcion` y retorna las ConsultasRegistradas."""
+    registro = ConsultasRegistradas()
+    with connections[using].execute_wrapper(registro):
+        funcion()
+    return registro
+
+class presupuesto_consultas(ContextDecorator):
+    """Falla (AssertionError) si el bloque o la función hace más de `maximo` consultas."""
+
+    def __init__(self, maximo, nombre=None, using='default'):
+        self.maximo = maximo
+        self.nombre = nombre
+        self.using = using
+
+    def __enter__(self):
+        self.registro = ConsultasRegistradas()
+        self._wrapper = connections[self.using].execute_wrapper(self.registro)
+        self._wrapper.__enter__()
+        return self.registro
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._wrapper.__exit__(exc_type, exc_value, traceback)
+        if exc_type is None and self.registro.total > self.maximo:
+            raise AssertionError(
+                f"{self.nombre or 'Bloque'}: {self.registro.total} consultas, presupuesto {self.maximo}.\n"
+                f"{self.registro.detalle()}"
+            )
+        return False
+
+def verificar_escalamiento(casos, ampliar, using='default'):
+    """
+    `casos`: dict nombre -> (funcion, maximo). Mide cada caso, llama a `ampliar()` (que agrega
+    datos) y vuelve a medir. Retorna la lista de fallas: presupuesto excedido en alguno de
+    los dos tamaños, o más consultas con más datos. Vacía si todo está bien.
+    """
+    chicos = {nombre: medir_consultas(funcion, using) for nombre, (funcion, _) in casos.items()}
+    ampliar()
+    fallas = []
+    for nombre, (funcion, maximo) in casos.items():
+        grande = medir_consultas(funcion, using)
+        chico = chicos[nombre]
+        if grande.total > chico.total:
+            fallas.append(
+                f"{nombre}: las consultas crecen con los datos ({chico.total} -> {grande.total}).\n{grande.detalle()}"
+            )
+        elif max(chico.total, grande.total) > maximo:
+            fallas.append(
+                f"{nombre}: {max(chico.total, grande.total)} consultas, presupuesto {maximo}.\n{grande.detalle()}"
+            )
+    return fallas
+
+class PresupuestoConsultasMixin:
+    """Para TestCase: assertPresupuestoConsultas y assertConsultasNoCrecen."""
+
+    def assertPresupuestoConsultas(self, maximo, nombre=None, using='default'):
+        return presupuesto_consultas(maximo, nombre, using)
+
+    def assertConsultasNoCrecen(self, casos, ampliar, using='default'):
+        fallas = verificar_escalamiento(casos, ampliar, using)
+        if fallas:
+            self.fail("\n\n".join(fallas))
@@ -0,0 +1,77 @@
+"""
+Render de HTML a PDF con WeasyPrint, reutilizando lo costoso entre documentos.
+
+Cada proceso (worker web o del pool de procesar_pdfs) crea una sola vez la configuración
+de fuentes y una caché LRU de imágenes ya decodificadas (el logo sale en todos los
+recibos). Las URLs /static/ y /media/ se leen del disco con url_fetcher en lugar de
+pedírselas por HTTP al propio servidor (base_url apunta a BASE_URL / 127.0.0.1:8000).
+Las plantillas Django ya quedan en memoria por el loader en caché.
+"""
+import mimetypes
+from collections import OrderedDict
+from urllib.parse import unquote, urlsplit
+
+from django.conf import settings
+
+from .instrumentacion import medir_pdf
+
+MAX_IMAGENES_CACHE = 64
+
+class CacheImagenes(OrderedDict):
+    """dict LRU para la opción `cache` de WeasyPrint (url -> imagen decodificada)."""
+
+    def __init__(self, maximo=MAX_IMAGENES_CACHE):
+        super().__init__()
+        self.maximo = maximo
+
+    def __getitem__(self, clave):
+        valor = super().__getitem__(clave)
+        self.move_to_end(clave)
+        return valor
+
+    def __setitem__(self, clave, valor):
+        super().__setitem__(clave, valor)
+        self.move_to_end(clave)
+        while len(self) > self.maximo:
+            self.popitem(last=False)
+
+def base_url():
+    return settings.BASE_URL if hasattr(settings, 'BASE_URL') else 'http://127.0.0.1:8000'
+
+def ruta_local(url):
+    """Archivo en disco para una URL /static/ o /media/ (relativa o de este servidor); None si no hay."""
+    from .services import link_callback
+
+    partes = urlsplit(url)
+    if partes.scheme not in ('', 'http', 'https') or (partes.netloc and partes.netloc != urlsplit(base_url()).netloc):
+        return None
+    ruta = link_callback(unquote(partes.path), None)
+    return ruta if ruta != unquote(partes.path) else None
+
+def url_fetcher(url, **kwargs):
+    from weasyprint import default_url_fetcher
+
+    ruta = ruta_local(url)
+    if ruta is None:
+        return default_url_fetcher(url, **kwargs)
+    with open(ruta, 'rb') as archivo:
+        contenido = archivo.read()
+    return {'string': contenido, 'mime_type': mimetypes.guess_type(ruta)[0], 'redirected_url': url}
+
+_fuentes = None
+_imagenes = CacheImagenes()
+
+def _configuracion_fuentes():
+    global _fuentes
+    if _fuentes is None:
+        from weasyprint.text.fonts import FontConfiguration
+        _fuentes = FontConfiguration()
+    return _fuentes
+
+def html_a_pdf(html, destino=None):
+    """Renderiza el HTML; escribe en `destino` (archivo abierto) o retorna los bytes."""
+    from weasyprint import HTML
+
+    with medir_pdf():
+        documento = HTML(string=html, base_url=base_url(), url_fetcher=url_fetcher)
+        return documento.write_pdf(destino, font_config=_configuracion_fuentes(), cache=_imagenes)
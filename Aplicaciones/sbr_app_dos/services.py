@@ -1,8 +1,17 @@
 import os
+from calendar import monthrange
 from decimal import Decimal
+from functools import lru_cache
+from io import BytesIO
 from datetime import date, datetime
 from dateutil.relativedelta import relativedelta
 from django.db import transaction
+from django.db.models import (
+    Case, CharField, Count, DateField, DecimalField, Exists, ExpressionWrapper, F, Min, OuterRef, Q, Sum,
+    Value, When
+)
+from django.db.models.functions import Coalesce, Floor, Greatest, Round, TruncMonth
+from django.db.models.lookups import GreaterThanOrEqual
 from django.conf import settings
 from django.template.loader import render_to_string
 from django.core.files.base import ContentFile
@@ -10,7 +19,14 @@ from django.core.files.base import ContentFile
 from django.contrib.staticfiles import finders 
 
 from xhtml2pdf import pisa
-from .models import Contrato, Cuota, Pago, ConfiguracionSistema, DetallePago
+from .models import (
+    CierreMensual, Contrato, Cuota, Pago, ConfiguracionSistema, DetallePago, ResumenContrato, ResumenDiario
+)
+from .cache_pdf import pdf_en_cache
+from .render_pdf import html_a_pdf
+from .asignacion import (
+    CuotaSnapshot, a_centavos, asignar_pago, calcular_mora, cerrar_estados, reaplicar_pagos
+)
 
 # ==========================================
 # UTILIDAD: CALLBACK UNIVERSAL (WINDOWS/LINUX)
@@ -57,178 +73,619 @@ def link_callback(uri, rel):
 # ==========================================
 # 1. GENERADOR DE TABLA DE AMORTIZACIÓN
 # ==========================================
-def generar_tabla_amortizacion(contrato_id, fecha_inicio_pago_str=None):
-    contrato = Contrato.objects.get(id=contrato_id)
-    contrato.cuotas.all().delete()
-    
-    saldo_actual = contrato.saldo_a_financiar
-    plazo_meses = contrato.numero_cuotas
-    
-    if plazo_meses <= 0: return False
-        
-    cuota_base = round(saldo_actual / plazo_meses, 2)
-    lista_cuotas_a_crear = []
-    
-    # Lógica de Fecha de Inicio
-    if fecha_inicio_pago_str:
+def _fecha_base_pagos(fecha_contrato, fecha_inicio_pago=None):
+    """Fecha de la cuota 1: la elegida ('YYYY-MM-DD' o date) o un mes después del contrato."""
+    if isinstance(fecha_inicio_pago, date):
+        return fecha_inicio_pago
+    if fecha_inicio_pago:
         try:
-            fecha_base = datetime.strptime(fecha_inicio_pago_str, '%Y-%m-%d').date()
+            return datetime.strptime(fecha_inicio_pago, '%Y-%m-%d').date()
         except ValueError:
-             fecha_base = contrato.fecha_contrato + relativedelta(months=1)
-    else:
-        fecha_base = contrato.fecha_contrato + relativedelta(months=1)
+            pass
+    return fecha_contrato + relativedelta(months=1)
 
-    for i in range(1, plazo_meses + 1):
-        # La cuota 1 es la fecha elegida, la 2 es un mes después, etc.
-        if i == 1:
-            fecha_vencimiento = fecha_base
-        else:
-            fecha_vencimiento = fecha_base + relativedelta(months=i-1)
-        
-        # Ajuste de centavos final
-        if i == plazo_meses:
-            valor_capital_cuota = saldo_actual
-        else:
-            valor_capital_cuota = cuota_base
+@lru_cache(maxsize=4096)
+def _fechas_vencimiento(fecha_base, plazo_meses):
+    """
+    Tabla de vencimientos mensuales (misma regla que relativedelta: el día se ajusta
+    al último día del mes cuando no existe). Se cachea porque en una carga masiva
+    muchos contratos comparten fecha de inicio y plazo.
+    """
+    anio, mes_base, dia = fecha_base.year, fecha_base.month - 1, fecha_base.day
+    fechas = []
+    for desplazamiento in range(plazo_meses):
+        anios_extra, mes = divmod(mes_base + desplazamiento, 12)
+        anio_cuota = anio + anios_extra
+        fechas.append(date(anio_cuota, mes + 1, min(dia, monthrange(anio_cuota, mes + 1)[1])))
+    return tuple(fechas)
+
+@lru_cache(maxsize=4096)
+def _capitales_cuotas(saldo, plazo_meses):
+    """Capital de cada cuota al centavo; la última absorbe el ajuste de centavos."""
+    cuota_base = round(saldo / plazo_meses, 2)
+    ultima = saldo - cuota_base * (plazo_meses - 1)
+    return (cuota_base,) * (plazo_meses - 1) + (ultima,)
+
+def calcular_tabla_amortizacion(saldo_a_financiar, numero_cuotas, fecha_base):
+    """Tabla en memoria: (numeros, fechas, capitales) como tuplas paralelas. No toca la BD."""
+    if numero_cuotas <= 0:
+        return (), (), ()
+    saldo = Decimal(str(saldo_a_financiar))
+    return (
+        tuple(range(1, numero_cuotas + 1)),
+        _fechas_vencimiento(fecha_base, numero_cuotas),
+        _capitales_cuotas(saldo, numero_cuotas),
+    )
+
+@transaction.atomic
+def generar_tablas_amortizacion(contratos, fechas_inicio=None, batch_size=500, dry_run=False):
+    """
+    Genera las cuotas de muchos contratos en una sola pasada (migraciones de cartera,
+    urbanizaciones nuevas). 'contratos' puede traer ids (se cargan en una query) o
+    instancias de Contrato (se usan sus valores en memoria).
+    'fechas_inicio' es un dict opcional {contrato_id: 'YYYY-MM-DD' | date}.
 
-        saldo_actual -= valor_capital_cuota
+    Igual que generar_tabla_amortizacion, borra las cuotas existentes y crea todas
+    las nuevas con un solo bulk_create. Con dry_run=True no escribe nada y retorna
+    [{'contrato_id', 'numeros', 'fechas', 'capitales'}, ...] para previsualizar;
+    si no, retorna el número de cuotas creadas.
+    """
+    fechas_inicio = fechas_inicio or {}
+    contratos = list(contratos)
+    ids = [c for c in contratos if not isinstance(c, Contrato)]
+    if ids:
+        cargados = Contrato.objects.only('id', 'fecha_contrato', 'saldo_a_financiar', 'numero_cuotas').in_bulk(ids)
+        contratos = [cargados[c] if not isinstance(c, Contrato) else c for c in contratos]
+
+    tablas = []
+    for contrato in contratos:
+        fecha_base = _fecha_base_pagos(contrato.fecha_contrato, fechas_inicio.get(contrato.id))
+        numeros, fechas, capitales = calcular_tabla_amortizacion(
+            contrato.saldo_a_financiar, contrato.numero_cuotas, fecha_base
+        )
+        tablas.append({'contrato_id': contrato.id, 'numeros': numeros, 'fechas': fechas, 'capitales': capitales})
 
-        cuota = Cuota(
-            contrato=contrato,
-            numero_cuota=i,
+    if dry_run:
+        return tablas
+
+    # Las cuotas nuevas no tienen mora: los días con mora de las anteriores cambian
+    anteriores = Cuota.objects.filter(contrato_id__in=[t['contrato_id'] for t in tablas])
+    dias_mora = set(anteriores.filter(valor_mora__gt=0).values_list('fecha_vencimiento', flat=True).distinct())
+    anteriores.delete()
+    creadas = Cuota.objects.bulk_create([
+        Cuota(
+            contrato_id=tabla['contrato_id'],
+            numero_cuota=numero,
             fecha_vencimiento=fecha_vencimiento,
-            valor_capital=valor_capital_cuota,
+            valor_capital=valor_capital,
             estado='PENDIENTE',
             valor_pagado=0,
             valor_mora=0
         )
-        lista_cuotas_a_crear.append(cuota)
+        for tabla in tablas
+        for numero, fecha_vencimiento, valor_capital in zip(tabla['numeros'], tabla['fechas'], tabla['capitales'])
+    ], batch_size=batch_size)
+    actualizar_resumenes(Contrato.objects.filter(id__in=[t['contrato_id'] for t in tablas]))
+    actualizar_resumen_diario(dias_mora)
+    if contratos:
+        # Contratos con fecha antigua cambian la mora histórica de meses ya cerrados
+        invalidar_cierres_desde(min(c.fecha_contrato for c in contratos))
+    return len(creadas)
 
-    Cuota.objects.bulk_create(lista_cuotas_a_crear)
-    return True
+def generar_tabla_amortizacion(contrato_id, fecha_inicio_pago_str=None):
+    contrato = Contrato.objects.get(id=contrato_id)
+    generar_tablas_amortizacion([contrato], {contrato.id: fecha_inicio_pago_str})
+    return contrato.numero_cuotas > 0
 
 # ==========================================
 # 2. LOGICA DE MORAS (AUTOMATICA)
 # ==========================================
-# En services.py -> reemplazar la función actualizar_moras_contrato
+ESTADOS_ABIERTOS = ['PENDIENTE', 'PARCIAL', 'VENCIDO']
+
+
+def obtener_porcentaje_mora():
+    """Porcentaje de mora configurado en el admin (3.00% si no hay configuración)."""
+    config = ConfiguracionSistema.objects.first()
+    return config.mora_porcentaje if config else Decimal('3.00')
+
+
+def expresion_mora(porcentaje_mora):
+    """
+    Expresión SQL equivalente a:
+        (valor_capital * porcentaje / 100).quantize(0.01, ROUND_HALF_UP), mínimo $0.01
+    Se trabaja en centavos enteros para que el redondeo sea exacto también en SQLite
+    (donde los DecimalField se guardan como REAL).
+    """
+    # Porcentaje en centésimas (3.00% -> 300), capital en centavos
+    puntos = int((Decimal(porcentaje_mora) * 100).to_integral_value())
+    centavos_capital = Round(F('valor_capital') * 100)
+    centavos_mora = Floor((centavos_capital * puntos + 5000) / 10000)
+
+    # Asegurar mínimo de $0.01 si el porcentaje dio 0 por ser cuota muy pequeña
+    if puntos > 0:
+        centavos_mora = Greatest(centavos_mora, Value(Decimal('1')))
+
+    return ExpressionWrapper(
+        centavos_mora / Value(100.0),
+        output_field=DecimalField(max_digits=10, decimal_places=2)
+    )
+
 
 def actualizar_moras_masivo(contratos_qs):
     """
-    Versión de ultra-alto rendimiento para actualizar la mora de múltiples contratos a la vez.
-    Ideal para usar en vistas de listados de clientes donde iterar uno a uno sobrecarga la BD.
+    Motor de mora en la base de datos: actualiza la mora de múltiples contratos con
+    unos pocos UPDATE condicionales (Case/When + F()), sin traer las cuotas a Python.
+    Solo toca las filas cuyo estado o valor_mora realmente cambian.
+
+    Retorna un dict con los conteos de filas modificadas:
+        {'vencidas': n, 'exentas': n, 'contratos_en_mora': n, 'contratos_al_dia': n}
     """
     hoy = date.today()
-    config = ConfiguracionSistema.objects.first()
-    porcentaje_mora = config.mora_porcentaje if config else Decimal('3.00')
+    porcentaje_mora = obtener_porcentaje_mora()
+    mora = expresion_mora(porcentaje_mora)
 
-    # Filtrar cuotas candidatas a cambiar
-    cuotas = Cuota.objects.filter(
+    # Cuotas abiertas cuya fecha de vencimiento es MENOR a hoy (YA VENCIERON)
+    vencidas = Cuota.objects.filter(
         contrato__in=contratos_qs,
-        estado__in=['PENDIENTE', 'PARCIAL', 'VENCIDO']
+        estado__in=ESTADOS_ABIERTOS,
+        fecha_vencimiento__lt=hoy
     )
-    
-    cuotas_a_actualizar = []
-    
-    for cuota in cuotas:
-        # Si la fecha de vencimiento es MENOR a hoy, YA VENCIÓ.
-        if cuota.fecha_vencimiento < hoy:
-            mora_calcular = Decimal('0.00')
-
-            # Respetar exención manual de mora
-            if cuota.mora_exenta:
-                nuevo_estado = 'PENDIENTE' if cuota.saldo_pendiente > 0 else 'PAGADO'
-                if cuota.estado != nuevo_estado or cuota.valor_mora != mora_calcular:
-                    cuota.estado = nuevo_estado
-                    cuota.valor_mora = mora_calcular
-                    cuotas_a_actualizar.append(cuota)
-                continue
-            
-            # Calcular Mora Única (Porcentual)
-            mora_calcular = (cuota.valor_capital * porcentaje_mora) / Decimal('100.00')
-            mora_calcular = mora_calcular.quantize(Decimal('0.01'), rounding='ROUND_HALF_UP')
-            
-            # Asegurar mínimo de $0.01 si el porcentaje dio 0 por ser cuota muy pequeña
-            if mora_calcular < Decimal('0.01') and porcentaje_mora > 0:
-                mora_calcular = Decimal('0.01')
-
-            # Actualizar estado y mora
-            if cuota.estado != 'VENCIDO' or cuota.valor_mora != mora_calcular:
-                cuota.estado = 'VENCIDO'
-                cuota.valor_mora = mora_calcular
-                cuotas_a_actualizar.append(cuota)
-                
-    if cuotas_a_actualizar:
-        Cuota.objects.bulk_update(cuotas_a_actualizar, ['estado', 'valor_mora'])
-
-    # Actualizar bandera global de los contratos
-    contratos_con_mora = set(Cuota.objects.filter(
-        contrato__in=contratos_qs, estado='VENCIDO'
-    ).values_list('contrato_id', flat=True))
-
-    contratos_qs.filter(id__in=contratos_con_mora).exclude(esta_en_mora=True).update(esta_en_mora=True)
-    contratos_qs.exclude(id__in=contratos_con_mora).filter(esta_en_mora=True).update(esta_en_mora=False)
+
+    # Días cuya mora generada va a cambiar (para el ResumenDiario)
+    dias_mora = set(
+        vencidas.filter(Q(mora_exenta=True) & ~Q(valor_mora=0) | Q(mora_exenta=False) & ~Q(valor_mora=mora))
+        .order_by().values_list('fecha_vencimiento', flat=True).distinct()
+    )
+
+    # 1. Respetar exención manual de mora: mora en 0 y estado según el saldo
+    saldo = F('valor_capital') + F('valor_mora') - F('valor_pagado')
+    nuevo_estado_exenta = Case(
+        When(GreaterThanOrEqual(saldo, Value(Decimal('0.01'))), then=Value('PENDIENTE')),
+        default=Value('PAGADO'),
+        output_field=CharField()
+    )
+    exentas = (
+        vencidas.filter(mora_exenta=True)
+        .exclude(Q(estado=nuevo_estado_exenta) & Q(valor_mora=0))
+        .update(estado=nuevo_estado_exenta, valor_mora=Decimal('0.00'))
+    )
+
+    # 2. Mora Única (Porcentual): VENCIDO con el valor calculado
+    con_mora = (
+        vencidas.filter(mora_exenta=False)
+        .exclude(Q(estado='VENCIDO') & Q(valor_mora=mora))
+        .update(estado='VENCIDO', valor_mora=mora)
+    )
+
+    # 3. Actualizar bandera global de los contratos
+    tiene_vencidas = Exists(Cuota.objects.filter(contrato=OuterRef('pk'), estado='VENCIDO'))
+    en_mora = contratos_qs.filter(tiene_vencidas).exclude(esta_en_mora=True).update(esta_en_mora=True)
+    al_dia = contratos_qs.filter(~tiene_vencidas).filter(esta_en_mora=True).update(esta_en_mora=False)
+
+    # 4. Saldos precalculados (las cuotas ya quedaron al día). Va antes de la marca de
+    # agua: contratos_qs puede venir filtrado por mora_calculada_hasta.
+    actualizar_resumenes(contratos_qs)
+    if dias_mora:
+        actualizar_resumen_diario(dias_mora)
+
+    # 5. Marca de agua: la mora de estos contratos ya está calculada para hoy
+    contratos_qs.exclude(mora_calculada_hasta=hoy).update(mora_calculada_hasta=hoy)
+
+    return {
+        'vencidas': con_mora,
+        'exentas': exentas,
+        'contratos_en_mora': en_mora,
+        'contratos_al_dia': al_dia,
+    }
+
+def actualizar_moras_pendientes(contratos_qs):
+    """
+    Igual que actualizar_moras_masivo pero salta los contratos cuya mora ya se
+    calculó hoy (mora_calculada_hasta). Es lo que deben usar las vistas de lectura:
+    la mora solo cambia cuando cambia el día o cuando se mueve dinero, y en ese
+    caso los servicios de pago ya la recalculan.
+    """
+    conteos = actualizar_moras_masivo(contratos_qs.exclude(mora_calculada_hasta=date.today()))
+    # Contratos creados fuera de los servicios (admin, cargas antiguas) aún sin resumen
+    actualizar_resumenes(contratos_qs.filter(resumen__isnull=True))
+    return conteos
+
+def recalcular_moras_diario(forzar=False, solo_activos=False):
+    """
+    Punto de entrada para el proceso nocturno (cron / tareas programadas).
+    Recalcula la mora de toda la cartera una vez al día.
+    """
+    contratos = Contrato.objects.all()
+    if solo_activos:
+        contratos = contratos.filter(estado='ACTIVO')
+    if forzar:
+        return actualizar_moras_masivo(contratos)
+    return actualizar_moras_pendientes(contratos)
 
 def actualizar_moras_contrato(contrato_id):
     """
     Versión corregida: Marca VENCIDO inmediatamente si pasa la fecha,
-    y aplica mora según los días de atraso configurados en Django Admin.
-    Usa Cuota.objects.filter() para evitar caché del ORM.
+    y aplica mora según el porcentaje configurado en Django Admin.
+    Delegada al motor masivo para que cueste un número fijo de queries
+    sin importar cuántas cuotas tenga el contrato.
     """
-    contrato = Contrato.objects.get(id=contrato_id)
-    hoy = date.today()
-    
-    # Intentamos leer configuración, si no existe, usamos valores por defecto
-    config = ConfiguracionSistema.objects.first()
-    
-    # Valores por defecto si el admin olvidó configurar
-    porcentaje_mora = config.mora_porcentaje if config else Decimal('3.00')
+    # Validar que el contrato exista (mismo comportamiento que antes)
+    Contrato.objects.only('id').get(id=contrato_id)
+    return actualizar_moras_masivo(Contrato.objects.filter(id=contrato_id))
+
+# ==========================================
+# 2.1 RESUMEN DE SALDOS POR CONTRATO
+# ==========================================
+CAMPOS_RESUMEN = [
+    'saldo_capital', 'saldo_mora', 'saldo_pendiente', 'total_pagado',
+    'cuotas_vencidas', 'proxima_fecha_vencimiento', 'actualizado_en',
+]
 
-    # IMPORTANTE: Usar Cuota.objects.filter para evitar caché del ORM
-    cuotas_no_pagadas = Cuota.objects.filter(
-        contrato_id=contrato_id,
-        estado__in=['PENDIENTE', 'PARCIAL', 'VENCIDO']
+def actualizar_resumenes(contratos_qs):
+    """
+    Recalcula ResumenContrato de los contratos dados con una sola consulta agrupada
+    y un solo upsert, sin traer las cuotas a Python. Retorna cuántos se escribieron.
+    """
+    cero = Value(Decimal('0.00'))
+    monto = DecimalField(max_digits=12, decimal_places=2)
+    filas = (
+        Contrato.objects.filter(pk__in=contratos_qs.values('pk'))
+        .order_by()
+        .values('pk')
+        .annotate(
+            pendiente=Coalesce(
+                Sum(F('cuotas__valor_capital') + F('cuotas__valor_mora') - F('cuotas__valor_pagado')),
+                cero, output_field=monto
+            ),
+            # El pago se imputa primero a capital
+            capital=Coalesce(
+                Sum(Greatest(F('cuotas__valor_capital') - F('cuotas__valor_pagado'), cero)),
+                cero, output_field=monto
+            ),
+            pagado=Coalesce(Sum('cuotas__valor_pagado'), cero, output_field=monto),
+            vencidas=Count('cuotas', filter=Q(cuotas__estado='VENCIDO')),
+            proxima=Min('cuotas__fecha_vencimiento', filter=Q(cuotas__estado__in=['PENDIENTE', 'PARCIAL'])),
+        )
     )
+    resumenes = [
+        ResumenContrato(
+            contrato_id=fila['pk'],
+            saldo_capital=a_centavos(fila['capital']),
+            saldo_mora=a_centavos(fila['pendiente']) - a_centavos(fila['capital']),
+            saldo_pendiente=a_centavos(fila['pendiente']),
+            total_pagado=a_centavos(fila['pagado']),
+            cuotas_vencidas=fila['vencidas'],
+            proxima_fecha_vencimiento=fila['proxima'],
+        )
+        for fila in filas
+    ]
+    if resumenes:
+        ResumenContrato.objects.bulk_create(
+            resumenes, batch_size=500,
+            update_conflicts=True, unique_fields=['contrato'], update_fields=CAMPOS_RESUMEN
+        )
+    return len(resumenes)
 
-    for cuota in cuotas_no_pagadas:
-        # Si la fecha de vencimiento es MENOR a hoy, YA VENCIÓ.
-        if cuota.fecha_vencimiento < hoy:
-            
-            mora_calcular = Decimal('0.00')
-
-            # Respetar exención manual de mora
-            if cuota.mora_exenta:
-                # Si está exenta, NO se cobra mora
-                cuota.estado = 'PENDIENTE' if cuota.saldo_pendiente > 0 else 'PAGADO'
-                cuota.valor_mora = Decimal('0.00')
-                cuota.save()
-                continue
-            
-            # Calcular Mora Única (Porcentual)
-            mora_calcular = (cuota.valor_capital * porcentaje_mora) / Decimal('100.00')
-            mora_calcular = mora_calcular.quantize(Decimal('0.01'), rounding='ROUND_HALF_UP')
-            
-            # Asegurar mínimo de $0.01 si el porcentaje dio 0 por ser cuota muy pequeña
-            if mora_calcular < Decimal('0.01') and porcentaje_mora > 0:
-                mora_calcular = Decimal('0.01')
+def obtener_resumen(contrato_id):
+    """ResumenContrato del contrato; lo construye si todavía no existe."""
+    resumen = ResumenContrato.objects.filter(contrato_id=contrato_id).first()
+    if resumen is None:
+        actualizar_resumenes(Contrato.objects.filter(id=contrato_id))
+        resumen = ResumenContrato.objects.get(contrato_id=contrato_id)
+    return resumen
+
+def verificar_resumenes(contratos_qs=None):
+    """
+    Compara ResumenContrato contra la suma directa de las cuotas (en Python, como lo
+    hacían las vistas). Retorna la lista de diferencias (vacía si todo cuadra).
+    """
+    if contratos_qs is None:
+        contratos_qs = Contrato.objects.all()
+
+    esperados = {
+        contrato_id: {
+            'saldo_capital': Decimal('0.00'), 'saldo_pendiente': Decimal('0.00'),
+            'total_pagado': Decimal('0.00'), 'cuotas_vencidas': 0, 'proxima_fecha_vencimiento': None,
+        }
+        for contrato_id in contratos_qs.values_list('id', flat=True)
+    }
+    for contrato_id, capital, mora, pagado, estado, vencimiento in (
+        Cuota.objects.filter(contrato_id__in=list(esperados))
+        .values_list('contrato_id', 'valor_capital', 'valor_mora', 'valor_pagado', 'estado', 'fecha_vencimiento')
+    ):
+        esperado = esperados[contrato_id]
+        esperado['saldo_capital'] += max(capital - pagado, Decimal('0.00'))
+        esperado['saldo_pendiente'] += capital + mora - pagado
+        esperado['total_pagado'] += pagado
+        if estado == 'VENCIDO':
+            esperado['cuotas_vencidas'] += 1
+        if estado in ('PENDIENTE', 'PARCIAL'):
+            proxima = esperado['proxima_fecha_vencimiento']
+            if proxima is None or vencimiento < proxima:
+                esperado['proxima_fecha_vencimiento'] = vencimiento
+
+    guardados = ResumenContrato.objects.in_bulk(list(esperados))
+    diferencias = []
+    for contrato_id, esperado in esperados.items():
+        esperado['saldo_mora'] = esperado['saldo_pendiente'] - esperado['saldo_capital']
+        resumen = guardados.get(contrato_id)
+        if resumen is None:
+            diferencias.append(f"Contrato #{contrato_id}: sin resumen")
+            continue
+        for campo, valor in esperado.items():
+            if getattr(resumen, campo) != valor:
+                diferencias.append(
+                    f"Contrato #{contrato_id} {campo}: esperado {valor}, guardado {getattr(resumen, campo)}"
+                )
+    return diferencias
+
+# ==========================================
+# 2.2 AGREGADOS PARA REPORTES
+# ==========================================
+def _entradas_supuestas(pagos):
+    """
+    Entrada: los pagos marcados es_entrada. Si el contrato tiene valor de entrada pero
+    ningún pago marcado, se toma su primer pago como la entrada (datos antiguos).
+    'pagos' debe traer todos los pagos de cada contrato; retorna los ids de esos primeros pagos.
+    """
+    return [
+        fila['primero']
+        for fila in (
+            pagos.filter(contrato__valor_entrada__gt=0)
+            .order_by()
+            .values('contrato_id')
+            .annotate(primero=Min('id'), marcadas=Count('id', filter=Q(es_entrada=True)))
+        )
+        if fila['marcadas'] == 0
+    ]
 
-            # Actualizar estado y mora - VENCIDO tiene prioridad sobre PARCIAL
-            cuota.estado = 'VENCIDO'
-            cuota.valor_mora = mora_calcular
-            cuota.save()
+def pagos_mensuales_por_contrato(contratos_qs):
+    """
+    Flujo de caja de cuotas por contrato y mes (según fecha_pago), sin la entrada.
+    Los pagos con DetallePago suman lo aplicado a cuotas; los pagos antiguos sin
+    detalles suman su monto completo. Son tres consultas agrupadas sin importar
+    cuántos contratos o pagos haya.
 
-    # Actualizar bandera global del contrato
-    tiene_mora = Cuota.objects.filter(contrato_id=contrato_id, estado='VENCIDO').exists()
-    if contrato.esta_en_mora != tiene_mora:
-        contrato.esta_en_mora = tiene_mora
-        contrato.save()
+    Retorna {contrato_id: {date(año, mes, 1): monto}}.
+    """
+    monto = DecimalField(max_digits=14, decimal_places=2)
+    pagos = Pago.objects.filter(contrato__in=contratos_qs.values('pk'))
+    pagos_cuotas = pagos.exclude(es_entrada=True).exclude(id__in=_entradas_supuestas(pagos))
+
+    flujo = {}
+    con_detalles = (
+        DetallePago.objects.filter(pago__in=pagos_cuotas)
+        .order_by()
+        .values('pago__contrato_id', mes=TruncMonth('pago__fecha_pago'))
+        .annotate(total=Sum('monto_aplicado', output_field=monto))
+        .values_list('pago__contrato_id', 'mes', 'total')
+    )
+    sin_detalles = (
+        pagos_cuotas.filter(~Exists(DetallePago.objects.filter(pago=OuterRef('pk'))))
+        .order_by()
+        .values('contrato_id', mes=TruncMonth('fecha_pago'))
+        .annotate(total=Sum('monto', output_field=monto))
+        .values_list('contrato_id', 'mes', 'total')
+    )
+    for consulta in (con_detalles, sin_detalles):
+        for contrato_id, mes, total in consulta:
+            total = a_centavos(total)
+            meses_contrato = flujo.setdefault(contrato_id, {})
+            meses_contrato[mes] = meses_contrato.get(mes, Decimal('0.00')) + total
+    return flujo
+
+def invalidar_cierres_desde(fecha):
+    """
+    Elimina los cierres mensuales (CierreMensual) desde el mes de 'fecha' en adelante:
+    los cobros de ese mes y lo pagado al cierre de los meses siguientes ya no son válidos.
+    Se regeneran en la próxima consulta. Fechas del mes en curso no tocan la BD.
+    """
+    if fecha is None:
+        return 0
+    if (fecha.year, fecha.month) >= (date.today().year, date.today().month):
+        return 0  # Solo existen cierres de meses pasados
+    borrados, _ = CierreMensual.objects.filter(
+        Q(anio__gt=fecha.year) | Q(anio=fecha.year, mes__gte=fecha.month)
+    ).delete()
+    return borrados
+
+# ==========================================
+# 2.3 RESUMEN DIARIO (KPIs del dashboard y del gestor)
+# ==========================================
+CAMPOS_RESUMEN_DIARIO = [
+    'pagos_recibidos', 'ingresos_lotes', 'entradas', 'abonos_cuotas', 'ingresos_caja', 'gastos', 'mora_generada',
+]
+
+@transaction.atomic
+def actualizar_resumen_diario(dias=None):
+    """
+    Recalcula ResumenDiario de los días dados (todas las filas de cada día, de todos
+    los vendedores) con consultas agrupadas por (día, vendedor). Con dias=None
+    reconstruye la tabla completa. Sin días no toca la BD. Retorna las filas escritas.
+    """
+    from Aplicaciones.sbr_gestor.models import Transaccion
+
+    if dias is not None:
+        # Pueden venir como 'YYYY-MM-DD' (instancias recién asignadas desde un formulario)
+        dias = {DateField().to_python(dia) for dia in dias if dia}
+        if not dias:
+            return 0
+    en_dias = lambda campo: Q(**{f'{campo}__in': dias}) if dias is not None else Q()
+    monto = DecimalField(max_digits=14, decimal_places=2)
+    suma = lambda campo, filtro=None: Coalesce(Sum(campo, filter=filtro), Value(Decimal('0')), output_field=monto)
+    devolucion = Q(contrato__estado='DEVOLUCION')
+
+    filas = {}
+    def acumular(dia, vendedor_id, **valores):
+        fila = filas.setdefault((dia, vendedor_id), dict.fromkeys(CAMPOS_RESUMEN_DIARIO, Decimal('0.00')))
+        for campo, valor in valores.items():
+            fila[campo] += a_centavos(valor)
+
+    # Pagos del día: todo lo recibido, el cash-flow sin devoluciones y los abonos a cuotas
+    pagos = Pago.objects.filter(en_dias('fecha_pago'))
+    entrada = Q(es_entrada=True) | Q(id__in=_entradas_supuestas(
+        Pago.objects.filter(contrato__in=pagos.values('contrato_id'))
+    ))
+    for fila in (
+        pagos.order_by()
+        .values('fecha_pago', vendedor=F('contrato__cliente__vendedor_id'))
+        .annotate(
+            recibido=suma('monto'),
+            ingresos=suma('monto', ~devolucion),
+            abonos=suma('monto', ~entrada & ~devolucion),
+            abonos_devueltos=suma('monto', ~entrada & devolucion),
+        )
+    ):
+        acumular(
+            fila['fecha_pago'], fila['vendedor'], pagos_recibidos=fila['recibido'],
+            ingresos_lotes=fila['ingresos'], abonos_cuotas=fila['abonos'] - fila['abonos_devueltos'],
+        )
+
+    # Entradas según el contrato (aunque no tengan un pago registrado), el día de la firma
+    for fila in (
+        Contrato.objects.filter(en_dias('fecha_contrato'), valor_entrada__gt=0)
+        .order_by()
+        .values('fecha_contrato', vendedor=F('cliente__vendedor_id'))
+        .annotate(
+            entradas=suma('valor_entrada', ~Q(estado='DEVOLUCION')),
+            devueltas=suma('valor_entrada', Q(estado='DEVOLUCION')),
+        )
+    ):
+        acumular(fila['fecha_contrato'], fila['vendedor'], entradas=fila['entradas'] - fila['devueltas'])
+
+    # Caja del gestor
+    for fila in (
+        Transaccion.objects.filter(en_dias('fecha'))
+        .order_by()
+        .values('fecha', vendedor=F('registrado_por_id'))
+        .annotate(ingresos=suma('valor', Q(tipo='INGRESO')), gastos=suma('valor', Q(tipo='GASTO')))
+    ):
+        acumular(fila['fecha'], fila['vendedor'], ingresos_caja=fila['ingresos'], gastos=fila['gastos'])
+
+    # Mora de las cuotas que vencen ese día
+    for fila in (
+        Cuota.objects.filter(en_dias('fecha_vencimiento'), valor_mora__gt=0)
+        .order_by()
+        .values('fecha_vencimiento', vendedor=F('contrato__cliente__vendedor_id'))
+        .annotate(mora=suma('valor_mora'))
+    ):
+        acumular(fila['fecha_vencimiento'], fila['vendedor'], mora_generada=fila['mora'])
+
+    ResumenDiario.objects.filter(en_dias('fecha')).delete()
+    ResumenDiario.objects.bulk_create([
+        ResumenDiario(fecha=dia, vendedor_id=vendedor_id, **valores)
+        for (dia, vendedor_id), valores in filas.items()
+        if any(valores.values())
+    ], batch_size=500)
+    return len(filas)
+
+def dias_de_contratos(contratos_qs):
+    """Días del ResumenDiario que dependen de estos contratos (firma, pagos y cuotas con mora)."""
+    dias = set(contratos_qs.values_list('fecha_contrato', flat=True))
+    dias.update(Pago.objects.filter(contrato__in=contratos_qs.values('pk')).values_list('fecha_pago', flat=True).distinct())
+    dias.update(
+        Cuota.objects.filter(contrato__in=contratos_qs.values('pk'), valor_mora__gt=0)
+        .values_list('fecha_vencimiento', flat=True).distinct()
+    )
+    return dias
+
+def verificar_resumen_diario():
+    """
+    Compara los totales de ResumenDiario contra la suma directa (en Python) de pagos,
+    contratos, transacciones y cuotas. Retorna la lista de diferencias (vacía si cuadra).
+    """
+    from Aplicaciones.sbr_gestor.models import Transaccion
+
+    esperados = dict.fromkeys(CAMPOS_RESUMEN_DIARIO, Decimal('0.00'))
+    supuestas = set(_entradas_supuestas(Pago.objects.all()))
+    for pago_id, monto, es_entrada, estado in Pago.objects.values_list('id', 'monto', 'es_entrada', 'contrato__estado'):
+        signo = -1 if estado == 'DEVOLUCION' else 1
+        esperados['pagos_recibidos'] += monto
+        if signo > 0:
+            esperados['ingresos_lotes'] += monto
+        if not es_entrada and pago_id not in supuestas:
+            esperados['abonos_cuotas'] += monto * signo
+    for entrada, estado in Contrato.objects.values_list('valor_entrada', 'estado'):
+        esperados['entradas'] += entrada * (-1 if estado == 'DEVOLUCION' else 1)
+    for valor, tipo in Transaccion.objects.values_list('valor', 'tipo'):
+        esperados['ingresos_caja' if tipo == 'INGRESO' else 'gastos'] += valor
+    for mora in Cuota.objects.values_list('valor_mora', flat=True):
+        esperados['mora_generada'] += mora
+
+    guardados = totales_resumen_diario()
+    return [
+        f"ResumenDiario {campo}: esperado {valor}, guardado {guardados[campo]}"
+        for campo, valor in esperados.items()
+        if guardados[campo] != valor
+    ]
+
+def _filas_resumen_diario(desde=None, hasta=None, vendedor=None):
+    filas = ResumenDiario.objects.all()
+    if desde:
+        filas = filas.filter(fecha__gte=desde)
+    if hasta:
+        filas = filas.filter(fecha__lte=hasta)
+    if vendedor is not None:
+        filas = filas.filter(vendedor=vendedor)
+    return filas
+
+def _sumas_resumen_diario():
+    monto = DecimalField(max_digits=14, decimal_places=2)
+    return {
+        campo: Coalesce(Sum(campo), Value(Decimal('0')), output_field=monto) for campo in CAMPOS_RESUMEN_DIARIO
+    }
+
+def _centavos_resumen(fila):
+    return {campo: a_centavos(fila[campo]) for campo in CAMPOS_RESUMEN_DIARIO}
+
+def totales_resumen_diario(desde=None, hasta=None, vendedor=None):
+    """
+    Suma de ResumenDiario en el rango (ambos extremos opcionales e inclusivos), de un
+    vendedor o de todos. Una consulta; cuesta O(días del rango).
+    """
+    return _centavos_resumen(_filas_resumen_diario(desde, hasta, vendedor).aggregate(**_sumas_resumen_diario()))
+
+def serie_resumen_diario(desde=None, hasta=None, vendedor=None):
+    """Igual que totales_resumen_diario pero día por día: [{'fecha', campo: monto, ...}, ...]."""
+    return [
+        {'fecha': fila['fecha'], **_centavos_resumen(fila)}
+        for fila in (
+            _filas_resumen_diario(desde, hasta, vendedor)
+            .order_by('fecha').values('fecha').annotate(**_sumas_resumen_diario())
+        )
+    ]
 
 # ==========================================
 # 3. PROCESADOR DE PAGOS
 # ==========================================
+# La regla de distribución vive en asignacion.py (núcleo puro, sin BD).
+# Aquí solo se cargan las cuotas una vez y se persiste el plan en bloque.
+
+CAMPOS_PAGO_CUOTA = ['valor_pagado', 'fecha_ultimo_pago', 'estado']
+
+def _snapshots_contrato(contrato_id):
+    """Carga todas las cuotas del contrato en una sola query, como snapshots."""
+    return [
+        CuotaSnapshot.desde_cuota(c)
+        for c in Cuota.objects.filter(contrato_id=contrato_id).order_by('numero_cuota', 'id')
+    ]
+
+def _cuotas_desde_snapshots(snapshots, campos):
+    """Instancias mínimas de Cuota (pk + campos) listas para bulk_update."""
+    return [Cuota(id=s.id, **{campo: getattr(s, campo) for campo in campos}) for s in snapshots]
+
+def guardar_plan_pago(pago, plan, campos=CAMPOS_PAGO_CUOTA):
+    """Persiste un PlanPago: un bulk_update de cuotas y un bulk_create de detalles."""
+    if plan.cuotas:
+        Cuota.objects.bulk_update(_cuotas_desde_snapshots(plan.cuotas, campos), campos, batch_size=500)
+    DetallePago.objects.bulk_create([
+        DetallePago(pago=pago, cuota_id=cuota_id, monto_aplicado=monto)
+        for cuota_id, monto in plan.asignaciones
+    ], batch_size=500)
+
 @transaction.atomic
 def registrar_pago_cliente(contrato_id, monto, metodo_pago, evidencia_img, usuario_vendedor, fecha_pago=None, cuota_origen_id=None):
     contrato = Contrato.objects.get(id=contrato_id)
-    dinero_disponible = Decimal(monto)
     
     # 1. Validar y procesar FECHA
     if not fecha_pago:
@@ -243,15 +700,19 @@ def registrar_pago_cliente(contrato_id, monto, metodo_pago, evidencia_img, usuar
         else:
             fecha_real = fecha_pago
 
-    cuota_origen_obj = None
-    start_numero_cuota = 0
+    # 2. Cuotas del contrato (una sola query) y punto de partida.
+    # Si el usuario selecciona la cuota #5, y debe la #3, el sistema pagará la #5 y siguientes,
+    # IGNORANDO la #3. Esto es lo que el usuario pidió ("seleccionar qué cuota estoy pagando").
+    cuotas = _snapshots_contrato(contrato.id)
+    cuota_origen_snapshot = None
     if cuota_origen_id:
-        try:
-            cuota_origen_obj = contrato.cuotas.get(id=cuota_origen_id)
-            start_numero_cuota = cuota_origen_obj.numero_cuota
-        except Cuota.DoesNotExist:
-            pass # Fallback a comportamiento normal
-            
+        # Fallback a comportamiento normal si la cuota no es de este contrato
+        cuota_origen_snapshot = next((c for c in cuotas if str(c.id) == str(cuota_origen_id)), None)
+    start_numero_cuota = cuota_origen_snapshot.numero_cuota if cuota_origen_snapshot else 0
+
+    # 3. Plan de asignación en memoria (FIFO + excedente)
+    plan = asignar_pago(cuotas, monto, fecha_real, start_numero_cuota)
+
     # Calcular nuevo número de transacción
     from django.db.models import Max
     last_pago = Pago.objects.filter(contrato=contrato).aggregate(Max('numero_transaccion'))
@@ -265,268 +726,189 @@ def registrar_pago_cliente(contrato_id, monto, metodo_pago, evidencia_img, usuar
         metodo_pago=metodo_pago,
         comprobante_imagen=evidencia_img,
         registrado_por=usuario_vendedor,
-        cuota_origen=cuota_origen_obj
+        cuota_origen_id=cuota_origen_snapshot.id if cuota_origen_snapshot else None,
+        # Si sobra dinero (ya no hay cuotas generadas o se pagó TODO el contrato), queda a favor.
+        saldo_a_favor=max(plan.sobrante, Decimal('0.00')),
     )
 
-    # 2. Definir lista de cuotas a afectar
-    # Lógica: Si elige una cuota específica, comenzamos desde esa en adelante.
-            
-    # Obtenemos las pendientes desde el punto de partida (o todas si no hay punto partida)
-    # Nota: Permitimos pagar 'VENCIDO', 'PENDIENTE', 'PARCIAL'.
-    # Si el usuario selecciona la cuota #5, y debe la #3, el sistema pagará la #5 y siguientes,
-    # IGNORANDO la #3. Esto es lo que el usuario pidió ("seleccionar qué cuota estoy pagando").
-    # Si no selecciona nada, el comportamiento por defecto es pagar las más antiguas primero.
+    # 4. Persistir el plan en bloque
+    guardar_plan_pago(nuevo_pago, plan)
     
-    qs = contrato.cuotas.filter(
-        estado__in=['PENDIENTE', 'PARCIAL', 'VENCIDO']
+    actualizar_moras_contrato(contrato.id)
+    return nuevo_pago
+
+CAMPOS_RECALCULO_CUOTA = list(CuotaSnapshot.CAMPOS_MUTABLES)
+
+def _reproducir_contrato(contrato_id):
+    """
+    Reproduce en memoria TODOS los pagos (sin la entrada) del contrato desde cero.
+    Solo lee de la BD; retorna (cuotas, pagos, originales, asignaciones, saldos_a_favor),
+    donde 'cuotas' son los snapshots con el estado final reproducido.
+    """
+    porcentaje_mora = obtener_porcentaje_mora()
+    cuotas_bd = _snapshots_contrato(contrato_id)
+    pagos = list(
+        Pago.objects.filter(contrato_id=contrato_id, es_entrada=False)
+        .select_related('cuota_origen')
+        .order_by('fecha_pago', 'id')
     )
-    
-    if start_numero_cuota > 0:
-        qs = qs.filter(numero_cuota__gte=start_numero_cuota)
-        
-    cuotas_pendientes = qs.order_by('numero_cuota')
 
-    # ... (inside registrar_pago_cliente)
-    
-    # IMPORTACION CORRECTA DENTRO DE LA FUNCIÓN PARA EVITAR CIRCULAR IMPORT
-    from .models import DetallePago
-    
-    # Procesar cuotas pendientes de la lista inicial
-    for cuota in cuotas_pendientes:
-        if dinero_disponible <= 0: break
-
-        total_deuda_cuota = cuota.total_a_pagar
-        falta_por_pagar = total_deuda_cuota - cuota.valor_pagado
-
-        # Tolerance: treat amounts under $0.01 as zero
-        if falta_por_pagar < Decimal('0.01'):
-            cuota.estado = 'PAGADO'
-            cuota.fecha_ultimo_pago = fecha_real
-            cuota.save()
-            continue
+    # Valores actuales en BD (para escribir solo lo que cambia)
+    originales = {c.id: c.valores() for c in cuotas_bd}
 
-        monto_aplicado_a_esta_cuota = Decimal('0.00')
+    # 1-3. Cuotas en cero y re-aplicar cada pago en orden cronológico (FIFO o basado en origen)
+    cuotas, planes = reaplicar_pagos(cuotas_bd, [
+        (pago.id, pago.monto, pago.fecha_pago, pago.cuota_origen.numero_cuota if pago.cuota_origen else 1)
+        for pago in pagos
+    ], porcentaje_mora)
 
-        if dinero_disponible >= falta_por_pagar:
-            # Cubre toda la cuota
-            monto_aplicado_a_esta_cuota = falta_por_pagar
-            cuota.valor_pagado += falta_por_pagar
-            cuota.estado = 'PAGADO'
-            cuota.fecha_ultimo_pago = fecha_real
-            dinero_disponible -= falta_por_pagar
-        else:
-            # Pago parcial
-            monto_aplicado_a_esta_cuota = dinero_disponible
-            cuota.valor_pagado += dinero_disponible
-            
-            # Recálculo estado
-            new_remaining = falta_por_pagar - monto_aplicado_a_esta_cuota
-            if new_remaining < Decimal('0.01'):
-                cuota.estado = 'PAGADO'
-            else:
-                cuota.estado = 'PARCIAL'
-            
-            cuota.fecha_ultimo_pago = fecha_real 
-            dinero_disponible = Decimal('0') 
-        
-        cuota.save()
-
-        # Registrar detalle del pago
-        if monto_aplicado_a_esta_cuota > 0:
-            DetallePago.objects.create(
-                pago=nuevo_pago,
-                cuota=cuota,
-                monto_aplicado=monto_aplicado_a_esta_cuota
-            )
-
-    # Lógica de Excedente (Surplus) para cuotas futuras
-    # Si sobra dinero y NO se seleccionó una cuota específica de inicio (para evitar saltos raros),
-    # aplicamos el sobrante a las siguientes cuotas PENDIENTES que no estaban en la lista original (ej. futuras)
-    if dinero_disponible > 0:
-        # Buscar futuras cuotas que no estaban en el query inicial o que se generaron después
-        ultima_cuota_procesada = cuotas_pendientes.last()
-        numero_inicio = (ultima_cuota_procesada.numero_cuota + 1) if ultima_cuota_procesada else 1
-        
-        # Obtenemos las siguientes cuotas cronológicamente
-        otras_cuotas = contrato.cuotas.filter(
-            numero_cuota__gte=numero_inicio
-        ).order_by('numero_cuota')
-
-        for cuota_futura in otras_cuotas:
-             if dinero_disponible <= 0: break
-             
-             total_deuda = cuota_futura.total_a_pagar
-             falta = total_deuda - cuota_futura.valor_pagado
-             
-             # Si la cuota ya está pagada (poco probable pero posible), saltar
-             if falta < Decimal('0.01'): continue
-
-             monto_aplicado = Decimal('0.00')
-
-             if dinero_disponible >= falta:
-                 monto_aplicado = falta
-                 cuota_futura.valor_pagado += falta
-                 cuota_futura.estado = 'PAGADO'
-                 cuota_futura.fecha_ultimo_pago = fecha_real
-                 dinero_disponible -= falta
-             else:
-                 monto_aplicado = dinero_disponible
-                 cuota_futura.valor_pagado += dinero_disponible
-                 # Si cubrió una parte, es PARCIAL
-                 # Si cubrió todo (caso raro float), es PAGADO
-                 remaining = falta - monto_aplicado
-                 if remaining < Decimal('0.01'):
-                     cuota_futura.estado = 'PAGADO'
-                 else:
-                     cuota_futura.estado = 'PARCIAL'
-                     
-                 cuota_futura.fecha_ultimo_pago = fecha_real
-                 dinero_disponible = Decimal('0')
-             
-             cuota_futura.save()
-             
-             if monto_aplicado > 0:
-                DetallePago.objects.create(
-                    pago=nuevo_pago,
-                    cuota=cuota_futura,
-                    monto_aplicado=monto_aplicado
-                )
+    asignaciones = {pago.id: planes[pago.id].asignaciones for pago in pagos}
+    saldos_a_favor = {pago.id: max(planes[pago.id].sobrante, Decimal('0.00')) for pago in pagos}
 
-    # Si AÚN sobra dinero (ya no hay cuotas generadas o se pagó TODO el contrato), queda a favor.
-    if dinero_disponible > 0:
-        texto_saldo = f" | Saldo a favor remanente: ${dinero_disponible:.2f}"
-        if nuevo_pago.observacion:
-            nuevo_pago.observacion += texto_saldo
-        else:
-            nuevo_pago.observacion = texto_saldo.strip(" | ")
-        nuevo_pago.save()
-    
-    actualizar_moras_contrato(contrato.id)
-    return nuevo_pago
+    # 4-5. Estados y moras finales
+    cerrar_estados(cuotas, date.today(), porcentaje_mora)
+
+    return cuotas, pagos, originales, asignaciones, saldos_a_favor
+
+def _detalles_guardados(contrato_id):
+    guardados = {}
+    for pago_id, cuota_id, monto in (
+        DetallePago.objects.filter(pago__contrato_id=contrato_id)
+        .order_by('id')
+        .values_list('pago_id', 'cuota_id', 'monto_aplicado')
+    ):
+        guardados.setdefault(pago_id, []).append((cuota_id, monto))
+    return guardados
+
+def _estado_guardado(contrato_id):
+    """Estado del recálculo en BD: ({cuota_id: snapshot}, {pago_id: detalles}, {pago_id: saldo a favor})."""
+    cuotas = {c.id: c for c in _snapshots_contrato(contrato_id)}
+    detalles = {pago_id: sorted(filas) for pago_id, filas in _detalles_guardados(contrato_id).items()}
+    saldos = dict(Pago.objects.filter(contrato_id=contrato_id, es_entrada=False).values_list('id', 'saldo_a_favor'))
+    return cuotas, detalles, saldos
+
+def _reescribir_desde_cero(contrato_id):
+    """
+    Recálculo completo sin atajos: borra todos los detalles, deja las cuotas y los saldos
+    a favor en cero y escribe la reproducción entera. Solo lo usa la verificación.
+    """
+    DetallePago.objects.filter(pago__contrato_id=contrato_id).delete()
+    Cuota.objects.filter(contrato_id=contrato_id).update(
+        valor_pagado=Decimal('0.00'), fecha_ultimo_pago=None, valor_mora=Decimal('0.00'), estado='PENDIENTE'
+    )
+    Pago.objects.filter(contrato_id=contrato_id, es_entrada=False).update(saldo_a_favor=Decimal('0.00'))
+
+    cuotas, pagos, _, asignaciones, saldos_a_favor = _reproducir_contrato(contrato_id)
+    DetallePago.objects.bulk_create([
+        DetallePago(pago_id=pago.id, cuota_id=cuota_id, monto_aplicado=monto)
+        for pago in pagos
+        for cuota_id, monto in asignaciones[pago.id]
+    ], batch_size=500)
+    for pago in pagos:
+        pago.saldo_a_favor = saldos_a_favor[pago.id]
+    Pago.objects.bulk_update(pagos, ['saldo_a_favor'], batch_size=500)
+    Cuota.objects.bulk_update(
+        _cuotas_desde_snapshots(cuotas, CAMPOS_RECALCULO_CUOTA), CAMPOS_RECALCULO_CUOTA, batch_size=500
+    )
+    actualizar_moras_masivo(Contrato.objects.filter(id=contrato_id))
+
+def _diferencias_recalculo(contrato_id):
+    """
+    Compara lo que dejó el recálculo incremental contra un recálculo completo hecho en
+    un savepoint (que se deshace: la BD queda con el resultado incremental).
+    """
+    cuotas, detalles, saldos = _estado_guardado(contrato_id)
+    punto = transaction.savepoint()
+    try:
+        _reescribir_desde_cero(contrato_id)
+        cuotas_completo, detalles_completo, saldos_completo = _estado_guardado(contrato_id)
+    finally:
+        transaction.savepoint_rollback(punto)
+
+    diferencias = []
+    for cuota_id, esperada in cuotas_completo.items():
+        guardada = cuotas.get(cuota_id)
+        for campo in CAMPOS_RECALCULO_CUOTA:
+            esperado, actual = getattr(esperada, campo), getattr(guardada, campo, None)
+            if esperado != actual:
+                diferencias.append(f"Cuota #{esperada.numero_cuota} {campo}: recálculo completo {esperado}, incremental {actual}")
+    for pago_id in sorted(set(detalles) | set(detalles_completo)):
+        if detalles.get(pago_id, []) != detalles_completo.get(pago_id, []):
+            diferencias.append(f"Pago #{pago_id}: detalles distintos al recálculo completo")
+    for pago_id, saldo in saldos_completo.items():
+        if saldos.get(pago_id) != saldo:
+            diferencias.append(f"Pago #{pago_id}: saldo a favor {saldos.get(pago_id)}, recálculo completo {saldo}")
+    return diferencias
 
 @transaction.atomic
-def recalcular_deuda_contrato(contrato_id):
+def recalcular_deuda_contrato(contrato_id, verificar=False):
     """
     Restaura valor_pagado en 0 y vuelve a aplicar TODOS los pagos existentes 
     en orden cronológico. Crucial para cuando se edita o elimina un pago intermedio.
     NOTA: NO modifica mora_exenta (eso es control manual del admin).
+
+    La reproducción sigue siendo completa (todos los pagos desde cero), pero en memoria
+    sobre las cuotas precargadas, sin consultas por pago. Lo incremental son las
+    escrituras: se busca el primer pago cuya distribución guardada (DetallePago) difiere
+    de la reproducida; los detalles anteriores no se tocan y desde ese punto se reescribe
+    con un solo bulk_create de DetallePago y un solo bulk_update de las cuotas que cambian.
+
+    Con verificar=True, además, hace un recálculo completo independiente (borra todos
+    los detalles y pone las cuotas en cero) dentro de un savepoint que se deshace, y
+    retorna las diferencias contra el resultado incremental (vacía si son idénticos).
     """
-    contrato = Contrato.objects.get(id=contrato_id)
-    
-    # 1. Resetear valor_pagado y mora de TODAS las cuotas
-    contrato.cuotas.all().update(valor_pagado=0, fecha_ultimo_pago=None, valor_mora=0, estado='PENDIENTE')
-        
-    # Destruir registros de detalles de pago (ya que se regenerarán)
-    from .models import DetallePago
-    DetallePago.objects.filter(pago__contrato_id=contrato_id).delete()
+    Contrato.objects.only('id').get(id=contrato_id)
+    cuotas, pagos, originales, asignaciones, saldos_a_favor = _reproducir_contrato(contrato_id)
 
-    # 2. Obtener todos los pagos en orden cronológico, EXCLUYENDO LA ENTRADA
-    pagos = contrato.pago_set.filter(es_entrada=False).order_by('fecha_pago', 'id')
-    
-    # 3. Re-aplicar lógica de pago para cada uno (FIFO o basado en origen)
-    for pago in pagos:
-        dinero_disponible = pago.monto
-        fecha_pago = pago.fecha_pago
-        
-        # Limpiar saldo a favor viejo si existe, ya que lo recalcularemos
-        if pago.observacion and " | Saldo a favor remanente:" in pago.observacion:
-            pago.observacion = pago.observacion.split(" | Saldo a favor remanente:")[0]
-            pago.save(update_fields=['observacion'])
-        
-        # Punto de inicio para distribuir el pago
-        start_num = pago.cuota_origen.numero_cuota if pago.cuota_origen else 1
-        cuotas_afectadas = contrato.cuotas.filter(numero_cuota__gte=start_num).order_by('numero_cuota')
-        
-        # --- VIAJE EN EL TIEMPO: Aplicar moras vigentes HASTA la fecha de este pago ---
-        config = ConfiguracionSistema.objects.first()
-        porcentaje_mora = config.mora_porcentaje if config else Decimal('3.00')
-        
-        for cuota in cuotas_afectadas:
-             # Si en la fecha que se hizo este pago, esta cuota ya estaba vencida:
-             if cuota.fecha_vencimiento < fecha_pago:
-                  if not cuota.mora_exenta:
-                       # Calcular Mora Única (Porcentual)
-                       mora_calcular = (cuota.valor_capital * porcentaje_mora) / Decimal('100.00')
-                       mora_calcular = mora_calcular.quantize(Decimal('0.01'), rounding='ROUND_HALF_UP')
-                       if mora_calcular < Decimal('0.01') and porcentaje_mora > 0:
-                            mora_calcular = Decimal('0.01')
-                       
-                       # Solo aplicar si la cuota no estaba ya pagada en su totalidad en ese viaje en el tiempo
-                       saldo = cuota.valor_capital - cuota.valor_pagado
-                       if saldo > Decimal('0.01'):
-                            cuota.valor_mora = mora_calcular
-                            cuota.estado = 'VENCIDO'
-                            cuota.save(update_fields=['valor_mora', 'estado'])
-        # -----------------------------------------------------------------------------
-        
-        # Refrescar cuotas desde la BD para tener datos actualizados
-        for cuota in cuotas_afectadas:
-            if dinero_disponible <= 0: 
-                break
+    # Primer pago afectado: el primero cuya distribución o saldo a favor guardado no coincide
+    guardados = _detalles_guardados(contrato_id)
+    inicio = len(pagos)
+    for i, pago in enumerate(pagos):
+        coincide = (
+            sorted(guardados.get(pago.id, [])) == sorted(asignaciones[pago.id])
+            and pago.saldo_a_favor == saldos_a_favor[pago.id]
+        )
+        if not coincide:
+            inicio = i
+            break
+    pagos_sin_cambios = {p.id for p in pagos[:inicio]}
 
-            # Refrescar el objeto desde la BD
-            cuota.refresh_from_db()
-            
-            total_deuda_cuota = cuota.total_a_pagar
-            falta_por_pagar = total_deuda_cuota - cuota.valor_pagado
-
-            if falta_por_pagar < Decimal('0.01'):
-                continue  # Ya está pagada
-
-            monto_aplicado = Decimal('0.00')
-
-            if dinero_disponible >= falta_por_pagar:
-                monto_aplicado = falta_por_pagar
-                cuota.valor_pagado += falta_por_pagar
-                cuota.fecha_ultimo_pago = fecha_pago
-                dinero_disponible -= falta_por_pagar
-            else:
-                monto_aplicado = dinero_disponible
-                cuota.valor_pagado += dinero_disponible
-                cuota.fecha_ultimo_pago = fecha_pago
-                dinero_disponible = 0
-            
-            cuota.save(update_fields=['valor_pagado', 'fecha_ultimo_pago'])
-            
-            # Registrar detalle si aplicamos dinero
-            if monto_aplicado > 0:
-                DetallePago.objects.create(
-                    pago=pago,
-                    cuota=cuota,
-                    monto_aplicado=monto_aplicado
-                )
-                
-        # Si aún sobra dinero (ya no hay cuotas o pagó todo), documentar a favor
-        if dinero_disponible > 0:
-            texto_saldo = f" | Saldo a favor remanente: ${dinero_disponible:.2f}"
-            if pago.observacion:
-                pago.observacion += texto_saldo
-            else:
-                pago.observacion = texto_saldo.strip(" | ")
-            pago.save(update_fields=['observacion'])
-    
-    # 4. Recalcular estados de TODAS las cuotas basándose en pagos y fechas
-    hoy = date.today()
-    for cuota in contrato.cuotas.all():
-        cuota.refresh_from_db()  # Asegurar datos frescos
-        saldo = cuota.saldo_pendiente
-        
-        if saldo < Decimal('0.01'):
-            cuota.estado = 'PAGADO'
-        elif cuota.fecha_vencimiento < hoy and not cuota.mora_exenta:
-            # VENCIDO tiene prioridad sobre PARCIAL cuando está vencido
-            cuota.estado = 'VENCIDO'
-        elif cuota.valor_pagado > 0:
-            cuota.estado = 'PARCIAL'
-        elif cuota.fecha_vencimiento < hoy:
-            cuota.estado = 'VENCIDO'
-        else:
-            cuota.estado = 'PENDIENTE'
-        
-        cuota.save(update_fields=['estado'])
-            
-    # 5. Actualizar moras (respetando mora_exenta)
-    actualizar_moras_contrato(contrato.id)
+    # Destruir detalles desde el primer pago afectado (y los huérfanos, p.ej. de la entrada)
+    if set(guardados) - pagos_sin_cambios:
+        DetallePago.objects.filter(pago__contrato_id=contrato_id).exclude(pago_id__in=pagos_sin_cambios).delete()
+
+    DetallePago.objects.bulk_create([
+        DetallePago(pago_id=pago.id, cuota_id=cuota_id, monto_aplicado=monto)
+        for pago in pagos[inicio:]
+        for cuota_id, monto in asignaciones[pago.id]
+    ], batch_size=500)
+
+    pagos_modificados = []
+    for pago in pagos[inicio:]:
+        if pago.saldo_a_favor != saldos_a_favor[pago.id]:
+            pago.saldo_a_favor = saldos_a_favor[pago.id]
+            pagos_modificados.append(pago)
+    if pagos_modificados:
+        Pago.objects.bulk_update(pagos_modificados, ['saldo_a_favor'], batch_size=500)
+
+    cuotas_modificadas = [c for c in cuotas if c.valores() != originales[c.id]]
+    if cuotas_modificadas:
+        Cuota.objects.bulk_update(
+            _cuotas_desde_snapshots(cuotas_modificadas, CAMPOS_RECALCULO_CUOTA),
+            CAMPOS_RECALCULO_CUOTA, batch_size=500
+        )
+    # Mora generada por día (ResumenDiario) de las cuotas cuya mora cambió
+    indice_mora = CuotaSnapshot.CAMPOS_MUTABLES.index('valor_mora')
+    actualizar_resumen_diario(
+        c.fecha_vencimiento for c in cuotas_modificadas if c.valor_mora != originales[c.id][indice_mora]
+    )
+
+    # Bandera del contrato y marca de agua (las cuotas ya quedaron al día)
+    actualizar_moras_masivo(Contrato.objects.filter(id=contrato_id))
+
+    if verificar:
+        return _diferencias_recalculo(contrato_id)
+    return []
 
 # ==========================================
 # 4. GENERADOR DE PDF
@@ -538,50 +920,8 @@ def generar_pdf_contrato(contrato_id):
     # Obtener el pago de entrada (el primero registrado)
     pago_entrada = contrato.pago_set.order_by('id').first()
     
-    metodo_real = 'EFECTIVO'
-    datos_bancarios = None
-
-    if pago_entrada:
-        # Lógica para determinar el método real y detalles desde la observación
-        obs = pago_entrada.observacion or ""
-        
-        if 'TRANSFERENCIA' in obs:
-            metodo_real = 'TRANSFERENCIA BANCARIA'
-            # Intentar extraer banco y cuenta
-            # Formato esperado: "Pago de Entrada (TRANSFERENCIA). Banco: X. Cuenta/Comp: Y."
-            try:
-                # Buscamos los delimitadores exactos que usamos en views.py
-                if "Banco:" in obs and "Cuenta/Comp:" in obs:
-                    # Todo lo que está después de 'Banco:'
-                    resto_banco = obs.split("Banco:")[1]
-                    
-                    # Separamos por el delimitador que sigue al banco: ". Cuenta/Comp:"
-                    # Usamos partition para seguridad
-                    if ". Cuenta/Comp:" in resto_banco:
-                        parte_banco, _, parte_cuenta = resto_banco.partition(". Cuenta/Comp:")
-                        
-                        datos_bancarios = {
-                            'banco': parte_banco.strip(),
-                            'cuenta': parte_cuenta.rstrip(".").strip() # Quitamos el punto final
-                        }
-                    else:
-                        # Fallback por si acaso el formato varió ligeramente (ej. falta espacio)
-                        # Intento split simple por 'Cuenta/Comp:'
-                        parte_banco = resto_banco.split("Cuenta/Comp:")[0].strip().rstrip(".")
-                        parte_cuenta = resto_banco.split("Cuenta/Comp:")[1].strip().rstrip(".")
-                        datos_bancarios = {
-                            'banco': parte_banco,
-                            'cuenta': parte_cuenta
-                        }
-            except Exception as e:
-                # En caso de error, dejamos datos_bancarios en None para que salga el default
-                print(f"Error parsing bank details: {e}")
-                pass
-                
-        elif 'DEPOSITO' in obs:
-            metodo_real = 'DEPÓSITO'
-        elif pago_entrada.metodo_pago == 'EFECTIVO':
-            metodo_real = 'EFECTIVO'
+    metodo_real = metodo_real_pago(pago_entrada)
+    datos_bancarios = datos_bancarios_pago(pago_entrada)
 
     context = {
         'contrato': contrato,
@@ -595,18 +935,12 @@ def generar_pdf_contrato(contrato_id):
         'fecha_actual': date.today(),
     }
     
-    from weasyprint import HTML
-    
     html_string = render_to_string('reportes/plantilla_contrato.html', context)
-    
-    from io import BytesIO
-    result_file = BytesIO()
-    
-    base_url = settings.BASE_URL if hasattr(settings, 'BASE_URL') else 'http://127.0.0.1:8000'
-    HTML(string=html_string, base_url=base_url).write_pdf(result_file)
+    # Fuentes e imágenes precargadas en el proceso; estáticos leídos del disco
+    contenido = html_a_pdf(html_string)
 
     filename = f"Contrato_{contrato.id}_{contrato.cliente.apellidos}.pdf"
-    contrato.archivo_contrato_pdf.save(filename, ContentFile(result_file.getvalue()))
+    contrato.archivo_contrato_pdf.save(filename, ContentFile(contenido))
     
     return contrato.archivo_contrato_pdf.url
 
@@ -614,76 +948,59 @@ def generar_pdf_contrato(contrato_id):
 # ==========================================
 # 5. GENERADOR DE RECIBO DE ENTRADA
 # ==========================================
-def _parse_bank_details(observacion):
+def metodo_real_pago(pago):
     """
-    Helper para extraer datos bancarios de la observación del pago.
+    Método de pago que se marca en contratos y recibos, leído de Pago.metodo_pago.
     """
-    datos_bancarios = None
-    if "Banco:" in observacion and "Cuenta/Comp:" in observacion:
-        try:
-            resto_banco = observacion.split("Banco:")[1]
-            if ". Cuenta/Comp:" in resto_banco:
-                parte_banco, _, parte_cuenta = resto_banco.partition(". Cuenta/Comp:")
-                datos_bancarios = {
-                    'banco': parte_banco.strip(),
-                    'cuenta': parte_cuenta.rstrip(".").strip()
-                }
-            else:
-                parte_banco = resto_banco.split("Cuenta/Comp:")[0].strip().rstrip(".")
-                parte_cuenta = resto_banco.split("Cuenta/Comp:")[1].strip().rstrip(".")
-                datos_bancarios = {
-                    'banco': parte_banco,
-                    'cuenta': parte_cuenta
-                }
-        except Exception:
-            pass
-    return datos_bancarios
+    if pago is None or pago.metodo_pago == 'EFECTIVO':
+        return 'EFECTIVO'
+    if pago.metodo_pago == 'DEPOSITO':
+        return 'DEPÓSITO'
+    return 'TRANSFERENCIA BANCARIA'
+
+def datos_bancarios_pago(pago):
+    """
+    {'banco', 'cuenta'} de una transferencia para los recibos, o None. Los depósitos no
+    llevan datos bancarios (el recibo no tiene dónde poner la papeleta).
+    """
+    if metodo_real_pago(pago) != 'TRANSFERENCIA BANCARIA' or not (pago.banco or pago.cuenta):
+        return None
+    return {'banco': pago.banco, 'cuenta': pago.cuenta}
+
+def _buffer_pdf(pdf):
+    if pdf is None:
+        return None
+    ruta, _ = pdf
+    with open(ruta, 'rb') as archivo:
+        return BytesIO(archivo.read())
 
 def generar_recibo_entrada_buffer(contrato_id):
     """
     Genera el PDF del recibo de entrada y retorna el buffer (BytesIO).
     """
+    return _buffer_pdf(recibo_entrada_pdf(contrato_id))
+
+def recibo_entrada_pdf(contrato_id):
+    """
+    PDF del recibo de entrada en la caché de disco: retorna (ruta, clave).
+    """
     contrato = Contrato.objects.get(id=contrato_id)
     config = ConfiguracionSistema.objects.first()
     
     pago_entrada = contrato.pago_set.order_by('id').first()
-    
-    metodo_real = 'EFECTIVO'
-    datos_bancarios = None
-
-    if pago_entrada:
-        obs = pago_entrada.observacion or ""
-        if 'TRANSFERENCIA' in obs:
-            metodo_real = 'TRANSFERENCIA BANCARIA'
-            datos_bancarios = _parse_bank_details(obs)
-        elif 'DEPOSITO' in obs:
-            metodo_real = 'DEPÓSITO'
-        elif pago_entrada.metodo_pago == 'EFECTIVO':
-            metodo_real = 'EFECTIVO'
 
     context = {
         'contrato': contrato,
         'cliente': contrato.cliente,
         'empresa': config,
-        'metodo_real_pago': metodo_real,
-        'datos_bancarios': datos_bancarios,
+        'metodo_real_pago': metodo_real_pago(pago_entrada),
+        'datos_bancarios': datos_bancarios_pago(pago_entrada),
         'saldo_pendiente': contrato.saldo_a_financiar,
         'fecha_actual': datetime.now(),
         'base_url': settings.BASE_URL if hasattr(settings, 'BASE_URL') else 'http://127.0.0.1:8000',
     }
     
-    from weasyprint import HTML
-    
-    html_string = render_to_string('reportes/recibo_entrada.html', context)
-    
-    from io import BytesIO
-    result_file = BytesIO()
-    
-    base_url = settings.BASE_URL if hasattr(settings, 'BASE_URL') else 'http://127.0.0.1:8000'
-    HTML(string=html_string, base_url=base_url).write_pdf(result_file)
-        
-    result_file.seek(0)
-    return result_file
+    return pdf_en_cache('reportes/recibo_entrada.html', context)
 
 # ==========================================
 # 6. GENERADOR DE RECIBO DE PAGO MENSUAL
@@ -692,6 +1009,13 @@ def generar_recibo_pago_buffer(cuota_id):
     """
     Genera el PDF del recibo de pago mensual para una cuota y retorna el buffer (BytesIO).
     """
+    return _buffer_pdf(recibo_pago_pdf(cuota_id))
+
+def recibo_pago_pdf(cuota_id):
+    """
+    PDF del recibo de pago mensual en la caché de disco: retorna (ruta, clave),
+    o None si la cuota no tiene pagos.
+    """
     cuota = Cuota.objects.get(id=cuota_id)
     contrato = cuota.contrato
     config = ConfiguracionSistema.objects.first()
@@ -705,25 +1029,10 @@ def generar_recibo_pago_buffer(cuota_id):
     monto_pagado = cuota.valor_pagado
     
     # Saldo pendiente global del contrato
-    saldo_pendiente = sum(c.total_a_pagar - c.valor_pagado for c in contrato.cuotas.all())
-    
-    # Determinar método de pago buscando en pagos recientes
-    # Buscamos un pago que coincida con la fecha (aproximación razonable)
-    metodo_real = 'EFECTIVO'
-    datos_bancarios = None
+    saldo_pendiente = obtener_resumen(contrato.id).saldo_pendiente
     
-    # Buscar el pago más reciente que cubra esta cuota
+    # Método de pago: el pago más reciente con la fecha de la cuota (aproximación razonable)
     pago_asociado = contrato.pago_set.filter(fecha_pago=fecha_pago).order_by('-id').first()
-    
-    if pago_asociado:
-        obs = pago_asociado.observacion or ""
-        if 'TRANSFERENCIA' in obs:
-            metodo_real = 'TRANSFERENCIA BANCARIA'
-            datos_bancarios = _parse_bank_details(obs)
-        elif 'DEPOSITO' in obs:
-            metodo_real = 'DEPÓSITO'
-        elif pago_asociado.metodo_pago == 'EFECTIVO':
-            metodo_real = 'EFECTIVO'
 
     context = {
         'contrato': contrato,
@@ -732,32 +1041,26 @@ def generar_recibo_pago_buffer(cuota_id):
         'empresa': config,
         'fecha_pago': fecha_pago,
         'monto_pagado': monto_pagado,
-        'metodo_real_pago': metodo_real,
-        'datos_bancarios': datos_bancarios,
+        'metodo_real_pago': metodo_real_pago(pago_asociado),
+        'datos_bancarios': datos_bancarios_pago(pago_asociado),
         'saldo_pendiente': saldo_pendiente,
         'fecha_actual': datetime.now(),
         'base_url': settings.BASE_URL if hasattr(settings, 'BASE_URL') else 'http://127.0.0.1:8000',
     }
     
-    from weasyprint import HTML
-    
-    html_string = render_to_string('reportes/recibo_pago_mensual.html', context)
-    
-    from io import BytesIO
-    result_file = BytesIO()
-    
-    # Usamos WeasyPrint para soportar CSS moderno (Flexbox, Grid)
-    # base_url apunta a la raiz para cargar imagenes estaticas
-    base_url = settings.BASE_URL if hasattr(settings, 'BASE_URL') else 'http://127.0.0.1:8000'
-    HTML(string=html_string, base_url=base_url).write_pdf(result_file)
-        
-    result_file.seek(0)
-    return result_file
+    # WeasyPrint (CSS moderno: Flexbox, Grid) solo si este recibo no está en caché
+    return pdf_en_cache('reportes/recibo_pago_mensual.html', context)
 
 def generar_recibo_transaccion_buffer(pago_id):
     """
     Genera el PDF del recibo para una transacción específica (Pago).
     """
+    return _buffer_pdf(recibo_transaccion_pdf(pago_id))
+
+def recibo_transaccion_pdf(pago_id):
+    """
+    PDF del recibo de una transacción (Pago) en la caché de disco: retorna (ruta, clave).
+    """
     pago = Pago.objects.get(id=pago_id)
     contrato = pago.contrato
     config = ConfiguracionSistema.objects.first()
@@ -767,21 +1070,8 @@ def generar_recibo_transaccion_buffer(pago_id):
     monto_pagado = pago.monto
     
     # Saldo pendiente global del contrato (al momento actual)
-    saldo_pendiente = sum(c.total_a_pagar - c.valor_pagado for c in contrato.cuotas.all())
+    saldo_pendiente = obtener_resumen(contrato.id).saldo_pendiente
     
-    # Determinar método de pago y detalles
-    metodo_real = 'EFECTIVO'
-    datos_bancarios = None
-    
-    obs = pago.observacion or ""
-    if 'TRANSFERENCIA' in obs or pago.metodo_pago == 'TRANSFERENCIA':
-        metodo_real = 'TRANSFERENCIA BANCARIA'
-        datos_bancarios = _parse_bank_details(obs)
-    elif 'DEPOSITO' in obs:
-        metodo_real = 'DEPÓSITO'
-    elif pago.metodo_pago == 'EFECTIVO':
-        metodo_real = 'EFECTIVO'
-
     # Calcular qué cuotas cubrió este pago para mostrarlas (Opcional)
     cuotas_cubiertas = []
     # Usamos los detalles
@@ -798,24 +1088,35 @@ def generar_recibo_transaccion_buffer(pago_id):
         'empresa': config,
         'fecha_pago': fecha_pago,
         'monto_pagado': monto_pagado,
-        'metodo_real_pago': metodo_real,
-        'datos_bancarios': datos_bancarios,
+        'metodo_real_pago': metodo_real_pago(pago),
+        'datos_bancarios': datos_bancarios_pago(pago),
         'saldo_pendiente': saldo_pendiente,
         'cuotas_str': cuotas_str,
         'fecha_actual': datetime.now(),
         'base_url': settings.BASE_URL if hasattr(settings, 'BASE_URL') else 'http://127.0.0.1:8000',
     }
     
-    from weasyprint import HTML
-    
-    # Usaremos una nueva plantilla o la misma adaptada
-    html_string = render_to_string('reportes/recibo_transaccion.html', context)
-    
-    from io import BytesIO
-    result_file = BytesIO()
-    
-    base_url = settings.BASE_URL if hasattr(settings, 'BASE_URL') else 'http://127.0.0.1:8000'
-    HTML(string=html_string, base_url=base_url).write_pdf(result_file)
-        
-    result_file.seek(0)
-    return result_file
\ No newline at end of file
+    return pdf_en_cache('reportes/recibo_transaccion.html', context)
+
+# ==========================================
+# 7. ESTADO DE CUENTA DEL CONTRATO
+# ==========================================
+def estado_cuenta_pdf(contrato_id):
+    """
+    PDF del estado de cuenta (cuotas, pagado y saldo) en la caché de disco: retorna (ruta, clave).
+    Se usa en la exportación masiva de los contratos en mora.
+    """
+    contrato = Contrato.objects.select_related('cliente').get(id=contrato_id)
+    cuotas = list(contrato.cuotas.all())
+    resumen = obtener_resumen(contrato.id)
+
+    context = {
+        'contrato': contrato,
+        'cliente': contrato.cliente,
+        'empresa': ConfiguracionSistema.objects.first(),
+        'cuotas': cuotas,
+        'resumen': resumen,
+        # Fecha del último cálculo de mora: el PDF cambia solo cuando cambian los datos
+        'fecha_corte': contrato.mora_calculada_hasta or date.today(),
+    }
+    return pdf_en_cache('reportes/estado_cuenta.html', context)
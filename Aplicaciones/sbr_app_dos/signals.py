@@ -1,7 +1,9 @@
 
 from django.contrib.auth.signals import user_logged_in, user_login_failed
+from django.db.models.signals import post_delete, post_save, pre_delete, pre_save
 from django.dispatch import receiver
-from .models import LogActividad
+from .models import Cliente, Contrato, LogActividad, Pago
+from .services import actualizar_resumen_diario, dias_de_contratos, invalidar_cierres_desde
 
 def get_client_ip(request):
     x_forwarded_for = request.META.get('HTTP_X_FORWARDED_FOR')
@@ -30,3 +32,81 @@ def log_user_login_failed(sender, credentials, request, **kwargs):
         detalle=f"Usuario intentado: {username}. IP: {ip}",
         ip_address=ip
     )
+
+
+# ==========================================
+# CIERRES MENSUALES Y RESUMEN DIARIO: actualizar al cambiar pagos y contratos
+# ==========================================
+def _fecha(valor):
+    return Pago._meta.get_field('fecha_pago').to_python(valor)
+
+def _dia_primer_pago(contrato_id):
+    # El primer pago puede ser la entrada de datos antiguos (services._entradas_supuestas)
+    return Pago.objects.filter(contrato_id=contrato_id).order_by('id').values_list('fecha_pago', flat=True).first()
+
+@receiver(pre_save, sender=Pago)
+def recordar_fecha_pago_anterior(sender, instance, raw=False, **kwargs):
+    # Si se edita la fecha, el mes anterior también cambia
+    instance._fecha_pago_anterior = None
+    if instance.pk and not raw:
+        instance._fecha_pago_anterior = (
+            Pago.objects.filter(pk=instance.pk).values_list('fecha_pago', flat=True).first()
+        )
+
+@receiver(post_save, sender=Pago)
+def actualizar_por_pago_guardado(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    fechas = [f for f in (_fecha(instance.fecha_pago), instance._fecha_pago_anterior) if f]
+    invalidar_cierres_desde(min(fechas))
+    actualizar_resumen_diario(fechas + [_dia_primer_pago(instance.contrato_id)])
+
+@receiver(post_delete, sender=Pago)
+def actualizar_por_pago_eliminado(sender, instance, **kwargs):
+    invalidar_cierres_desde(_fecha(instance.fecha_pago))
+    actualizar_resumen_diario([_fecha(instance.fecha_pago), _dia_primer_pago(instance.contrato_id)])
+
+CAMPOS_CONTRATO_RESUMEN_DIARIO = ('fecha_contrato', 'estado', 'valor_entrada', 'cliente_id')
+
+@receiver(pre_save, sender=Contrato)
+def recordar_contrato_anterior(sender, instance, raw=False, **kwargs):
+    instance._valores_anteriores = None
+    if instance.pk and not raw:
+        instance._valores_anteriores = (
+            Contrato.objects.filter(pk=instance.pk).values_list(*CAMPOS_CONTRATO_RESUMEN_DIARIO).first()
+        )
+
+@receiver(post_save, sender=Contrato)
+def actualizar_por_contrato_guardado(sender, instance, created=False, raw=False, **kwargs):
+    if raw:
+        return
+    if created:
+        actualizar_resumen_diario([instance.fecha_contrato])
+        return
+    anteriores = instance._valores_anteriores
+    actuales = tuple(getattr(instance, campo) for campo in CAMPOS_CONTRATO_RESUMEN_DIARIO)
+    if anteriores is not None and anteriores != actuales:
+        # Pasar a DEVOLUCION (o cambiar de cliente) cambia el signo/vendedor de todos sus días
+        dias = dias_de_contratos(Contrato.objects.filter(pk=instance.pk))
+        actualizar_resumen_diario(dias | {anteriores[0]})
+
+@receiver(pre_delete, sender=Contrato)
+def recordar_dias_contrato(sender, instance, **kwargs):
+    instance._dias_resumen = dias_de_contratos(Contrato.objects.filter(pk=instance.pk))
+
+@receiver(post_delete, sender=Contrato)
+def actualizar_por_contrato_eliminado(sender, instance, **kwargs):
+    actualizar_resumen_diario(getattr(instance, '_dias_resumen', {instance.fecha_contrato}))
+
+@receiver(pre_save, sender=Cliente)
+def recordar_vendedor_anterior(sender, instance, raw=False, **kwargs):
+    instance._vendedor_anterior = None
+    if instance.pk and not raw:
+        instance._vendedor_anterior = Cliente.objects.filter(pk=instance.pk).values_list('vendedor_id', flat=True).first()
+
+@receiver(post_save, sender=Cliente)
+def actualizar_por_cambio_de_vendedor(sender, instance, created=False, raw=False, **kwargs):
+    # Los totales por vendedor siguen al vendedor actual del cliente
+    if raw or created or instance._vendedor_anterior in (None, instance.vendedor_id):
+        return
+    actualizar_resumen_diario(dias_de_contratos(Contrato.objects.filter(cliente=instance)))
@@ -0,0 +1,199 @@
+"""
+Cola de PDF en base de datos.
+
+Las vistas solo encolan (encolar_pdf) y responden; el comando procesar_pdfs toma las
+tareas pendientes y las renderiza en un pool de procesos, con un máximo de renders
+simultáneos (PDF_MAX_RENDERS_CONCURRENTES) para que WeasyPrint no ocupe los workers web.
+Una tarea que falla se reintenta con espera creciente hasta max_intentos; una que quedó
+EN_PROCESO más de PDF_TAREA_TIMEOUT_MIN minutos (el worker murió) vuelve a la cola.
+"""
+import os
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db.models import F, Q
+from django.urls import reverse
+from django.utils import timezone
+
+from .models import Contrato, TareaPDF
+
+DIRECTORIO_TAREAS_PDF = 'tareas_pdf'
+# Primer reintento a los 30 s, luego 60 s, 120 s...
+SEGUNDOS_REINTENTO = 30
+
+def encolar_pdf(tipo, objeto_id=None, usuario=None, **parametros):
+    """
+    Crea la tarea (o reutiliza una igual que aún no empezó) y la retorna.
+    Si se llama dentro de una transacción, la tarea se confirma o descarta con ella.
+    """
+    pendiente = TareaPDF.objects.filter(
+        tipo=tipo, objeto_id=objeto_id, parametros=parametros, solicitado_por=usuario, estado='PENDIENTE'
+    ).first()
+    if pendiente:
+        return pendiente
+    return TareaPDF.objects.create(tipo=tipo, objeto_id=objeto_id, parametros=parametros, solicitado_por=usuario)
+
+# ==========================================
+# RENDERIZADORES: tarea -> (archivo en MEDIA_ROOT, nombre de descarga)
+# ==========================================
+def _render_contrato(tarea):
+    from .services import generar_pdf_contrato
+    generar_pdf_contrato(tarea.objeto_id)
+    contrato = Contrato.objects.get(id=tarea.objeto_id)
+    return contrato.archivo_contrato_pdf.name, f"Contrato_{contrato.id}.pdf"
+
+def _render_recibo(generador, nombre):
+    # Los recibos quedan en la caché de PDF (cache_pdf): la descarga normal ya no renderiza
+    def render(tarea):
+        pdf = generador(tarea.objeto_id)
+        if pdf is None:
+            raise ValueError("No hay pagos para generar el recibo.")
+        return os.path.relpath(pdf[0], settings.MEDIA_ROOT), nombre.format(tarea.objeto_id)
+    return render
+
+def _guardar_reporte(tarea, contenido):
+    return default_storage.save(f'{DIRECTORIO_TAREAS_PDF}/{tarea.id}.pdf', ContentFile(contenido))
+
+def _render_reporte_general(tarea):
+    from .reportes import pdf_reporte_general, rango_reporte
+    desde, hasta = rango_reporte(tarea.parametros.get('desde'), tarea.parametros.get('hasta'))
+    contenido, nombre = pdf_reporte_general(tarea.solicitado_por, desde, hasta, tarea.parametros.get('solo_activos', False))
+    return _guardar_reporte(tarea, contenido), nombre
+
+def _render_reporte_mensual(tarea):
+    from .reportes import pdf_reporte_mensual
+    contenido, nombre = pdf_reporte_mensual(tarea.solicitado_por, tarea.parametros.get('mes'), tarea.parametros.get('anio'))
+    return _guardar_reporte(tarea, contenido), nombre
+
+def _render_exportacion(tarea):
+    from .exportacion_pdf import TIPOS_EXPORTACION, documentos_exportacion, exportar_documentos
+    p = tarea.parametros
+    ids = documentos_exportacion(p['documentos'], p.get('desde'), p.get('hasta'), p.get('contratos'), tarea.solicitado_por)
+    TareaPDF.objects.filter(id=tarea.id).update(progreso=0, total=len(ids))
+
+    def progreso(hechos):
+        # Renovar iniciado_en: una exportación larga que avanza no cuenta como colgada
+        TareaPDF.objects.filter(id=tarea.id).update(progreso=hechos, iniciado_en=timezone.now())
+
+    archivo = f"{DIRECTORIO_TAREAS_PDF}/{tarea.id}.{p['formato']}"
+    destino = os.path.join(settings.MEDIA_ROOT, archivo)
+    os.makedirs(os.path.dirname(destino), exist_ok=True)
+    # Renders en el mismo proceso: la tarea ya ocupa uno de los PDF_MAX_RENDERS_CONCURRENTES
+    # del worker; un pool propio aquí los multiplicaría
+    try:
+        exportar_documentos(p['documentos'], ids, p['formato'], destino, 1, progreso)
+    except BaseException:
+        if os.path.exists(destino):
+            os.remove(destino)
+        raise
+
+    nombre = TIPOS_EXPORTACION[p['documentos']].replace(' ', '_')
+    periodo = '_'.join(filter(None, [p.get('desde'), p.get('hasta')]))
+    return archivo, f"{nombre}{'_' + periodo if periodo else ''}.{p['formato']}"
+
+def _renderizadores():
+    from .services import recibo_entrada_pdf, recibo_pago_pdf, recibo_transaccion_pdf
+    return {
+        'CONTRATO': _render_contrato,
+        'RECIBO_ENTRADA': _render_recibo(recibo_entrada_pdf, "Recibo_Entrada_{}.pdf"),
+        'RECIBO_PAGO': _render_recibo(recibo_pago_pdf, "Recibo_Cuota_{}.pdf"),
+        'RECIBO_TRANSACCION': _render_recibo(recibo_transaccion_pdf, "Recibo_Pago_{}.pdf"),
+        'REPORTE_GENERAL': _render_reporte_general,
+        'REPORTE_MENSUAL': _render_reporte_mensual,
+        'EXPORTACION': _render_exportacion,
+    }
+
+# ==========================================
+# WORKER
+# ==========================================
+def liberar_tareas_colgadas():
+    """Devuelve a la cola (o marca ERROR) las tareas EN_PROCESO de un worker que murió."""
+    limite = timezone.now() - timedelta(minutes=getattr(settings, 'PDF_TAREA_TIMEOUT_MIN', 10))
+    colgadas = TareaPDF.objects.filter(estado='EN_PROCESO', iniciado_en__lt=limite)
+    colgadas.filter(intentos__gte=F('max_intentos')).update(
+        estado='ERROR', error="Tiempo de render agotado.", terminado_en=timezone.now()
+    )
+    return colgadas.update(estado='PENDIENTE', disponible_desde=timezone.now())
+
+def tomar_tareas(limite):
+    """
+    Marca EN_PROCESO hasta `limite` tareas disponibles, sin pasar el máximo global de
+    renders simultáneos, y retorna sus ids. El UPDATE condicionado al estado evita
+    que dos workers tomen la misma tarea.
+    """
+    maximo = getattr(settings, 'PDF_MAX_RENDERS_CONCURRENTES', 2)
+    limite = min(limite, maximo - TareaPDF.objects.filter(estado='EN_PROCESO').count())
+    if limite <= 0:
+        return []
+
+    ahora = timezone.now()
+    candidatas = TareaPDF.objects.filter(estado='PENDIENTE', disponible_desde__lte=ahora).values_list('id', flat=True)
+    tomadas = []
+    for tarea_id in candidatas[:limite]:
+        if TareaPDF.objects.filter(id=tarea_id, estado='PENDIENTE').update(
+            estado='EN_PROCESO', iniciado_en=ahora, intentos=F('intentos') + 1
+        ):
+            tomadas.append(tarea_id)
+    return tomadas
+
+def registrar_fallo(tarea_id, error):
+    """Reintenta más tarde con espera creciente o, agotados los intentos, deja la tarea en ERROR."""
+    tarea = TareaPDF.objects.get(id=tarea_id)
+    tarea.error = str(error)[:2000]
+    if tarea.intentos >= tarea.max_intentos:
+        tarea.estado = 'ERROR'
+        tarea.terminado_en = timezone.now()
+    else:
+        tarea.estado = 'PENDIENTE'
+        tarea.disponible_desde = timezone.now() + timedelta(seconds=SEGUNDOS_REINTENTO * 2 ** (tarea.intentos - 1))
+    tarea.save(update_fields=['estado', 'error', 'terminado_en', 'disponible_desde'])
+
+def ejecutar_tarea(tarea_id):
+    """Renderiza una tarea ya tomada. Retorna True si quedó LISTO."""
+    tarea = TareaPDF.objects.select_related('solicitado_por').get(id=tarea_id)
+    try:
+        archivo, nombre = _renderizadores()[tarea.tipo](tarea)
+    except Exception as e:
+        registrar_fallo(tarea_id, e)
+        return False
+    TareaPDF.objects.filter(id=tarea_id).update(
+        estado='LISTO', archivo=archivo, nombre_archivo=nombre, error='', terminado_en=timezone.now()
+    )
+    return True
+
+def purgar_tareas(dias=7):
+    """Borra las tareas terminadas hace más de `dias` días y los archivos de reportes y exportaciones que generaron."""
+    viejas = TareaPDF.objects.filter(estado__in=['LISTO', 'ERROR'], terminado_en__lt=timezone.now() - timedelta(days=dias))
+    propios = viejas.filter(Q(tipo__startswith='REPORTE_') | Q(tipo='EXPORTACION'))
+    for archivo in propios.exclude(archivo='').values_list('archivo', flat=True):
+        default_storage.delete(archivo)
+    return viejas.delete()[0]
+
+# ==========================================
+# CONSULTA (endpoint de estado y descarga)
+# ==========================================
+def url_resultado(tarea):
+    """URL de descarga del PDF listo (None si aún no termina)."""
+    if tarea.estado != 'LISTO':
+        return None
+    if tarea.tipo == 'RECIBO_ENTRADA':
+        return reverse('descargar_recibo_entrada', args=[tarea.objeto_id])
+    if tarea.tipo == 'RECIBO_PAGO':
+        return reverse('descargar_recibo_pago', args=[tarea.objeto_id])
+    if tarea.tipo == 'RECIBO_TRANSACCION':
+        return reverse('descargar_recibo_transaccion', args=[tarea.objeto_id])
+    return reverse('descargar_tarea_pdf', args=[tarea.id])
+
+def estado_tarea(tarea):
+    return {
+        'id': tarea.id,
+        'tipo': tarea.tipo,
+        'estado': tarea.estado,
+        'intentos': tarea.intentos,
+        'progreso': tarea.progreso,
+        'total': tarea.total,
+        'error': tarea.error if tarea.estado == 'ERROR' else '',
+        'url': url_resultado(tarea),
+    }
@@ -1,9 +1,32 @@
 from django.test import TestCase
+from django.core.cache import cache
 from decimal import Decimal
 from datetime import date, timedelta
 from django.contrib.auth.models import User
 from .models import Cliente, Lote, Contrato, Cuota, ConfiguracionSistema
 from .services import actualizar_moras_contrato
+from .presupuesto_consultas import PresupuestoConsultasMixin
+
+
+class CarteraSembradaMixin:
+    """
+    Cartera sintética (sembrar_cartera con los argumentos de CARTERA) y superusuario
+    `self.admin`, creados una sola vez por clase en setUpTestData: cada prueba corre en
+    su propia transacción, así que lo que cambia se deshace al terminar. El cliente de
+    pruebas ya entra con la sesión del admin.
+    """
+    CARTERA = {}
+
+    @classmethod
+    def setUpTestData(cls):
+        from .cartera_sintetica import sembrar_cartera
+        sembrar_cartera(vendedores=2, **cls.CARTERA)
+        cls.admin = User.objects.create_superuser(f"admin_{cls.CARTERA['prefijo']}", password='x')
+
+    def setUp(self):
+        # La caché (reportes) no se deshace con la transacción de cada prueba
+        cache.clear()
+        self.client.force_login(self.admin)
 
 class MoraCalculationTests(TestCase):
     def setUp(self):
@@ -106,3 +129,1544 @@ class MoraCalculationTests(TestCase):
         # Back to VENCIDO
         self.assertEqual(cuota.estado, 'VENCIDO')
         self.assertEqual(cuota.valor_mora, Decimal('3.00'))
+
+
+class MoraMasivaTests(TestCase):
+    """El motor de mora en SQL debe dar exactamente el mismo resultado que el cálculo Decimal."""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='vendedor', password='password')
+        self.cliente = Cliente.objects.create(
+            vendedor=self.user, cedula='1234567890', nombres='Test', apellidos='User',
+            celular='0999999999', direccion='Test Address'
+        )
+        ConfiguracionSistema.objects.create(nombre_empresa='Test Corp', ruc_empresa='123', mora_porcentaje=Decimal('3.00'))
+        self.contrato = Contrato.objects.create(
+            cliente=self.cliente, fecha_contrato=date.today() - timedelta(days=400),
+            precio_venta_final=5000, valor_entrada=0, saldo_a_financiar=5000, numero_cuotas=12
+        )
+
+    def _cuota(self, numero, capital, dias_atraso=10, **kwargs):
+        return Cuota.objects.create(
+            contrato=self.contrato, numero_cuota=numero,
+            fecha_vencimiento=date.today() - timedelta(days=dias_atraso),
+            valor_capital=Decimal(capital), **kwargs
+        )
+
+    def test_redondeo_identico_al_calculo_decimal(self):
+        from .services import actualizar_moras_masivo
+        capitales = ['100.00', '100.50', '0.10', '0.16', '33.33', '183.35', '416.67', '1.50', '999.99', '250.17']
+        cuotas = [self._cuota(i, c) for i, c in enumerate(capitales, start=1)]
+
+        conteos = actualizar_moras_masivo(Contrato.objects.filter(id=self.contrato.id))
+
+        self.assertEqual(conteos['vencidas'], len(capitales))
+        self.assertEqual(conteos['contratos_en_mora'], 1)
+        for cuota in cuotas:
+            cuota.refresh_from_db()
+            esperado = (cuota.valor_capital * Decimal('3.00') / Decimal('100.00')).quantize(Decimal('0.01'), rounding='ROUND_HALF_UP')
+            esperado = max(esperado, Decimal('0.01'))
+            self.assertEqual(cuota.estado, 'VENCIDO')
+            self.assertEqual(cuota.valor_mora, esperado, f"capital {cuota.valor_capital}")
+
+    def test_solo_toca_filas_que_cambian(self):
+        from .services import actualizar_moras_masivo
+        self._cuota(1, '100.00')
+        self._cuota(2, '100.00', dias_atraso=-20)  # Aún no vence
+        self._cuota(3, '100.00', mora_exenta=True, estado='VENCIDO', valor_mora=Decimal('3.00'))
+        self._cuota(4, '100.00', mora_exenta=True, valor_pagado=Decimal('100.00'))
+        contratos = Contrato.objects.filter(id=self.contrato.id)
+
+        primera = actualizar_moras_masivo(contratos)
+        self.assertEqual(primera['vencidas'], 1)
+        self.assertEqual(primera['exentas'], 2)
+        estados = dict(Cuota.objects.values_list('numero_cuota', 'estado'))
+        self.assertEqual(estados, {1: 'VENCIDO', 2: 'PENDIENTE', 3: 'PENDIENTE', 4: 'PAGADO'})
+
+        # Segunda pasada: nada cambia, nada se escribe
+        segunda = actualizar_moras_masivo(contratos)
+        self.assertEqual(segunda, {'vencidas': 0, 'exentas': 0, 'contratos_en_mora': 0, 'contratos_al_dia': 0})
+
+    def test_numero_de_queries_constante(self):
+        from .services import actualizar_moras_masivo
+        for i in range(1, 41):
+            self._cuota(i, '125.00', dias_atraso=i)
+        # 1 de días con mora + 6 de mora + 2 del resumen de saldos + 9 del resumen diario
+        with self.assertNumQueries(18):
+            actualizar_moras_masivo(Contrato.objects.filter(id=self.contrato.id))
+
+    def test_marca_de_agua_evita_recalculo_el_mismo_dia(self):
+        from .services import actualizar_moras_pendientes
+        cuota = self._cuota(1, '100.00')
+        contratos = Contrato.objects.filter(id=self.contrato.id)
+
+        actualizar_moras_pendientes(contratos)
+        self.contrato.refresh_from_db()
+        self.assertEqual(self.contrato.mora_calculada_hasta, date.today())
+
+        # Con la marca en hoy, la vista de lectura no vuelve a escribir
+        Cuota.objects.filter(id=cuota.id).update(valor_mora=0, estado='PENDIENTE')
+        with self.assertNumQueries(9):  # 1 de días con mora + 6 de mora + 2 del resumen de saldos
+            conteos = actualizar_moras_pendientes(contratos)
+        self.assertEqual(conteos['vencidas'], 0)
+
+        # El proceso nocturno forzado sí recalcula
+        from django.core.management import call_command
+        from io import StringIO
+        call_command('actualizar_moras', '--forzar', stdout=StringIO())
+        cuota.refresh_from_db()
+        self.assertEqual(cuota.valor_mora, Decimal('3.00'))
+
+    def test_cambio_de_porcentaje_invalida_marca(self):
+        from .services import actualizar_moras_pendientes
+        actualizar_moras_pendientes(Contrato.objects.filter(id=self.contrato.id))
+        config = ConfiguracionSistema.objects.get()
+        config.mora_porcentaje = Decimal('5.00')
+        config.save()
+        self.contrato.refresh_from_db()
+        self.assertIsNone(self.contrato.mora_calculada_hasta)
+
+
+class RecalculoDeudaTests(TestCase):
+    """recalcular_deuda_contrato reproduce en memoria y solo reescribe desde el primer pago afectado."""
+
+    def setUp(self):
+        from .services import generar_tabla_amortizacion
+        self.user = User.objects.create_user(username='vendedor', password='password')
+        cliente = Cliente.objects.create(
+            vendedor=self.user, cedula='1234567890', nombres='Test', apellidos='User',
+            celular='0999999999', direccion='Test Address'
+        )
+        ConfiguracionSistema.objects.create(nombre_empresa='Test Corp', ruc_empresa='123', mora_porcentaje=Decimal('3.00'))
+        self.contrato = Contrato.objects.create(
+            cliente=cliente, fecha_contrato=date.today() - timedelta(days=720),
+            precio_venta_final=2400, valor_entrada=0, saldo_a_financiar=2400, numero_cuotas=24
+        )
+        generar_tabla_amortizacion(self.contrato.id)
+
+    def _pagar(self, dias_desde_contrato, monto):
+        from .models import Pago
+        return Pago.objects.create(
+            contrato=self.contrato, monto=Decimal(monto), metodo_pago='EFECTIVO',
+            fecha_pago=self.contrato.fecha_contrato + timedelta(days=dias_desde_contrato)
+        )
+
+    def test_editar_pago_intermedio_conserva_detalles_anteriores(self):
+        from .models import DetallePago
+        from .services import recalcular_deuda_contrato
+        pagos = [self._pagar(30 * i, '150.00') for i in range(1, 11)]
+        recalcular_deuda_contrato(self.contrato.id)
+        ids_previos = set(DetallePago.objects.filter(pago__in=pagos[:5]).values_list('id', flat=True))
+
+        pagos[5].monto = Decimal('40.00')
+        pagos[5].save()
+        diferencias = recalcular_deuda_contrato(self.contrato.id, verificar=True)
+
+        self.assertEqual(diferencias, [])
+        # Los pagos anteriores al editado no se reescriben
+        self.assertEqual(set(DetallePago.objects.filter(pago__in=pagos[:5]).values_list('id', flat=True)), ids_previos)
+        self.assertEqual(
+            sum(DetallePago.objects.filter(pago=pagos[5]).values_list('monto_aplicado', flat=True)),
+            Decimal('40.00')
+        )
+
+    def test_verificacion_usa_un_recalculo_independiente(self):
+        from unittest import mock
+        from .models import Pago
+        from . import services
+        pago = self._pagar(30, '5000.00')
+        reproducir = services._reproducir_contrato
+        llamadas = []
+
+        def incremental_con_error(contrato_id):
+            # Solo la primera reproducción (la incremental) pierde el saldo a favor
+            cuotas, pagos, originales, asignaciones, saldos = reproducir(contrato_id)
+            if not llamadas:
+                saldos = {pago_id: Decimal('0.00') for pago_id in saldos}
+            llamadas.append(contrato_id)
+            return cuotas, pagos, originales, asignaciones, saldos
+
+        with mock.patch.object(services, '_reproducir_contrato', side_effect=incremental_con_error):
+            diferencias = services.recalcular_deuda_contrato(self.contrato.id, verificar=True)
+
+        self.assertEqual(diferencias, [f"Pago #{pago.id}: saldo a favor 0.00, recálculo completo 2600.00"])
+        # El recálculo completo se deshace: queda lo que escribió el incremental
+        self.assertEqual(Pago.objects.get(id=pago.id).saldo_a_favor, Decimal('0.00'))
+
+    def test_numero_de_queries_no_depende_de_los_pagos(self):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        from .services import recalcular_deuda_contrato
+
+        self._pagar(30, '100.00')
+        with CaptureQueriesContext(connection) as pocos:
+            recalcular_deuda_contrato(self.contrato.id)
+
+        for i in range(2, 40):
+            self._pagar(30 * i, '55.55')
+        with CaptureQueriesContext(connection) as muchos:
+            recalcular_deuda_contrato(self.contrato.id)
+
+        self.assertLessEqual(len(muchos.captured_queries), len(pocos.captured_queries) + 2)
+
+    def test_saldo_a_favor_no_se_duplica(self):
+        from .services import recalcular_deuda_contrato
+        pago = self._pagar(30, '5000.00')
+        recalcular_deuda_contrato(self.contrato.id)
+        recalcular_deuda_contrato(self.contrato.id)
+        pago.refresh_from_db()
+        self.assertEqual(pago.saldo_a_favor, Decimal('2600.00'))
+        self.assertFalse(pago.observacion)
+
+
+class AsignacionPagoTests(TestCase):
+    """Núcleo puro de asignación (asignacion.py) y su persistencia en registrar_pago_cliente."""
+
+    def setUp(self):
+        from .services import generar_tabla_amortizacion
+        self.user = User.objects.create_user(username='vendedor', password='password')
+        cliente = Cliente.objects.create(
+            vendedor=self.user, cedula='1234567890', nombres='Test', apellidos='User',
+            celular='0999999999', direccion='Test Address'
+        )
+        ConfiguracionSistema.objects.create(nombre_empresa='Test Corp', ruc_empresa='123', mora_porcentaje=Decimal('3.00'))
+        self.contrato = Contrato.objects.create(
+            cliente=cliente, fecha_contrato=date.today(),
+            precio_venta_final=2400, valor_entrada=0, saldo_a_financiar=2400, numero_cuotas=24
+        )
+        generar_tabla_amortizacion(self.contrato.id)
+
+    def _snapshots(self):
+        from .asignacion import CuotaSnapshot
+        return [CuotaSnapshot.desde_cuota(c) for c in self.contrato.cuotas.order_by('numero_cuota')]
+
+    def test_asignar_pago_no_modifica_las_cuotas_recibidas(self):
+        from .asignacion import asignar_pago
+        cuotas = self._snapshots()
+        antes = [c.valores() for c in cuotas]
+
+        plan = asignar_pago(cuotas, Decimal('250.00'), date.today())
+
+        self.assertEqual([c.valores() for c in cuotas], antes)
+        self.assertEqual([monto for _, monto in plan.asignaciones], [Decimal('100.00'), Decimal('100.00'), Decimal('50.00')])
+        self.assertEqual([c.estado for c in plan.cuotas], ['PAGADO', 'PAGADO', 'PARCIAL'])
+        self.assertEqual(plan.sobrante, Decimal('0.00'))
+
+    def test_cuota_de_origen_y_excedente(self):
+        from .asignacion import asignar_pago
+        cuotas = self._snapshots()
+        # Desde la #23: paga #23 y #24, y el excedente vuelve a la #1
+        plan = asignar_pago(cuotas, Decimal('250.00'), date.today(), numero_inicio=23)
+        numeros = {c.id: c.numero_cuota for c in cuotas}
+        self.assertEqual([numeros[cuota_id] for cuota_id, _ in plan.asignaciones], [23, 24, 1])
+
+    def test_simular_pagos(self):
+        from .asignacion import simular_pagos
+        cuotas = self._snapshots()
+        finales, planes = simular_pagos(cuotas, [(Decimal('100.00'), date.today(), 0)] * 30)
+        self.assertTrue(all(c.estado == 'PAGADO' for c in finales))
+        self.assertEqual(sum(p.sobrante for p in planes), Decimal('600.00'))
+        self.assertTrue(all(c.valor_pagado == 0 for c in cuotas))
+
+    def test_registrar_pago_queries_constantes(self):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        from .models import DetallePago
+        from .services import registrar_pago_cliente
+
+        with CaptureQueriesContext(connection) as una:
+            registrar_pago_cliente(self.contrato.id, '100.00', 'EFECTIVO', None, self.user)
+        with CaptureQueriesContext(connection) as todas:
+            pago = registrar_pago_cliente(self.contrato.id, '2350.00', 'EFECTIVO', None, self.user)
+
+        self.assertEqual(len(todas.captured_queries), len(una.captured_queries))
+        self.assertEqual(DetallePago.objects.filter(pago=pago).count(), 23)
+        self.assertEqual(pago.saldo_a_favor, Decimal('50.00'))
+        self.assertFalse(self.contrato.cuotas.exclude(estado='PAGADO').exists())
+
+
+class TablaAmortizacionMasivaTests(TestCase):
+    """generar_tablas_amortizacion: muchos contratos en una sola pasada."""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='vendedor', password='password')
+        cliente = Cliente.objects.create(
+            vendedor=self.user, cedula='1234567890', nombres='Test', apellidos='User',
+            celular='0999999999', direccion='Test Address'
+        )
+        self.contratos = [
+            Contrato.objects.create(
+                cliente=cliente, fecha_contrato=date(2024, 1, 31),
+                precio_venta_final=1000, valor_entrada=0, saldo_a_financiar=Decimal('1000.00'), numero_cuotas=3
+            )
+            for _ in range(5)
+        ]
+
+    def test_dry_run_no_escribe_y_ajusta_centavos_y_fechas(self):
+        from .services import generar_tablas_amortizacion
+        tablas = generar_tablas_amortizacion([c.id for c in self.contratos], dry_run=True)
+
+        self.assertFalse(Cuota.objects.exists())
+        self.assertEqual(tablas[0]['capitales'], (Decimal('333.33'), Decimal('333.33'), Decimal('333.34')))
+        # 31 de enero + 1 mes -> fin de febrero (bisiesto), luego 29 de marzo y abril
+        self.assertEqual(tablas[0]['fechas'], (date(2024, 2, 29), date(2024, 3, 29), date(2024, 4, 29)))
+
+    def test_un_solo_bulk_create_para_todos_los_contratos(self):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        from .services import generar_tablas_amortizacion
+
+        fechas = {self.contratos[0].id: '2024-05-15'}
+        with CaptureQueriesContext(connection) as consultas:
+            creadas = generar_tablas_amortizacion([c.id for c in self.contratos], fechas, batch_size=1000)
+
+        self.assertEqual(creadas, 15)
+        inserts = [q for q in consultas.captured_queries if q['sql'].startswith('INSERT INTO "sbr_app_dos_cuota"')]
+        self.assertEqual(len(inserts), 1)
+        self.assertEqual(
+            self.contratos[0].cuotas.order_by('numero_cuota').first().fecha_vencimiento, date(2024, 5, 15)
+        )
+
+    def test_numero_de_cuota_unico_por_contrato(self):
+        from django.db import IntegrityError, transaction
+        from .services import generar_tablas_amortizacion
+        generar_tablas_amortizacion([self.contratos[0].id])
+
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Cuota.objects.create(
+                contrato=self.contratos[0], numero_cuota=1, fecha_vencimiento=date(2024, 2, 29), valor_capital=100
+            )
+        # El mismo número en otro contrato sí se permite
+        Cuota.objects.create(
+            contrato=self.contratos[1], numero_cuota=1, fecha_vencimiento=date(2024, 2, 29), valor_capital=100
+        )
+
+
+class ResumenContratoTests(TestCase):
+    """ResumenContrato se mantiene al día con los servicios de pago, edición y mora."""
+
+    def setUp(self):
+        from .services import generar_tabla_amortizacion
+        self.user = User.objects.create_user(username='vendedor', password='password')
+        cliente = Cliente.objects.create(
+            vendedor=self.user, cedula='1234567890', nombres='Test', apellidos='User',
+            celular='0999999999', direccion='Test Address'
+        )
+        ConfiguracionSistema.objects.create(nombre_empresa='Test Corp', ruc_empresa='123', mora_porcentaje=Decimal('3.00'))
+        self.contrato = Contrato.objects.create(
+            cliente=cliente, fecha_contrato=date.today() - timedelta(days=95),
+            precio_venta_final=1200, valor_entrada=0, saldo_a_financiar=1200, numero_cuotas=12
+        )
+        generar_tabla_amortizacion(self.contrato.id)
+
+    def test_pago_edicion_y_mora_mantienen_el_resumen(self):
+        from .models import ResumenContrato
+        from .services import recalcular_deuda_contrato, registrar_pago_cliente, verificar_resumenes
+
+        actualizar_moras_contrato(self.contrato.id)
+        resumen = ResumenContrato.objects.get(contrato=self.contrato)
+        self.assertEqual(resumen.cuotas_vencidas, 3)
+        self.assertEqual(resumen.saldo_mora, Decimal('9.00'))
+        self.assertEqual(resumen.saldo_pendiente, Decimal('1209.00'))
+
+        pago = registrar_pago_cliente(self.contrato.id, '150.00', 'EFECTIVO', None, self.user)
+        resumen.refresh_from_db()
+        self.assertEqual(resumen.total_pagado, Decimal('150.00'))
+        self.assertEqual(resumen.saldo_pendiente, Decimal('1059.00'))
+        self.assertEqual(verificar_resumenes(), [])
+
+        pago.monto = Decimal('50.00')
+        pago.save()
+        recalcular_deuda_contrato(self.contrato.id)
+        resumen.refresh_from_db()
+        self.assertEqual(resumen.total_pagado, Decimal('50.00'))
+        self.assertEqual(verificar_resumenes(), [])
+
+    def test_vista_de_lectura_actualiza_resumen_al_calcular_mora(self):
+        from .models import ResumenContrato
+        from .services import actualizar_moras_pendientes
+
+        # La tabla se generó sin mora; la primera lectura del día la calcula
+        actualizar_moras_pendientes(Contrato.objects.filter(id=self.contrato.id))
+        resumen = ResumenContrato.objects.get(contrato=self.contrato)
+        self.assertEqual(resumen.saldo_mora, Decimal('9.00'))
+        self.assertEqual(resumen.saldo_pendiente, Decimal('1209.00'))
+
+    def test_comando_detecta_y_reconstruye(self):
+        from io import StringIO
+        from django.core.management import call_command
+        from .models import ResumenContrato
+        from .services import verificar_resumenes
+
+        ResumenContrato.objects.filter(contrato=self.contrato).update(saldo_pendiente=0)
+        self.assertTrue(verificar_resumenes())
+
+        salida = StringIO()
+        call_command('reconstruir_resumenes', '--verificar', stdout=salida)
+        self.assertIn('saldo_pendiente', salida.getvalue())
+
+        call_command('reconstruir_resumenes', stdout=StringIO())
+        self.assertEqual(verificar_resumenes(), [])
+        self.assertEqual(ResumenContrato.objects.get(contrato=self.contrato).saldo_pendiente, Decimal('1200.00'))
+
+
+class ReporteGeneralTests(TestCase):
+    """reporte_general_view agrega los pagos en la BD: consultas fijas sin importar la cartera."""
+
+    def setUp(self):
+        self.user = User.objects.create_superuser(username='admin', password='password')
+        self.client.force_login(self.user)
+        ConfiguracionSistema.objects.create(nombre_empresa='Test Corp', ruc_empresa='123', mora_porcentaje=Decimal('3.00'))
+        self.hoy = date.today()
+        cache.clear()
+
+    def _contrato(self, i, entrada_marcada=True):
+        from .models import Pago
+        from .services import generar_tabla_amortizacion, registrar_pago_cliente
+        cliente = Cliente.objects.create(
+            vendedor=self.user, cedula=f'{i:010d}', nombres='Test', apellidos=f'User {i}',
+            celular='0999999999', direccion='Test Address'
+        )
+        contrato = Contrato.objects.create(
+            cliente=cliente, fecha_contrato=self.hoy.replace(day=1) - timedelta(days=40),
+            precio_venta_final=1300, valor_entrada=100, saldo_a_financiar=1200, numero_cuotas=12
+        )
+        Pago.objects.create(
+            contrato=contrato, fecha_pago=contrato.fecha_contrato, monto=100,
+            metodo_pago='EFECTIVO', es_entrada=entrada_marcada
+        )
+        generar_tabla_amortizacion(contrato.id)
+        registrar_pago_cliente(contrato.id, '150.00', 'EFECTIVO', None, self.user, fecha_pago=self.hoy)
+        # Pago antiguo sin DetallePago
+        Pago.objects.create(contrato=contrato, fecha_pago=self.hoy, monto=Decimal('20.00'), metodo_pago='EFECTIVO')
+        return contrato
+
+    def _reporte(self, url='/reportes/general/'):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        with CaptureQueriesContext(connection) as consultas:
+            respuesta = self.client.get(url)
+        self.assertEqual(respuesta.status_code, 200)
+        return respuesta, len(consultas.captured_queries)
+
+    def test_totales_y_consultas_constantes(self):
+        self._contrato(1)
+        self._contrato(2, entrada_marcada=False)
+        self._reporte()  # Primera lectura del día: calcula moras
+        cache.clear()  # Medir la construcción, no la lectura desde la caché
+        respuesta, pocos = self._reporte()
+
+        # Entrada (100) + cuotas (150) + pago sin detalles (20); la entrada no entra en la matriz
+        for fila in respuesta.context['reporte_data']:
+            self.assertEqual(fila['total_pagado'], Decimal('270.00'))
+            self.assertEqual(fila['pagos_mensuales'][-1], Decimal('170.00'))
+            self.assertEqual(fila['primera_cuota_capital'], Decimal('100.00'))
+        self.assertEqual(respuesta.context['total_general'], Decimal('540.00'))
+
+        for i in range(3, 11):
+            self._contrato(i, entrada_marcada=i % 2 == 0)
+        self._reporte()
+        cache.clear()
+        respuesta, muchos = self._reporte()
+        self.assertEqual(len(respuesta.context['reporte_data']), 10)
+        self.assertEqual(muchos, pocos)
+
+    def test_pdf_y_exportacion_reusan_el_reporte_en_cache(self):
+        from unittest import mock
+        from . import reportes
+        self._contrato(1)
+        self._contrato(2, entrada_marcada=False)
+
+        construir = mock.patch.object(reportes, 'construir_reporte_general', wraps=reportes.construir_reporte_general)
+        with construir as construido, mock.patch('xhtml2pdf.pisa.CreatePDF'):
+            self._reporte()
+            respuesta = self.client.get('/reportes/general/pdf/')
+            self.assertEqual(respuesta.status_code, 200)
+            respuesta, _ = self._reporte('/reportes/general/exportar/?formato=csv')
+            self.assertEqual(construido.call_count, 1)
+
+            # Un pago nuevo cambia la versión de datos: se reconstruye
+            from .services import registrar_pago_cliente
+            registrar_pago_cliente(Contrato.objects.first().id, '10.00', 'EFECTIVO', None, self.user)
+            self._reporte()
+            self.assertEqual(construido.call_count, 2)
+
+            # Editar un cliente (p. ej. reasignarlo o corregir su nombre) también
+            cliente = Cliente.objects.first()
+            cliente.apellidos = 'Corregido'
+            cliente.save()
+            respuesta_editada, _ = self._reporte()
+            self.assertEqual(construido.call_count, 3)
+            self.assertIn('Corregido', respuesta_editada.content.decode())
+
+        lineas = respuesta.content.decode('utf-8-sig').strip().splitlines()
+        self.assertEqual(len(lineas), 4)  # Encabezados, 2 contratos y totales
+        self.assertTrue(lineas[0].startswith('Contrato;Estado;Cédula'))
+        self.assertTrue(lineas[-1].startswith('TOTALES') and lineas[-1].endswith(';540.00'))
+
+
+class ReporteMensualCierreTests(TestCase):
+    """Los meses cerrados se leen de CierreMensual y solo se invalidan al cambiar pagos de ese mes o anteriores."""
+
+    def setUp(self):
+        from dateutil.relativedelta import relativedelta
+        from .services import generar_tabla_amortizacion
+        self.user = User.objects.create_superuser(username='admin', password='password')
+        ConfiguracionSistema.objects.create(nombre_empresa='Test Corp', ruc_empresa='123', mora_porcentaje=Decimal('3.00'))
+        cliente = Cliente.objects.create(
+            vendedor=self.user, cedula='0000000001', nombres='Test', apellidos='User',
+            celular='0999999999', direccion='Test Address'
+        )
+        self.contrato = Contrato.objects.create(
+            cliente=cliente, fecha_contrato=date.today().replace(day=1) - relativedelta(months=4),
+            precio_venta_final=1200, valor_entrada=0, saldo_a_financiar=1200, numero_cuotas=12
+        )
+        generar_tabla_amortizacion(self.contrato.id)
+        self.cuota = self.contrato.cuotas.get(numero_cuota=1)
+
+    def _mes(self, fecha):
+        from .reportes import datos_reporte_mensual
+        return datos_reporte_mensual(self.user, str(fecha.month), str(fecha.year))
+
+    def test_mes_cerrado_se_guarda_y_conserva_la_mora_al_cierre(self):
+        from unittest import mock
+        from .models import CierreMensual, Pago
+        from .services import registrar_pago_cliente
+        from . import reportes
+        vencimiento = self.cuota.fecha_vencimiento
+        registrar_pago_cliente(self.contrato.id, '50.00', 'EFECTIVO', None, self.user, fecha_pago=vencimiento)
+
+        datos = self._mes(vencimiento)
+        self.assertTrue(datos['es_mes_pasado'])
+        self.assertEqual(datos['total_cobrado_mes'], Decimal('50.00'))
+        self.assertEqual(datos['cobros_lista'][0]['cuotas_cubiertas'], '#1')
+        # Al cierre quedaban $50 de capital + $3 de mora de la cuota #1
+        self.assertEqual(datos['total_mora_historica'], Decimal('53.00'))
+        self.assertEqual(CierreMensual.objects.count(), 1)
+
+        # Un pago de hoy no cambia el mes cerrado: se lee del cierre y de los datos del cliente
+        registrar_pago_cliente(self.contrato.id, '60.00', 'EFECTIVO', None, self.user)
+        construir = mock.patch.object(reportes, 'construir_cierres_mensuales', wraps=reportes.construir_cierres_mensuales)
+        with construir as construido, self.assertNumQueries(2):
+            datos = self._mes(vencimiento)
+        self.assertEqual(construido.call_count, 0)
+        self.assertEqual(datos['total_mora_historica'], Decimal('53.00'))
+
+        # Un pago con fecha en ese mes lo invalida
+        Pago.objects.create(contrato=self.contrato, fecha_pago=vencimiento, monto=Decimal('10.00'), metodo_pago='EFECTIVO')
+        self.assertEqual(CierreMensual.objects.count(), 0)
+        self.assertEqual(self._mes(vencimiento)['total_cobrado_mes'], Decimal('60.00'))
+
+        # El año completo une los cierres con los meses abiertos
+        anual = reportes.datos_reporte_mensual(self.user, 'anual', str(date.today().year))
+        esperado = sum(
+            (p.monto for p in Pago.objects.filter(fecha_pago__year=date.today().year)), Decimal('0.00')
+        )
+        self.assertEqual(anual['total_cobrado_mes'], esperado)
+
+
+    def test_mes_cerrado_sigue_al_vendedor_actual_del_cliente(self):
+        from .models import CierreMensual
+        from .reportes import datos_reporte_mensual
+        from .services import registrar_pago_cliente
+        vencimiento = self.cuota.fecha_vencimiento
+        registrar_pago_cliente(self.contrato.id, '50.00', 'EFECTIVO', None, self.user, fecha_pago=vencimiento)
+        anterior = User.objects.create_user(username='anterior', password='password')
+        nuevo = User.objects.create_user(username='nuevo', password='password')
+        cliente = self.contrato.cliente
+        cliente.vendedor = anterior
+        cliente.save()
+        self._mes(vencimiento)
+        self.assertEqual(CierreMensual.objects.count(), 1)
+        self.assertNotIn('cedula', CierreMensual.objects.get().cobros[0])
+
+        # Reasignar y renombrar al cliente no toca el cierre, pero se ve al leerlo
+        cliente.vendedor = nuevo
+        cliente.apellidos = 'Renombrado'
+        cliente.save()
+        viejo = datos_reporte_mensual(anterior, str(vencimiento.month), str(vencimiento.year))
+        self.assertEqual((viejo['cobros_lista'], viejo['mora_historica_lista']), ([], []))
+        actual = datos_reporte_mensual(nuevo, str(vencimiento.month), str(vencimiento.year))
+        self.assertEqual(actual['total_cobrado_mes'], Decimal('50.00'))
+        self.assertEqual(actual['cobros_lista'][0]['cliente']['apellidos'], 'Renombrado')
+        self.assertEqual(actual['mora_historica_lista'][0]['cliente']['apellidos'], 'Renombrado')
+        self.assertEqual(CierreMensual.objects.count(), 1)
+
+    def test_exencion_y_porcentaje_invalidan_la_mora_al_cierre(self):
+        from .models import CierreMensual
+        vencimiento = self.cuota.fecha_vencimiento
+        self.assertEqual(self._mes(vencimiento)['total_mora_historica'], Decimal('103.00'))
+
+        self.client.force_login(self.user)
+        self.client.post(f'/cuota/{self.cuota.id}/toggle-mora/')
+        self.assertEqual(CierreMensual.objects.count(), 0)
+        self.assertEqual(self._mes(vencimiento)['total_mora_historica'], Decimal('100.00'))
+
+        config = ConfiguracionSistema.objects.get()
+        config.mora_porcentaje = Decimal('5.00')
+        config.save()
+        self.assertEqual(CierreMensual.objects.count(), 0)
+
+
+class ResumenDiarioTests(TestCase):
+    """El ResumenDiario mantenido por señales debe coincidir con una reconstrucción completa."""
+
+    def setUp(self):
+        from .services import generar_tabla_amortizacion
+        self.user = User.objects.create_superuser(username='admin', password='password')
+        ConfiguracionSistema.objects.create(nombre_empresa='Test Corp', ruc_empresa='123', mora_porcentaje=Decimal('3.00'))
+        self.contratos = []
+        for i, entrada in enumerate(['200.00', '150.00']):
+            cliente = Cliente.objects.create(
+                vendedor=self.user, cedula=f'000000000{i}', nombres='Test', apellidos=f'User {i}',
+                celular='0999999999', direccion='Test Address'
+            )
+            contrato = Contrato.objects.create(
+                cliente=cliente, fecha_contrato=date.today() - timedelta(days=120),
+                precio_venta_final=1400, valor_entrada=Decimal(entrada), saldo_a_financiar=1200, numero_cuotas=12
+            )
+            generar_tabla_amortizacion(contrato.id)
+            self.contratos.append(contrato)
+
+    def _filas(self):
+        from .models import ResumenDiario
+        return sorted(ResumenDiario.objects.values_list(
+            'fecha', 'vendedor_id', 'pagos_recibidos', 'ingresos_lotes', 'entradas',
+            'abonos_cuotas', 'ingresos_caja', 'gastos', 'mora_generada'
+        ))
+
+    def test_incremental_igual_a_reconstruccion_y_al_gestor(self):
+        from .models import Pago
+        from .services import actualizar_moras_masivo, actualizar_resumen_diario, registrar_pago_cliente, verificar_resumen_diario
+        from Aplicaciones.sbr_gestor.models import Transaccion
+        from Aplicaciones.sbr_gestor.views import calcular_ganancias_lotes_rapido, totales_gestor
+        primero, segundo = self.contratos
+        hace_un_mes = date.today() - timedelta(days=30)
+
+        # Entrada sin marcar (dato antiguo) en el primero, marcada en el segundo
+        Pago.objects.create(contrato=primero, fecha_pago=primero.fecha_contrato, monto=Decimal('200.00'), metodo_pago='EFECTIVO')
+        Pago.objects.create(contrato=segundo, fecha_pago=segundo.fecha_contrato, monto=Decimal('150.00'),
+                            metodo_pago='EFECTIVO', es_entrada=True)
+        registrar_pago_cliente(primero.id, '100.00', 'EFECTIVO', None, self.user, fecha_pago=hace_un_mes)
+        registrar_pago_cliente(segundo.id, '80.00', 'EFECTIVO', None, self.user)
+        actualizar_moras_masivo(Contrato.objects.all())
+        transaccion = Transaccion.objects.create(tipo='INGRESO', valor=Decimal('40.00'), descripcion='Caja', fecha=hace_un_mes,
+                                                 registrado_por=self.user)
+        Transaccion.objects.create(tipo='GASTO', valor=Decimal('15.50'), descripcion='Gasto', fecha=date.today(),
+                                   registrado_por=self.user)
+        transaccion.fecha = date.today()
+        transaccion.save()
+        segundo.estado = 'DEVOLUCION'
+        segundo.save()
+
+        self.assertEqual(verificar_resumen_diario(), [])
+        incremental = self._filas()
+        actualizar_resumen_diario()
+        self.assertEqual(incremental, self._filas())
+
+        # Mismos totales que el cálculo recorriendo pagos del gestor
+        self.assertEqual(totales_gestor()[0], calcular_ganancias_lotes_rapido())
+        self.assertEqual(totales_gestor()[1:], (Decimal('40.00'), Decimal('15.50')))
+        for fecha in (hace_un_mes, date.today()):
+            self.assertEqual(
+                totales_gestor(fecha.month, fecha.year)[0],
+                calcular_ganancias_lotes_rapido(fecha.month, fecha.year)
+            )
+
+    def test_api_kpis(self):
+        from .services import registrar_pago_cliente
+        registrar_pago_cliente(self.contratos[0].id, '100.00', 'EFECTIVO', None, self.user)
+        self.client.force_login(self.user)
+
+        hoy = date.today().isoformat()
+        datos = self.client.get('/api/kpis/', {'desde': hoy, 'hasta': hoy}).json()
+        self.assertTrue(datos['success'])
+        self.assertEqual(datos['totales']['pagos_recibidos'], '100.00')
+        self.assertEqual([dia['fecha'] for dia in datos['dias']], [hoy])
+
+        self.assertEqual(self.client.get('/api/kpis/', {'desde': 'ayer'}).status_code, 400)
+
+
+class CachePdfTests(TestCase):
+    """Los recibos se renderizan una sola vez mientras sus datos no cambien."""
+
+    def setUp(self):
+        import tempfile
+        from django.test import override_settings
+        from .services import generar_tabla_amortizacion, registrar_pago_cliente
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        ajustes = override_settings(MEDIA_ROOT=media.name)
+        ajustes.enable()
+        self.addCleanup(ajustes.disable)
+
+        self.user = User.objects.create_superuser(username='admin', password='password')
+        ConfiguracionSistema.objects.create(nombre_empresa='Test Corp', ruc_empresa='123', mora_porcentaje=Decimal('3.00'))
+        cliente = Cliente.objects.create(
+            vendedor=self.user, cedula='0000000001', nombres='Test', apellidos='User',
+            celular='0999999999', direccion='Test Address'
+        )
+        self.contrato = Contrato.objects.create(
+            cliente=cliente, fecha_contrato=date.today(), precio_venta_final=1200,
+            valor_entrada=0, saldo_a_financiar=1200, numero_cuotas=12
+        )
+        generar_tabla_amortizacion(self.contrato.id)
+        self.pago = registrar_pago_cliente(self.contrato.id, '100.00', 'EFECTIVO', None, self.user)
+        self.client.force_login(self.user)
+
+    def _renderizador(self):
+        from unittest import mock
+        from . import cache_pdf
+        escribir = lambda html, destino: destino.write(b'%PDF-1.7 ' + html.encode('utf-8')[:50])
+        return mock.patch.object(cache_pdf, '_escribir_pdf', side_effect=escribir)
+
+    def test_descarga_repetida_sale_de_disco_y_responde_304(self):
+        from .services import registrar_pago_cliente
+        url = f'/pago/{self.pago.id}/descargar-recibo/'
+        with self._renderizador() as renderizar:
+            primera = self.client.get(url)
+            segunda = self.client.get(url)
+            self.assertEqual(renderizar.call_count, 1)
+            self.assertEqual(b''.join(primera.streaming_content), b''.join(segunda.streaming_content))
+            self.assertEqual(primera['ETag'], segunda['ETag'])
+
+            no_modificado = self.client.get(url, HTTP_IF_NONE_MATCH=primera['ETag'])
+            self.assertEqual(no_modificado.status_code, 304)
+            self.assertEqual(renderizar.call_count, 1)
+
+            # Otro pago cambia el saldo pendiente del recibo: nueva versión
+            registrar_pago_cliente(self.contrato.id, '50.00', 'EFECTIVO', None, self.user)
+            tercera = self.client.get(url, HTTP_IF_NONE_MATCH=primera['ETag'])
+            self.assertEqual(tercera.status_code, 200)
+            self.assertNotEqual(tercera['ETag'], primera['ETag'])
+            self.assertEqual(renderizar.call_count, 2)
+
+    def test_limpieza_por_tamano_borra_los_menos_usados(self):
+        import os
+        from .cache_pdf import limpiar_cache_pdf
+        from .services import recibo_pago_pdf, recibo_transaccion_pdf
+        with self._renderizador():
+            viejo, _ = recibo_transaccion_pdf(self.pago.id)
+            nuevo, _ = recibo_pago_pdf(self.contrato.cuotas.get(numero_cuota=1).id)
+        os.utime(viejo, (0, 0))
+
+        self.assertEqual(limpiar_cache_pdf(max_mb=os.path.getsize(nuevo) / 1024 / 1024), 1)
+        self.assertFalse(os.path.exists(viejo))
+        self.assertTrue(os.path.exists(nuevo))
+
+    def test_limpieza_tras_fallos_como_mucho_una_vez_por_intervalo(self):
+        from unittest import mock
+        from . import cache_pdf
+        from .services import recibo_pago_pdf, recibo_transaccion_pdf
+        with self._renderizador(), mock.patch.object(cache_pdf, '_ultima_limpieza', None), \
+                mock.patch.object(cache_pdf, 'limpiar_cache_pdf') as limpiar:
+            recibo_transaccion_pdf(self.pago.id)
+            recibo_pago_pdf(self.contrato.cuotas.get(numero_cuota=1).id)
+        self.assertEqual(limpiar.call_count, 1)
+
+
+class TareasPdfTests(TestCase):
+    """La cola de PDF: máximo de renders simultáneos, reintentos y endpoint de estado."""
+
+    def setUp(self):
+        import tempfile
+        from django.test import override_settings
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        ajustes = override_settings(MEDIA_ROOT=media.name, PDF_MAX_RENDERS_CONCURRENTES=1)
+        ajustes.enable()
+        self.addCleanup(ajustes.disable)
+
+        self.user = User.objects.create_superuser(username='admin', password='password')
+        ConfiguracionSistema.objects.create(nombre_empresa='Test Corp', ruc_empresa='123', mora_porcentaje=Decimal('3.00'))
+        self.client.force_login(self.user)
+
+    def test_reporte_en_cola_se_descarga_al_terminar(self):
+        from .models import TareaPDF
+        from .tareas_pdf import ejecutar_tarea, tomar_tareas
+        hoy = date.today()
+        respuesta = self.client.get('/reportes/mensual/pdf/cola/', {'mes': hoy.month, 'anio': hoy.year})
+        self.client.get('/reportes/mensual/pdf/cola/', {'mes': hoy.month, 'anio': hoy.year})
+        tarea = TareaPDF.objects.get()  # La segunda solicitud reutiliza la pendiente
+        self.assertContains(respuesta, f'/api/tareas-pdf/{tarea.id}/')
+        self.assertEqual(self.client.get(f'/api/tareas-pdf/{tarea.id}/').json()['estado'], 'PENDIENTE')
+
+        # Una segunda tarea espera: el máximo de renders simultáneos es 1
+        TareaPDF.objects.create(tipo='REPORTE_GENERAL', solicitado_por=self.user)
+        self.assertEqual(tomar_tareas(5), [tarea.id])
+        self.assertEqual(tomar_tareas(5), [])
+
+        self.assertTrue(ejecutar_tarea(tarea.id))
+        estado = self.client.get(f'/api/tareas-pdf/{tarea.id}/').json()
+        self.assertEqual(estado['estado'], 'LISTO')
+        descarga = self.client.get(estado['url'])
+        self.assertEqual(descarga['Content-Type'], 'application/pdf')
+        self.assertTrue(b''.join(descarga.streaming_content).startswith(b'%PDF'))
+
+    def test_fallo_se_reintenta_con_espera_y_luego_queda_en_error(self):
+        from unittest import mock
+        from django.utils import timezone
+        from . import tareas_pdf
+        from .models import TareaPDF
+        tarea = tareas_pdf.encolar_pdf('CONTRATO', 999, self.user)
+
+        for intento in range(1, 4):
+            TareaPDF.objects.filter(id=tarea.id).update(disponible_desde=timezone.now())
+            self.assertEqual(tareas_pdf.tomar_tareas(1), [tarea.id])
+            with mock.patch.object(tareas_pdf, '_render_contrato', side_effect=OSError('sin fuentes')):
+                self.assertFalse(tareas_pdf.ejecutar_tarea(tarea.id))
+            tarea.refresh_from_db()
+            self.assertEqual(tarea.intentos, intento)
+            if intento < 3:
+                self.assertEqual(tarea.estado, 'PENDIENTE')
+                self.assertGreater(tarea.disponible_desde, timezone.now())
+                self.assertEqual(tareas_pdf.tomar_tareas(1), [])  # Aún en espera
+
+        self.assertEqual(tarea.estado, 'ERROR')
+        self.assertEqual(tarea.error, 'sin fuentes')
+
+class RenderPdfTests(TestCase):
+    """Los recursos locales de los PDF se leen del disco y las imágenes se reutilizan."""
+
+    def test_ruta_local_resuelve_estaticos_y_descarta_hosts_externos(self):
+        from .render_pdf import base_url, ruta_local
+        ruta = ruta_local('/static/img/logo.png')
+        self.assertTrue(ruta.endswith('logo.png'))
+        self.assertEqual(ruta_local(base_url() + '/static/img/logo.png'), ruta)
+        self.assertIsNone(ruta_local('https://ejemplo.com/static/img/logo.png'))
+        self.assertIsNone(ruta_local('/static/img/no_existe.png'))
+        self.assertIsNone(ruta_local('data:image/png;base64,AAAA'))
+
+    def test_cache_imagenes_descarta_la_menos_usada(self):
+        from .render_pdf import CacheImagenes
+        imagenes = CacheImagenes(maximo=2)
+        imagenes['a'] = 1
+        imagenes['b'] = 2
+        imagenes['a']  # 'a' pasa a ser la más reciente
+        imagenes['c'] = 3
+        self.assertEqual(list(imagenes), ['a', 'c'])
+
+class ExportacionPdfTests(TestCase):
+    """Exportación masiva de recibos y estados de cuenta a ZIP o a un solo PDF."""
+
+    def setUp(self):
+        import tempfile
+        from django.test import override_settings
+        from .models import Pago
+        from .services import generar_tabla_amortizacion, registrar_pago_cliente
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        # Sin PDF_EXPORTACION_PROCESOS=1: la cola debe renderizar en el mismo proceso
+        # (un pool, además de pasar el máximo de renders, no vería la transacción del test)
+        ajustes = override_settings(MEDIA_ROOT=media.name, PDF_EXPORTACION_PROCESOS=4)
+        ajustes.enable()
+        self.addCleanup(ajustes.disable)
+
+        self.user = User.objects.create_superuser(username='admin', password='password')
+        ConfiguracionSistema.objects.create(nombre_empresa='Test Corp', ruc_empresa='123', mora_porcentaje=Decimal('3.00'))
+        self.contratos = []
+        for i in range(2):
+            cliente = Cliente.objects.create(
+                vendedor=self.user, cedula=f'000000000{i}', nombres='Test', apellidos=f'User {i}',
+                celular='0999999999', direccion='Test Address'
+            )
+            contrato = Contrato.objects.create(
+                cliente=cliente, fecha_contrato=date.today(), precio_venta_final=1200,
+                valor_entrada=0, saldo_a_financiar=1200, numero_cuotas=12
+            )
+            generar_tabla_amortizacion(contrato.id)
+            self.contratos.append(contrato)
+        self.pagos = [registrar_pago_cliente(c.id, '100.00', 'EFECTIVO', None, self.user) for c in self.contratos]
+        # Un pago fuera del período
+        viejo = registrar_pago_cliente(self.contratos[0].id, '50.00', 'EFECTIVO', None, self.user)
+        Pago.objects.filter(id=viejo.id).update(fecha_pago=date.today() - timedelta(days=400))
+        self.client.force_login(self.user)
+
+        from unittest import mock
+        from . import cache_pdf
+
+        def escribir(html, destino):
+            from pypdf import PdfWriter
+            pdf = PdfWriter()
+            pdf.add_blank_page(width=100, height=100)
+            pdf.write(destino)
+        renderizador = mock.patch.object(cache_pdf, '_escribir_pdf', side_effect=escribir)
+        renderizador.start()
+        self.addCleanup(renderizador.stop)
+
+    def test_zip_de_recibos_del_periodo_con_avance(self):
+        import zipfile
+        from io import BytesIO
+        from .models import TareaPDF
+        from .tareas_pdf import ejecutar_tarea, tomar_tareas
+        hoy = date.today()
+        respuesta = self.client.get('/reportes/exportar-recibos/', {
+            'documentos': 'RECIBOS', 'formato': 'zip',
+            'desde': (hoy - timedelta(days=30)).isoformat(), 'hasta': hoy.isoformat(),
+        })
+        tarea = TareaPDF.objects.get(tipo='EXPORTACION')
+        self.assertContains(respuesta, f'/api/tareas-pdf/{tarea.id}/')
+
+        self.assertEqual(tomar_tareas(1), [tarea.id])
+        self.assertTrue(ejecutar_tarea(tarea.id))
+        estado = self.client.get(f'/api/tareas-pdf/{tarea.id}/').json()
+        self.assertEqual((estado['estado'], estado['progreso'], estado['total']), ('LISTO', 2, 2))
+
+        descarga = self.client.get(estado['url'])
+        with zipfile.ZipFile(BytesIO(b''.join(descarga.streaming_content))) as archivo:
+            self.assertEqual(archivo.namelist(), [f'Recibo_Pago_{p.id}.pdf' for p in self.pagos])
+
+    def test_pdf_unido_de_estados_de_cuenta_en_mora(self):
+        from io import BytesIO
+        from pypdf import PdfReader
+        from .exportacion_pdf import documentos_exportacion, exportar_documentos
+        Contrato.objects.filter(id=self.contratos[1].id).update(esta_en_mora=True)
+
+        ids = documentos_exportacion('ESTADOS')
+        self.assertEqual(ids, [self.contratos[1].id])
+        avance = []
+        salida = BytesIO()
+        exportar_documentos('ESTADOS', ids + [self.contratos[0].id], 'pdf', salida, progreso=avance.append)
+        self.assertEqual(avance, [1, 2])
+        self.assertEqual(len(PdfReader(BytesIO(salida.getvalue())).pages), 2)
+
+    def test_sin_documentos_no_encola(self):
+        from .models import TareaPDF
+        respuesta = self.client.get('/reportes/exportar-recibos/', {'documentos': 'RECIBOS', 'desde': '2000-01-01', 'hasta': '2000-01-31'})
+        self.assertRedirects(respuesta, '/clientes/', fetch_redirect_response=False)
+        self.assertFalse(TareaPDF.objects.filter(tipo='EXPORTACION').exists())
+
+class DatosPagoTests(TestCase):
+    """Datos bancarios y saldo a favor en columnas del Pago (antes texto en la observación)."""
+
+    def test_parser_de_observaciones_anteriores(self):
+        from importlib import import_module
+        extraer_datos_pago = import_module('Aplicaciones.sbr_app_dos.migrations.0036_pago_datos_estructurados').extraer_datos_pago
+        transferencia = extraer_datos_pago("Pago de Entrada (TRANSFERENCIA). Banco: Pichincha S.A.. Cuenta/Comp: 2200-33.")
+        self.assertEqual((transferencia['banco'], transferencia['cuenta'], transferencia['comprobante']), ('Pichincha S.A.', '2200-33', ''))
+
+        deposito = extraer_datos_pago("Pago de Entrada (DEPOSITO). Depósito. Banco: Guayaquil. Comp: 778.")
+        self.assertEqual((deposito['banco'], deposito['cuenta'], deposito['comprobante']), ('Guayaquil', '', '778'))
+        self.assertTrue(deposito['es_deposito'])
+        self.assertFalse(transferencia['es_deposito'])
+
+        # El formulario de venta vaciaba banco y papeleta al elegir depósito: solo queda la marca
+        deposito_vacio = extraer_datos_pago("Pago de Entrada (DEPOSITO). Depósito. Banco: . Comp: .")
+        self.assertEqual((deposito_vacio['banco'], deposito_vacio['comprobante']), ('', ''))
+        self.assertTrue(deposito_vacio['es_deposito'])
+
+        saldo = extraer_datos_pago("Abono en ventanilla | Saldo a favor remanente: $1,050.50")
+        self.assertEqual(saldo['saldo_a_favor'], Decimal('1050.50'))
+        self.assertEqual(saldo['observacion'], 'Abono en ventanilla')
+        self.assertIsNone(extraer_datos_pago("Saldo a favor remanente: $20.00")['observacion'])
+
+    def test_recibos_por_metodo_de_pago(self):
+        from unittest import mock
+        from django.template.loader import render_to_string
+        from . import services
+        from .models import Pago
+        user = User.objects.create_user(username='vendedor', password='password')
+        cliente = Cliente.objects.create(
+            vendedor=user, cedula='0000000001', nombres='Test', apellidos='User', celular='0999999999', direccion='X'
+        )
+        contrato = Contrato.objects.create(
+            cliente=cliente, fecha_contrato=date.today(), precio_venta_final=1200,
+            valor_entrada=200, saldo_a_financiar=1000, numero_cuotas=10
+        )
+        pago = Pago.objects.create(
+            contrato=contrato, fecha_pago=date.today(), monto=200, metodo_pago='EFECTIVO', es_entrada=True
+        )
+
+        def recibo(recibo_pdf, objeto_id):
+            with mock.patch.object(services, 'pdf_en_cache') as en_cache:
+                recibo_pdf(objeto_id)
+            plantilla, contexto = en_cache.call_args.args
+            return contexto, render_to_string(plantilla, contexto)
+
+        # (metodo_pago, banco, cuenta, comprobante) -> casilla marcada, datos bancarios impresos
+        casos = [
+            (('EFECTIVO', '', '', ''), 'En efectivo', None),
+            (('TRANSFERENCIA', 'Pichincha', '2200-33', ''), 'Transferencia', {'banco': 'Pichincha', 'cuenta': '2200-33'}),
+            # Transferencia registrada sin datos (antes salía como EFECTIVO si la observación no decía TRANSFERENCIA)
+            (('TRANSFERENCIA', '', '', ''), 'Transferencia', None),
+            # Depósito: no se marca efectivo ni transferencia y no se imprime la papeleta como cuenta
+            (('DEPOSITO', 'Guayaquil', '', '778'), None, None),
+            # Depósito como lo guarda la venta: sin banco ni papeleta
+            (('DEPOSITO', '', '', ''), None, None),
+        ]
+        for (metodo, banco, cuenta, comprobante), casilla, datos in casos:
+            Pago.objects.filter(id=pago.id).update(metodo_pago=metodo, banco=banco, cuenta=cuenta, comprobante=comprobante)
+            for recibo_pdf, objeto_id in ((services.recibo_entrada_pdf, contrato.id), (services.recibo_transaccion_pdf, pago.id)):
+                with self.subTest(metodo=metodo, comprobante=comprobante, recibo=recibo_pdf.__name__):
+                    contexto, html = recibo(recibo_pdf, objeto_id)
+                    self.assertEqual(contexto['metodo_real_pago'] == 'DEPÓSITO', metodo == 'DEPOSITO')
+                    self.assertEqual(contexto['datos_bancarios'], datos)
+                    for etiqueta in ('En efectivo', 'Transferencia'):
+                        marcada = f'{etiqueta} <div class="check-box">X</div>' in html
+                        self.assertEqual(marcada, etiqueta == casilla, etiqueta)
+                    self.assertNotIn('778', html)
+
+    def test_venta_con_deposito_guarda_el_metodo(self):
+        from .models import Pago
+        from .services import metodo_real_pago
+        user = User.objects.create_user(username='vendedor', password='password')
+        lote = Lote.objects.create(manzana='D', numero_lote='1', dimensiones='10x20m', precio_contado=Decimal('5000'))
+        self.client.force_login(user)
+        # Así llega del formulario: el JS vacía banco y papeleta cuando se elige depósito
+        self.client.post('/ventas/nueva/', {
+            'cedula': '0000000002', 'nombres': 'Ana', 'apellidos': 'Vera', 'celular': '0999999999',
+            'direccion': 'X', 'lote_id': lote.id, 'fecha_contrato': date.today().isoformat(),
+            'precio_final': '5000', 'entrada': '500', 'saldo': '4500', 'plazo': '12',
+            'fecha_primer_pago': (date.today() + timedelta(days=30)).isoformat(),
+            'metodo_pago_entrada': 'DEPOSITO', 'banco_entrada': '', 'cuenta_entrada': '',
+        })
+        entrada = Pago.objects.get(contrato__cliente__cedula='0000000002', es_entrada=True)
+        self.assertEqual(entrada.metodo_pago, 'DEPOSITO')
+        self.assertEqual(entrada.comprobante, '')
+        self.assertEqual(metodo_real_pago(entrada), 'DEPÓSITO')
+
+class CarteraSinteticaTests(TestCase):
+    """Cartera sintética y benchmark de servicios (comandos sembrar_cartera y benchmark_servicios)."""
+
+    def test_cartera_consistente_con_el_motor(self):
+        from .cartera_sintetica import PLAZOS, sembrar_cartera
+        from .models import Pago
+        from .services import verificar_resumenes
+
+        conteos = sembrar_cartera(contratos=12, vendedores=2, manzanas=3, semilla=7)
+
+        self.assertEqual(conteos['contratos'], 12)
+        self.assertEqual(Cuota.objects.count(), conteos['cuotas'])
+        self.assertTrue(set(Contrato.objects.values_list('numero_cuotas', flat=True)) <= set(PLAZOS))
+        self.assertEqual(Pago.objects.filter(es_entrada=True).count(), 12)
+        self.assertEqual(verificar_resumenes(), [])
+        # Las devoluciones y cancelaciones liberan el lote
+        self.assertFalse(Lote.objects.filter(contrato__estado__in=['DEVOLUCION', 'CANCELADO'], estado='VENDIDO').exists())
+
+    def test_benchmark_mide_sin_dejar_cambios_y_detecta_regresiones(self):
+        from .benchmark import comparar_resultados, ejecutar_benchmark
+        from .models import Pago
+
+        resultado = ejecutar_benchmark(
+            repeticiones=2, solo=['registrar_pago_cliente', 'recalcular_deuda_contrato'],
+            sembrar={'contratos': 4, 'vendedores': 1, 'semilla': 3}
+        )
+
+        self.assertEqual(set(resultado['casos']), {'registrar_pago_cliente', 'recalcular_deuda_contrato'})
+        self.assertGreater(resultado['casos']['registrar_pago_cliente']['consultas'], 0)
+        self.assertFalse(Contrato.objects.exists())
+        self.assertFalse(Pago.objects.exists())
+
+        anterior = {'casos': {'recalcular_deuda_contrato': dict(resultado['casos']['recalcular_deuda_contrato'], consultas=1)}}
+        regresiones = comparar_resultados(anterior, resultado)
+        self.assertEqual(len(regresiones), 1)
+        self.assertIn('recalcular_deuda_contrato: consultas 1 ->', regresiones[0])
+
+class InstrumentacionTests(TestCase):
+    """Middleware de instrumentación: Server-Timing, agregado por URL y línea JSON."""
+
+    def setUp(self):
+        from .instrumentacion import agregado_rutas
+        agregado_rutas.reiniciar()
+        self.admin = User.objects.create_superuser(username='admin', password='password')
+        self.client.force_login(self.admin)
+
+    def test_request_medido(self):
+        import json
+        from django.test import override_settings
+        from .instrumentacion import agregado_rutas
+
+        with override_settings(INSTRUMENTACION_MUESTREO=1), self.assertLogs('sbr.instrumentacion', 'INFO') as logs:
+            response = self.client.get('/clientes/')
+
+        self.assertIn('db;dur=', response['Server-Timing'])
+        self.assertIn('tpl;dur=', response['Server-Timing'])
+        linea = json.loads(logs.output[0].split(':', 2)[2])
+        self.assertEqual(linea['ruta'], 'lista_clientes')
+        self.assertGreater(linea['consultas'], 0)
+        self.assertGreater(linea['plantillas_ms'], 0)
+        self.assertLessEqual(len(linea['lentas']), 3)
+
+        ruta, = agregado_rutas.resumen()
+        self.assertEqual((ruta['ruta'], ruta['muestras']), ('lista_clientes', 1))
+
+        datos = self.client.get('/sistema/instrumentacion/?formato=json').json()
+        self.assertEqual(datos['rutas'][0]['ruta'], 'lista_clientes')
+
+    def test_sin_muestreo_no_mide(self):
+        from django.test import override_settings
+        from .instrumentacion import agregado_rutas, medir_pdf, medir_request
+
+        with override_settings(INSTRUMENTACION_MUESTREO=0):
+            response = self.client.get('/clientes/')
+        self.assertNotIn('Server-Timing', response)
+        self.assertEqual(agregado_rutas.resumen(), [])
+
+        # Los cronómetros de PDF solo suman dentro de un request medido
+        import time
+        with medir_pdf():
+            pass
+        with medir_request() as medicion, medir_pdf():
+            time.sleep(0.002)
+        self.assertGreater(medicion.pdf_ms, 1)
+        self.assertEqual(medicion.consultas, 0)
+
+class PresupuestoConsultasVistasTests(CarteraSembradaMixin, PresupuestoConsultasMixin, TestCase):
+    """Reportes y listados: presupuesto de consultas fijo, sin importar el tamaño de la cartera."""
+
+    # url -> consultas máximas (incluye sesión y usuario del request)
+    PRESUPUESTOS = {
+        '/': 10,
+        '/api/kpis/': 9,
+        '/lotes/': 8,
+        '/reportes/mensual/': 15,
+        '/reportes/mensual/?mes=anual': 15,
+        '/reportes/mensual/?mes=1&anio=2025': 17,
+        '/reportes/mensual/pdf/': 15,
+        '/reportes/general/': 23,
+        '/reportes/general/pdf/': 19,
+        '/reportes/general/exportar/?formato=csv': 19,
+        '/gestor/': 12,
+        '/gestor/?lotes=1&tipo=INGRESO': 14,
+        '/gestor/api/totales/': 8,
+        '/caja/': 8,
+        '/caja/?tipo=GASTO': 8,
+    }
+
+    # Lo bastante grande para pasar por todas las ramas (cobros, proyección y mora no vacíos)
+    CARTERA = {'contratos': 8, 'semilla': 1, 'prefijo': 'chica'}
+
+    def _casos(self, usuario, presupuestos):
+        from django.test import Client
+        cliente_http = Client()
+        cliente_http.force_login(usuario)
+
+        def visitar(url):
+            def get():
+                response = cliente_http.get(url)
+                self.assertEqual(response.status_code, 200, url)
+            return get
+        return {url: (visitar(url), maximo) for url, maximo in presupuestos.items()}
+
+    def _ampliar(self):
+        from .cartera_sintetica import sembrar_cartera
+        sembrar_cartera(contratos=30, vendedores=2, semilla=2, prefijo='grande')
+
+    def test_superusuario(self):
+        self.assertConsultasNoCrecen(self._casos(self.admin, self.PRESUPUESTOS), self._ampliar)
+
+    def test_vendedor(self):
+        vendedor = User.objects.get(username='chica_vendedor_1')
+        self.assertConsultasNoCrecen(self._casos(vendedor, self.PRESUPUESTOS), self._ampliar)
+
+    def test_servicios(self):
+        from Aplicaciones.sbr_gestor.views import calcular_ganancias_lotes_rapido
+        from .reportes import construir_reporte_general, rango_reporte
+        hoy = date.today()
+        desde, hasta = rango_reporte()
+        casos = {
+            'calcular_ganancias_lotes_rapido': (
+                lambda: calcular_ganancias_lotes_rapido(str(hoy.month), str(hoy.year)), 2
+            ),
+            'calcular_ganancias_lotes_historico': (calcular_ganancias_lotes_rapido, 2),
+            'construir_reporte_general': (lambda: construir_reporte_general(self.admin, desde, hasta), 6),
+        }
+        self.assertConsultasNoCrecen(casos, self._ampliar)
+
+    def test_lista_clientes(self):
+        self.assertConsultasNoCrecen(self._casos(self.admin, {'/clientes/': 19}), self._ampliar)
+
+    def test_presupuesto_excedido(self):
+        from .presupuesto_consultas import presupuesto_consultas
+        with self.assertRaisesMessage(AssertionError, 'contratos: 3 consultas, presupuesto 2'):
+            with presupuesto_consultas(2, 'contratos'):
+                for contrato_id in Contrato.objects.values_list('id', flat=True)[:2]:
+                    Contrato.objects.get(id=contrato_id)
+        with self.assertPresupuestoConsultas(1):
+            list(Contrato.objects.select_related('cliente'))
+
+class EtiquetasLotesTests(TestCase):
+    def setUp(self):
+        vendedor = User.objects.create_user(username='vendedor', password='password')
+        cliente = Cliente.objects.create(
+            vendedor=vendedor, cedula='0999999999', nombres='Ana', apellidos='Loor', celular='0999999999', direccion='-'
+        )
+        lote = lambda manzana, numero: Lote.objects.create(
+            manzana=manzana, numero_lote=numero, dimensiones='10x20m', precio_contado=Decimal('5000')
+        )
+        datos = dict(cliente=cliente, fecha_contrato=date.today(), saldo_a_financiar=Decimal('1000'), numero_cuotas=10)
+        self.varios = Contrato.objects.create(**datos)
+        self.varios.lotes.add(lote('B', '10'), lote('A', '2'), lote('B', '1'))
+        # Contrato antiguo: solo el campo 'lote', sin M2M
+        self.antiguo = Contrato.objects.create(lote=lote('C', '7'), **datos)
+
+    def test_anotacion_sql_igual_a_las_propiedades(self):
+        for contrato in Contrato.objects.with_lote_labels():
+            referencia = Contrato.objects.get(pk=contrato.pk)
+            self.assertEqual(contrato.manzanas_str, referencia.manzanas_str)
+            self.assertEqual(contrato.numeros_lotes_str, referencia.numeros_lotes_str)
+        contrato = Contrato.objects.with_lote_labels().get(pk=self.varios.pk)
+        self.assertEqual((contrato.manzanas_str, contrato.numeros_lotes_str), ('A, B', '1, 2, 10'))
+
+    def test_propiedades_usan_el_prefetch(self):
+        contratos = list(Contrato.objects.select_related('lote').prefetch_related('lotes').order_by('id'))
+        with self.assertNumQueries(0):
+            etiquetas = [
+                (c.lote_principal.numero_lote, c.lotes_display, c.manzanas_str, c.numeros_lotes_str) for c in contratos
+            ]
+        self.assertEqual(etiquetas, [
+            ('10', 'Mz B - Lote(s) 10, 1 / Mz A - Lote(s) 2', 'A, B', '1, 2, 10'),
+            ('7', 'Mz C - Lote 7', 'C', '7'),
+        ])
+
+class ListadoClientesTests(TestCase):
+    def setUp(self):
+        self.vendedor = User.objects.create_user(username='vendedor', password='password')
+        self.otro = User.objects.create_user(username='otro', password='password')
+        self.admin = User.objects.create_superuser(username='admin', password='password')
+        personas = [
+            ('0911111111', 'Macías Loor', 'José', 'A', '5', self.vendedor),
+            ('0922222222', 'Vera Cedeño', 'Ana', 'A', '12', self.vendedor),
+            ('1733333333', 'Macías Vera', 'Lucía', 'B', '5', self.otro),
+        ]
+        self.contratos = []
+        for i, (cedula, apellidos, nombres, manzana, numero, vendedor) in enumerate(personas):
+            cliente = Cliente.objects.create(
+                vendedor=vendedor, cedula=cedula, nombres=nombres, apellidos=apellidos, celular='0999999999', direccion='-'
+            )
+            lote = Lote.objects.create(manzana=manzana, numero_lote=numero, dimensiones='10x20m', precio_contado=Decimal('5000'))
+            contrato = Contrato.objects.create(
+                cliente=cliente, fecha_contrato=date(2026, 1, 1) + timedelta(days=i % 2), saldo_a_financiar=Decimal('1000'),
+                numero_cuotas=10, esta_en_mora=(i == 1), mora_calculada_hasta=date.today(),
+            )
+            contrato.lotes.add(lote)
+            self.contratos.append(contrato)
+
+    def _ids(self, usuario, **params):
+        self.client.force_login(usuario)
+        response = self.client.get('/clientes/', params)
+        self.assertEqual(response.status_code, 200)
+        return sorted(c.id for c in response.context['contratos'])
+
+    def test_busqueda_por_prefijo_cedula_y_lote(self):
+        macias_loor, vera, macias_vera = [c.id for c in self.contratos]
+        self.assertEqual(self._ids(self.admin, q='macias'), [macias_loor, macias_vera])  # sin tilde
+        self.assertEqual(self._ids(self.admin, q='Mac lo'), [macias_loor])
+        self.assertEqual(self._ids(self.admin, q='0922'), [vera])
+        self.assertEqual(self._ids(self.admin, q='5'), [macias_loor, macias_vera])
+        # El índice sigue los cambios del cliente
+        Cliente.objects.filter(cedula='0922222222').update(apellidos='Zambrano')
+        self.assertEqual(self._ids(self.admin, q='zamb'), [vera])
+        self.assertEqual(self._ids(self.admin, q='vera'), [macias_vera])
+
+    def test_indice_sin_triggers_se_repara(self):
+        from django.db import connection
+        from .busqueda_clientes import indice_texto_incompleto, reparar_indice_texto
+        if connection.vendor != 'sqlite':
+            self.skipTest('Triggers FTS5 solo en SQLite')
+        vera = self.contratos[1].id
+        # Como si una migración hubiera rehecho la tabla de clientes
+        with connection.cursor() as cursor:
+            cursor.execute("DROP TRIGGER sbr_app_dos_cliente_fts_au")
+        Cliente.objects.filter(cedula='0922222222').update(apellidos='Zambrano')
+        self.assertTrue(indice_texto_incompleto())
+        self.assertEqual(self._ids(self.admin, q='zamb'), [])
+
+        self.assertTrue(reparar_indice_texto())
+        self.assertFalse(indice_texto_incompleto())
+        self.assertEqual(self._ids(self.admin, q='zamb'), [vera])
+        self.assertFalse(reparar_indice_texto())
+
+    def test_filtros_y_permisos(self):
+        macias_loor, vera, macias_vera = [c.id for c in self.contratos]
+        self.assertEqual(self._ids(self.admin, mora='en-mora'), [vera])
+        self.assertEqual(self._ids(self.admin, manzana='A', mora='al-dia'), [macias_loor])
+        self.assertEqual(self._ids(self.admin, vendedor=str(self.otro.id)), [macias_vera])
+        # El vendedor solo ve lo suyo aunque pida otro vendedor
+        self.assertEqual(self._ids(self.vendedor, q='macias', vendedor=str(self.otro.id)), [macias_loor])
+        self.assertEqual(self.client.get(f'/api/contratos/{macias_vera}/modal/').status_code, 404)
+        datos = self.client.get(f'/api/contratos/{macias_loor}/modal/').json()
+        self.assertEqual(datos['lote'], {'titulo': 'Mz. A - Lote 5', 'imagen_url': None})
+        self.assertIsNone(datos['entrada'])
+
+    def test_paginacion_por_cursor_recorre_todo_sin_repetir(self):
+        from .busqueda_clientes import pagina_contratos
+        for i in range(7):
+            Contrato.objects.create(
+                cliente=self.contratos[0].cliente, fecha_contrato=date(2025, 6, 1) + timedelta(days=i // 2),
+                saldo_a_financiar=Decimal('1000'), numero_cuotas=10,
+            )
+        esperado = list(Contrato.objects.order_by('-fecha_contrato', '-id').values_list('id', flat=True))
+        vistos, cursor, paginas = [], None, []
+        while True:
+            with self.assertNumQueries(1):
+                pagina = pagina_contratos(Contrato.objects.all(), despues=cursor, tamano=3)
+            paginas.append(pagina)
+            vistos += [c.id for c in pagina['contratos']]
+            cursor = pagina['siguiente']
+            if cursor is None:
+                break
+        self.assertEqual(vistos, esperado)
+        self.assertIsNone(paginas[0]['anterior'])
+        # Volver atrás desde la última página da la penúltima
+        atras = pagina_contratos(Contrato.objects.all(), antes=paginas[-1]['anterior'], tamano=3)
+        self.assertEqual([c.id for c in atras['contratos']], [c.id for c in paginas[-2]['contratos']])
+
+class GananciasHistoricasTests(CarteraSembradaMixin, TestCase):
+    CARTERA = {'contratos': 30, 'semilla': 7, 'prefijo': 'ganancias'}
+
+    @classmethod
+    def setUpTestData(cls):
+        from .models import Pago
+        super().setUpTestData()
+        contratos = list(Contrato.objects.order_by('id'))
+        # Datos antiguos: entradas sin el flag es_entrada (el primer pago es la entrada)...
+        Pago.objects.filter(contrato__in=contratos[:8], es_entrada=True).update(es_entrada=False)
+        # ...a veces sin valor_entrada en el contrato (entonces el primer pago es un abono)
+        Contrato.objects.filter(id__in=[c.id for c in contratos[:3]]).update(valor_entrada=Decimal('0.00'))
+        # y devoluciones que restan
+        Contrato.objects.filter(id__in=[c.id for c in contratos[5:12:2]]).update(estado='DEVOLUCION')
+
+    @staticmethod
+    def _recorrido_por_contrato():
+        """El cálculo anterior (un recorrido por contrato), como referencia."""
+        total = Decimal('0.00')
+        for contrato in Contrato.objects.all():
+            ids_entradas = set(contrato.pago_set.filter(es_entrada=True).values_list('id', flat=True))
+            if contrato.valor_entrada > 0 and not ids_entradas:
+                primer_pago = contrato.pago_set.order_by('id').first()
+                if primer_pago:
+                    ids_entradas.add(primer_pago.id)
+            contrato_total = contrato.valor_entrada or Decimal('0.00')
+            for pago in contrato.pago_set.exclude(id__in=ids_entradas):
+                contrato_total += pago.monto
+            total += -contrato_total if contrato.estado == 'DEVOLUCION' else contrato_total
+        return total
+
+    def test_igual_al_recorrido_por_contrato_en_dos_consultas(self):
+        from Aplicaciones.sbr_gestor.views import calcular_ganancias_lotes_rapido
+        esperado = self._recorrido_por_contrato()
+        with self.assertNumQueries(2):
+            total = calcular_ganancias_lotes_rapido()
+        self.assertEqual(total, esperado)
+        self.assertEqual(str(total), str(esperado.quantize(Decimal('0.01'))))
+
+class LibroCajaTests(CarteraSembradaMixin, TestCase):
+    CARTERA = {'contratos': 12, 'semilla': 3, 'prefijo': 'libro'}
+
+    def _totales_directos(self):
+        from Aplicaciones.sbr_gestor.views import totales_gestor
+        ingresos_lotes, ingresos_caja, gastos = totales_gestor()
+        return {'ingresos': ingresos_lotes + ingresos_caja, 'gastos': gastos, 'saldo': ingresos_lotes + ingresos_caja - gastos}
+
+    def test_cuadra_con_los_totales_despues_de_editar_y_eliminar(self):
+        from Aplicaciones.sbr_gestor.libro import totales_libro, verificar_libro
+        from Aplicaciones.sbr_gestor.models import AsientoLibro, Transaccion
+        from .models import MovimientoCaja, Pago
+        self.assertEqual(verificar_libro(), [])
+        self.assertEqual(totales_libro(), self._totales_directos())
+        primeros = list(AsientoLibro.objects.order_by('id').values_list('id', 'importe', 'saldo')[:20])
+
+        contratos = list(Contrato.objects.filter(estado='ACTIVO').order_by('id'))
+        pago = Pago.objects.filter(contrato=contratos[0], es_entrada=False).order_by('-id').first()
+        pago.monto += Decimal('15.50')
+        pago.fecha_pago -= timedelta(days=40)
+        pago.save()
+        Pago.objects.filter(contrato=contratos[1], es_entrada=False).order_by('id').first().delete()
+        contratos[2].estado = 'DEVOLUCION'
+        contratos[2].save()
+        contratos[3].delete()
+        tr = Transaccion.objects.create(tipo='GASTO', valor=Decimal('80.00'), fecha=date.today(), descripcion='x')
+        tr.tipo, tr.valor = 'INGRESO', Decimal('95.25')
+        tr.save()
+        Transaccion.objects.exclude(pk=tr.pk).first().delete()
+        movimiento = MovimientoCaja.objects.first()
+        movimiento.monto += Decimal('1.00')
+        movimiento.save()
+
+        self.assertEqual(verificar_libro(), [])
+        self.assertEqual(totales_libro(), self._totales_directos())
+        # Solo se agregan asientos: los anteriores siguen iguales
+        self.assertEqual(list(AsientoLibro.objects.order_by('id').values_list('id', 'importe', 'saldo')[:20]), primeros)
+        # Los datos de origen no cambiaron desde la última sincronización: nada que asentar
+        from Aplicaciones.sbr_gestor.libro import sincronizar_libro
+        self.assertEqual(sincronizar_libro(), 0)
+
+    def test_saldo_a_una_fecha_con_cortes(self):
+        from Aplicaciones.sbr_gestor.libro import saldo_al, totales_libro
+        from Aplicaciones.sbr_gestor.models import AsientoLibro, CorteLibro, Transaccion
+        directo = lambda fecha: sum(AsientoLibro.objects.filter(fecha__lte=fecha, cuenta='GESTOR').values_list('importe', flat=True), Decimal('0.00'))
+        hace_un_anio = date.today() - timedelta(days=365)
+
+        self.assertEqual(saldo_al(hace_un_anio), directo(hace_un_anio))
+        self.assertTrue(CorteLibro.objects.filter(cuenta='GESTOR', fecha__lt=hace_un_anio).exists())
+        self.assertEqual(saldo_al(date.today()), totales_libro()['saldo'])
+        # Ya con cortes: un corte + la cola del mes
+        with self.assertNumQueries(2):
+            saldo_al(hace_un_anio)
+
+        # Un gasto con fecha atrasada invalida los cortes desde su fecha
+        atrasada = hace_un_anio - timedelta(days=60)
+        Transaccion.objects.create(tipo='GASTO', valor=Decimal('123.45'), fecha=atrasada, descripcion='atrasado')
+        self.assertFalse(CorteLibro.objects.filter(cuenta='GESTOR', fecha__gte=atrasada).exists())
+        self.assertEqual(saldo_al(hace_un_anio), directo(hace_un_anio))
+        self.assertEqual(saldo_al(atrasada - timedelta(days=1)), directo(atrasada - timedelta(days=1)))
+
+    def test_totales_sin_filtro_en_una_consulta(self):
+        from Aplicaciones.sbr_gestor.libro import totales_libro
+        from Aplicaciones.sbr_gestor.views import obtener_saldo_general_global
+        with self.assertNumQueries(1):
+            saldo = obtener_saldo_general_global()
+        esperado = self._totales_directos()
+        self.assertEqual(saldo, esperado['saldo'])
+
+        respuesta = self.client.get('/gestor/api/totales/').json()
+        self.assertEqual(respuesta['saldo_actual'], f"{esperado['saldo']:.2f}")
+        self.assertEqual(respuesta['total_ingresos'], f"{esperado['ingresos']:.2f}")
+        # La caja de movimientos usa su propia cuenta
+        from .models import MovimientoCaja
+        caja = totales_libro('CAJA')
+        ingresos = sum(MovimientoCaja.objects.filter(tipo='INGRESO').values_list('monto', flat=True), Decimal('0.00'))
+        self.assertEqual(caja['ingresos'], ingresos)
+
+class GraficosGestorTests(CarteraSembradaMixin, TestCase):
+    CARTERA = {'contratos': 10, 'semilla': 5, 'prefijo': 'graficos'}
+
+    def test_totales_por_categoria_igual_al_recorrido(self):
+        from Aplicaciones.sbr_gestor.models import Transaccion
+        from Aplicaciones.sbr_gestor.views import totales_gestor
+        Transaccion.objects.create(tipo='GASTO', valor=Decimal('12.34'), fecha=date.today(), descripcion='sin categoría')
+        esperado = {'INGRESO': {}, 'GASTO': {}}
+        for tr in Transaccion.objects.select_related('categoria'):
+            nombre = tr.categoria.nombre if tr.categoria else ('Otros Ingresos' if tr.tipo == 'INGRESO' else 'Sin Categoría')
+            esperado[tr.tipo][nombre] = esperado[tr.tipo].get(nombre, Decimal('0.00')) + tr.valor
+        esperado['INGRESO']['Venta de Lotes'] = totales_gestor()[0]
+
+        datos = self.client.get('/gestor/api/graficos/categorias/').json()
+        for clave, tipo in (('ingresos', 'INGRESO'), ('gastos', 'GASTO')):
+            self.assertEqual(dict(zip(datos[clave]['labels'], datos[clave]['data'])), {k: float(v) for k, v in esperado[tipo].items()})
+            self.assertEqual(datos[clave]['data'], sorted(datos[clave]['data'], reverse=True))
+
+    def test_serie_por_semana_y_mes(self):
+        from Aplicaciones.sbr_gestor.graficos import serie_ingresos_gastos
+        from .services import totales_resumen_diario
+        desde, hasta = date.today() - timedelta(days=200), date.today()
+        for periodo in ('semana', 'mes'):
+            serie = serie_ingresos_gastos(periodo, desde, hasta)
+            totales = totales_resumen_diario(desde, hasta)
+            self.assertAlmostEqual(sum(serie['ingresos']), float(totales['ingresos_lotes'] + totales['ingresos_caja']), places=2)
+            self.assertAlmostEqual(sum(serie['gastos']), float(totales['gastos']), places=2)
+        semanas = serie_ingresos_gastos('semana', desde, hasta)['labels']
+        self.assertTrue(all(date.fromisoformat(d).weekday() == 0 for d in semanas))
+        self.assertEqual(len(serie_ingresos_gastos('dia')['labels']), 30)
+        self.assertEqual(self.client.get('/gestor/api/graficos/serie/?periodo=anio').status_code, 400)
+
+    def test_revalidacion_con_etag(self):
+        from Aplicaciones.sbr_gestor.models import CategoriaTransaccion, Transaccion
+        url = '/gestor/api/graficos/serie/?periodo=semana'
+        primera = self.client.get(url)
+        self.assertEqual(primera.status_code, 200)
+        self.assertIn('Last-Modified', primera)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=primera['ETag']).status_code, 304)
+
+        # Cambiar solo la categoría no toca el libro de caja, pero sí la versión
+        tr = Transaccion.objects.filter(tipo='GASTO').first()
+        tr.categoria = CategoriaTransaccion.objects.create(nombre='Nueva', tipo='GASTO')
+        tr.save()
+        segunda = self.client.get(url, HTTP_IF_NONE_MATCH=primera['ETag'])
+        self.assertEqual(segunda.status_code, 200)
+        self.assertNotEqual(segunda['ETag'], primera['ETag'])
+
+        Transaccion.objects.create(tipo='INGRESO', valor=Decimal('5.00'), fecha=date.today(), descripcion='x')
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=segunda['ETag']).status_code, 200)
+
+    def test_dashboard_muestra_una_pagina(self):
+        from Aplicaciones.sbr_gestor.models import Transaccion
+        from Aplicaciones.sbr_gestor.movimientos import TAMANO_PAGINA_MOVIMIENTOS, pagina_movimientos_gestor
+        total = Transaccion.objects.count()
+        respuesta = self.client.get('/gestor/')
+        self.assertEqual(len(respuesta.context['movimientos']), min(total, TAMANO_PAGINA_MOVIMIENTOS))
+
+        # Con lotes: las páginas recorren todo sin repetir, en orden de fecha
+        vistos, cursor = [], None
+        while True:
+            datos = pagina_movimientos_gestor(con_lotes=True, despues=cursor, tamano=7)
+            vistos += datos['movimientos']
+            cursor = datos['siguiente']
+            if not cursor:
+                break
+        self.assertGreater(len(vistos), total)
+
+
+class HistorialMovimientosTests(CarteraSembradaMixin, TestCase):
+    CARTERA = {'contratos': 8, 'semilla': 9, 'prefijo': 'historial'}
+
+    @classmethod
+    def setUpTestData(cls):
+        from Aplicaciones.sbr_gestor.models import CategoriaTransaccion, Transaccion
+        from .models import MovimientoCaja
+        super().setUpTestData()
+        # Varios movimientos el mismo día: el cursor debe desempatar por origen e id
+        hoy = date.today()
+        cls.categoria = CategoriaTransaccion.objects.create(nombre='Historial', tipo='GASTO')
+        for i in range(4):
+            Transaccion.objects.create(tipo='GASTO', valor=Decimal('5.00'), fecha=hoy, categoria=cls.categoria)
+            MovimientoCaja.objects.create(tipo='INGRESO' if i % 2 else 'GASTO', monto=Decimal('3.00'), fecha=hoy)
+
+    def _recorrer(self, pagina, **filtros):
+        """Todas las páginas hacia adelante y luego hacia atrás: (adelante, [páginas hacia atrás])."""
+        paginas = [pagina(tamano=4, **filtros)]
+        while paginas[-1]['siguiente']:
+            paginas.append(pagina(tamano=4, despues=paginas[-1]['siguiente'], **filtros))
+        atras = [paginas[-1]]
+        while atras[-1]['anterior']:
+            atras.append(pagina(tamano=4, antes=atras[-1]['anterior'], **filtros))
+        return paginas, atras
+
+    def test_paginas_cubren_el_feed_en_orden(self):
+        from Aplicaciones.sbr_gestor.models import Transaccion
+        from Aplicaciones.sbr_gestor.movimientos import ORIGENES, pagina_feed, ramas_gestor
+        from .models import Contrato, Pago
+        paginas, atras = self._recorrer(lambda **kw: pagina_feed(ramas_gestor(con_lotes=True), **kw))
+        claves = [clave for p in paginas for clave in p['claves']]
+        self.assertEqual(claves, sorted(claves, key=lambda c: (c[2], ORIGENES[c[0]], c[1]), reverse=True))
+        self.assertEqual(len(set(claves)), len(claves))
+        # Hacia atrás se vuelven a ver exactamente las mismas páginas
+        self.assertEqual([p['claves'] for p in atras[::-1]], [p['claves'] for p in paginas])
+
+        esperadas = (
+            Transaccion.objects.count()
+            + Pago.objects.exclude(contrato__estado='DEVOLUCION').count()
+            + Contrato.objects.filter(valor_entrada__gt=0, pago__isnull=True).exclude(estado='DEVOLUCION').count()
+        )
+        self.assertEqual(len(claves), esperadas)
+
+    def test_filtros(self):
+        from Aplicaciones.sbr_gestor.models import Transaccion
+        from Aplicaciones.sbr_gestor.movimientos import pagina_movimientos_gestor
+        desde = date.today() - timedelta(days=60)
+        paginas, _ = self._recorrer(pagina_movimientos_gestor, desde=desde, tipo='GASTO', con_lotes=True)
+        filas = [fila for p in paginas for fila in p['movimientos']]
+        self.assertEqual(len(filas), Transaccion.objects.filter(tipo='GASTO', fecha__gte=desde).count())
+        self.assertTrue(all(f['tipo'] == 'GASTO' and f['fecha'] >= desde and not f['is_lote'] for f in filas))
+
+        solo_categoria = pagina_movimientos_gestor(categoria=str(self.categoria.id))['movimientos']
+        self.assertEqual(len(solo_categoria), 4)
+        lotes = pagina_movimientos_gestor(categoria='lotes', tamano=50)['movimientos']
+        self.assertTrue(lotes and all(f['is_lote'] for f in lotes))
+
+        # Un cursor inválido se ignora: primera página
+        respuesta = self.client.get('/gestor/', {'tipo': 'GASTO', 'desde': desde.isoformat(), 'despues': 'basura'})
+        self.assertEqual([f['id'] for f in respuesta.context['movimientos']], [f['id'] for f in filas[:25]])
+
+    def test_caja_paginada_en_la_bd(self):
+        from Aplicaciones.sbr_gestor.movimientos import pagina_movimientos_caja
+        from .models import MovimientoCaja
+        paginas, atras = self._recorrer(pagina_movimientos_caja)
+        vistos = [m.id for p in paginas for m in p['movimientos']]
+        self.assertEqual(vistos, list(MovimientoCaja.objects.order_by('-fecha', '-id').values_list('id', flat=True)))
+        self.assertEqual([m.id for p in atras[::-1] for m in p['movimientos']], vistos)
+
+        respuesta = self.client.get('/caja/', {'tipo': 'INGRESO'})
+        self.assertTrue(all(m.tipo == 'INGRESO' for m in respuesta.context['movimientos']))
+        self.assertNotContains(respuesta, 'dataTables')
@@ -8,6 +8,8 @@ urlpatterns = [
     # --- DASHBOARD / HOME ---
     # Vista principal: Resumen de ventas o accesos directos
     path('', views.dashboard_view, name='dashboard'),
+    # KPIs (JSON) desde el resumen diario
+    path('api/kpis/', views.api_kpis_view, name='api_kpis'),
 
     # --- FLUJO DE VENTAS ---
     # El "Wizard" paso a paso para vender
@@ -15,6 +17,8 @@ urlpatterns = [
     
     # Listado de mis clientes (Vendedor ve los suyos, Admin ve todos)
     path('clientes/', views.lista_clientes_view, name='lista_clientes'),
+    # Modales del listado (foto del lote, pago de entrada), cargados al abrirlos
+    path('api/contratos/<int:pk>/modal/', views.api_contrato_modal_view, name='api_contrato_modal'),
     
     # Detalle profundo: Tabla de amortización, estado de cuenta
     path('contrato/<int:pk>/detalle/', views.detalle_contrato_view, name='detalle_contrato'),
@@ -54,11 +58,21 @@ urlpatterns = [
     path('reportes/mensual/pdf/', views.reporte_mensual_pdf_view, name='reporte_mensual_pdf'),
     path('reportes/general/', views.reporte_general_view, name='reporte_general'),
     path('reportes/general/pdf/', views.reporte_general_pdf_view, name='reporte_general_pdf'),
+    path('reportes/general/exportar/', views.reporte_general_exportar_view, name='reporte_general_exportar'),
+    path('reportes/<str:reporte>/pdf/cola/', views.encolar_reporte_pdf_view, name='encolar_reporte_pdf'),
+    path('reportes/exportar-recibos/', views.encolar_exportacion_view, name='encolar_exportacion'),
+
+    # Cola de PDF (estado y descarga de tareas en segundo plano)
+    path('api/tareas-pdf/<int:tarea_id>/', views.api_tarea_pdf_view, name='api_tarea_pdf'),
+    path('tareas-pdf/<int:tarea_id>/descargar/', views.descargar_tarea_pdf_view, name='descargar_tarea_pdf'),
 
     path('lotes/', views.gestion_lotes_view, name='gestion_lotes'),
     path('lotes/crear/', views.crear_lote_view, name='crear_lote'),
     path('lotes/editar/<int:pk>/', views.editar_lote_view, name='editar_lote'),
     
+    # Métricas de rendimiento por URL (superusuarios)
+    path('sistema/instrumentacion/', views.instrumentacion_view, name='instrumentacion'),
+
     # Control manual de mora
     path('cuota/<int:cuota_id>/toggle-mora/', views.toggle_mora_cuota, name='toggle_mora_cuota'),
     
@@ -1,26 +1,43 @@
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required
+from django.contrib.auth.models import User
 from django.contrib import messages
-from django.db.models import Sum, Q
-from django.http import FileResponse, HttpResponse
+from django.db.models import OuterRef, Prefetch, Q, Subquery, Sum
+from django.core.files.storage import default_storage
+from django.http import FileResponse, Http404, HttpResponse, JsonResponse
+from django.urls import reverse
 from datetime import date
+from urllib.parse import urlencode
 from decimal import Decimal, ROUND_HALF_UP
 from django.db import transaction
+from django.conf import settings
 from django.template.loader import render_to_string
-from .services import actualizar_moras_contrato 
+from .services import (
+    actualizar_moras_contrato, actualizar_moras_pendientes, datos_bancarios_pago, invalidar_cierres_desde, metodo_real_pago,
+    obtener_resumen, serie_resumen_diario, totales_resumen_diario
+)
+from .reportes import (
+    contexto_reporte_general, datos_reporte_mensual, exportar_reporte_csv, exportar_reporte_xlsx,
+    obtener_reporte_general, pdf_reporte_general, pdf_reporte_mensual, rango_reporte
+)
+from .cache_pdf import respuesta_pdf
+from .tareas_pdf import encolar_pdf, estado_tarea, url_resultado
+from .exportacion_pdf import FORMATOS_EXPORTACION, TIPOS_EXPORTACION, documentos_exportacion
+from .instrumentacion import agregado_rutas, medir_pdf
+from .busqueda_clientes import FILTROS_CLIENTES, filtrar_contratos, pagina_contratos
 import base64
 import os
 from django.contrib.staticfiles import finders
 # Importamos Modelos
-from .models import Cliente, Lote, Contrato, Pago, Cuota, ConfiguracionSistema, DetallePago, MovimientoCaja
+from .models import Cliente, Lote, Contrato, Pago, Cuota, ConfiguracionSistema, DetallePago, MovimientoCaja, TareaPDF
 
 # Importamos Servicios (La lógica pesada)
 from .services import (
     generar_tabla_amortizacion, 
     registrar_pago_cliente, 
     generar_pdf_contrato,
-    generar_recibo_entrada_buffer,
-    generar_recibo_pago_buffer
+    recibo_entrada_pdf,
+    recibo_pago_pdf
 )
 
 # ==========================================
@@ -35,19 +52,43 @@ def dashboard_view(request):
         contratos = Contrato.objects.filter(cliente__vendedor=request.user)
 
     total_ventas = contratos.count()
-    # Sumar pagos realizados hoy
-    pagos_hoy = Pago.objects.filter(
-        fecha_pago=date.today(),
-        contrato__in=contratos
-    ).aggregate(Sum('monto'))['monto__sum'] or 0
+    # Sumar pagos realizados hoy (ResumenDiario: no recorre los pagos)
+    vendedor = None if request.user.is_superuser else request.user
+    pagos_hoy = totales_resumen_diario(date.today(), date.today(), vendedor)['pagos_recibidos'] or 0
 
     context = {
         'total_ventas': total_ventas,
         'pagos_hoy': pagos_hoy,
-        'contratos_recientes': contratos.order_by('-id')[:5]
+        'contratos_recientes': contratos.select_related('cliente', 'lote').order_by('-id')[:5]
     }
     return render(request, 'dashboard.html', context)
 
+@login_required
+def api_kpis_view(request):
+    """
+    KPIs del rango ?desde=YYYY-MM-DD&hasta=YYYY-MM-DD (por defecto el mes en curso),
+    leídos del ResumenDiario: totales y serie por día. El vendedor solo ve lo suyo.
+    """
+    hoy = date.today()
+    try:
+        desde = date.fromisoformat(request.GET['desde']) if request.GET.get('desde') else hoy.replace(day=1)
+        hasta = date.fromisoformat(request.GET['hasta']) if request.GET.get('hasta') else hoy
+    except ValueError:
+        return JsonResponse({'success': False, 'error': 'Fechas inválidas, use YYYY-MM-DD'}, status=400)
+
+    vendedor = None if request.user.is_superuser else request.user
+    formato = lambda fila: {campo: f"{valor:.2f}" for campo, valor in fila.items() if campo != 'fecha'}
+    return JsonResponse({
+        'success': True,
+        'desde': desde.isoformat(),
+        'hasta': hasta.isoformat(),
+        'totales': formato(totales_resumen_diario(desde, hasta, vendedor)),
+        'dias': [
+            {'fecha': fila['fecha'].isoformat(), **formato(fila)}
+            for fila in serie_resumen_diario(desde, hasta, vendedor)
+        ],
+    })
+
 # ==========================================
 # 2. NUEVA VENTA (Wizard)
 # ==========================================
@@ -113,7 +154,7 @@ def crear_venta_view(request):
                 banco_entrada = request.POST.get('banco_entrada')
                 cuenta_entrada = request.POST.get('cuenta_entrada')
                 
-                metodo_modelo = 'TRANSFERENCIA' if metodo_entrada in ['TRANSFERENCIA', 'DEPOSITO'] else 'EFECTIVO'
+                metodo_modelo = metodo_entrada if metodo_entrada in ['TRANSFERENCIA', 'DEPOSITO'] else 'EFECTIVO'
                 
                 observacion_pago = f"Pago de Entrada ({metodo_entrada})."
                 if metodo_entrada == 'TRANSFERENCIA':
@@ -146,7 +187,11 @@ def crear_venta_view(request):
                         comprobante_imagen=request.FILES.get('comprobante'),
                         observacion=observacion_pago,
                         registrado_por=request.user,
-                        es_entrada=True
+                        es_entrada=True,
+                        # Datos bancarios en columnas: los recibos ya no leen la observación
+                        banco=(banco_entrada or '') if metodo_entrada in ['TRANSFERENCIA', 'DEPOSITO'] else '',
+                        cuenta=(cuenta_entrada or '') if metodo_entrada == 'TRANSFERENCIA' else '',
+                        comprobante=(cuenta_entrada or '') if metodo_entrada == 'DEPOSITO' else '',
                     )
 
                 # Marcar lotes como vendidos
@@ -159,7 +204,10 @@ def crear_venta_view(request):
                 # 4. GENERAR LÓGICA
                 generar_tabla_amortizacion(contrato.id, fecha_inicio_pago_str=fecha_pago_input)
                 actualizar_moras_contrato(contrato.id)
-                generar_pdf_contrato(contrato.id)
+                # El PDF se renderiza en el worker (procesar_pdfs); la tarea se confirma con la venta
+                encolar_pdf('CONTRATO', contrato.id, request.user)
+                if contrato.valor_entrada > 0:
+                    encolar_pdf('RECIBO_ENTRADA', contrato.id, request.user)
 
                 messages.success(request, f'Contrato N° {contrato.id} generado exitosamente.')
                 return redirect('detalle_contrato', pk=contrato.id)
@@ -184,21 +232,86 @@ def crear_venta_view(request):
 # ==========================================
 @login_required
 def lista_clientes_view(request):
+    """
+    Listado paginado en el servidor: ?q= (nombre, cédula o número de lote), ?estado=,
+    ?mora=en-mora|al-dia, ?vendedor= (solo admin), ?manzana= y los cursores ?despues= / ?antes=.
+    """
     # Filtro de seguridad: Vendedor solo ve lo suyo
     if request.user.is_superuser:
-        clientes = Cliente.objects.all()
         contratos_activos = Contrato.objects.filter(estado='ACTIVO')
-        contratos = Contrato.objects.select_related('cliente').prefetch_related('lotes').order_by('fecha_contrato', 'id')
+        contratos = Contrato.objects.all()
     else:
-        clientes = Cliente.objects.filter(vendedor=request.user)
         contratos_activos = Contrato.objects.filter(estado='ACTIVO', cliente__vendedor=request.user)
-        contratos = Contrato.objects.filter(cliente__vendedor=request.user).select_related('cliente').prefetch_related('lotes').order_by('fecha_contrato', 'id')
-    
-    # NUEVA LÓGICA: Forzar recálculo masivo de moras en tiempo real para todos los contratos listados
-    from .services import actualizar_moras_masivo
-    actualizar_moras_masivo(contratos_activos)
-    
-    return render(request, 'ventas/lista_clientes.html', {'clientes': clientes, 'contratos': contratos})
+        contratos = Contrato.objects.filter(cliente__vendedor=request.user)
+
+    # Recálculo masivo de moras solo para los contratos que aún no se calcularon hoy
+    # (antes de filtrar: el filtro "En Mora" usa esta_en_mora)
+    actualizar_moras_pendientes(contratos_activos)
+
+    filtros = {campo: request.GET.get(campo, '').strip() for campo in FILTROS_CLIENTES}
+    if not request.user.is_superuser:
+        filtros['vendedor'] = ''
+    contratos = filtrar_contratos(contratos, **filtros)
+
+    # Pago de entrada (el primero de cada contrato) y valor de la primera cuota sin
+    # una consulta por fila: la plantilla usa contrato.pagos_entrada.0 y contrato.valor_primera_cuota
+    primer_pago = Pago.objects.filter(contrato=OuterRef('contrato')).order_by('id').values('id')[:1]
+    contratos = contratos.with_lote_labels().select_related('cliente', 'lote').prefetch_related(
+        'lotes',
+        Prefetch('pago_set', queryset=Pago.objects.filter(id=Subquery(primer_pago)), to_attr='pagos_entrada'),
+    ).annotate(
+        valor_primera_cuota=Subquery(
+            Cuota.objects.filter(contrato=OuterRef('pk')).order_by('numero_cuota').values('valor_capital')[:1]
+        )
+    )
+    pagina = pagina_contratos(contratos, request.GET.get('despues'), request.GET.get('antes'))
+
+    # Enlaces de página: los mismos filtros con el cursor nuevo
+    parametros = {campo: valor for campo, valor in filtros.items() if valor}
+    enlace = lambda cursor: '?' + urlencode({**parametros, **cursor})
+
+    context = {
+        'contratos': pagina['contratos'],
+        'filtros': filtros,
+        'hay_filtros': bool(parametros),
+        'pagina_siguiente': enlace({'despues': pagina['siguiente']}) if pagina['siguiente'] else None,
+        'pagina_anterior': enlace({'antes': pagina['anterior']}) if pagina['anterior'] else None,
+        'estados_contrato': Contrato.ESTADOS_CONTRATO,
+        'manzanas': Lote.objects.order_by('manzana').values_list('manzana', flat=True).distinct(),
+        'vendedores': (
+            User.objects.filter(mis_clientes__isnull=False).distinct().order_by('username')
+            if request.user.is_superuser else []
+        ),
+    }
+    return render(request, 'ventas/lista_clientes.html', context)
+
+@login_required
+def api_contrato_modal_view(request, pk):
+    """Datos de los modales del listado (foto del lote y pago de entrada), al abrirlos."""
+    contratos = Contrato.objects.all() if request.user.is_superuser else Contrato.objects.filter(cliente__vendedor=request.user)
+    contrato = get_object_or_404(contratos.select_related('lote').prefetch_related('lotes'), pk=pk)
+
+    lote = contrato.lote_principal
+    imagen = (lote.foto_lista or lote.plano) if lote else None
+    pago = contrato.pago_set.order_by('id').first()
+    entrada = None
+    if pago and pago.metodo_pago != 'EFECTIVO':
+        comprobante = pago.comprobante_imagen.url if pago.comprobante_imagen else None
+        entrada = {
+            'metodo': pago.get_metodo_pago_display(),
+            'monto': f"{pago.monto:.2f}",
+            'observacion': pago.observacion or '',
+            'comprobante_url': comprobante,
+            'comprobante_es_pdf': bool(comprobante) and comprobante.lower().endswith('.pdf'),
+        }
+    return JsonResponse({
+        'success': True,
+        'lote': {
+            'titulo': f"Mz. {contrato.manzanas_str} - Lote {contrato.numeros_lotes_str}",
+            'imagen_url': imagen.url if imagen else None,
+        },
+        'entrada': entrada,
+    })
 
 # ==========================================
 # 4. DETALLE CONTRATO (Panel Cliente)
@@ -211,8 +324,8 @@ def detalle_contrato_view(request, pk):
         messages.error(request, "No tiene permisos para acceder a esta información.")
         return redirect('dashboard')
 
-    # 1. Actualizar cálculo matemático al instante
-    actualizar_moras_contrato(contrato.id)
+    # 1. Actualizar cálculo matemático (si no se calculó ya hoy)
+    actualizar_moras_pendientes(Contrato.objects.filter(id=contrato.id))
 
     from django.db.models import Sum
 
@@ -236,8 +349,8 @@ def detalle_contrato_view(request, pk):
     # Sumar dinero de mora
     total_mora = sum(c.valor_mora for c in cuotas_vencidas)
     
-    # Saldo pendiente real
-    saldo_pendiente_total = sum(c.total_a_pagar - c.valor_pagado for c in cuotas)
+    # Saldo pendiente real (precalculado en ResumenContrato)
+    saldo_pendiente_total = obtener_resumen(contrato.id).saldo_pendiente
 
     # Próxima a pagar (La primera PENDIENTE o PARCIAL, excluyendo VENCIDO para el indicador)
     proxima_cuota = cuotas.filter(estado__in=['PENDIENTE', 'PARCIAL']).first()
@@ -302,7 +415,11 @@ def detalle_contrato_view(request, pk):
         'proxima_cuota': proxima_cuota,
         'saldo_pendiente_total': saldo_pendiente_total,
         'puede_cerrar': saldo_pendiente_total <= 0 and contrato.estado == 'ACTIVO',
-        'pagos_historial': pagos_historial
+        'pagos_historial': pagos_historial,
+        # PDF del contrato aún en la cola (la página consulta su estado)
+        'tarea_contrato_pdf': TareaPDF.objects.filter(
+            tipo='CONTRATO', objeto_id=contrato.id, terminado_en__isnull=True
+        ).last(),
     }
     return render(request, 'ventas/detalle_cliente.html', context)
 
@@ -311,7 +428,7 @@ def cerrar_contrato_view(request, pk):
     contrato = get_object_or_404(Contrato, pk=pk)
     
     # Validaciones de seguridad
-    saldo_pendiente = sum((c.valor_capital + c.valor_mora) - c.valor_pagado for c in contrato.cuotas.all())
+    saldo_pendiente = obtener_resumen(contrato.id).saldo_pendiente
     
     if saldo_pendiente > 0:
         messages.error(request, "Error: No se puede cerrar un contrato con deuda pendiente.")
@@ -391,7 +508,7 @@ def registrar_pago_view(request, pk):
 
         try:
             # Llamamos al servicio inteligente
-            registrar_pago_cliente(
+            pago = registrar_pago_cliente(
                 contrato_id=contrato.id,
                 monto=monto,
                 metodo_pago=metodo,
@@ -400,6 +517,8 @@ def registrar_pago_view(request, pk):
                 fecha_pago=fecha_pago,
                 cuota_origen_id=cuota_id
             )
+            # El recibo queda listo en la caché de PDF antes de que lo pidan
+            encolar_pdf('RECIBO_TRANSACCION', pago.id, request.user)
             messages.success(request, "Pago registrado con éxito.")
             return redirect('detalle_contrato', pk=contrato.id)
         except Exception as e:
@@ -454,10 +573,6 @@ def editar_cuota_view(request, pk):
                 if nuevo_metodo:
                      pago.metodo_pago = nuevo_metodo
                 
-                # Eliminar el rastro del saldo a favor de la observación para que el recálculo lo regenere limpio
-                if pago.observacion and " | Saldo a favor remanente:" in pago.observacion:
-                    pago.observacion = pago.observacion.split(" | Saldo a favor remanente:")[0]
-                    
                 pago.save()
                 
                 # EL MOTOR MAGICO DE RECALCULO QUE REPARAMOS ANTERIORMENTE
@@ -511,10 +626,6 @@ def editar_pago_view(request, pago_id):
                 if nuevo_metodo:
                     pago.metodo_pago = nuevo_metodo
 
-                # Limpiar rastro de saldo a favor para que el recalculo lo regenere limpio
-                if pago.observacion and " | Saldo a favor remanente:" in pago.observacion:
-                    pago.observacion = pago.observacion.split(" | Saldo a favor remanente:")[0]
-
                 pago.save()
 
                 from .services import recalcular_deuda_contrato
@@ -582,18 +693,13 @@ def descargar_contrato_pdf(request, pk):
 @login_required
 def descargar_recibo_entrada_pdf(request, pk):
     """
-    Genera y descarga el recibo de pago de entrada al vuelo.
-    Compatible con móviles (iOS/Android).
+    Descarga el recibo de pago de entrada (desde la caché de PDF si no cambió).
+    Compatible con móviles (iOS/Android): Content-Length y attachment explícitos.
     """
-    buffer = generar_recibo_entrada_buffer(pk)
-    if not buffer:
+    pdf = recibo_entrada_pdf(pk)
+    if not pdf:
         return HttpResponse("Error al generar el recibo PDF.", status=500)
-    
-    # Usar HttpResponse con headers explícitos para compatibilidad móvil
-    response = HttpResponse(buffer.getvalue(), content_type='application/pdf')
-    response['Content-Disposition'] = f'attachment; filename="Recibo_Entrada_{pk}.pdf"'
-    response['Content-Length'] = len(buffer.getvalue())
-    return response
+    return respuesta_pdf(request, pdf, f"Recibo_Entrada_{pk}.pdf")
 
 @login_required
 def descargar_contrato_word(request, pk):
@@ -602,23 +708,18 @@ def descargar_contrato_word(request, pk):
 @login_required
 def descargar_recibo_pago_pdf(request, cuota_id):
     """
-    Genera y descarga el recibo de pago mensual de una cuota en PDF.
+    Descarga el recibo de pago mensual de una cuota en PDF (desde la caché si no cambió).
     Compatible con móviles (iOS/Android).
     """
-    buffer = generar_recibo_pago_buffer(cuota_id)
-    if not buffer:
+    pdf = recibo_pago_pdf(cuota_id)
+    if not pdf:
         from .models import Cuota
         # Si falla, verificar si es porque no está pagado
         c = Cuota.objects.get(id=cuota_id)
         if c.valor_pagado <= 0:
             return HttpResponse("Esta cuota no tiene pagos registrados.", status=400)
         return HttpResponse("Error al generar el recibo PDF.", status=500)
-    
-    # Usar HttpResponse con headers explícitos para compatibilidad móvil
-    response = HttpResponse(buffer.getvalue(), content_type='application/pdf')
-    response['Content-Disposition'] = f'attachment; filename="Recibo_Cuota_{cuota_id}.pdf"'
-    response['Content-Length'] = len(buffer.getvalue())
-    return response
+    return respuesta_pdf(request, pdf, f"Recibo_Cuota_{cuota_id}.pdf")
 
 # ==========================================
 # VISTAS DE PREVIEW PARA MÓVILES
@@ -688,29 +789,8 @@ def generar_contrato_word(request, pk):
     
     # === Lógica de Pagos para Word ===
     pago_entrada = contrato.pago_set.order_by('id').first()
-    metodo_real = 'EFECTIVO'
-    datos_bancarios = None
-
-    if pago_entrada:
-        obs = pago_entrada.observacion or ""
-        if 'TRANSFERENCIA' in obs:
-            metodo_real = 'TRANSFERENCIA BANCARIA'
-            try:
-                if "Banco:" in obs and "Cuenta/Comp:" in obs:
-                    resto_banco = obs.split("Banco:")[1]
-                    if ". Cuenta/Comp:" in resto_banco:
-                        parte_banco, _, parte_cuenta = resto_banco.partition(". Cuenta/Comp:")
-                        datos_bancarios = {'banco': parte_banco.strip(), 'cuenta': parte_cuenta.rstrip(".").strip()}
-                    else:
-                        parte_banco = resto_banco.split("Cuenta/Comp:")[0].strip().rstrip(".")
-                        parte_cuenta = resto_banco.split("Cuenta/Comp:")[1].strip().rstrip(".")
-                        datos_bancarios = {'banco': parte_banco, 'cuenta': parte_cuenta}
-            except:
-                pass
-        elif 'DEPOSITO' in obs:
-            metodo_real = 'DEPÓSITO'
-        elif pago_entrada.metodo_pago == 'EFECTIVO':
-            metodo_real = 'EFECTIVO'
+    metodo_real = metodo_real_pago(pago_entrada)
+    datos_bancarios = datos_bancarios_pago(pago_entrada)
 
     # Estrategia 3: URL de Archivo Local (file://) para que Word lo busque en disco
     # Esto funciona porque el servidor y el cliente (Word) están en la misma máquina.
@@ -868,587 +948,169 @@ def editar_lote_view(request, pk):
 # ==========================================
 # REPORTE MENSUAL DE INGRESOS Y MORA
 # ==========================================
-def _obtener_datos_mensuales(user, mes_str, anio_str):
-    from datetime import date
-    from dateutil.relativedelta import relativedelta
-    from decimal import Decimal
-    
-    hoy = date.today()
-    es_anual = False
-    
-    mes = hoy.month
-    anio = hoy.year
-    
-    try:
-        if anio_str:
-            anio = int(anio_str)
-            if mes_str == 'anual':
-                es_anual = True
-                mes = 'anual'
-            elif mes_str:
-                mes = int(mes_str)
-    except ValueError:
-        pass
-        
-    if es_anual:
-        primer_dia_mes = date(anio, 1, 1)
-        ultimo_dia_mes = date(anio, 12, 31)
-    else:
-        if not isinstance(mes, int):
-            mes = hoy.month
-        primer_dia_mes = date(anio, mes, 1)
-        ultimo_dia_mes = primer_dia_mes + relativedelta(months=1) - relativedelta(days=1)
-    
-    if user.is_superuser:
-        contratos_todos = Contrato.objects.all().prefetch_related('pago_set__detalles__cuota', 'cliente', 'lote')
-        contratos_activos = Contrato.objects.filter(estado='ACTIVO').prefetch_related('pago_set__detalles__cuota', 'cliente', 'lote')
-    else:
-        contratos_todos = Contrato.objects.filter(cliente__vendedor=user).prefetch_related('pago_set__detalles__cuota', 'cliente', 'lote')
-        contratos_activos = Contrato.objects.filter(estado='ACTIVO', cliente__vendedor=user).prefetch_related('pago_set__detalles__cuota', 'cliente', 'lote')
-        
-    es_mes_pasado = ultimo_dia_mes < hoy
-
-    # 1. Ingresos Cash Flow: TODO pago recibido en el mes (incluyendo abono inicial y de contratos que ahora estén inactivos)
-    #    Una fila por TRANSACCION (no por cliente), con fecha y cuotas cubiertas
-    cobros_lista_raw = []   # lista de transacciones individuales
-    total_cobrado_mes = Decimal('0.00')
-    total_entradas    = Decimal('0.00')
-    total_ingresos    = Decimal('0.00')
-
-    for contrato in contratos_todos:
-        cliente = contrato.cliente
-        pago_entrada = contrato.pago_set.order_by('id').first()
-
-        for pago in contrato.pago_set.all().order_by('fecha_pago'):
-            # Solo pagos cuya fecha real de cobro cae en el período (Cash Flow)
-            if not (primer_dia_mes <= pago.fecha_pago <= ultimo_dia_mes):
-                continue
-
-            es_entrada = pago.es_entrada or (pago == pago_entrada and not pago.detalles.exists())
-
-            # Cuotas que cubre este pago (números de cuota)
-            if es_entrada:
-                cuotas_cubiertas = ['Entrada']
-            else:
-                numeros = list(
-                    pago.detalles.select_related('cuota')
-                    .values_list('cuota__numero_cuota', flat=True)
-                    .order_by('cuota__numero_cuota')
-                )
-                cuotas_cubiertas = [f'#{n}' for n in numeros] if numeros else ['—']
-
-            cobros_lista_raw.append({
-                'cliente':          cliente,
-                'contrato':         contrato,
-                'fecha_pago':       pago.fecha_pago,
-                'metodo':           pago.metodo_pago,
-                'cuotas_cubiertas': ', '.join(cuotas_cubiertas),
-                'es_entrada':       es_entrada,
-                'monto_cuotas':     Decimal('0.00') if es_entrada else pago.monto,
-                'monto_entrada':    pago.monto if es_entrada else Decimal('0.00'),
-                'total_cobrado':    pago.monto,
-            })
-
-            total_cobrado_mes += pago.monto
-            if es_entrada:
-                total_entradas += pago.monto
-            else:
-                total_ingresos += pago.monto
-
-    # Ordenar: por fecha_pago, luego por apellido
-    cobros_lista_raw.sort(key=lambda x: (x['fecha_pago'], x['cliente'].apellidos))
-
-    # 2. Proyección Restante (Cuotas venciendo este mes, aún no pagadas totalmente)
-    #    SOLO DE CONTRATOS ACTIVOS
-    proyeccion_por_cliente = {}
-    if not es_mes_pasado:
-        for contrato in contratos_activos:
-            cuotas_proyeccion = contrato.cuotas.filter(
-                fecha_vencimiento__gte=primer_dia_mes,
-                fecha_vencimiento__lte=ultimo_dia_mes,
-                estado__in=['PENDIENTE', 'PARCIAL', 'VENCIDO']
-            )
-            deuda = sum(c.saldo_pendiente for c in cuotas_proyeccion)
-            if deuda > 0:
-                proyeccion_por_cliente[contrato.id] = {
-                    'cliente': contrato.cliente,
-                    'contrato': contrato,
-                    'cuotas_count': cuotas_proyeccion.count(),
-                    'deuda_total': deuda
-                }
-    total_proyeccion = sum(p['deuda_total'] for p in proyeccion_por_cliente.values())
-
-    # 3. Mora Histórica (Cuotas vencidas ANTES de este mes, no pagadas)
-    #    SOLO DE CONTRATOS ACTIVOS
-    mora_historica = {}
-    for contrato in contratos_activos:
-        if es_mes_pasado:
-            # Si es mes pasado, TODO lo impago vencido hasta el fin de ESE mes se considera mora actual acumulada a la fecha de ese mes.
-            cuotas_mora = contrato.cuotas.filter(
-                fecha_vencimiento__lte=ultimo_dia_mes,
-                estado__in=['PENDIENTE', 'PARCIAL', 'VENCIDO']
-            )
-        else:
-            cuotas_mora = contrato.cuotas.filter(
-                fecha_vencimiento__lt=primer_dia_mes,
-                estado__in=['PENDIENTE', 'PARCIAL', 'VENCIDO']
-            )
-        deuda = sum(c.saldo_pendiente for c in cuotas_mora)
-        if deuda > 0:
-            mora_historica[contrato.id] = {
-                'cliente': contrato.cliente,
-                'contrato': contrato,
-                'cuotas_count': cuotas_mora.count(),
-                'deuda_total': deuda
-            }
-    total_mora_historica = sum(m['deuda_total'] for m in mora_historica.values())
-
-    # 4. Devoluciones del mes (REMOVIDO A PETICION DEL USUARIO)
-
-    return {
-        'fecha_inicio': primer_dia_mes,
-        'fecha_fin': ultimo_dia_mes,
-        'mes_actual': mes,
-        'anio_actual': anio,
-        'es_anual': es_anual,
-        'es_mes_pasado': es_mes_pasado,
-        # --- Cobros: una fila por transacción (fecha + cuota + monto) ---
-        'cobros_lista': cobros_lista_raw,
-        'total_cobrado_mes': total_cobrado_mes,
-        'total_entradas': total_entradas,
-        'total_ingresos': total_ingresos,
-        # --- Para backward-compat ---
-        'entradas_lista': [c for c in cobros_lista_raw if c['es_entrada']],
-        'ingresos_lista': [c for c in cobros_lista_raw if not c['es_entrada']],
-        # --- Proyeccion y mora ---
-        'proyeccion_lista': sorted(proyeccion_por_cliente.values(), key=lambda x: x['deuda_total'], reverse=True),
-        'total_proyeccion': total_proyeccion,
-        'mora_historica_lista': sorted(mora_historica.values(), key=lambda x: x['deuda_total'], reverse=True),
-        'total_mora_historica': total_mora_historica,
-    }
-
 @login_required
 def reporte_mensual_view(request):
     mes = request.GET.get('mes')
     anio = request.GET.get('anio')
-    context = _obtener_datos_mensuales(request.user, mes, anio)
+    context = datos_reporte_mensual(request.user, mes, anio)
     return render(request, 'reportes/reporte_mensual.html', context)
 
 
 @login_required
 def reporte_general_view(request):
-    from datetime import date
-    from dateutil.relativedelta import relativedelta
-    from decimal import Decimal
-    
-    # Get date range from GET params
-    desde_str = request.GET.get('desde', None)  # Format: YYYY-MM
-    hasta_str = request.GET.get('hasta', None)
+    # Format: YYYY-MM
+    desde, hasta = rango_reporte(request.GET.get('desde'), request.GET.get('hasta'))
     solo_activos = request.GET.get('solo_activos', None) == 'on'
-    
-    # Parse dates
-    if desde_str:
-        desde_year, desde_month = map(int, desde_str.split('-'))
-        desde = date(desde_year, desde_month, 1)
-    else:
-        desde = date.today().replace(day=1, month=1)  # Default to January this year
-    
-    if hasta_str:
-        hasta_year, hasta_month = map(int, hasta_str.split('-'))
-        # Last day of the month
-        hasta = date(hasta_year, hasta_month, 1) + relativedelta(months=1) - relativedelta(days=1)
-    else:
-        hasta = date.today()
-    
-    # Generate list of months between desde and hasta
-    meses_nombres = {
-        1: 'Ene', 2: 'Feb', 3: 'Mar', 4: 'Abr', 5: 'May', 6: 'Jun',
-        7: 'Jul', 8: 'Ago', 9: 'Sep', 10: 'Oct', 11: 'Nov', 12: 'Dic'
-    }
-    
-    meses = []
-    current = desde
-    while current <= hasta:
-        meses.append({
-            'year': current.year,
-            'month': current.month,
-            'label': f"{meses_nombres[current.month]} {current.year}"
-        })
-        current = current + relativedelta(months=1)
-    
-    # Get contracts
-    contratos_qs = Contrato.objects.select_related('cliente', 'lote').prefetch_related('cuotas', 'pago_set')
-    
-    if not request.user.is_superuser:
-        contratos_qs = contratos_qs.filter(cliente__vendedor=request.user)
-    
-    if solo_activos:
-        contratos_qs = contratos_qs.filter(estado='ACTIVO')
-    
-    # Build report data
-    reporte_data = []
-    
-    # Initialize totals for each month
-    totales_mensuales = [Decimal('0.00') for _ in meses]
-    total_general = Decimal('0.00')
-    total_cuotas = Decimal('0.00')  # Total de todas las cuotas mensuales
-    total_vtotal = Decimal('0.00')  # Suma de precio_venta_final
-    total_entrada = Decimal('0.00')  # Suma de valor_entrada
-    total_saldo = Decimal('0.00')  # Suma de saldos pendientes
-    
-    for contrato in contratos_qs:
-        # Actualizar moras para que el saldo pendiente sea exacto al del detalle_cliente
-        actualizar_moras_contrato(contrato.id)
-        
-        # Basic data
-        row = {
-            'contrato': contrato,
-            'cliente': contrato.cliente,
-            'lote': contrato.lote,
-            'pagos_mensuales': [],
-            'total_pagado': Decimal('0.00'),
-            'es_devolucion': contrato.estado == 'DEVOLUCION',
-            'saldo_pendiente': Decimal('0.00')  # Se calculará después
-        }
-        
-        # Sumar totales de VTotal y Entrada
-        total_vtotal += contrato.precio_venta_final or Decimal('0.00')
-        total_entrada += contrato.valor_entrada or Decimal('0.00')
-        
-        # Calculate cuota value for totals
-        primera_cuota = contrato.cuotas.first()
-        if primera_cuota:
-            total_cuotas += primera_cuota.valor_capital
-        
-        cuotas_en_rango = contrato.cuotas.filter(
-            fecha_vencimiento__gte=desde,
-            fecha_vencimiento__lte=hasta
-        )
-        
-        # Calcular saldo pendiente y Total Pagado desde las cuotas (fuente de verdad)
-        # Total Pagado = V.Entrada + sum(cuota.valor_pagado) → independiente del rango de fechas
-        todas_cuotas = list(contrato.cuotas.all())
-        row['saldo_pendiente'] = sum(
-            c.total_a_pagar - c.valor_pagado
-            for c in todas_cuotas
-        )
-        row['total_pagado'] = contrato.valor_entrada or Decimal('0.00')
-
-        # Inicializar columnas mensuales (se llenarán con pagos del rango seleccionado)
-        row['pagos_mensuales'] = [Decimal('0.00')] * len(meses)
-
-        # Ubicar la entrada en el mes correspondiente (COMENTADO: El usuario no quiere ver la entrada en la matriz de meses)
-        # Esto evita que aparezca como una "cuota gigante" en el reporte
-        """
-        pago_entrada_obj = contrato.pago_set.filter(es_entrada=True).order_by('id').first()
-        if not pago_entrada_obj:
-            pago_entrada_obj = contrato.pago_set.order_by('id').first()
-        if pago_entrada_obj:
-            fecha_entrada = pago_entrada_obj.fecha_pago
-            for i, mes in enumerate(meses):
-                mes_inicio = date(mes['year'], mes['month'], 1)
-                mes_fin = mes_inicio + relativedelta(months=1) - relativedelta(days=1)
-                if mes_inicio <= fecha_entrada <= mes_fin:
-                    monto_e = contrato.valor_entrada or Decimal('0.00')
-                    row['pagos_mensuales'][i] += monto_e
-                    if not row['es_devolucion']:
-                        totales_mensuales[i] += monto_e
-                    else:
-                        totales_mensuales[i] -= monto_e
-                    break
-        """
-        # IDs de pagos de entrada para excluirlos de la lógica "Legacy" (sin detalles)
-        ids_entradas = set(contrato.pago_set.filter(es_entrada=True).values_list('id', flat=True))
-        if contrato.valor_entrada > 0 and not ids_entradas:
-            # Fallback: Solo si hay deuda de entrada pero no hay flag, tomamos el primer pago como entrada
-            pago_entrada_obj_fallback = contrato.pago_set.order_by('id').first()
-            if pago_entrada_obj_fallback:
-                ids_entradas.add(pago_entrada_obj_fallback.id)
-
-        # Procesar cuotas
-        for pago in contrato.pago_set.all():
-            # Saltar el pago de entrada en ambas ramas: ya fue sumado en la línea de valor_entrada
-            if pago.id in ids_entradas:
-                continue
-
-            detalles = pago.detalles.select_related('cuota')
-            
-            if detalles.exists():
-                # SIEMPRE procesar detalles (son cuotas/mora reales)
-                for detalle in detalles:
-
-                    fecha_pago_real = pago.fecha_pago
-                    monto = detalle.monto_aplicado
-                    
-                    # Distribuir en meses (Cash Flow: usando fecha_pago_real)
-                    for i, mes in enumerate(meses):
-                        mes_inicio = date(mes['year'], mes['month'], 1)
-                        mes_fin = mes_inicio + relativedelta(months=1) - relativedelta(days=1)
-                        if mes_inicio <= fecha_pago_real <= mes_fin:
-                            row['pagos_mensuales'][i] += monto
-                            if not row['es_devolucion']:
-                                totales_mensuales[i] += monto
-                            else:
-                                totales_mensuales[i] -= monto
-                            break # Ya lo encontró
-                            
-                    # Sumar SIEMPRE al histórico de Total Pagado
-                    row['total_pagado'] += monto
-            else:
-                # Pago legacy sin detalles
-
-                fecha_ref = pago.fecha_pago
-                monto = pago.monto
-                
-                # Distribuir en meses
-                for i, mes in enumerate(meses):
-                    mes_inicio = date(mes['year'], mes['month'], 1)
-                    mes_fin = mes_inicio + relativedelta(months=1) - relativedelta(days=1)
-                    if mes_inicio <= fecha_ref <= mes_fin:
-                        row['pagos_mensuales'][i] += monto
-                        if not row['es_devolucion']:
-                            totales_mensuales[i] += monto
-                        else:
-                            totales_mensuales[i] -= monto
-                        break
-                        
-                # Sumar SIEMPRE al histórico de Total Pagado
-                row['total_pagado'] += monto
-        # Add to general total
-        if row['es_devolucion']:
-            total_general -= row['total_pagado']
-        else:
-            total_general += row['total_pagado']
-        
-        total_saldo += row['saldo_pendiente']
-        reporte_data.append(row)
-    
-    context = {
-        'desde': desde,
-        'hasta': hasta,
-        'meses': meses,
-        'reporte_data': reporte_data,
-        'solo_activos': solo_activos,
-        'totales_mensuales': totales_mensuales,
-        'total_general': total_general,
-        'total_cuotas': total_cuotas,
-        'total_vtotal': total_vtotal,
-        'total_entrada': total_entrada,
-        'total_saldo': total_saldo,
-    }
-    return render(request, 'reportes/reporte_general.html', context)
+
+    # Mismo dataset (en caché) que el PDF y las exportaciones
+    datos = obtener_reporte_general(request.user, desde, hasta, solo_activos)
+    return render(request, 'reportes/reporte_general.html', contexto_reporte_general(datos))
 
 @login_required
 def reporte_general_pdf_view(request):
-    from datetime import datetime, date
-    from decimal import Decimal
-    from dateutil.relativedelta import relativedelta
-    from io import BytesIO
-    from django.template.loader import render_to_string
-    from xhtml2pdf import pisa
-    from .services import link_callback
-    
-    # Get filter parameters
-    desde_str = request.GET.get('desde')
-    hasta_str = request.GET.get('hasta')
+    desde, hasta = rango_reporte(request.GET.get('desde'), request.GET.get('hasta'))
     solo_activos = request.GET.get('solo_activos') == 'on'
-    
-    # Parse dates
-    desde = datetime.strptime(desde_str, '%Y-%m').date() if desde_str else date.today().replace(day=1)
-    hasta = datetime.strptime(hasta_str, '%Y-%m').date() if hasta_str else date.today()
-    
-    # Generate month list
-    meses = []
-    current_date = desde.replace(day=1)
-    hasta_mes = hasta.replace(day=1)
-    
-    while current_date <= hasta_mes:
-        meses.append({
-            'year': current_date.year,
-            'month': current_date.month,
-            'label': current_date.strftime('%b %y').upper()
-        })
-        current_date += relativedelta(months=1)
-    
-    # Get contracts
-    contratos_qs = Contrato.objects.select_related('cliente', 'lote').all()
-    
-    if not request.user.is_superuser:
-        contratos_qs = contratos_qs.filter(cliente__vendedor=request.user)
-    
-    if solo_activos:
-        contratos_qs = contratos_qs.filter(estado='ACTIVO')
-    
-    # Build report data (same logic as reporte_general_view)
-    reporte_data = []
-    totales_mensuales = [Decimal('0.00') for _ in meses]
-    total_general = Decimal('0.00')
-    total_cuotas = Decimal('0.00')
-    total_vtotal = Decimal('0.00')
-    total_entrada = Decimal('0.00')
-    total_saldo = Decimal('0.00')
 
-    
-    for contrato in contratos_qs:
-        # Actualizar moras para exactitud financiera
-        actualizar_moras_contrato(contrato.id)
-        
-        hasta_fin_de_mes = hasta.replace(day=1) + relativedelta(months=1) - relativedelta(days=1)
-        cuotas_en_rango = contrato.cuotas.filter(
-            fecha_vencimiento__gte=desde.replace(day=1),
-            fecha_vencimiento__lte=hasta_fin_de_mes
-        )
-        
-        total_vtotal += contrato.precio_venta_final or Decimal('0.00')
-        total_entrada += contrato.valor_entrada or Decimal('0.00')
-        
-        row = {
-
-            'contrato': contrato,
-            'cliente': contrato.cliente,
-            'lote': contrato.lote,
-            'pagos_mensuales': [],
-            'total_pagado': Decimal('0.00'),
-            'es_devolucion': contrato.estado == 'DEVOLUCION',
-            # Deuda pendiente TOTAL del contrato (igual que "Deuda Pendiente" en detalle_cliente)
-            'saldo_pendiente': sum(
-                c.total_a_pagar - c.valor_pagado
-                for c in contrato.cuotas.all()
-            )
-        }
-        
-        primera_cuota = contrato.cuotas.first()
-        if primera_cuota:
-            total_cuotas += primera_cuota.valor_capital
-        
-        # Inicializar los totales de este contrato
-        row['pagos_mensuales'] = [Decimal('0.00')] * len(meses)
-        # Sumar el valor de entrada siempre, sin importar el rango de fechas
-        row['total_pagado'] = contrato.valor_entrada or Decimal('0.00')
-        hasta_fin_de_mes_range = hasta.replace(day=1) + relativedelta(months=1) - relativedelta(days=1)
-
-        # Ubicar la entrada en el mes correspondiente (COMENTADO: El usuario no quiere ver la entrada en la matriz de meses)
-        """
-        pago_entrada_obj = contrato.pago_set.filter(es_entrada=True).order_by('id').first()
-        if not pago_entrada_obj:
-            pago_entrada_obj = contrato.pago_set.order_by('id').first()
-        if pago_entrada_obj:
-            fecha_entrada = pago_entrada_obj.fecha_pago
-            for i, mes in enumerate(meses):
-                mes_inicio = date(mes['year'], mes['month'], 1)
-                mes_fin = mes_inicio + relativedelta(months=1) - relativedelta(days=1)
-                if mes_inicio <= fecha_entrada <= mes_fin:
-                    monto_e = contrato.valor_entrada or Decimal('0.00')
-                    row['pagos_mensuales'][i] += monto_e
-                    if not row['es_devolucion']:
-                        totales_mensuales[i] += monto_e
-                    else:
-                        totales_mensuales[i] -= monto_e
-                    break
-        """
-        # IDs de pagos de entrada para excluirlos de la lógica "Legacy"
-        ids_entradas = set(contrato.pago_set.filter(es_entrada=True).values_list('id', flat=True))
-        if contrato.valor_entrada > 0 and not ids_entradas:
-            pago_entrada_obj_fallback = contrato.pago_set.order_by('id').first()
-            if pago_entrada_obj_fallback:
-                ids_entradas.add(pago_entrada_obj_fallback.id)
-
-        # Procesar cuotas
-        for pago in contrato.pago_set.all():
-            detalles = pago.detalles.select_related('cuota')
-            
-            if detalles.exists():
-                # SIEMPRE procesar detalles
-                for detalle in detalles:
-                    fecha_pago_real = pago.fecha_pago
-                    monto = detalle.monto_aplicado
-                    
-                    # Distribuir en meses
-                    for i, mes in enumerate(meses):
-                        mes_inicio = date(mes['year'], mes['month'], 1)
-                        mes_fin = mes_inicio + relativedelta(months=1) - relativedelta(days=1)
-                        if mes_inicio <= fecha_pago_real <= mes_fin:
-                            row['pagos_mensuales'][i] += monto
-                            if not row['es_devolucion']:
-                                totales_mensuales[i] += monto
-                            else:
-                                totales_mensuales[i] -= monto
-                            break
-                            
-                    # Sumar SIEMPRE al histórico de Total Pagado
-                    row['total_pagado'] += monto
-            elif pago.id not in ids_entradas:
-                # Pago legacy
-
-                fecha_ref = pago.fecha_pago
-                monto = pago.monto
-                
-                # Distribuir en meses
-                for i, mes in enumerate(meses):
-                    mes_inicio = date(mes['year'], mes['month'], 1)
-                    mes_fin = mes_inicio + relativedelta(months=1) - relativedelta(days=1)
-                    if mes_inicio <= fecha_ref <= mes_fin:
-                        row['pagos_mensuales'][i] += monto
-                        if not row['es_devolucion']:
-                            totales_mensuales[i] += monto
-                        else:
-                            totales_mensuales[i] -= monto
-                        break
-                        
-                # Sumar SIEMPRE al histórico de Total Pagado
-                row['total_pagado'] += monto
-        
-        if row['es_devolucion']:
-            total_general -= row['total_pagado']
-        else:
-            total_general += row['total_pagado']
-            
-        total_saldo += row['saldo_pendiente']
-        
-        reporte_data.append(row)
-    
-    context = {
-        'desde': desde,
-        'hasta': hasta,
-        'meses': meses,
-        'reporte_data': reporte_data,
-        'totales_mensuales': totales_mensuales,
-        'total_general': total_general,
-        'total_cuotas': total_cuotas,
-        'total_entrada': total_entrada,
-        'total_vtotal': total_vtotal,
-        'total_saldo': total_saldo,
-    }
+    contenido, nombre = pdf_reporte_general(request.user, desde, hasta, solo_activos)
+    response = HttpResponse(contenido, content_type='application/pdf')
+    response['Content-Disposition'] = f'attachment; filename="{nombre}"'
+    return response
 
-    
-    html_string = render_to_string('reportes/reporte_general_pdf.html', context)
-    result_file = BytesIO()
-    pisa.CreatePDF(html_string, dest=result_file, link_callback=link_callback)
-    
-    response = HttpResponse(result_file.getvalue(), content_type='application/pdf')
-    response['Content-Disposition'] = f'attachment; filename="Reporte_General_{desde.strftime("%Y-%m")}_to_{hasta.strftime("%Y-%m")}.pdf"'
+@login_required
+def reporte_general_exportar_view(request):
+    """Exporta el Reporte General a CSV o Excel (?formato=csv|xlsx)."""
+    desde, hasta = rango_reporte(request.GET.get('desde'), request.GET.get('hasta'))
+    solo_activos = request.GET.get('solo_activos') == 'on'
+    formato = request.GET.get('formato', 'xlsx')
+
+    datos = obtener_reporte_general(request.user, desde, hasta, solo_activos)
+    nombre = f'Reporte_General_{desde.strftime("%Y-%m")}_to_{hasta.strftime("%Y-%m")}'
+
+    if formato == 'csv':
+        # BOM para que Excel detecte UTF-8 (tildes y ñ)
+        response = HttpResponse('\ufeff' + exportar_reporte_csv(datos), content_type='text/csv; charset=utf-8')
+        response['Content-Disposition'] = f'attachment; filename="{nombre}.csv"'
+    else:
+        response = HttpResponse(
+            exportar_reporte_xlsx(datos),
+            content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+        )
+        response['Content-Disposition'] = f'attachment; filename="{nombre}.xlsx"'
     return response
 
 @login_required
 def reporte_mensual_pdf_view(request):
-    from io import BytesIO
-    from django.template.loader import render_to_string
-    from xhtml2pdf import pisa
-    from .services import link_callback
-    
-    mes = request.GET.get('mes')
-    anio = request.GET.get('anio')
-    context = _obtener_datos_mensuales(request.user, mes, anio)
-    
-    html_string = render_to_string('reportes/reporte_mensual_pdf.html', context)
-    result_file = BytesIO()
-    pisa.CreatePDF(html_string, dest=result_file, link_callback=link_callback)
-    
-    response = HttpResponse(result_file.getvalue(), content_type='application/pdf')
-    fecha_str = context['fecha_inicio'].strftime("%Y-%m")
-    response['Content-Disposition'] = f'attachment; filename="Reporte_Mensual_{fecha_str}.pdf"'
+    contenido, nombre = pdf_reporte_mensual(request.user, request.GET.get('mes'), request.GET.get('anio'))
+    response = HttpResponse(contenido, content_type='application/pdf')
+    response['Content-Disposition'] = f'attachment; filename="{nombre}"'
     return response
 
+# ==========================================
+# COLA DE PDF (render en segundo plano)
+# ==========================================
+def _obtener_tarea_pdf(request, tarea_id):
+    tarea = get_object_or_404(TareaPDF, pk=tarea_id)
+    if request.user.is_superuser or tarea.solicitado_por_id == request.user.id:
+        return tarea
+    if tarea.tipo == 'CONTRATO' and Contrato.objects.filter(id=tarea.objeto_id, cliente__vendedor=request.user).exists():
+        return tarea
+    raise Http404("Tarea no encontrada.")
+
+@login_required
+def encolar_reporte_pdf_view(request, reporte):
+    """Encola el PDF del reporte (general o mensual) y muestra la página de espera."""
+    if reporte == 'general':
+        tarea = encolar_pdf(
+            'REPORTE_GENERAL', usuario=request.user,
+            desde=request.GET.get('desde') or None, hasta=request.GET.get('hasta') or None,
+            solo_activos=request.GET.get('solo_activos') == 'on'
+        )
+        titulo, url_volver = 'Reporte General (PDF)', 'reporte_general'
+    elif reporte == 'mensual':
+        tarea = encolar_pdf('REPORTE_MENSUAL', usuario=request.user, mes=request.GET.get('mes'), anio=request.GET.get('anio'))
+        titulo, url_volver = 'Reporte Mensual (PDF)', 'reporte_mensual'
+    else:
+        raise Http404("Reporte no encontrado.")
+    return render(request, 'reportes/tarea_pdf.html', {
+        'tarea': tarea,
+        'titulo': titulo,
+        'url_volver': reverse(url_volver) + (f"?{request.GET.urlencode()}" if request.GET else ''),
+    })
+
+@login_required
+def encolar_exportacion_view(request):
+    """
+    Encola la exportación masiva (ZIP o PDF unido) de recibos de pago de un período o de
+    estados de cuenta en mora, y muestra la página de espera con el avance.
+    """
+    documentos = request.GET.get('documentos', 'RECIBOS')
+    formato = request.GET.get('formato', 'zip')
+    try:
+        desde = date.fromisoformat(request.GET['desde']) if request.GET.get('desde') else None
+        hasta = date.fromisoformat(request.GET['hasta']) if request.GET.get('hasta') else None
+        contratos = [int(c) for c in request.GET.get('contratos', '').replace(' ', '').split(',') if c]
+    except ValueError:
+        messages.error(request, "Fechas o números de contrato no válidos.")
+        return redirect('lista_clientes')
+    if documentos not in TIPOS_EXPORTACION or formato not in FORMATOS_EXPORTACION:
+        raise Http404("Exportación no encontrada.")
+
+    if not documentos_exportacion(documentos, desde, hasta, contratos, request.user):
+        messages.warning(request, "No hay documentos para exportar con esos filtros.")
+        return redirect('lista_clientes')
+
+    tarea = encolar_pdf(
+        'EXPORTACION', usuario=request.user, documentos=documentos, formato=formato,
+        desde=desde.isoformat() if desde else None, hasta=hasta.isoformat() if hasta else None,
+        contratos=contratos,
+    )
+    return render(request, 'reportes/tarea_pdf.html', {
+        'tarea': tarea,
+        'titulo': f"{TIPOS_EXPORTACION[documentos]} ({formato.upper()})",
+        'url_volver': reverse('lista_clientes'),
+    })
+
+@login_required
+def api_tarea_pdf_view(request, tarea_id):
+    """Estado de una tarea de PDF (la consultan cada pocos segundos el detalle y la página de espera)."""
+    return JsonResponse({'success': True, **estado_tarea(_obtener_tarea_pdf(request, tarea_id))})
+
+@login_required
+def descargar_tarea_pdf_view(request, tarea_id):
+    tarea = _obtener_tarea_pdf(request, tarea_id)
+    if tarea.estado != 'LISTO':
+        return HttpResponse("El PDF aún no está listo.", status=409)
+    if tarea.tipo.startswith('RECIBO_'):
+        # Los recibos se sirven desde la caché de PDF
+        return redirect(url_resultado(tarea))
+    if not default_storage.exists(tarea.archivo):
+        return HttpResponse("El PDF ya no está disponible, vuelva a generarlo.", status=410)
+    return FileResponse(default_storage.open(tarea.archivo), as_attachment=True, filename=tarea.nombre_archivo)
+
+# ==========================================
+# INSTRUMENTACIÓN (solo superusuarios)
+# ==========================================
+@login_required
+def instrumentacion_view(request):
+    """Métricas por URL de los requests medidos por este proceso (?formato=json para la API)."""
+    if not request.user.is_superuser:
+        messages.error(request, "Acceso denegado. Solo administradores pueden ver las métricas.")
+        return redirect('dashboard')
+
+    if request.method == 'POST':
+        agregado_rutas.reiniciar()
+        messages.success(request, "Métricas reiniciadas.")
+        return redirect('instrumentacion')
+
+    rutas = agregado_rutas.resumen()
+    if request.GET.get('formato') == 'json':
+        return JsonResponse({'muestreo': settings.INSTRUMENTACION_MUESTREO, 'rutas': rutas})
+    return render(request, 'gestion/instrumentacion.html', {
+        'rutas': rutas,
+        'muestreo': settings.INSTRUMENTACION_MUESTREO,
+        'ventana': settings.INSTRUMENTACION_VENTANA,
+    })
+
 # ==========================================
 # CONTROL MANUAL DE MORA
 # ==========================================
@@ -1472,6 +1134,8 @@ def toggle_mora_cuota(request, cuota_id):
         
         # Recalcular moras del contrato
         actualizar_moras_contrato(contrato.id)
+        # La mora al cierre de los meses desde su vencimiento depende de la exención
+        invalidar_cierres_desde(cuota.fecha_vencimiento)
         
         if cuota.mora_exenta:
             messages.success(request, f"✓ Cuota #{cuota.numero_cuota} exenta de mora.")
@@ -1531,7 +1195,8 @@ def descargar_contrato_pdf(request, pk):
     result_file = BytesIO()
     
     # Generar PDF
-    pisa_status = pisa.CreatePDF(html_string, dest=result_file, link_callback=link_callback)
+    with medir_pdf():
+        pisa_status = pisa.CreatePDF(html_string, dest=result_file, link_callback=link_callback)
     
     if pisa_status.err:
         return HttpResponse('Error al generar PDF: ' + str(pisa_status.err), status=500)
@@ -1560,18 +1225,8 @@ def preview_recibo_transaccion(request, pago_id):
     cuotas_cubiertas = [str(d.cuota.numero_cuota) for d in pago.detalles.all().order_by('cuota__numero_cuota')]
     cuotas_str = ", ".join(cuotas_cubiertas) if cuotas_cubiertas else "Abono General"
     
-    saldo_pendiente = sum(c.total_a_pagar - c.valor_pagado for c in contrato.cuotas.all())
+    saldo_pendiente = obtener_resumen(contrato.id).saldo_pendiente
 
-    # Determinar método de pago y detalles
-    metodo_real = 'EFECTIVO'
-    datos_bancarios = None
-    
-    obs = pago.observacion or ""
-    if 'TRANSFERENCIA' in obs or pago.metodo_pago == 'TRANSFERENCIA':
-        metodo_real = 'TRANSFERENCIA BANCARIA'
-    elif 'DEPOSITO' in obs:
-        metodo_real = 'DEPÓSITO'
-        
     context = {
         'contrato': contrato,
         'cliente': contrato.cliente,
@@ -1581,7 +1236,7 @@ def preview_recibo_transaccion(request, pago_id):
         'fecha_pago': fecha_pago,
         'cuotas_str': cuotas_str,
         'saldo_pendiente': saldo_pendiente,
-        'metodo_real': metodo_real,
+        'metodo_real': metodo_real_pago(pago),
         'fecha_actual': date.today(),
         'pago_id': pago.id, # Para el boton de descargar
     }
@@ -1590,23 +1245,21 @@ def preview_recibo_transaccion(request, pago_id):
 @login_required
 def descargar_recibo_transaccion_pdf(request, pago_id):
     """
-    Genera y descarga el PDF del recibo de una transacción.
+    Descarga el PDF del recibo de una transacción (desde la caché si no cambió).
     """
-    from .services import generar_recibo_transaccion_buffer
+    from .services import recibo_transaccion_pdf
     from .models import Pago
     
-    buffer = generar_recibo_transaccion_buffer(pago_id)
+    pdf = recibo_transaccion_pdf(pago_id)
     
-    if not buffer:
+    if not pdf:
         messages.error(request, "No se pudo generar el recibo.")
         # Fallback redirect if something goes wrong
         return redirect('dashboard')
         
-    response = HttpResponse(buffer, content_type='application/pdf')
     pago = Pago.objects.get(pk=pago_id)
     filename = f"Recibo_Pago_{pago.numero_transaccion}_{pago.contrato.cliente.apellidos}.pdf"
-    response['Content-Disposition'] = f'attachment; filename="{filename}"'
-    return response
+    return respuesta_pdf(request, pdf, filename)
 
 # ==========================================
 # GESTOR DE GASTOS Y FLUJO DE CAJA
@@ -1617,16 +1270,24 @@ def gestor_gastos_view(request):
     Vista principal del dashboard del gestor de gastos.
     Muestra los KPIs (Saldo, Ingresos, Gastos) e historial.
     """
-    # Obtener todos los movimientos ordenados por fecha de registro (más reciente primero)
-    movimientos = MovimientoCaja.objects.all().order_by('-fecha_registro', '-id')
-    
-    # Calcular KPIs
-    total_ingresos = sum(m.monto for m in movimientos if m.tipo == 'INGRESO')
-    total_gastos = sum(m.monto for m in movimientos if m.tipo == 'GASTO')
-    saldo_actual = total_ingresos - total_gastos
+    # Una página del historial (más recientes primero), filtrada y paginada por cursor en la BD
+    from Aplicaciones.sbr_gestor.movimientos import leer_filtros, pagina_movimientos_caja
+    desde, hasta, tipo, _ = leer_filtros(request.GET)
+    pagina = pagina_movimientos_caja(
+        desde, hasta, tipo, despues=request.GET.get('despues'), antes=request.GET.get('antes')
+    )
+    filtros = {campo: request.GET[campo] for campo in ('desde', 'hasta', 'tipo') if request.GET.get(campo)}
+
+    # KPIs: acumulados del último asiento de la cuenta CAJA del libro de caja
+    from Aplicaciones.sbr_gestor.libro import totales_libro
+    totales = totales_libro('CAJA')
+    total_ingresos, total_gastos, saldo_actual = totales['ingresos'], totales['gastos'], totales['saldo']
     
     context = {
-        'movimientos': movimientos,
+        'movimientos': pagina['movimientos'],
+        'filtros': filtros,
+        'url_anterior': '?' + urlencode({**filtros, 'antes': pagina['anterior']}) if pagina['anterior'] else None,
+        'url_siguiente': '?' + urlencode({**filtros, 'despues': pagina['siguiente']}) if pagina['siguiente'] else None,
         'total_ingresos': total_ingresos,
         'total_gastos': total_gastos,
         'saldo_actual': saldo_actual,
@@ -0,0 +1,33 @@
+"""
+Puntos de entrada de los procesos del pool de procesar_pdfs y de la exportación masiva.
+
+El pool usa 'spawn' (igual en Windows y Linux): el hijo arranca sin Django y sin heredar
+las conexiones del padre, e importa este módulo antes de que corra el inicializador.
+Por eso aquí no se importan modelos a nivel de módulo.
+"""
+
+def inicializar_proceso():
+    import django
+    django.setup()
+
+def ejecutar_en_proceso(tarea_id):
+    """tareas_pdf.ejecutar_tarea descartando conexiones caídas antes y después."""
+    from django.db import close_old_connections
+    from .tareas_pdf import ejecutar_tarea
+
+    close_old_connections()
+    try:
+        return ejecutar_tarea(tarea_id)
+    finally:
+        close_old_connections()
+
+def renderizar_documento(tipo, objeto_id):
+    """exportacion_pdf.render_documento en el pool de la exportación masiva."""
+    from django.db import close_old_connections
+    from .exportacion_pdf import render_documento
+
+    close_old_connections()
+    try:
+        return render_documento(tipo, objeto_id)
+    finally:
+        close_old_connections()
@@ -0,0 +1,113 @@
+"""
+Datos de los gráficos del dashboard del gestor, calculados en la BD.
+
+  - totales_por_categoria: ingresos y gastos por categoría (una consulta agrupada sobre
+    Transaccion, más la venta de lotes de totales_gestor).
+  - serie_ingresos_gastos: ingresos (lotes + caja) contra gastos por día, semana o mes,
+    agrupando el ResumenDiario (días × vendedores, no pagos ni transacciones).
+
+Las vistas api_graficos_* responden con ETag y Last-Modified de version_graficos: el
+navegador revalida y, si nada se escribió desde la última vez, recibe un 304 sin cuerpo.
+"""
+import hashlib
+from datetime import date, timedelta
+from decimal import Decimal
+
+from dateutil.relativedelta import relativedelta
+from django.db.models import DecimalField, F, Max, Sum, Value
+from django.db.models.functions import Coalesce, TruncDay, TruncMonth, TruncWeek
+
+from Aplicaciones.sbr_app_dos.asignacion import a_centavos
+from Aplicaciones.sbr_app_dos.models import ResumenDiario
+from .models import AsientoLibro, Transaccion
+
+# periodo -> (función de agrupación, inicio del período que contiene `dia`, paso, cuántos por defecto)
+PERIODOS = {
+    'dia': (TruncDay, lambda dia: dia, relativedelta(days=1), 30),
+    'semana': (TruncWeek, lambda dia: dia - timedelta(days=dia.weekday()), relativedelta(weeks=1), 12),
+    'mes': (TruncMonth, lambda dia: dia.replace(day=1), relativedelta(months=1), 12),
+}
+
+
+def version_graficos():
+    """
+    (huella, última escritura) de los datos de los gráficos. Todo cambio de montos o
+    fechas (pagos, contratos, transacciones) agrega un asiento al libro de caja; los
+    cambios de categoría se ven en Transaccion.actualizado_en. Dos consultas indexadas.
+    """
+    ultimo = AsientoLibro.objects.filter(cuenta='GESTOR').order_by('-id').values('id', 'registrado_en').first() or {}
+    transacciones = Transaccion.objects.aggregate(ultima=Max('actualizado_en'))
+    fechas = [f for f in (ultimo.get('registrado_en'), transacciones['ultima']) if f]
+    huella = repr((ultimo.get('id'), transacciones['ultima']))
+    return hashlib.sha1(huella.encode()).hexdigest()[:16], max(fechas) if fechas else None
+
+def totales_por_categoria(mes=None, anio=None):
+    """
+    {'ingresos': {'labels', 'data'}, 'gastos': {...}} en el mes (o en todo el historial),
+    de mayor a menor. Los ingresos incluyen 'Venta de Lotes' con la regla de totales_gestor.
+    """
+    from .views import rango_mes, totales_gestor
+
+    transacciones = Transaccion.objects.all()
+    if mes and anio:
+        transacciones = transacciones.filter(fecha__range=rango_mes(mes, anio))
+    monto = DecimalField(max_digits=14, decimal_places=2)
+    graficos = {'ingresos': {}, 'gastos': {}}
+    for fila in (
+        transacciones.order_by()
+        .values('tipo', 'categoria__nombre')
+        .annotate(total=Sum('valor', output_field=monto))
+    ):
+        sin_categoria = 'Otros Ingresos' if fila['tipo'] == 'INGRESO' else 'Sin Categoría'
+        grafico = graficos['ingresos' if fila['tipo'] == 'INGRESO' else 'gastos']
+        nombre = fila['categoria__nombre'] or sin_categoria
+        # Dos categorías con el mismo nombre se muestran juntas
+        grafico[nombre] = grafico.get(nombre, Decimal('0.00')) + a_centavos(fila['total'])
+
+    ingresos_lotes = totales_gestor(mes, anio)[0]
+    if ingresos_lotes > 0:
+        graficos['ingresos']['Venta de Lotes'] = ingresos_lotes
+
+    resultado = {}
+    for clave, grafico in graficos.items():
+        orden = sorted(grafico.items(), key=lambda item: item[1], reverse=True)
+        resultado[clave] = {'labels': [nombre for nombre, _ in orden], 'data': [float(total) for _, total in orden]}
+    return resultado
+
+def rango_serie(periodo, hasta=None):
+    """(desde, hasta) por defecto: los últimos N períodos hasta `hasta` (hoy), incluido el actual."""
+    _, inicio, paso, cantidad = PERIODOS[periodo]
+    hasta = hasta or date.today()
+    return inicio(hasta) - paso * (cantidad - 1), hasta
+
+def serie_ingresos_gastos(periodo='mes', desde=None, hasta=None):
+    """
+    {'periodo', 'labels', 'ingresos', 'gastos'}: un punto por período entre desde y hasta
+    (también los vacíos, en cero); el primero y el último solo suman los días dentro del
+    rango. Ingresos = cobros de lotes sin DEVOLUCION + ingresos de caja, igual que los
+    KPIs con filtro de mes. Una consulta sobre ResumenDiario.
+    """
+    truncar, inicio, paso, _ = PERIODOS[periodo]
+    if desde is None or hasta is None:
+        desde, hasta = rango_serie(periodo, hasta)
+    monto = DecimalField(max_digits=14, decimal_places=2)
+    suma = lambda expresion: Coalesce(Sum(expresion, output_field=monto), Value(Decimal('0')), output_field=monto)
+    filas = {
+        fila['periodo']: fila
+        for fila in (
+            ResumenDiario.objects.filter(fecha__range=(desde, hasta))
+            .order_by()
+            .values(periodo=truncar('fecha'))
+            .annotate(ingresos=suma(F('ingresos_lotes') + F('ingresos_caja')), gastos=suma('gastos'))
+        )
+    }
+
+    serie = {'periodo': periodo, 'labels': [], 'ingresos': [], 'gastos': []}
+    actual = inicio(desde)
+    while actual <= hasta:
+        fila = filas.get(actual, {})
+        serie['labels'].append(actual.isoformat())
+        serie['ingresos'].append(float(a_centavos(fila.get('ingresos'))))
+        serie['gastos'].append(float(a_centavos(fila.get('gastos'))))
+        actual += paso
+    return serie
@@ -0,0 +1,277 @@
+"""
+Libro de caja: saldo del gestor y de la caja sin recalcular todo el historial.
+
+Cada cambio en un pago, contrato, transacción o movimiento de caja agrega asientos
+(AsientoLibro) con la diferencia entre lo que ese origen debe aportar y lo que ya está
+asentado: un alta asienta el importe, una edición la reversa de lo anterior más lo
+nuevo, una baja solo la reversa. Nada se modifica ni se borra, y sincronizar dos veces
+no asienta nada la segunda. Cada asiento lleva el saldo acumulado de su cuenta, así que:
+
+  - el saldo actual es el último asiento (una consulta, sin importar el historial);
+  - el saldo a una fecha es el último corte de fin de mes (CorteLibro) más la suma de
+    los asientos del mes en curso. Un asiento con fecha anterior borra los cortes
+    desde esa fecha; generar_cortes los vuelve a crear al consultar.
+
+Cuentas:
+  GESTOR  entradas y abonos a cuotas de los lotes (misma regla que totales_gestor sin
+          filtro de mes: DEVOLUCION resta) + transacciones del gestor.
+  CAJA    movimientos de caja (MovimientoCaja).
+
+Las señales (signals.py) sincronizan cada cambio; las cargas en bloque (bulk_create,
+update) no las disparan: llamar a sincronizar_libro() después, o al comando
+reconstruir_resumenes.
+"""
+from datetime import date, timedelta
+from decimal import Decimal
+
+from dateutil.relativedelta import relativedelta
+from django.db import transaction
+from django.db.models import DecimalField, Q, Sum, Value
+from django.db.models.functions import Coalesce, TruncMonth
+
+from Aplicaciones.sbr_app_dos.asignacion import a_centavos
+from Aplicaciones.sbr_app_dos.models import Contrato, MovimientoCaja, Pago
+from Aplicaciones.sbr_app_dos.services import _entradas_supuestas
+from .models import AsientoLibro, CorteLibro, Transaccion
+
+CERO = Decimal('0.00')
+
+ORIGENES_LOTES = ('CONTRATO', 'PAGO')
+
+
+def _en(campo, ids):
+    return Q(**{f'{campo}__in': list(ids)}) if ids is not None else Q()
+
+def _sumas():
+    monto = DecimalField(max_digits=16, decimal_places=2)
+    return {
+        'ingresos': Coalesce(Sum('importe', filter=Q(tipo='INGRESO')), Value(CERO), output_field=monto),
+        'gastos': Coalesce(-Sum('importe', filter=Q(tipo='GASTO')), Value(CERO), output_field=monto),
+    }
+
+def _totales(ingresos, gastos):
+    ingresos, gastos = a_centavos(ingresos), a_centavos(gastos)
+    return {'ingresos': ingresos, 'gastos': gastos, 'saldo': ingresos - gastos}
+
+# ==========================================
+# LO QUE CADA ORIGEN DEBE APORTAR
+# ==========================================
+# Clave de un asiento: (origen, origen_id, contrato_id, fecha, tipo) -> importe neto
+
+def _esperados_contratos(ids=None):
+    """Entradas (según el contrato, el día de la firma) y abonos a cuotas de los contratos."""
+    esperados = {}
+    signos = {}
+    for contrato_id, fecha, entrada, estado in (
+        Contrato.objects.filter(_en('id', ids)).values_list('id', 'fecha_contrato', 'valor_entrada', 'estado')
+    ):
+        signos[contrato_id] = -1 if estado == 'DEVOLUCION' else 1
+        if entrada > 0:
+            esperados[('CONTRATO', contrato_id, contrato_id, fecha, 'INGRESO')] = entrada * signos[contrato_id]
+
+    pagos = Pago.objects.filter(_en('contrato_id', ids))
+    supuestas = set(_entradas_supuestas(pagos))
+    for pago_id, contrato_id, fecha, monto in (
+        pagos.filter(es_entrada=False).values_list('id', 'contrato_id', 'fecha_pago', 'monto')
+    ):
+        if pago_id not in supuestas and contrato_id in signos:
+            esperados[('PAGO', pago_id, contrato_id, fecha, 'INGRESO')] = monto * signos[contrato_id]
+    return esperados
+
+def _esperados_caja(origen, filas):
+    """Ingresos suman, gastos restan. `filas`: (id, fecha, tipo, valor)."""
+    return {
+        (origen, pk, None, fecha, tipo): valor if tipo == 'INGRESO' else -valor
+        for pk, fecha, tipo, valor in filas
+    }
+
+def _esperados_transacciones(ids=None):
+    return _esperados_caja('TRANSACCION', Transaccion.objects.filter(_en('id', ids)).values_list(
+        'id', 'fecha', 'tipo', 'valor'
+    ))
+
+def _esperados_movimientos(ids=None):
+    return _esperados_caja('MOVIMIENTO', MovimientoCaja.objects.filter(_en('id', ids)).values_list(
+        'id', 'fecha', 'tipo', 'monto'
+    ))
+
+def _asentados(asientos):
+    """Neto ya asentado por clave."""
+    return {
+        (fila['origen'], fila['origen_id'], fila['contrato_id'], fila['fecha'], fila['tipo']): a_centavos(fila['neto'])
+        for fila in (
+            asientos.order_by()
+            .values('origen', 'origen_id', 'contrato_id', 'fecha', 'tipo')
+            .annotate(neto=Sum('importe'))
+        )
+    }
+
+# ==========================================
+# ASENTAR
+# ==========================================
+def _asentar(cuenta, calcular):
+    """
+    `calcular()` -> (esperados, queryset de los asientos de esos orígenes). Asienta las
+    diferencias después del último asiento de la cuenta y retorna cuántos asientos creó.
+    """
+    with transaction.atomic():
+        # Bloquea el último asiento: dos sincronizaciones de la misma cuenta no se cruzan
+        ultimo = AsientoLibro.objects.select_for_update().filter(cuenta=cuenta).order_by('-id').first()
+        esperados, asientos = calcular()
+        asentados = _asentados(asientos)
+        diferencias = [
+            (clave, esperados.get(clave, CERO) - asentados.get(clave, CERO))
+            for clave in esperados.keys() | asentados.keys()
+        ]
+        diferencias = sorted(
+            ((clave, importe) for clave, importe in diferencias if importe),
+            key=lambda d: (d[0][3], d[0][0], d[0][1], d[0][4])
+        )
+        if not diferencias:
+            return 0
+
+        ingresos, gastos = (ultimo.ingresos, ultimo.gastos) if ultimo else (CERO, CERO)
+        nuevos = []
+        for (origen, origen_id, contrato_id, fecha, tipo), importe in diferencias:
+            if tipo == 'INGRESO':
+                ingresos += importe
+            else:
+                gastos -= importe
+            nuevos.append(AsientoLibro(
+                cuenta=cuenta, origen=origen, origen_id=origen_id, contrato_id=contrato_id, tipo=tipo,
+                fecha=fecha, importe=importe, saldo=ingresos - gastos, ingresos=ingresos, gastos=gastos,
+            ))
+        AsientoLibro.objects.bulk_create(nuevos, batch_size=1000)
+        # Los cortes desde la fecha más antigua asentada ya no son válidos
+        CorteLibro.objects.filter(cuenta=cuenta, fecha__gte=diferencias[0][0][3]).delete()
+        return len(nuevos)
+
+def sincronizar_contratos(ids=None):
+    """Asienta los cambios de entradas y pagos de los contratos `ids` (todos con None)."""
+    return _asentar('GESTOR', lambda: (
+        _esperados_contratos(ids),
+        AsientoLibro.objects.filter(_en('contrato_id', ids), cuenta='GESTOR', origen__in=ORIGENES_LOTES),
+    ))
+
+def sincronizar_transacciones(ids=None):
+    return _asentar('GESTOR', lambda: (
+        _esperados_transacciones(ids),
+        AsientoLibro.objects.filter(_en('origen_id', ids), cuenta='GESTOR', origen='TRANSACCION'),
+    ))
+
+def sincronizar_movimientos(ids=None):
+    return _asentar('CAJA', lambda: (
+        _esperados_movimientos(ids),
+        AsientoLibro.objects.filter(_en('origen_id', ids), cuenta='CAJA', origen='MOVIMIENTO'),
+    ))
+
+def sincronizar_libro():
+    """Asienta todo lo que falte (después de cargas en bloque o de la primera migración)."""
+    return sincronizar_contratos() + sincronizar_transacciones() + sincronizar_movimientos()
+
+# ==========================================
+# CONSULTAR
+# ==========================================
+def generar_cortes(cuenta='GESTOR', hasta=None):
+    """
+    Crea los cortes de fin de mes que falten hasta el mes anterior al de `hasta` (hoy
+    por defecto), con una consulta agrupada por mes desde el último corte válido.
+    Retorna el último corte (None si la cuenta aún no tiene asientos hasta ahí).
+    """
+    limite = (hasta or date.today()).replace(day=1) - timedelta(days=1)
+    ultimo = CorteLibro.objects.filter(cuenta=cuenta, fecha__lte=limite).order_by('-fecha').first()
+    if ultimo and ultimo.fecha == limite:
+        return ultimo
+
+    asientos = AsientoLibro.objects.filter(cuenta=cuenta, fecha__lte=limite)
+    if ultimo:
+        asientos = asientos.filter(fecha__gt=ultimo.fecha)
+    meses = {
+        fila['mes']: fila
+        for fila in asientos.order_by().values(mes=TruncMonth('fecha')).annotate(**_sumas())
+    }
+    if ultimo:
+        mes = ultimo.fecha + timedelta(days=1)
+        ingresos, gastos = ultimo.ingresos, ultimo.gastos
+    elif meses:
+        mes = min(meses)
+        ingresos, gastos = CERO, CERO
+    else:
+        return None
+
+    # Un corte por mes, también los meses sin asientos: la cadena no tiene huecos
+    cortes = []
+    while mes <= limite:
+        if mes in meses:
+            ingresos += a_centavos(meses[mes]['ingresos'])
+            gastos += a_centavos(meses[mes]['gastos'])
+        mes += relativedelta(months=1)
+        cortes.append(CorteLibro(
+            cuenta=cuenta, fecha=mes - timedelta(days=1), saldo=ingresos - gastos, ingresos=ingresos, gastos=gastos,
+        ))
+    CorteLibro.objects.bulk_create(cortes, ignore_conflicts=True)
+    return cortes[-1] if cortes else ultimo
+
+def totales_libro(cuenta='GESTOR', fecha=None):
+    """
+    {'ingresos', 'gastos', 'saldo'} de la cuenta. Sin fecha: el último asiento (una
+    consulta). Con fecha: movimientos con fecha hasta ese día inclusive, desde el último
+    corte más los asientos del mes de `fecha`.
+    """
+    if fecha is None:
+        ultimo = AsientoLibro.objects.filter(cuenta=cuenta).order_by('-id').values('ingresos', 'gastos').first()
+        return _totales(**ultimo) if ultimo else _totales(CERO, CERO)
+
+    corte = generar_cortes(cuenta, fecha)
+    cola = AsientoLibro.objects.filter(cuenta=cuenta, fecha__lte=fecha)
+    if corte:
+        cola = cola.filter(fecha__gt=corte.fecha)
+    sumas = cola.aggregate(**_sumas())
+    base = (corte.ingresos, corte.gastos) if corte else (CERO, CERO)
+    return _totales(base[0] + a_centavos(sumas['ingresos']), base[1] + a_centavos(sumas['gastos']))
+
+def saldo_al(fecha, cuenta='GESTOR'):
+    return totales_libro(cuenta, fecha)['saldo']
+
+# ==========================================
+# VERIFICAR
+# ==========================================
+def verificar_libro():
+    """
+    Compara el libro contra los datos de origen: lo asentado por cada pago, contrato,
+    transacción y movimiento, los totales de cada cuenta (calculados aparte, como
+    calcular_ganancias_lotes_rapido) y la cadena de saldos. Retorna la lista de diferencias.
+    """
+    from .views import calcular_ganancias_lotes_rapido
+
+    diferencias = []
+    esperados = {
+        'GESTOR': {**_esperados_contratos(), **_esperados_transacciones()},
+        'CAJA': _esperados_movimientos(),
+    }
+    for cuenta, esperado in esperados.items():
+        asentados = _asentados(AsientoLibro.objects.filter(cuenta=cuenta))
+        for clave in sorted(esperado.keys() | asentados.keys(), key=lambda c: (c[0], c[1], c[3])):
+            if esperado.get(clave, CERO) != asentados.get(clave, CERO):
+                origen, origen_id, _, fecha, tipo = clave
+                diferencias.append(
+                    f"Libro {cuenta} {origen} #{origen_id} {tipo} {fecha}: "
+                    f"esperado {esperado.get(clave, CERO)}, asentado {asentados.get(clave, CERO)}"
+                )
+
+    caja = lambda modelo, campo, tipo: a_centavos(modelo.objects.filter(tipo=tipo).aggregate(t=Sum(campo))['t'])
+    totales = {
+        'GESTOR': _totales(
+            calcular_ganancias_lotes_rapido() + caja(Transaccion, 'valor', 'INGRESO'), caja(Transaccion, 'valor', 'GASTO')
+        ),
+        'CAJA': _totales(caja(MovimientoCaja, 'monto', 'INGRESO'), caja(MovimientoCaja, 'monto', 'GASTO')),
+    }
+    for cuenta, esperado in totales.items():
+        guardado = totales_libro(cuenta)
+        suma = a_centavos(AsientoLibro.objects.filter(cuenta=cuenta).aggregate(t=Sum('importe'))['t'])
+        for campo, valor in esperado.items():
+            if guardado[campo] != valor:
+                diferencias.append(f"Libro {cuenta} {campo}: esperado {valor}, último asiento {guardado[campo]}")
+        if suma != guardado['saldo']:
+            diferencias.append(f"Libro {cuenta}: la suma de los asientos ({suma}) no cuadra con el saldo ({guardado['saldo']})")
+    return diferencias
@@ -0,0 +1,17 @@
+# Generated by Django 6.0.1 on 2026-10-18 17:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sbr_gestor', '0002_categoriatransaccion_transaccion_categoria'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='transaccion',
+            index=models.Index(fields=['tipo', 'fecha'], name='transaccion_tipo_fecha_idx'),
+        ),
+    ]
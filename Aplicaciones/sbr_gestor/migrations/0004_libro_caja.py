@@ -0,0 +1,57 @@
+# Generated by Django 6.0.1 on 2026-10-18 20:40
+
+from django.db import migrations, models
+
+
+def asentar_historial(apps, schema_editor):
+    # Asientos iniciales desde los pagos, contratos, transacciones y movimientos existentes.
+    # Usa libro.py y no los modelos históricos: solo lee columnas que ya existen en este
+    # punto y, con la BD vacía (p. ej. la de pruebas), no escribe nada.
+    from Aplicaciones.sbr_gestor.libro import sincronizar_libro
+    sincronizar_libro()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sbr_app_dos', '0038_busqueda_clientes'),
+        ('sbr_gestor', '0003_indices_consultas'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AsientoLibro',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('cuenta', models.CharField(choices=[('GESTOR', 'Gestor (lotes y transacciones)'), ('CAJA', 'Caja (movimientos)')], max_length=10)),
+                ('origen', models.CharField(choices=[('CONTRATO', 'Entrada del contrato'), ('PAGO', 'Pago de cuotas'), ('TRANSACCION', 'Transacción del gestor'), ('MOVIMIENTO', 'Movimiento de caja')], max_length=12)),
+                ('origen_id', models.PositiveIntegerField()),
+                ('contrato_id', models.PositiveIntegerField(blank=True, null=True)),
+                ('tipo', models.CharField(choices=[('INGRESO', 'Ingreso'), ('GASTO', 'Gasto')], max_length=10)),
+                ('fecha', models.DateField()),
+                ('importe', models.DecimalField(decimal_places=2, max_digits=14)),
+                ('saldo', models.DecimalField(decimal_places=2, max_digits=16)),
+                ('ingresos', models.DecimalField(decimal_places=2, max_digits=16)),
+                ('gastos', models.DecimalField(decimal_places=2, max_digits=16)),
+                ('registrado_en', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['cuenta', '-id'], name='asiento_cuenta_id_idx'), models.Index(fields=['cuenta', 'fecha'], name='asiento_cuenta_fecha_idx'), models.Index(fields=['origen', 'origen_id'], name='asiento_origen_idx'), models.Index(fields=['contrato_id'], name='asiento_contrato_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='CorteLibro',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('cuenta', models.CharField(choices=[('GESTOR', 'Gestor (lotes y transacciones)'), ('CAJA', 'Caja (movimientos)')], max_length=10)),
+                ('fecha', models.DateField()),
+                ('saldo', models.DecimalField(decimal_places=2, max_digits=16)),
+                ('ingresos', models.DecimalField(decimal_places=2, max_digits=16)),
+                ('gastos', models.DecimalField(decimal_places=2, max_digits=16)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('cuenta', 'fecha'), name='corte_cuenta_fecha_unico')],
+            },
+        ),
+        migrations.RunPython(asentar_historial, migrations.RunPython.noop),
+    ]
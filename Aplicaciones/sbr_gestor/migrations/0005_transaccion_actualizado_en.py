@@ -0,0 +1,20 @@
+# Generated by Django 6.0.1 on 2026-10-18 21:30
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sbr_gestor', '0004_libro_caja'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='transaccion',
+            name='actualizado_en',
+            field=models.DateTimeField(auto_now=True, db_index=True, default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+    ]
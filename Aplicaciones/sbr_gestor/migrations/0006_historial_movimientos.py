@@ -0,0 +1,17 @@
+# Generated by Django 6.0.1 on 2026-10-18 22:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sbr_gestor', '0005_transaccion_actualizado_en'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='transaccion',
+            index=models.Index(fields=['-fecha', '-id'], name='transaccion_fecha_id_idx'),
+        ),
+    ]
@@ -29,6 +29,16 @@ class Transaccion(models.Model):
     
     registrado_por = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True)
     fecha_registro = models.DateTimeField(auto_now_add=True)
+    # Última edición (versión de los gráficos del dashboard, graficos.py)
+    actualizado_en = models.DateTimeField(auto_now=True, db_index=True)
+
+    class Meta:
+        indexes = [
+            # Totales de ingresos/gastos por período
+            models.Index(fields=['tipo', 'fecha'], name='transaccion_tipo_fecha_idx'),
+            # Historial paginado por cursor (movimientos.py)
+            models.Index(fields=['-fecha', '-id'], name='transaccion_fecha_id_idx'),
+        ]
 
     def save(self, *args, **kwargs):
         if self.descripcion:
@@ -37,3 +47,74 @@ class Transaccion(models.Model):
 
     def __str__(self):
         return f"{self.tipo} - ${self.valor} ({self.fecha})"
+
+
+# ==========================================
+# LIBRO DE CAJA (libro.py)
+# ==========================================
+class AsientoLibro(models.Model):
+    """
+    Libro de caja de solo agregar: cada alta, cambio o baja de un pago, entrada de
+    contrato, transacción o movimiento de caja agrega un asiento con la diferencia
+    (un cambio es la reversa de lo anterior más lo nuevo). Cada asiento lleva el
+    saldo, ingresos y gastos acumulados de su cuenta hasta él (en orden de registro).
+    """
+    CUENTAS = [
+        ('GESTOR', 'Gestor (lotes y transacciones)'),
+        ('CAJA', 'Caja (movimientos)'),
+    ]
+    ORIGENES = [
+        ('CONTRATO', 'Entrada del contrato'),
+        ('PAGO', 'Pago de cuotas'),
+        ('TRANSACCION', 'Transacción del gestor'),
+        ('MOVIMIENTO', 'Movimiento de caja'),
+    ]
+    TIPO_CHOICES = Transaccion.TIPO_CHOICES
+
+    cuenta = models.CharField(max_length=10, choices=CUENTAS)
+    origen = models.CharField(max_length=12, choices=ORIGENES)
+    origen_id = models.PositiveIntegerField()
+    # Contrato de los asientos de lotes (sigue existiendo aunque el pago se borre)
+    contrato_id = models.PositiveIntegerField(null=True, blank=True)
+    tipo = models.CharField(max_length=10, choices=TIPO_CHOICES)
+    # Fecha del movimiento (pago, firma, transacción), no la del registro
+    fecha = models.DateField()
+    # Efecto en el saldo: negativo para gastos, devoluciones y reversas
+    importe = models.DecimalField(max_digits=14, decimal_places=2)
+    saldo = models.DecimalField(max_digits=16, decimal_places=2)
+    ingresos = models.DecimalField(max_digits=16, decimal_places=2)
+    gastos = models.DecimalField(max_digits=16, decimal_places=2)
+    registrado_en = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            # Último asiento de la cuenta (saldo actual)
+            models.Index(fields=['cuenta', '-id'], name='asiento_cuenta_id_idx'),
+            # Cola de "saldo a una fecha" desde el último corte
+            models.Index(fields=['cuenta', 'fecha'], name='asiento_cuenta_fecha_idx'),
+            models.Index(fields=['origen', 'origen_id'], name='asiento_origen_idx'),
+            models.Index(fields=['contrato_id'], name='asiento_contrato_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.cuenta} {self.origen} #{self.origen_id}: {self.importe} ({self.fecha})"
+
+
+class CorteLibro(models.Model):
+    """
+    Saldo de una cuenta al cierre de un mes (asientos con fecha hasta ese día). Un
+    asiento con fecha anterior borra los cortes desde su fecha; se regeneran al consultar.
+    """
+    cuenta = models.CharField(max_length=10, choices=AsientoLibro.CUENTAS)
+    fecha = models.DateField()
+    saldo = models.DecimalField(max_digits=16, decimal_places=2)
+    ingresos = models.DecimalField(max_digits=16, decimal_places=2)
+    gastos = models.DecimalField(max_digits=16, decimal_places=2)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['cuenta', 'fecha'], name='corte_cuenta_fecha_unico'),
+        ]
+
+    def __str__(self):
+        return f"Corte {self.cuenta} {self.fecha}: {self.saldo}"
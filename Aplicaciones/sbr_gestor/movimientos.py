@@ -0,0 +1,265 @@
+"""
+Historial de movimientos paginado en la BD: transacciones, pagos de lotes, entradas sin
+pago ("fantasmas") y movimientos de caja en un solo feed.
+
+Cada fuente es una rama con la misma forma de columnas (mov_origen, mov_id, mov_fecha),
+ya filtrada (fechas, tipo, categoría), ordenada por (fecha, id) y limitada a una página:
+
+    SELECT mov_origen, mov_id, mov_fecha FROM (
+        SELECT * FROM (<transacciones ... ORDER BY fecha DESC, id DESC LIMIT n>) AS rama0
+        UNION ALL
+        SELECT * FROM (<pagos ... LIMIT n>) AS rama1
+        ...
+    ) AS feed ORDER BY mov_fecha DESC, mov_origen DESC, mov_id DESC LIMIT n
+
+Cada rama recorre su índice de fecha solo hasta llenar la página y la paginación es por
+cursor (fecha, origen, id), sin OFFSET ni COUNT: la primera página y la última cuestan
+lo mismo con 500 o con 500.000 movimientos. Después se cargan las filas de la página
+(una consulta por origen presente, con select_related).
+
+El ORM no permite LIMIT dentro de un UNION en SQLite; por eso las ramas se arman con el
+ORM y solo la unión se escribe en SQL.
+"""
+from datetime import date
+
+from django.db import connection
+from django.db.models import DateField, Exists, F, IntegerField, OuterRef, Q, Value
+
+from Aplicaciones.sbr_app_dos.models import Contrato, MovimientoCaja, Pago
+from .models import Transaccion
+
+TAMANO_PAGINA_MOVIMIENTOS = 25
+
+# Origen -> número que desempata movimientos del mismo día (mayor = más arriba)
+ORIGENES = {'MOVIMIENTO': 4, 'TRANSACCION': 3, 'PAGO': 2, 'CONTRATO': 1}
+_POR_NUMERO = {numero: origen for origen, numero in ORIGENES.items()}
+
+FILTROS_MOVIMIENTOS = ('desde', 'hasta', 'tipo', 'categoria')
+
+
+def _fecha(valor):
+    # SQLite devuelve la fecha como texto en el SQL crudo
+    return DateField().to_python(valor)
+
+def _rama(origen, queryset, campo_fecha):
+    """Rama del feed: (origen, queryset con las columnas comunes, campo de fecha)."""
+    return origen, queryset.annotate(
+        mov_origen=Value(ORIGENES[origen], output_field=IntegerField()),
+        mov_id=F('id'),
+        mov_fecha=F(campo_fecha),
+    ), campo_fecha
+
+def ramas_gestor(desde=None, hasta=None, tipo='', categoria='', con_lotes=False):
+    """
+    Ramas del historial del gestor. `categoria`: id de CategoriaTransaccion, o 'lotes'
+    para ver solo la venta de lotes (pagos y entradas sin pago de contratos no devueltos).
+    """
+    transacciones = Transaccion.objects.all()
+    pagos = Pago.objects.exclude(contrato__estado='DEVOLUCION')
+    fantasmas = Contrato.objects.filter(valor_entrada__gt=0).exclude(estado='DEVOLUCION').filter(
+        ~Exists(Pago.objects.filter(contrato=OuterRef('pk')))
+    )
+    if desde:
+        transacciones = transacciones.filter(fecha__gte=desde)
+        pagos = pagos.filter(fecha_pago__gte=desde)
+        fantasmas = fantasmas.filter(fecha_contrato__gte=desde)
+    if hasta:
+        transacciones = transacciones.filter(fecha__lte=hasta)
+        pagos = pagos.filter(fecha_pago__lte=hasta)
+        fantasmas = fantasmas.filter(fecha_contrato__lte=hasta)
+    if tipo:
+        transacciones = transacciones.filter(tipo=tipo)
+
+    ramas = []
+    if categoria != 'lotes':
+        if categoria:
+            transacciones = transacciones.filter(categoria_id=categoria)
+        ramas.append(_rama('TRANSACCION', transacciones, 'fecha'))
+    # Los lotes son ingresos sin categoría de transacción
+    if (con_lotes or categoria == 'lotes') and tipo in ('', 'INGRESO') and categoria in ('', 'lotes'):
+        ramas += [_rama('PAGO', pagos, 'fecha_pago'), _rama('CONTRATO', fantasmas, 'fecha_contrato')]
+    return ramas
+
+def ramas_caja(desde=None, hasta=None, tipo=''):
+    movimientos = MovimientoCaja.objects.all()
+    if desde:
+        movimientos = movimientos.filter(fecha__gte=desde)
+    if hasta:
+        movimientos = movimientos.filter(fecha__lte=hasta)
+    if tipo:
+        movimientos = movimientos.filter(tipo=tipo)
+    return [_rama('MOVIMIENTO', movimientos, 'fecha')]
+
+# ==========================================
+# CURSOR
+# ==========================================
+def cursor_movimiento(clave):
+    origen, pk, fecha = clave
+    return f"{fecha.isoformat()}_{ORIGENES[origen]}_{pk}"
+
+def leer_cursor(valor):
+    """'YYYY-MM-DD_origen_id' -> (fecha, número de origen, id); None si no es válido."""
+    try:
+        fecha, origen, pk = (valor or '').split('_')
+        return date.fromisoformat(fecha), int(origen), int(pk)
+    except ValueError:
+        return None
+
+def _desde_cursor(origen, campo_fecha, cursor, hacia_atras):
+    """
+    Condición de la rama para empezar después del cursor (o antes, `hacia_atras`), en el
+    orden (fecha, origen, id): el origen de la rama es fijo, así que se resuelve aquí.
+    """
+    fecha, origen_cursor, pk = cursor
+    pasado = 'gt' if hacia_atras else 'lt'
+    propio = ORIGENES[origen]
+    if propio == origen_cursor:
+        return Q(**{f'{campo_fecha}__{pasado}': fecha}) | Q(**{campo_fecha: fecha, f'id__{pasado}': pk})
+    # Mismo día: las ramas de origen menor van después del cursor (mayor, hacia atrás)
+    incluye_dia = (propio < origen_cursor) != hacia_atras
+    return Q(**{f'{campo_fecha}__{pasado}{"e" if incluye_dia else ""}': fecha})
+
+# ==========================================
+# PÁGINA
+# ==========================================
+def _sql_feed(ramas, cursor, hacia_atras, limite):
+    direccion = 'ASC' if hacia_atras else 'DESC'
+    partes, parametros = [], []
+    for i, (origen, queryset, campo_fecha) in enumerate(ramas):
+        if cursor:
+            queryset = queryset.filter(_desde_cursor(origen, campo_fecha, cursor, hacia_atras))
+        orden = ('mov_fecha', 'mov_id') if hacia_atras else ('-mov_fecha', '-mov_id')
+        sql, params = (
+            queryset.order_by(*orden).values('mov_origen', 'mov_id', 'mov_fecha')[:limite].query.sql_with_params()
+        )
+        partes.append(f"SELECT * FROM ({sql}) AS rama{i}")
+        parametros += params
+    sql = (
+        f"SELECT mov_origen, mov_id, mov_fecha FROM ({' UNION ALL '.join(partes)}) AS feed "
+        f"ORDER BY mov_fecha {direccion}, mov_origen {direccion}, mov_id {direccion} LIMIT {int(limite)}"
+    )
+    return sql, parametros
+
+def pagina_feed(ramas, despues=None, antes=None, tamano=TAMANO_PAGINA_MOVIMIENTOS):
+    """
+    Una página del feed (más recientes primero). `despues` / `antes` son cursores de
+    cursor_movimiento, como en busqueda_clientes.pagina_contratos. Retorna
+    {'claves': [(origen, id, fecha)], 'siguiente', 'anterior'}.
+    """
+    desde_despues, desde_antes = leer_cursor(despues), leer_cursor(antes)
+    cursor = desde_antes or desde_despues
+    hacia_atras = desde_antes is not None
+    claves = []
+    if ramas:
+        with connection.cursor() as cursor_bd:
+            cursor_bd.execute(*_sql_feed(ramas, cursor, hacia_atras, tamano + 1))
+            claves = [(_POR_NUMERO[origen], pk, _fecha(fecha)) for origen, pk, fecha in cursor_bd.fetchall()]
+
+    hay_mas = len(claves) > tamano
+    claves = claves[:tamano]
+    if hacia_atras:
+        claves.reverse()
+        hay_anterior, hay_siguiente = hay_mas, True
+    else:
+        hay_anterior, hay_siguiente = desde_despues is not None, hay_mas
+    return {
+        'claves': claves,
+        'siguiente': cursor_movimiento(claves[-1]) if claves and hay_siguiente else None,
+        'anterior': cursor_movimiento(claves[0]) if claves and hay_anterior else None,
+    }
+
+def cargar_movimientos(claves):
+    """Los objetos de cada clave, en el orden de la página: una consulta por origen presente."""
+    consultas = {
+        'TRANSACCION': lambda: Transaccion.objects.select_related('categoria'),
+        'PAGO': lambda: Pago.objects.select_related('contrato', 'contrato__cliente'),
+        'CONTRATO': lambda: Contrato.objects.select_related('cliente'),
+        'MOVIMIENTO': lambda: MovimientoCaja.objects.select_related('registrado_por'),
+    }
+    por_origen = {}
+    for origen, pk, _ in claves:
+        por_origen.setdefault(origen, []).append(pk)
+    objetos = {
+        origen: consultas[origen]().in_bulk(ids)
+        for origen, ids in por_origen.items()
+    }
+    # Una fila borrada entre las dos consultas simplemente no aparece
+    return [(origen, objetos[origen][pk]) for origen, pk, _ in claves if pk in objetos[origen]]
+
+# ==========================================
+# FILAS DE LA TABLA DEL GESTOR
+# ==========================================
+def _fila_transaccion(m):
+    return {
+        'id': m.id,
+        'is_lote': False,
+        'fecha': m.fecha,
+        'tipo': m.tipo,
+        'categoria_nombre': m.categoria.nombre if m.categoria else 'SN Categoría',
+        'valor': m.valor,
+        'descripcion': m.descripcion,
+        'numero_recibo': m.numero_recibo,
+        'foto_url': m.foto_recibo.url if m.foto_recibo else None,
+        'mov_obj': m
+    }
+
+def _fila_pago(p):
+    desc = f"Entrada Lote - Contrato #{p.contrato.id} ({p.contrato.cliente})" if p.es_entrada else f"Cuota Lote - Contrato #{p.contrato.id} ({p.contrato.cliente})"
+    if p.observacion: desc += f" | {p.observacion[:40]}"
+    return {
+        'id': p.id,
+        'is_lote': True,
+        'fecha': p.fecha_pago,
+        'tipo': 'INGRESO',
+        'categoria_nombre': 'Venta de Lotes',
+        'valor': p.monto,
+        'descripcion': desc,
+        'numero_recibo': f"PGO-{p.id}",
+        'foto_url': p.comprobante_imagen.url if p.comprobante_imagen else None,
+        'contrato_id': p.contrato.id
+    }
+
+def _fila_fantasma(f):
+    return {
+        'id': f.id,
+        'is_lote': True,
+        'fecha': f.fecha_contrato,
+        'tipo': 'INGRESO',
+        'categoria_nombre': 'Venta de Lotes',
+        'valor': f.valor_entrada,
+        'descripcion': f"Entrada Automática - Contrato #{f.id} ({f.cliente})",
+        'numero_recibo': f"CTR-{f.id}",
+        'foto_url': None,
+        'contrato_id': f.id
+    }
+
+FILAS_GESTOR = {'TRANSACCION': _fila_transaccion, 'PAGO': _fila_pago, 'CONTRATO': _fila_fantasma}
+
+def pagina_movimientos_gestor(desde=None, hasta=None, tipo='', categoria='', con_lotes=False,
+                              despues=None, antes=None, tamano=TAMANO_PAGINA_MOVIMIENTOS):
+    """Página del historial del gestor: {'movimientos': [filas de la tabla], 'siguiente', 'anterior'}."""
+    pagina = pagina_feed(ramas_gestor(desde, hasta, tipo, categoria, con_lotes), despues, antes, tamano)
+    pagina['movimientos'] = [FILAS_GESTOR[origen](objeto) for origen, objeto in cargar_movimientos(pagina['claves'])]
+    return pagina
+
+def pagina_movimientos_caja(desde=None, hasta=None, tipo='', despues=None, antes=None, tamano=TAMANO_PAGINA_MOVIMIENTOS):
+    """Página de la caja: {'movimientos': [MovimientoCaja], 'siguiente', 'anterior'}."""
+    pagina = pagina_feed(ramas_caja(desde, hasta, tipo), despues, antes, tamano)
+    pagina['movimientos'] = [objeto for _, objeto in cargar_movimientos(pagina['claves'])]
+    return pagina
+
+def leer_filtros(datos):
+    """(desde, hasta, tipo, categoria) validados desde request.GET; lo inválido se ignora."""
+    fechas = []
+    for campo in ('desde', 'hasta'):
+        try:
+            fechas.append(date.fromisoformat(datos.get(campo, '')))
+        except ValueError:
+            fechas.append(None)
+    tipo = datos.get('tipo', '')
+    categoria = datos.get('categoria', '')
+    return (
+        fechas[0], fechas[1],
+        tipo if tipo in ('INGRESO', 'GASTO') else '',
+        categoria if categoria == 'lotes' or categoria.isdigit() else '',
+    )
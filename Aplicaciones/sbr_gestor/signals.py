@@ -0,0 +1,59 @@
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+from Aplicaciones.sbr_app_dos.models import Contrato, MovimientoCaja, Pago
+from Aplicaciones.sbr_app_dos.services import actualizar_resumen_diario
+from Aplicaciones.sbr_app_dos.signals import CAMPOS_CONTRATO_RESUMEN_DIARIO
+from .libro import sincronizar_contratos, sincronizar_movimientos, sincronizar_transacciones
+from .models import Transaccion
+
+# ==========================================
+# RESUMEN DIARIO: ingresos y gastos de caja
+# ==========================================
+@receiver(pre_save, sender=Transaccion)
+def recordar_fecha_anterior(sender, instance, raw=False, **kwargs):
+    # Si se edita la fecha, el día anterior también cambia
+    instance._fecha_anterior = None
+    if instance.pk and not raw:
+        instance._fecha_anterior = Transaccion.objects.filter(pk=instance.pk).values_list('fecha', flat=True).first()
+
+@receiver(post_save, sender=Transaccion)
+def actualizar_por_transaccion_guardada(sender, instance, raw=False, **kwargs):
+    if not raw:
+        actualizar_resumen_diario([instance.fecha, instance._fecha_anterior])
+
+@receiver(post_delete, sender=Transaccion)
+def actualizar_por_transaccion_eliminada(sender, instance, **kwargs):
+    actualizar_resumen_diario([instance.fecha])
+
+# ==========================================
+# LIBRO DE CAJA: asentar cada cambio (libro.py)
+# ==========================================
+@receiver(post_save, sender=Pago)
+@receiver(post_delete, sender=Pago)
+def asentar_pago(sender, instance, raw=False, **kwargs):
+    if not raw:
+        sincronizar_contratos([instance.contrato_id])
+
+@receiver(post_save, sender=Contrato)
+def asentar_contrato_guardado(sender, instance, created=False, raw=False, **kwargs):
+    # Solo la firma, el estado y la entrada cambian lo asentado (valores anteriores: sbr_app_dos.signals)
+    anteriores = getattr(instance, '_valores_anteriores', None)
+    if not raw and (created or anteriores != tuple(getattr(instance, c) for c in CAMPOS_CONTRATO_RESUMEN_DIARIO)):
+        sincronizar_contratos([instance.pk])
+
+@receiver(post_delete, sender=Contrato)
+def asentar_contrato_eliminado(sender, instance, **kwargs):
+    # Reversa de la entrada y de los pagos que quedaran asentados
+    sincronizar_contratos([instance.pk])
+
+@receiver(post_save, sender=Transaccion)
+@receiver(post_delete, sender=Transaccion)
+def asentar_transaccion(sender, instance, raw=False, **kwargs):
+    if not raw:
+        sincronizar_transacciones([instance.pk])
+
+@receiver(post_save, sender=MovimientoCaja)
+@receiver(post_delete, sender=MovimientoCaja)
+def asentar_movimiento(sender, instance, raw=False, **kwargs):
+    if not raw:
+        sincronizar_movimientos([instance.pk])
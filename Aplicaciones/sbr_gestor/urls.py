@@ -8,4 +8,6 @@ urlpatterns = [
     path('eliminar/<int:tr_id>/', views.eliminar_transaccion_view, name='eliminar_transaccion'),
     path('api/categoria/crear/', views.crear_categoria_api, name='api_crear_categoria'),
     path('api/totales/', views.api_totales_view, name='api_totales'),
+    path('api/graficos/categorias/', views.api_graficos_categorias_view, name='api_graficos_categorias'),
+    path('api/graficos/serie/', views.api_graficos_serie_view, name='api_graficos_serie'),
 ]
@@ -1,14 +1,27 @@
-import json
+from urllib.parse import urlencode
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required
 from django.http import JsonResponse
 from django.contrib import messages
 from django.views.decorators.csrf import csrf_exempt
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
 from decimal import Decimal
+from calendar import monthrange
 from datetime import date
-from django.db.models import Sum
+from django.db.models import Case, DecimalField, Exists, F, OuterRef, Q, Subquery, Sum, When
+from .graficos import PERIODOS, rango_serie, serie_ingresos_gastos, totales_por_categoria, version_graficos
+from .libro import totales_libro
+from .movimientos import FILTROS_MOVIMIENTOS, leer_filtros, pagina_movimientos_gestor
 from .models import Transaccion, CategoriaTransaccion
-from Aplicaciones.sbr_app_dos.models import Contrato
+from Aplicaciones.sbr_app_dos.asignacion import a_centavos
+from Aplicaciones.sbr_app_dos.models import Contrato, Pago
+from Aplicaciones.sbr_app_dos.services import totales_resumen_diario
+
+def rango_mes(mes, anio):
+    """(primer día, último día) del mes: filtrar por rango usa los índices de fecha, __month no."""
+    desde = date(int(anio), int(mes), 1)
+    return desde, desde.replace(day=monthrange(desde.year, desde.month)[1])
 
 def calcular_ganancias_lotes_rapido(mes=None, anio=None):
     """
@@ -17,192 +30,166 @@ def calcular_ganancias_lotes_rapido(mes=None, anio=None):
       - Sin filtro de mes: valor_entrada (campo contrato) + pagos de cuotas
       - Con filtro de mes:  cash-flow → suma de Pago.monto recibido ese mes
     Contratos DEVOLUCION se restan; CANCELADO/CERRADO se suman normalmente.
-    """
-    from django.db.models import Sum
-    from Aplicaciones.sbr_app_dos.models import Pago, Contrato
-    from decimal import Decimal
 
+    Ninguna vista la llama: el dashboard y api_totales leen totales_gestor (ResumenDiario)
+    y el libro de caja. Queda como cálculo independiente desde Pago/Contrato para
+    libro.verificar_libro, como referencia de paridad en las pruebas y en el benchmark.
+    """
     if mes and anio:
         # ── Modo cash-flow (mes específico) ─────────────────────────────────
         # Solo el dinero realmente recibido en ese mes
-        total = (
+        return a_centavos(
             Pago.objects
-            .filter(fecha_pago__year=int(anio), fecha_pago__month=int(mes))
+            .filter(fecha_pago__range=rango_mes(mes, anio))
             .exclude(contrato__estado='DEVOLUCION')
-            .aggregate(t=Sum('monto'))['t'] or Decimal('0.00')
+            .aggregate(t=Sum('monto'))['t']
         )
-        return total
 
     # ── Modo total histórico (sin filtro de mes) ─────────────────────────────
-    # Replica exactamente: reporte_general → total_general
-    total = Decimal('0.00')
-
-    contratos_qs = Contrato.objects.prefetch_related('pago_set').all()
+    # Replica exactamente: reporte_general → total_general, con dos consultas agregadas
+    # (antes: un recorrido por contrato con tres consultas cada uno)
+    monto = DecimalField(max_digits=14, decimal_places=2)
+    con_signo = lambda campo, estado: Case(
+        When(**{estado: 'DEVOLUCION'}, then=-F(campo)), default=F(campo), output_field=monto
+    )
 
-    for contrato in contratos_qs:
-        # Identificar IDs de pagos de entrada (igual que reporte_general)
-        ids_entradas = set(
-            contrato.pago_set.filter(es_entrada=True).values_list('id', flat=True)
-        )
-        if contrato.valor_entrada > 0 and not ids_entradas:
-            # Fallback para contratos legacy sin flag es_entrada
-            primer_pago = contrato.pago_set.order_by('id').first()
-            if primer_pago:
-                ids_entradas.add(primer_pago.id)
-
-        # 1. Contar la entrada desde el campo del contrato (siempre)
-        contrato_total = contrato.valor_entrada or Decimal('0.00')
+    # 1. La entrada se cuenta siempre desde el campo del contrato
+    entradas = Contrato.objects.aggregate(
+        t=Sum(con_signo('valor_entrada', 'estado'), output_field=monto)
+    )['t']
 
-        # 2. Sumar pagos de cuotas (no-entrada)
-        for pago in contrato.pago_set.exclude(id__in=ids_entradas):
-            contrato_total += pago.monto
+    # 2. Pagos de cuotas: todo pago que no sea la entrada. Contratos legacy sin flag
+    #    es_entrada (y con valor_entrada > 0): su primer pago es la entrada
+    primer_pago = Pago.objects.filter(contrato=OuterRef('contrato')).order_by('id').values('id')[:1]
+    entrada_legacy = (
+        Q(contrato__valor_entrada__gt=0, id=Subquery(primer_pago))
+        & ~Exists(Pago.objects.filter(contrato=OuterRef('contrato'), es_entrada=True))
+    )
+    abonos = Pago.objects.filter(es_entrada=False).exclude(entrada_legacy).aggregate(
+        t=Sum(con_signo('monto', 'contrato__estado'), output_field=monto)
+    )['t']
 
-        # 3. DEVOLUCION resta; todo lo demás suma
-        if contrato.estado == 'DEVOLUCION':
-            total -= contrato_total
-        else:
-            total += contrato_total
+    # 3. DEVOLUCION resta (signo en cada suma)
+    return a_centavos(entradas) + a_centavos(abonos)
 
-    return total
+def totales_gestor(mes=None, anio=None):
+    """
+    (ingresos_lotes, ingresos_caja, gastos) desde el ResumenDiario: suma días en lugar
+    de recorrer pagos y transacciones. Misma regla que calcular_ganancias_lotes_rapido:
+      - Con filtro de mes: cash-flow del mes sin contratos en DEVOLUCION
+      - Sin filtro: entradas según contrato + abonos a cuotas (DEVOLUCION resta)
+    """
+    if mes and anio:
+        totales = totales_resumen_diario(*rango_mes(mes, anio))
+        ingresos_lotes = totales['ingresos_lotes']
+    else:
+        totales = totales_resumen_diario()
+        ingresos_lotes = totales['entradas'] + totales['abonos_cuotas']
+    return ingresos_lotes, totales['ingresos_caja'], totales['gastos']
 
 def obtener_saldo_general_global():
-    from django.db.models import Sum
-    
-    ingresos_lotes = calcular_ganancias_lotes_rapido()
-    
-    ingresos_caja = Transaccion.objects.filter(tipo='INGRESO').aggregate(t=Sum('valor'))['t'] or Decimal('0.00')
-    gastos_caja = Transaccion.objects.filter(tipo='GASTO').aggregate(t=Sum('valor'))['t'] or Decimal('0.00')
-    
-    saldo_actual = (ingresos_lotes + ingresos_caja) - gastos_caja
-    return saldo_actual
+    """Saldo del gestor (lotes + ingresos - gastos): el último asiento del libro de caja."""
+    return totales_libro('GESTOR')['saldo']
 
-@login_required
-def dashboard_gestor_view(request):
+def mes_y_anio(request):
+    """(mes, anio) de ?mes=&anio= o de ?mes_filtro=YYYY-MM (None, None sin filtro)."""
     mes = request.GET.get('mes')
     anio = request.GET.get('anio')
-    
-    hoy = date.today()
     filtro_fecha = request.GET.get('mes_filtro', '') # formato: "YYYY-MM"
     if filtro_fecha:
         parts = filtro_fecha.split('-')
         if len(parts) == 2:
             anio, mes = parts[0], parts[1]
-    
-    movimientos = Transaccion.objects.all().order_by('-fecha_registro', '-id')
-    
-    if mes and anio:
-        movimientos = movimientos.filter(fecha__year=int(anio), fecha__month=int(mes))
-        ingresos_lotes = calcular_ganancias_lotes_rapido(mes=mes, anio=anio)
-        context_mes_filtro = f"{anio}-{str(mes).zfill(2)}"
-    else:
-        ingresos_lotes = calcular_ganancias_lotes_rapido()
-        context_mes_filtro = ''
+    return mes, anio
+
+@login_required
+def dashboard_gestor_view(request):
+    mes, anio = mes_y_anio(request)
+    hoy = date.today()
+    context_mes_filtro = f"{anio}-{str(mes).zfill(2)}" if mes and anio else ''
         
-    ingresos_caja = sum(m.valor for m in movimientos if m.tipo == 'INGRESO')
+    ingresos_lotes, ingresos_caja, total_gastos = totales_gestor(mes, anio)
     total_ingresos = ingresos_caja + ingresos_lotes
-    total_gastos = sum(m.valor for m in movimientos if m.tipo == 'GASTO')
     saldo_actual = total_ingresos - total_gastos
-    
-    # JSON para Chart.js - GASTOS
-    gastos = [m for m in movimientos if m.tipo == 'GASTO']
-    dict_categorias = {}
-    for g in gastos:
-        cat_name = g.categoria.nombre if g.categoria else 'Sin Categoría'
-        dict_categorias[cat_name] = dict_categorias.get(cat_name, Decimal('0.00')) + g.valor
-        
-    categorias_nombres = list(dict_categorias.keys())
-    categorias_valores = [float(v) for v in dict_categorias.values()]
-    chart_data = json.dumps({'labels': categorias_nombres, 'data': categorias_valores})
 
-    # JSON para Chart.js - INGRESOS
-    ingresos = [m for m in movimientos if m.tipo == 'INGRESO']
-    dict_ingresos = {}
-    
-    if ingresos_lotes > 0:
-        dict_ingresos['Venta de Lotes'] = ingresos_lotes
-        
-    for i in ingresos:
-        cat_name = i.categoria.nombre if i.categoria else 'Otros Ingresos'
-        dict_ingresos[cat_name] = dict_ingresos.get(cat_name, Decimal('0.00')) + i.valor
-        
-    chart_ingresos = json.dumps({
-        'labels': list(dict_ingresos.keys()),
-        'data': [float(v) for v in dict_ingresos.values()]
-    })
-
-    # Unificación de datos para la tabla
-    lista_movimientos = []
-    
-    for m in movimientos:
-        lista_movimientos.append({
-            'id': m.id,
-            'is_lote': False,
-            'fecha': m.fecha,
-            'tipo': m.tipo,
-            'categoria_nombre': m.categoria.nombre if m.categoria else 'SN Categoría',
-            'valor': m.valor,
-            'descripcion': m.descripcion,
-            'numero_recibo': m.numero_recibo,
-            'foto_url': m.foto_recibo.url if m.foto_recibo else None,
-            'mov_obj': m
-        })
-        
-    # Obtener pagos de lotes
-    from Aplicaciones.sbr_app_dos.models import Pago, Contrato
-    pagos_qs = Pago.objects.select_related('contrato', 'contrato__cliente').exclude(contrato__estado='DEVOLUCION')
-    fantasmas_qs = Contrato.objects.select_related('cliente').filter(valor_entrada__gt=0, pago__isnull=True).exclude(estado='DEVOLUCION')
-    
+    # Los gráficos se cargan aparte (api_graficos_*); la tabla, una página a la vez
+    con_lotes = request.GET.get('lotes') == '1'
+    desde, hasta, tipo, categoria = leer_filtros(request.GET)
     if mes and anio:
-        pagos_qs = pagos_qs.filter(fecha_pago__year=int(anio), fecha_pago__month=int(mes))
-        fantasmas_qs = fantasmas_qs.filter(fecha_contrato__year=int(anio), fecha_contrato__month=int(mes))
-        
-    for p in pagos_qs:
-        desc = f"Entrada Lote - Contrato #{p.contrato.id} ({p.contrato.cliente})" if p.es_entrada else f"Cuota Lote - Contrato #{p.contrato.id} ({p.contrato.cliente})"
-        if p.observacion: desc += f" | {p.observacion[:40]}"
-        
-        lista_movimientos.append({
-            'id': p.id,
-            'is_lote': True,
-            'fecha': p.fecha_pago,
-            'tipo': 'INGRESO',
-            'categoria_nombre': 'Venta de Lotes',
-            'valor': p.monto,
-            'descripcion': desc,
-            'numero_recibo': f"PGO-{p.id}",
-            'foto_url': p.comprobante_imagen.url if p.comprobante_imagen else None,
-            'contrato_id': p.contrato.id
-        })
-        
-    for f in fantasmas_qs:
-        lista_movimientos.append({
-            'id': f.id,
-            'is_lote': True,
-            'fecha': f.fecha_contrato,
-            'tipo': 'INGRESO',
-            'categoria_nombre': 'Venta de Lotes',
-            'valor': f.valor_entrada,
-            'descripcion': f"Entrada Automática - Contrato #{f.id} ({f.cliente})",
-            'numero_recibo': f"CTR-{f.id}",
-            'foto_url': None,
-            'contrato_id': f.id
-        })
-        
-    # Ordenar todo por fecha
-    lista_movimientos.sort(key=lambda x: x['fecha'], reverse=True)
+        inicio_mes, fin_mes = rango_mes(mes, anio)
+        desde, hasta = max(desde or inicio_mes, inicio_mes), min(hasta or fin_mes, fin_mes)
+    movimientos = pagina_movimientos_gestor(
+        desde, hasta, tipo, categoria, con_lotes,
+        despues=request.GET.get('despues'), antes=request.GET.get('antes'),
+    )
+    filtros = {campo: request.GET[campo] for campo in FILTROS_MOVIMIENTOS if request.GET.get(campo)}
+    if context_mes_filtro:
+        filtros['mes_filtro'] = context_mes_filtro
+    if con_lotes:
+        filtros['lotes'] = '1'
 
     context = {
-        'movimientos': lista_movimientos,
+        'movimientos': movimientos['movimientos'],
+        'con_lotes': con_lotes,
+        'filtros': filtros,
+        'url_lotes': '?' + urlencode({**filtros, 'lotes': '' if con_lotes else '1'}),
+        'url_anterior': '?' + urlencode({**filtros, 'antes': movimientos['anterior']}) if movimientos['anterior'] else None,
+        'url_siguiente': '?' + urlencode({**filtros, 'despues': movimientos['siguiente']}) if movimientos['siguiente'] else None,
         'total_ingresos': total_ingresos,
         'total_gastos': total_gastos,
         'saldo_actual': saldo_actual,
         'categorias': CategoriaTransaccion.objects.all().order_by('nombre'),
         'hoy': hoy,
         'mes_filtro': context_mes_filtro,
-        'chart_data': chart_data,
-        'chart_ingresos': chart_ingresos
     }
     return render(request, 'sbr_gestor/dashboard.html', context)
 
+def _respuesta_graficos(request, datos):
+    """
+    JsonResponse con ETag y Last-Modified de la última escritura (version_graficos). Si el
+    navegador ya tiene esa versión responde 304 sin calcular `datos()`.
+    """
+    huella, ultima = version_graficos()
+    etag = quote_etag(f"graficos-{huella}")
+    ultima = int(ultima.timestamp()) if ultima else None
+    no_modificado = get_conditional_response(request, etag=etag, last_modified=ultima)
+    if no_modificado is not None:
+        return no_modificado
+
+    response = JsonResponse({'success': True, **datos()})
+    response['ETag'] = etag
+    if ultima:
+        response['Last-Modified'] = http_date(ultima)
+    # Revalidar siempre: una escritura nueva cambia la versión
+    response['Cache-Control'] = 'private, no-cache'
+    return response
+
+@login_required
+def api_graficos_categorias_view(request):
+    mes, anio = mes_y_anio(request)
+    return _respuesta_graficos(request, lambda: totales_por_categoria(mes, anio))
+
+@login_required
+def api_graficos_serie_view(request):
+    """Ingresos contra gastos por ?periodo=dia|semana|mes, en el mes filtrado o entre ?desde= y ?hasta=."""
+    mes, anio = mes_y_anio(request)
+    periodo = request.GET.get('periodo') or ('dia' if mes and anio else 'mes')
+    try:
+        if periodo not in PERIODOS:
+            raise ValueError(f"Período no válido: {periodo}")
+        if mes and anio:
+            desde, hasta = rango_mes(mes, anio)
+        elif request.GET.get('desde') or request.GET.get('hasta'):
+            hasta = date.fromisoformat(request.GET['hasta']) if request.GET.get('hasta') else date.today()
+            desde = date.fromisoformat(request.GET['desde']) if request.GET.get('desde') else rango_serie(periodo, hasta)[0]
+        else:
+            desde, hasta = rango_serie(periodo)
+        if desde > hasta:
+            raise ValueError("La fecha 'desde' es posterior a 'hasta'.")
+    except ValueError as error:
+        return JsonResponse({'success': False, 'error': str(error)}, status=400)
+    return _respuesta_graficos(request, lambda: serie_ingresos_gastos(periodo, desde, hasta))
+
 @login_required
 def registrar_transaccion_view(request):
     if request.method == 'POST':
@@ -344,26 +331,15 @@ def crear_categoria_api(request):
 
 @login_required
 def api_totales_view(request):
-    mes = request.GET.get('mes')
-    anio = request.GET.get('anio')
-    
-    filtro_fecha = request.GET.get('mes_filtro', '') # formato: "YYYY-MM"
-    if filtro_fecha:
-        parts = filtro_fecha.split('-')
-        if len(parts) == 2:
-            anio, mes = parts[0], parts[1]
-            
-    movimientos = Transaccion.objects.all()
+    mes, anio = mes_y_anio(request)
     if mes and anio:
-        movimientos = movimientos.filter(fecha__year=int(anio), fecha__month=int(mes))
-        ingresos_lotes = calcular_ganancias_lotes_rapido(mes=mes, anio=anio)
+        ingresos_lotes, ingresos_caja, total_gastos = totales_gestor(mes, anio)
+        total_ingresos = ingresos_caja + ingresos_lotes
+        saldo_actual = total_ingresos - total_gastos
     else:
-        ingresos_lotes = calcular_ganancias_lotes_rapido()
-        
-    ingresos_caja = sum(m.valor for m in movimientos if m.tipo == 'INGRESO')
-    total_ingresos = ingresos_caja + ingresos_lotes
-    total_gastos = sum(m.valor for m in movimientos if m.tipo == 'GASTO')
-    saldo_actual = total_ingresos - total_gastos
+        # Sin filtro: los acumulados del último asiento del libro de caja (una consulta)
+        totales = totales_libro('GESTOR')
+        total_ingresos, total_gastos, saldo_actual = totales['ingresos'], totales['gastos'], totales['saldo']
     
     return JsonResponse({
         'success': True,
@@ -1,3 +1,17 @@
+import json
+import logging
+import random
+import time
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections
+
+from Aplicaciones.sbr_app_dos.instrumentacion import agregado_rutas, medir_request, server_timing
+
+logger = logging.getLogger('sbr.instrumentacion')
+
+
 
 class ForceCSPMiddleware:
     def __init__(self, get_response):
@@ -21,3 +35,40 @@ class ForceCSPMiddleware:
             response['Content-Security-Policy'] = csp_policy
             
         return response
+
+
+class InstrumentacionMiddleware:
+    """
+    Mide una fracción de los requests (INSTRUMENTACION_MUESTREO, 0 = apagado): consultas
+    y tiempo de SQL, plantillas y PDF. Ver Aplicaciones/sbr_app_dos/instrumentacion.py.
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        muestreo = getattr(settings, 'INSTRUMENTACION_MUESTREO', 0)
+        if not muestreo or random.random() >= muestreo:
+            return self.get_response(request)
+
+        with ExitStack() as pila:
+            medicion = pila.enter_context(
+                medir_request(getattr(settings, 'INSTRUMENTACION_CONSULTAS_LENTAS', 3))
+            )
+            for conexion in connections.all():
+                pila.enter_context(conexion.execute_wrapper(medicion))
+            inicio = time.perf_counter()
+            response = self.get_response(request)
+            total_ms = (time.perf_counter() - inicio) * 1000
+
+        ruta = request.resolver_match.view_name if request.resolver_match else 'sin_ruta'
+        agregado_rutas.registrar(ruta, total_ms, medicion)
+        response['Server-Timing'] = server_timing(total_ms, medicion)
+        logger.info(json.dumps({
+            'ruta': ruta,
+            'metodo': request.method,
+            'estado': response.status_code,
+            'total_ms': round(total_ms, 2),
+            **medicion.como_dict(),
+            'lentas': medicion.consultas_lentas(),
+        }))
+        return response
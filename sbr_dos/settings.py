@@ -79,6 +79,7 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'sbr_dos.middleware.ForceCSPMiddleware', # CSP Personalizado (Primero)
+    'sbr_dos.middleware.InstrumentacionMiddleware', # Server-Timing y métricas por URL (muestreado)
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -93,7 +94,8 @@ ROOT_URLCONF = 'sbr_dos.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        # DjangoTemplates que además cronometra los renders (instrumentación por request)
+        'BACKEND': 'Aplicaciones.sbr_app_dos.instrumentacion.PlantillasMedidas',
         'DIRS': [],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -169,6 +171,39 @@ STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles')
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# Caché de recibos PDF en MEDIA_ROOT/cache_pdf (ver sbr_app_dos/cache_pdf.py)
+PDF_CACHE_MAX_MB = 200
+PDF_CACHE_MAX_DIAS = 30
+# Tras un PDF nuevo se limpia la caché como mucho una vez por este intervalo (por proceso)
+PDF_CACHE_SEGUNDOS_LIMPIEZA = 300
+
+# Cola de PDF (ver sbr_app_dos/tareas_pdf.py y el comando procesar_pdfs)
+PDF_MAX_RENDERS_CONCURRENTES = 2
+PDF_TAREA_TIMEOUT_MIN = 10
+# Procesos de render del comando exportar_recibos (en la cola, cada exportación usa uno)
+PDF_EXPORTACION_PROCESOS = 2
+
+# Instrumentación por request (sbr_dos/middleware.py y sbr_app_dos/instrumentacion.py):
+# fracción de requests medidos (0 = apagado), consultas lentas por request y muestras por URL
+INSTRUMENTACION_MUESTREO = float(os.getenv('INSTRUMENTACION_MUESTREO', '0.05'))
+INSTRUMENTACION_CONSULTAS_LENTAS = 3
+INSTRUMENTACION_VENTANA = 200
+
+# Una línea JSON por request medido
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'solo_mensaje': {'format': '%(message)s'},
+    },
+    'handlers': {
+        'instrumentacion': {'class': 'logging.StreamHandler', 'formatter': 'solo_mensaje'},
+    },
+    'loggers': {
+        'sbr.instrumentacion': {'handlers': ['instrumentacion'], 'level': 'INFO', 'propagate': False},
+    },
+}
+
 # Configuración de Login
 LOGIN_REDIRECT_URL = '/'  # A donde va al iniciar sesión (área de gestión)
 LOGOUT_REDIRECT_URL = 'login'     # A donde va al salir